@@ -0,0 +1,231 @@
+"""
+Benchmarks for the scan and archive stages on a synthetic library.
+
+Run from the synology-photo-archiver directory:
+
+    python3 -m benchmarks.run --output results.json
+    python3 -m benchmarks.run --baseline results.json --files 20000
+
+Results are written as JSON; with --baseline every benchmark is compared
+to the same benchmark in an earlier results file.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from src.codec import CODECS
+from src.compression import create_archive, parse_volume_size
+from src.compressibility import CompressibilityPolicy
+from src.encryption import derive_key
+from src.metrics import Phase
+from src.scanner import find_changed_files
+
+from .synthetic import DEFAULT_SPEC, apply_churn, generate_library
+
+
+# A benchmark this much slower than its baseline is reported as a regression.
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+# Benchmarks faster than this are too noisy to call regressions.
+MIN_COMPARABLE_SECONDS = 0.05
+
+
+def _drop_caches():
+    """Asks the kernel to drop the page cache (root only); returns True on success."""
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return True
+    except OSError:
+        return False
+
+
+def _result(name, phase, **fields):
+    summary = phase.summary()
+    summary['name'] = name
+    summary.update(fields)
+    return summary
+
+
+def _scan(name, source_dir, processed, previous_dirs, paranoid=False, cold=False):
+    """Times one scan; returns (result, processed files, directory summaries) for the next one."""
+    dropped = _drop_caches() if cold else False
+    current_dirs = {}
+    with Phase(name, progress_interval=None) as phase:
+        changed = find_changed_files(source_dir, processed, previous_dirs=previous_dirs,
+                                     current_dirs=current_dirs, paranoid=paranoid, phase=phase)
+    processed = dict(processed)
+    processed.update((path, record._replace(archive_id='benchmark')) for path, record in changed)
+    return _result(name, phase, changed=len(changed), caches_dropped=dropped), processed, current_dirs
+
+
+def benchmark_scans(source_dir, spec, churn):
+    """Cold and warm full scans, then rescans after churn with and without pruning."""
+    results = []
+    result, processed, dirs = _scan('scan_cold', source_dir, {}, None, cold=True)
+    results.append(result)
+    result, processed, dirs = _scan('scan_warm', source_dir, processed, dirs)
+    results.append(result)
+
+    churned = apply_churn(source_dir, churn, spec)
+    result, _, _ = _scan('rescan_churn', source_dir, processed, dirs)
+    results.append(dict(result, churn=churn, **churned))
+    result, _, _ = _scan('rescan_churn_paranoid', source_dir, processed, dirs, paranoid=True)
+    results.append(dict(result, churn=churn, **churned))
+    return results
+
+
+def benchmark_archives(source_dir, work_dir, codecs, volume_sizes, workers, encrypt=False):
+    """
+    Archive throughput for every codec and volume size combination.
+
+    With encrypt, every combination also runs encrypted (named ``..._enc``),
+    so the encryption overhead shows next to the plain run.
+    """
+    files = sorted(path for path in Path(source_dir).rglob('*') if path.is_file())
+    keys = [None, derive_key('benchmark')] if encrypt else [None]
+    results = []
+    for codec in codecs:
+        for volume_size in volume_sizes:
+            for key in keys:
+                destination = Path(work_dir) / 'archive'
+                shutil.rmtree(destination, ignore_errors=True)
+                name = f'archive_{codec}_{volume_size or "single"}' + ('_enc' if key is not None else '')
+                with Phase(name, progress_interval=None) as phase:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        success = create_archive(files, source_dir, destination, None, '', volume_size,
+                                                 codec=codec, policy=CompressibilityPolicy(), workers=workers,
+                                                 phase=phase, key=key)
+                if not success:
+                    raise RuntimeError(f"archive benchmark failed for codec {codec}")
+                results.append(_result(phase.name, phase, codec=codec, volume_size=volume_size,
+                                       volume_bytes=parse_volume_size(volume_size), workers=workers,
+                                       encrypted=key is not None))
+    shutil.rmtree(Path(work_dir) / 'archive', ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compares results to a baseline run.
+
+    Args:
+        results: Results dictionary of the current run
+        baseline: Results dictionary of an earlier run
+        threshold: Relative slowdown reported as a regression
+
+    Returns:
+        Tuple of (printable lines, names of regressed benchmarks)
+    """
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    lines = []
+    if baseline.get('spec') != results['spec']:
+        lines.append("Warning: The baseline was run on a different library spec; timings are not comparable.")
+    lines.append(f"{'benchmark':<32} {'seconds':>9} {'baseline':>9} {'change':>8}")
+    regressions = []
+    for result in results['results']:
+        old = previous.get(result['name'])
+        if old is None or not old['seconds']:
+            lines.append(f"{result['name']:<32} {result['seconds']:>9.3f} {'-':>9} {'-':>8}")
+            continue
+        change = result['seconds'] / old['seconds'] - 1
+        slow = max(result['seconds'], old['seconds']) >= MIN_COMPARABLE_SECONDS
+        flag = '  REGRESSION' if change > threshold and slow else ''
+        if flag:
+            regressions.append(result['name'])
+        lines.append(f"{result['name']:<32} {result['seconds']:>9.3f} {old['seconds']:>9.3f} {change:>+8.1%}{flag}")
+    return lines, regressions
+
+
+def run(spec, work_dir, churn=0.01, codecs=('store', 'gzip'), volume_sizes=('', '16m'), workers=1, encrypt=False):
+    """
+    Generates a library in work_dir and runs every benchmark on it.
+
+    Returns:
+        Results dictionary, ready to be written as JSON
+    """
+    source_dir = Path(work_dir) / 'library'
+    with Phase('generate', progress_interval=None) as phase:
+        library = generate_library(source_dir, spec)
+    results = benchmark_scans(source_dir, spec, churn)
+    results += benchmark_archives(source_dir, work_dir, codecs, volume_sizes, workers, encrypt)
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'spec': spec._asdict(),
+        'library': library,
+        'generate_seconds': round(phase.seconds, 3),
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark scanning and archiving on a synthetic photo library.')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against an earlier results file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help='Relative slowdown reported as a regression (default 0.10)')
+    parser.add_argument('--work-dir', help='Directory for the library (default: a temporary directory)')
+    parser.add_argument('--files', type=int, default=DEFAULT_SPEC.files)
+    parser.add_argument('--depth', type=int, default=DEFAULT_SPEC.depth)
+    parser.add_argument('--fanout', type=int, default=DEFAULT_SPEC.fanout)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SPEC.seed)
+    parser.add_argument('--size-scale', type=float, default=1.0, help='Multiply all median file sizes')
+    parser.add_argument('--churn', type=float, default=0.01, help='Share of files changed before rescanning')
+    parser.add_argument('--codecs', default='store,gzip', help='Comma-separated codecs to benchmark')
+    parser.add_argument('--volume-sizes', default=',16m', help="Comma-separated volume sizes ('' = single archive)")
+    parser.add_argument('--workers', type=int, default=1, help='Compression threads')
+    parser.add_argument('--encrypt', action='store_true',
+                        help='Also run every archive benchmark encrypted (needs the cryptography package)')
+    args = parser.parse_args(argv)
+
+    spec = DEFAULT_SPEC._replace(
+        files=args.files, depth=args.depth, fanout=args.fanout, seed=args.seed,
+        jpeg_size=int(DEFAULT_SPEC.jpeg_size * args.size_scale),
+        raw_size=int(DEFAULT_SPEC.raw_size * args.size_scale),
+        xmp_size=int(DEFAULT_SPEC.xmp_size * args.size_scale),
+    )
+    codecs = [name for name in args.codecs.split(',') if name]
+    unavailable = [name for name in codecs if name not in CODECS or not CODECS[name].available]
+    if unavailable:
+        print(f"Error: Codec(s) not available: {', '.join(unavailable)}")
+        sys.exit(1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='archiver-bench-')
+    try:
+        results = run(spec, work_dir, args.churn, codecs, args.volume_sizes.split(','), args.workers, args.encrypt)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for result in results['results']:
+        ratio = f"{result['ratio']:.3f}" if result['ratio'] is not None else '-'
+        print(f"{result['name']:<32} {result['seconds']:>8.3f}s {result['files_per_second']:>10.0f} files/s "
+              f"{result['mb_per_second']:>8.1f} MB/s  ratio {ratio}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}.")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            lines, regressions = compare(results, json.load(f), args.threshold)
+        for line in lines:
+            print(line)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import os
+import random
+from collections import namedtuple
+from pathlib import Path
+
+
+# Shape of a generated library. Sizes are medians in bytes; actual sizes
+# follow a log-normal distribution around them, capped at 8x the median.
+# The mix fractions pick the payload type of every file and should add up
+# to at most 1; the rest are JPEGs.
+LibrarySpec = namedtuple('LibrarySpec', [
+    'files', 'depth', 'fanout', 'seed',
+    'jpeg_size', 'raw_size', 'xmp_size', 'raw_fraction', 'xmp_fraction', 'size_sigma',
+])
+
+DEFAULT_SPEC = LibrarySpec(
+    files=2000, depth=3, fanout=4, seed=1,
+    jpeg_size=48 * 1024, raw_size=192 * 1024, xmp_size=4 * 1024,
+    raw_fraction=0.1, xmp_fraction=0.3, size_sigma=0.5,
+)
+
+# Fixed start of the mtimes given to generated files (2020-01-01), so two
+# libraries generated from the same spec are identical, timestamps included.
+BASE_MTIME = 1577836800
+
+# Keeps the low 4 bits of every byte: sensor-like data that compresses ~2:1.
+_LOW_ENTROPY = bytes(b & 0x0F for b in range(256))
+
+_XMP_TEMPLATE = (
+    '<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+    '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+    ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+    '  <rdf:Description xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmp:Rating="{rating}"\n'
+    '   xmp:CreateDate="2020-{month:02d}-{day:02d}T{hour:02d}:00:00" crs:Exposure2012="{exposure:+.2f}"/>\n'
+)
+
+
+def _payload(rng, kind, size):
+    """Returns reproducible file contents of one payload kind."""
+    if kind == 'jpg':
+        # JPEG-like: a JFIF header followed by incompressible data.
+        return (b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + rng.randbytes(size))[:size]
+    if kind == 'raw':
+        return rng.randbytes(size).translate(_LOW_ENTROPY)
+    # XMP-like sidecar: repetitive XML with a few varying values.
+    chunks = []
+    length = 0
+    while length < size:
+        chunk = _XMP_TEMPLATE.format(
+            rating=rng.randrange(6), month=rng.randrange(1, 13), day=rng.randrange(1, 29),
+            hour=rng.randrange(24), exposure=rng.uniform(-2, 2),
+        )
+        chunks.append(chunk)
+        length += len(chunk)
+    return ''.join(chunks).encode()[:size]
+
+
+def _size(rng, median, sigma):
+    return max(1, min(int(rng.lognormvariate(0, sigma) * median), median * 8))
+
+
+def _kind(rng, spec):
+    roll = rng.random()
+    if roll < spec.raw_fraction:
+        return 'raw'
+    if roll < spec.raw_fraction + spec.xmp_fraction:
+        return 'xmp'
+    return 'jpg'
+
+
+def _leaf_directories(spec):
+    """Returns the album directories (relative paths) files are spread over."""
+    leaves = ['']
+    for level in range(spec.depth):
+        leaves = [os.path.join(parent, f'{level}_{i:02d}') for parent in leaves for i in range(spec.fanout)]
+    return leaves
+
+
+def _write_file(rng, spec, path, kind, mtime):
+    median = {'jpg': spec.jpeg_size, 'raw': spec.raw_size, 'xmp': spec.xmp_size}[kind]
+    data = _payload(rng, kind, _size(rng, median, spec.size_sigma))
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+    return len(data)
+
+
+def generate_library(root, spec=DEFAULT_SPEC):
+    """
+    Writes a reproducible synthetic photo library.
+
+    Files are spread round-robin over ``fanout ** depth`` album directories.
+    The same spec and seed always produce the same paths, contents and mtimes.
+
+    Args:
+        root: Directory to create the library in (created if missing)
+        spec: LibrarySpec describing the library
+
+    Returns:
+        Dictionary with the number of files and total bytes per payload kind
+    """
+    rng = random.Random(spec.seed)
+    root = Path(root)
+    leaves = _leaf_directories(spec)
+    totals = {}
+    for directory in leaves:
+        (root / directory).mkdir(parents=True, exist_ok=True)
+    for i in range(spec.files):
+        kind = _kind(rng, spec)
+        path = root / leaves[i % len(leaves)] / f'IMG_{i:06d}.{kind}'
+        size = _write_file(rng, spec, path, kind, BASE_MTIME + i)
+        files, total = totals.get(kind, (0, 0))
+        totals[kind] = (files + 1, total + size)
+    return {kind: {'files': files, 'bytes': total} for kind, (files, total) in sorted(totals.items())}
+
+
+def apply_churn(root, fraction, spec=DEFAULT_SPEC, seed=None):
+    """
+    Changes a fraction of a generated library the way a photo library changes.
+
+    Half of the churn rewrites existing files (edits, new sidecar values),
+    the other half adds new files. Both land in existing albums.
+
+    Args:
+        root: Directory holding a library made by generate_library
+        fraction: Share of the library's files to touch, e.g. 0.01 for 1%
+        spec: Spec the library was generated with
+        seed: Random seed; defaults to one derived from the spec
+
+    Returns:
+        Dictionary with the number of 'modified' and 'added' files
+    """
+    rng = random.Random(spec.seed * 7919 + 1 if seed is None else seed)
+    root = Path(root)
+    existing = sorted(path for path in root.rglob('IMG_*') if path.is_file())
+    count = int(len(existing) * fraction)
+    modified = rng.sample(existing, min(len(existing), count - count // 2))
+    # Far enough after the original mtimes to be seen as changes.
+    mtime = BASE_MTIME + 10 * spec.files + 1
+    for path in modified:
+        _write_file(rng, spec, path, path.suffix[1:], mtime)
+
+    leaves = _leaf_directories(spec)
+    for i in range(count // 2):
+        kind = _kind(rng, spec)
+        path = root / rng.choice(leaves) / f'NEW_{i:06d}.{kind}'
+        _write_file(rng, spec, path, kind, mtime)
+    return {'modified': len(modified), 'added': count // 2}
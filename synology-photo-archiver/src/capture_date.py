@@ -0,0 +1,334 @@
+"""
+Capture dates of photos, read from the first bytes of each file, for partitioning archives by date.
+
+Only what is needed to reach the EXIF date is read: the start of the file,
+plus the EXIF block itself when it lies further in (HEIC keeps it in the
+media data). Supported are JPEG, HEIC/HEIF/AVIF and TIFF-based files (TIFF
+and most RAW formats: DNG, CR2, NEF, ARW, ...). Anything else, and photos
+without a usable date, fall back to the modification time.
+
+Dates are cached in the state keyed by path and validated by (size,
+mtime_ns), like compressibility decisions, so a file is read at most once
+while it stays unchanged.
+"""
+import datetime
+import re
+import struct
+import sys
+
+
+# Bytes read from the start of every file; enough for the EXIF block of
+# nearly every JPEG and for the metadata boxes of HEIC files.
+HEADER_BYTES = 64 * 1024
+
+# Largest EXIF block read from elsewhere in a file.
+MAX_EXIF_BYTES = 256 * 1024
+
+PARTITIONS = ('none', 'year', 'month')
+DEFAULT_PARTITION = 'none'
+
+# EXIF tags holding dates, in order of preference.
+_DATE_TIME_ORIGINAL = 0x9003
+_DATE_TIME_DIGITIZED = 0x9004
+_DATE_TIME = 0x0132
+_EXIF_IFD_POINTER = 0x8769
+
+_EXIF_DATE = re.compile(rb'(\d{4})[:-](\d{2})[:-](\d{2})')
+
+_HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif', b'avis'}
+
+
+def _parse_date(raw):
+    """Returns 'YYYY-MM-DD' for an EXIF date string, or None for a blank or implausible one."""
+    match = _EXIF_DATE.match(raw.strip(b'\0 '))
+    if match is None:
+        return None
+    year, month, day = (int(part) for part in match.groups())
+    if not (1826 <= year <= 2200 and 1 <= month <= 12 and 1 <= day <= 31):
+        return None  # '0000:00:00 00:00:00' is common for "unknown"
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def _tiff_date(read):
+    """
+    Finds the capture date in a TIFF structure (EXIF data is one).
+
+    Args:
+        read: Callable (offset, length) -> bytes relative to the TIFF header;
+            may return fewer bytes past the end
+    """
+    header = read(0, 8)
+    if header[:2] == b'II':
+        order = '<'
+    elif header[:2] == b'MM':
+        order = '>'
+    else:
+        return None
+    if len(header) < 8 or struct.unpack(order + 'H', header[2:4])[0] != 42:
+        return None
+
+    def entries(offset):
+        count_bytes = read(offset, 2)
+        if len(count_bytes) < 2:
+            return {}
+        count = min(struct.unpack(order + 'H', count_bytes)[0], 1024)
+        table = read(offset + 2, 12 * count)
+        found = {}
+        for i in range(len(table) // 12):
+            tag, kind, n = struct.unpack(order + 'HHI', table[12 * i:12 * i + 8])
+            found[tag] = (kind, n, table[12 * i + 8:12 * i + 12])
+        return found
+
+    def ascii_value(entry):
+        kind, n, value = entry
+        if kind != 2:
+            return None
+        if n <= 4:
+            return value[:n]
+        return read(struct.unpack(order + 'I', value)[0], min(n, 64))
+
+    ifd0 = entries(struct.unpack(order + 'I', header[4:8])[0])
+    candidates = []
+    pointer = ifd0.get(_EXIF_IFD_POINTER)
+    if pointer is not None and pointer[0] in (4, 13):
+        exif = entries(struct.unpack(order + 'I', pointer[2])[0])
+        candidates += [exif.get(_DATE_TIME_ORIGINAL), exif.get(_DATE_TIME_DIGITIZED)]
+    candidates.append(ifd0.get(_DATE_TIME))
+    for entry in candidates:
+        if entry is not None:
+            raw = ascii_value(entry)
+            date = _parse_date(raw) if raw else None
+            if date is not None:
+                return date
+    return None
+
+
+def _jpeg_date(f, data):
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:  # Fill byte
+            position += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        if marker in (0xDA, 0xD9):  # Image data starts: no EXIF before it
+            return None
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        if marker == 0xE1 and data[position + 4:position + 10] == b'Exif\0\0':
+            end = position + 2 + length
+            if end > len(data):
+                data += f.read(end - len(data))
+            segment = data[position + 10:end]
+            return _tiff_date(lambda offset, size: segment[offset:offset + size])
+        position += 2 + length
+    return None
+
+
+def _boxes(data, start, end):
+    """Yields (type, payload start, payload end) of the ISO BMFF boxes in data[start:end]."""
+    position = start
+    while position + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[position:position + 8])
+        header = 8
+        if size == 1:
+            if position + 16 > end:
+                return
+            size = struct.unpack('>Q', data[position + 8:position + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield kind, position + header, min(position + size, end)
+        position += size
+
+
+def _read_uint(data, position, size):
+    if size == 0:
+        return 0, position
+    return int.from_bytes(data[position:position + size], 'big'), position + size
+
+
+def _heif_exif_location(data, start, end):
+    """Returns (file offset, length) of the Exif item described by a 'meta' box payload, or None."""
+    exif_id = None
+    locations = {}
+    for kind, box_start, box_end in _boxes(data, start + 4, end):  # 'meta' is a full box
+        version = data[box_start]
+        if kind == b'iinf':
+            count_size = 2 if version == 0 else 4
+            for entry_kind, entry_start, _ in _boxes(data, box_start + 4 + count_size, box_end):
+                entry_version = data[entry_start]
+                if entry_kind != b'infe' or entry_version < 2:
+                    continue
+                id_size = 2 if entry_version == 2 else 4
+                item_id, position = _read_uint(data, entry_start + 4, id_size)
+                if data[position + 2:position + 6] == b'Exif':
+                    exif_id = item_id
+        elif kind == b'iloc':
+            sizes = data[box_start + 4], data[box_start + 5]
+            offset_size, length_size = sizes[0] >> 4, sizes[0] & 15
+            base_offset_size, index_size = sizes[1] >> 4, (sizes[1] & 15 if version in (1, 2) else 0)
+            position = box_start + 6
+            id_size = 2 if version < 2 else 4
+            count, position = _read_uint(data, position, id_size)
+            for _ in range(min(count, 4096)):
+                item_id, position = _read_uint(data, position, id_size)
+                if version in (1, 2):
+                    position += 2  # Construction method; file offsets (0) are assumed
+                position += 2  # Data reference index
+                base_offset, position = _read_uint(data, position, base_offset_size)
+                extent_count, position = _read_uint(data, position, 2)
+                extents = []
+                for _ in range(extent_count):
+                    position += index_size
+                    extent_offset, position = _read_uint(data, position, offset_size)
+                    extent_length, position = _read_uint(data, position, length_size)
+                    extents.append((base_offset + extent_offset, extent_length))
+                if extents:
+                    locations[item_id] = extents[0]
+                if position > box_end:
+                    break
+    return locations.get(exif_id) if exif_id is not None else None
+
+
+def _heif_date(f, data):
+    for kind, start, end in _boxes(data, 0, len(data)):
+        if kind != b'meta':
+            continue
+        location = _heif_exif_location(data, start, end)
+        if location is None:
+            return None
+        offset, length = location
+        f.seek(offset)
+        item = f.read(min(length, MAX_EXIF_BYTES))
+        if len(item) < 4:
+            return None
+        # The item starts with the offset of the TIFF header after it (past 'Exif\0\0').
+        tiff_start = 4 + struct.unpack('>I', item[:4])[0]
+        return _tiff_date(lambda position, size: item[tiff_start + position:tiff_start + position + size])
+    return None
+
+
+def _file_tiff_date(f, data):
+    def read(offset, size):
+        if offset + size <= len(data):
+            return data[offset:offset + size]
+        f.seek(offset)
+        return f.read(size)
+    return _tiff_date(read)
+
+
+def read_capture_date(path):
+    """
+    Reads the capture date of a photo from its header.
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        'YYYY-MM-DD', or None if the file has no readable capture date
+
+    Raises:
+        OSError: If the file cannot be read
+    """
+    with open(path, 'rb') as f:
+        data = f.read(HEADER_BYTES)
+        try:
+            if data[:2] == b'\xff\xd8':
+                return _jpeg_date(f, data)
+            if data[4:8] == b'ftyp' and data[8:12] in _HEIF_BRANDS:
+                return _heif_date(f, data)
+            if data[:4] in (b'II*\0', b'MM\0*'):
+                return _file_tiff_date(f, data)
+        except (struct.error, IndexError, ValueError):
+            return None  # Damaged or unusual metadata: not worth failing the archive over
+    return None
+
+
+class CaptureDates:
+    """
+    Assigns files to date partitions ('2023' or '2023-07').
+
+    Capture dates are looked up in and added to a cache keyed by path and
+    validated by (size, mtime_ns); files without one use their modification
+    time, which is cached too (as None) so they are not read again.
+    """
+
+    def __init__(self, partition='month', cache=None):
+        """
+        Args:
+            partition: 'year' or 'month'
+            cache: Optional mapping (anything with .get()) from relative path to
+                (size, mtime_ns, capture date or None) tuples from previous runs
+
+        Raises:
+            ValueError: If partition is not 'year' or 'month'
+        """
+        if partition not in ('year', 'month'):
+            raise ValueError(f"unknown partition '{partition}'; choose one of: {', '.join(PARTITIONS)}")
+        self.partition = partition
+        self._cache = cache if cache is not None else {}
+        self.extracted = {}  # New results, to be saved in the state
+        self.cache_hits = 0
+
+    def capture_date(self, path, key, stat_result):
+        """
+        Returns the capture date of a file ('YYYY-MM-DD'), or None.
+
+        Args:
+            path: Path to read the file from
+            key: Cache key for the file (its relative path)
+            stat_result: os.stat_result (or anything with st_size and st_mtime_ns) of the file
+        """
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == stat_result.st_size and cached[1] == stat_result.st_mtime_ns:
+            self.cache_hits += 1
+            return cached[2]
+        try:
+            date = read_capture_date(path)
+        except OSError:
+            return None  # The archiver reports unreadable files
+        self.extracted[key] = (stat_result.st_size, stat_result.st_mtime_ns, date)
+        return date
+
+    def cached_date(self, key, size, mtime_ns):
+        """Returns the cached capture date of a file if it is still valid, without reading the file; else None."""
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == size and cached[1] == mtime_ns:
+            return cached[2]
+        return None
+
+    def bucket(self, date, mtime_ns):
+        """Returns the partition for a capture date ('YYYY-MM-DD' or None, then the modification time is used)."""
+        if date is None:
+            date = datetime.datetime.fromtimestamp(mtime_ns / 1e9).strftime('%Y-%m-%d')
+        return date[:4] if self.partition == 'year' else date[:7]
+
+
+def load_partition(config, cache=None):
+    """
+    Reads the partition setting ([Archive] partition) of the configuration.
+
+    Args:
+        config: ConfigParser with the configuration
+        cache: Optional capture date cache for the CaptureDates (see StateStore.capture_date_cache)
+
+    Returns:
+        CaptureDates, or None if archives are not partitioned
+
+    Raises:
+        SystemExit: If the setting is invalid
+    """
+    partition = config.get('Archive', 'partition', fallback=DEFAULT_PARTITION).strip().lower() or 'none'
+    if partition == 'none':
+        return None
+    try:
+        return CaptureDates(partition, cache)
+    except ValueError as e:
+        print(f"Error: Invalid [Archive] setting: {e}")
+        sys.exit(1)
@@ -0,0 +1,307 @@
+"""
+Archive chains: a full archive followed by deltas, compacted into a new full now and then.
+
+    python3 -m src.chain list
+    python3 -m src.chain prune --keep 2
+
+Every run writes a new generation under its own name, next to the others:
+
+    photo.20260101_020000.full.000.tar.gz        volumes
+    photo.20260101_020000.full.manifest.jsonl
+    photo.20260102_020000.delta.000.tar.gz
+    photo.20260102_020000.delta.manifest.jsonl
+    photo.chain.json                             the generations, oldest first
+
+A full generation holds every file of the library; a delta holds the files
+added or changed since the previous generation, plus tombstones for the files
+deleted since. The library as of a generation is the last full before it with
+every delta up to it applied in order.
+
+Compaction (see compact) merges a full and its deltas into a new full.
+Retention then deletes the chains older than the most recent ones.
+"""
+import argparse
+import datetime
+import fnmatch
+import glob
+import json
+import os
+import sys
+from pathlib import Path
+
+from .config import load_config
+from .jobs import select_job
+from .manifest import MANIFEST_SUFFIX, load_manifest
+
+
+CHAIN_FORMAT = 1
+CHAIN_SUFFIX = '.chain.json'
+
+# Chains (a full and its deltas) kept when older ones are pruned; 0 keeps all.
+DEFAULT_KEEP_CHAINS = 2
+
+
+def generation_name(source_name, archive_id, kind):
+    """Returns the stem of a generation's volume and manifest names."""
+    return f"{source_name}.{archive_id}.{kind}"
+
+
+def new_archive_id(chain=None):
+    """Returns a timestamp id for a new generation, unique within the chain."""
+    archive_id = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    taken = {generation['archive_id'] for generation in chain.generations} if chain is not None else set()
+    candidate, suffix = archive_id, 0
+    while candidate in taken:
+        suffix += 1
+        candidate = f"{archive_id}_{suffix}"
+    return candidate
+
+
+class ArchiveChain:
+    """
+    The generations of an archive, as recorded in ``<source>.chain.json``.
+
+    A generation is added as 'pending' before its archive is written and
+    marked 'complete' once its manifest is in place, so an interrupted run
+    can be resumed (or cleaned up) under its own name.
+    """
+
+    def __init__(self, path, generations=None):
+        """
+        Args:
+            path: Path of the chain file
+            generations: Generation records, oldest first
+        """
+        self.path = Path(path)
+        self.generations = generations or []
+
+    @property
+    def pending(self):
+        """The generation being written, or None."""
+        for generation in self.generations:
+            if generation['status'] == 'pending':
+                return generation
+        return None
+
+    def _find(self, archive_id):
+        for generation in self.generations:
+            if generation['archive_id'] == archive_id:
+                return generation
+        raise KeyError(archive_id)
+
+    def current(self, as_of=None):
+        """
+        Returns the complete generations that make up the library, oldest first.
+
+        Args:
+            as_of: Optional archive id; the library as it was after that generation
+
+        Returns:
+            The last full generation (up to as_of) and the deltas after it;
+            empty if there is no complete full generation
+        """
+        generations = []
+        for generation in self.generations:
+            if generation['status'] != 'complete':
+                continue
+            if generation['kind'] == 'full':
+                generations = [generation]
+            elif generations:
+                generations.append(generation)
+            if generation['archive_id'] == as_of:
+                break
+        else:
+            if as_of is not None:
+                raise KeyError(as_of)
+        return generations
+
+    @property
+    def deltas_since_full(self):
+        """Number of deltas on top of the current full."""
+        return max(0, len(self.current()) - 1)
+
+    def manifest_path(self, generation):
+        """Returns the path of a generation's manifest."""
+        return self.path.with_name(generation['name'] + MANIFEST_SUFFIX)
+
+    def begin(self, archive_id, kind, **fields):
+        """Records a generation about to be written; returns its name."""
+        source_name = self.path.name[:-len(CHAIN_SUFFIX)]
+        name = generation_name(source_name, archive_id, kind)
+        self.generations.append({
+            'archive_id': archive_id, 'kind': kind, 'name': name, 'status': 'pending',
+            'created': datetime.datetime.now().isoformat(timespec='seconds'), **fields,
+        })
+        self.save()
+        return name
+
+    def complete(self, archive_id, **fields):
+        """Marks a generation as complete, adding fields to its record."""
+        generation = self._find(archive_id)
+        generation.update(fields, status='complete')
+        self.save()
+
+    def abandon(self, archive_id):
+        """Forgets a pending generation and deletes whatever it had written."""
+        generation = self._find(archive_id)
+        self._delete_files(generation)
+        self.generations.remove(generation)
+        self.save()
+
+    def _delete_files(self, generation):
+        for path in self.path.parent.glob(glob.escape(generation['name']) + '.*'):
+            path.unlink()
+
+    def prune(self, keep_chains=DEFAULT_KEEP_CHAINS):
+        """
+        Deletes every generation older than the keep_chains most recent full ones.
+
+        Returns:
+            List of the generation records removed
+        """
+        fulls = [i for i, generation in enumerate(self.generations)
+                 if generation['kind'] == 'full' and generation['status'] == 'complete']
+        if keep_chains <= 0 or len(fulls) <= keep_chains:
+            return []
+        cutoff = fulls[-keep_chains]
+        removed = [generation for generation in self.generations[:cutoff] if generation['status'] == 'complete']
+        for generation in removed:
+            self._delete_files(generation)
+        self.generations = [generation for generation in self.generations if generation not in removed]
+        self.save()
+        return removed
+
+    def save(self):
+        """Writes the chain file atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': CHAIN_FORMAT, 'generations': self.generations}, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def chain_path(destination_dir, source_name):
+    """Returns the path of the chain file of an archive."""
+    return Path(destination_dir) / f"{source_name}{CHAIN_SUFFIX}"
+
+
+def load_chain(destination_dir, source_name):
+    """
+    Loads the chain of an archive.
+
+    Args:
+        destination_dir: Directory holding the archive
+        source_name: Archive name (the source directory name)
+
+    Returns:
+        ArchiveChain; without a chain file, an empty one
+
+    Raises:
+        ValueError: If the chain file is not supported
+    """
+    path = chain_path(destination_dir, source_name)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return ArchiveChain(path)
+    if data.get('format') != CHAIN_FORMAT:
+        raise ValueError(f"'{path}' is not a supported archive chain")
+    return ArchiveChain(path, data['generations'])
+
+
+class ChainView:
+    """
+    The library as of one generation: every file and where its content is stored.
+
+    ``entries`` maps each relative path to (archive id, path of its record
+    in that generation's manifest); for deduplicated files that is the
+    reference's target, which may itself be a reference (see record).
+    """
+
+    def __init__(self, chain, generations):
+        self.generations = generations
+        self.manifests = {}
+        self.entries = {}
+        for generation in generations:
+            archive_id = generation['archive_id']
+            manifest_path = chain.manifest_path(generation)
+            manifest = load_manifest(manifest_path)
+            self.manifests[archive_id] = (manifest_path, manifest)
+            for path in manifest.tombstones:
+                self.entries.pop(path, None)
+            for path in manifest.files:
+                self.entries[path] = (archive_id, path)
+            for path, reference in manifest.references.items():
+                self.entries[path] = (reference.get('target_archive') or archive_id, reference['target'])
+
+    def record(self, path):
+        """
+        Returns where a file's content is stored.
+
+        References are followed until they reach a file record, so a
+        reference to a path that is itself a reference in its generation
+        still finds the content.
+
+        Returns:
+            Tuple of (archive id, manifest path, Manifest, file record), or None
+            if the content lives outside the chain (or the references form a cycle)
+        """
+        location = self.entries[path]
+        seen = set()
+        while location not in seen:
+            seen.add(location)
+            archive_id, target = location
+            if archive_id not in self.manifests:
+                return None
+            manifest_path, manifest = self.manifests[archive_id]
+            record = manifest.files.get(target)
+            if record is not None:
+                return archive_id, manifest_path, manifest, record
+            reference = manifest.references.get(target)
+            if reference is None:
+                return None
+            location = (reference.get('target_archive') or archive_id, reference['target'])
+        return None
+
+    def select(self, patterns):
+        """Returns the paths matching any of the patterns (see restore.select_files), sorted."""
+        return sorted(path for path in self.entries
+                      if any(fnmatch.fnmatchcase(path, pattern) or path.startswith(pattern.rstrip('/') + '/')
+                             for pattern in patterns))
+
+
+def main(argv=None):
+    """Entry point for listing and pruning the configured archive chain."""
+    parser = argparse.ArgumentParser(description='Inspect and prune an archive chain.')
+    parser.add_argument('command', choices=('list', 'prune'))
+    parser.add_argument('--config', default='config.ini', help='Configuration file (default: config.ini)')
+    parser.add_argument('--job', help='Job whose archive to use, when the configuration has [Job ...] sections')
+    parser.add_argument('--keep', type=int, help='Chains kept by prune (default: keep_chains from the configuration)')
+    args = parser.parse_args(argv)
+
+    config = select_job(load_config(args.config), args.job)
+    source_dir = config.get('Paths', 'source_dir')
+    destination_dir = config.get('Paths', 'destination_dir')
+    try:
+        chain = load_chain(destination_dir, Path(source_dir).name)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read the archive chain: {e}")
+        sys.exit(1)
+
+    if args.command == 'list':
+        for generation in chain.generations:
+            print(f"{generation['archive_id']:<20} {generation['kind']:<6} {generation['status']:<9} "
+                  f"{generation['name']}")
+        print(f"{len(chain.generations)} generations; {chain.deltas_since_full} deltas since the last full.")
+    else:
+        keep = args.keep if args.keep is not None else config.getint('Chain', 'keep_chains',
+                                                                    fallback=DEFAULT_KEEP_CHAINS)
+        removed = chain.prune(keep)
+        print(f"Removed {len(removed)} generations older than the last {keep} chains.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import os
+import sqlite3
+import stat
+import sys
+from pathlib import Path
+
+from .journal import ChangeJournal, format_position, parse_position
+from .path_filter import NO_FILTER
+from .scanner import DEFAULT_SCAN_WORKERS, is_modified, iter_changed_files, walk_tree
+from .state import FileRecord
+
+
+CHANGE_SOURCES = ('walk', 'journal')
+DEFAULT_CHANGE_SOURCE = 'walk'
+
+# Meta key under which the state remembers how far the journal was consumed.
+JOURNAL_POSITION_KEY = 'journal_position'
+
+# Meta key under which the state remembers the include/exclude rules of the last run
+# (their fingerprint; stored by the archiver with the run's records).
+PATH_FILTER_KEY = 'path_filter'
+
+
+# A change source finds the files that changed since the last run. Every
+# source offers the same interface:
+#
+#   changes(processed_files, phase=None)  iterator of (relative path, FileRecord)
+#   deletions(processed_files)            iterator of relative paths gone from the source,
+#                                         valid once changes() is exhausted
+#   dir_summaries                         DirSummary dict to store, or None to keep the stored ones
+#   meta                                  dict of state meta values to store, or None
+#   acknowledge()                         called once the run's records are committed
+#   close()
+
+
+class FullWalkSource:
+    """Finds changes by walking the whole source directory (see scanner.iter_changed_files)."""
+
+    name = 'walk'
+
+    def __init__(self, source_dir, workers=DEFAULT_SCAN_WORKERS, previous_dirs=None, paranoid=False,
+                 journal=None, path_filter=NO_FILTER):
+        """
+        Args:
+            source_dir: Path to the source directory
+            workers: Number of directories listed concurrently
+            previous_dirs: DirSummary tuples from the previous run, for pruning
+            paranoid: If True, stat every file
+            journal: Optional ChangeJournal. Its position is taken before the
+                walk starts, so the next run can continue from the journal.
+            path_filter: path_filter.PathFilter of files and directories to leave out
+        """
+        self.source_dir = source_dir
+        self.workers = workers
+        self.previous_dirs = previous_dirs
+        self.paranoid = paranoid
+        self.path_filter = path_filter
+        self.dir_summaries = {}
+        self._journal = journal
+        self._position = journal.position(source_dir) if journal is not None else None
+
+    @property
+    def meta(self):
+        if self._position is None:
+            return None
+        return {JOURNAL_POSITION_KEY: format_position(self._position)}
+
+    def changes(self, processed_files, phase=None):
+        return iter_changed_files(self.source_dir, processed_files, self.workers, self.previous_dirs,
+                                  self.dir_summaries, self.paranoid, phase, self.path_filter)
+
+    def deletions(self, processed_files):
+        # A deleted file changes its directory's listing, so pruned directories hold none.
+        previous = self.previous_dirs or {}
+
+        def may_be_deleted(relative_path):
+            directory = os.path.dirname(relative_path)
+            summary = self.dir_summaries.get(directory)
+            return summary is None or previous.get(directory) != summary
+
+        return _deleted_files(self.source_dir, processed_files, may_be_deleted, self.path_filter)
+
+    def acknowledge(self):
+        # Everything logged before the walk started has been seen by the walk.
+        if self._position is not None:
+            self._journal.prune(self._position.seq)
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+
+
+class JournalSource:
+    """
+    Finds changes from the change journal kept by the watcher, without walking.
+
+    Only the files named by journal events since the previous run are
+    stat'ed; directories that appeared as a whole (created or moved in) are
+    walked. Directory summaries are left as they are: a later full walk
+    merely does some extra work where they have gone stale.
+    """
+
+    name = 'journal'
+    dir_summaries = None
+
+    def __init__(self, source_dir, journal, since, position, workers=DEFAULT_SCAN_WORKERS, path_filter=NO_FILTER):
+        """
+        Args:
+            source_dir: Path to the source directory
+            journal: ChangeJournal that passed its consistency check
+            since: JournalPosition consumed by the previous run
+            position: Current JournalPosition; events up to it are consumed
+            workers: Number of directories listed concurrently in new subtrees
+            path_filter: path_filter.PathFilter of files and directories to leave out
+        """
+        self.source_dir = source_dir
+        self.workers = workers
+        self.path_filter = path_filter
+        self._journal = journal
+        self._since = since
+        self._position = position
+        self._deleted = set()
+
+    @property
+    def meta(self):
+        return {JOURNAL_POSITION_KEY: format_position(self._position)}
+
+    def changes(self, processed_files, phase=None):
+        """
+        Returns an iterator of changed files, like scanner.iter_changed_files.
+
+        Raises:
+            SystemExit: If source directory is not found or is not a directory
+        """
+        source_path = Path(self.source_dir)
+        if not source_path.is_dir():
+            print(f"Error: Source directory '{self.source_dir}' not found or is not a directory.")
+            sys.exit(1)
+        # Read here, on the caller's thread: the SQLite connection belongs to it.
+        events = self._journal.events(self._since.seq, self._position.seq)
+        return self._changes(source_path, processed_files, events, phase)
+
+    def _changes(self, source_path, processed_files, events, phase):
+        files = set()
+        directories = set()
+        for kind, relative_path in events:
+            if kind == 'file':
+                if not self.path_filter.skips(relative_path):
+                    files.add(relative_path)
+            elif kind == 'dir':
+                if not self.path_filter.skips(relative_path, directory=True):
+                    directories.add(relative_path)
+            elif kind == 'delete':
+                self._deleted.add(relative_path)
+        directories = _outermost(directories)
+
+        def candidates():
+            for directory in sorted(directories):
+                if not (source_path / directory).is_dir():
+                    continue  # Moved away again
+                yield from walk_tree(source_path / directory, self.workers, paranoid=True,
+                                     path_filter=self.path_filter, relative_root=directory)
+            for relative_path in sorted(files):
+                if _is_within(relative_path, directories):
+                    continue
+                try:
+                    st = os.stat(source_path / relative_path)
+                except OSError:
+                    continue  # Deleted or renamed since
+                if stat.S_ISREG(st.st_mode):
+                    yield relative_path, st
+
+        changed = 0
+        for relative_path, st in candidates():
+            if phase is not None:
+                phase.advance(files=1)
+            if is_modified(processed_files.get(relative_path), st):
+                changed += 1
+                yield relative_path, FileRecord(st.st_size, st.st_mtime_ns, st.st_ino, None)
+        if phase is not None:
+            phase.note(journal_events=len(events), changed=changed)
+            phase.stop()
+
+    def deletions(self, processed_files):
+        # Delete events name files or whole directories that were removed or moved away.
+        if not self._deleted:
+            return iter(())
+        return _deleted_files(
+            self.source_dir, processed_files,
+            lambda relative_path: relative_path in self._deleted or _is_within(relative_path, self._deleted),
+        )
+
+    def acknowledge(self):
+        self._journal.prune(self._position.seq)
+
+    def close(self):
+        self._journal.close()
+
+
+def _deleted_files(source_dir, processed_files, may_be_deleted, path_filter=NO_FILTER):
+    """
+    Yields the processed files that may_be_deleted selects and that are no longer
+    regular files, or that path_filter now leaves out.
+    """
+    source_path = Path(source_dir)
+    for relative_path, _ in processed_files.items():
+        if may_be_deleted(relative_path) and (path_filter.skips(relative_path)
+                                              or not os.path.isfile(source_path / relative_path)):
+            yield relative_path
+
+
+def _is_within(relative_path, directories):
+    parent = os.path.dirname(relative_path)
+    while parent:
+        if parent in directories:
+            return True
+        parent = os.path.dirname(parent)
+    return False
+
+
+def _outermost(directories):
+    """Drops directories nested inside other directories of the set."""
+    return {directory for directory in directories if not _is_within(directory, directories)}
+
+
+def open_change_source(kind, source_dir, state, journal_path=None, workers=DEFAULT_SCAN_WORKERS,
+                       previous_dirs=None, paranoid=False, full=False, path_filter=NO_FILTER):
+    """
+    Picks the change source for a run.
+
+    The journal is used only if it provably holds every change since the
+    previous run: the same watcher session must still be alive and must not
+    have lost events. Otherwise the whole tree is walked, and the journal
+    position taken before the walk lets the next run use the journal again.
+
+    Args:
+        kind: 'walk' or 'journal'
+        source_dir: Path to the source directory
+        state: StateStore holding the position consumed by the previous run
+        journal_path: Path of the journal database written by the watcher
+        workers: Number of directories listed concurrently
+        previous_dirs: DirSummary tuples from the previous run
+        paranoid: If True, always walk and stat every file
+        full: If True, always walk (a full archive); the journal position is
+            still taken for the next run
+        path_filter: path_filter.PathFilter of files and directories to leave
+            out. When it differs from the previous run's, the whole tree is
+            walked without pruning, and files it now leaves out are reported
+            as deleted
+
+    Returns:
+        FullWalkSource or JournalSource
+
+    Raises:
+        SystemExit: If kind is not a known change source
+    """
+    if kind not in CHANGE_SOURCES:
+        print(f"Error: Unknown change source '{kind}'. Choose one of: {', '.join(CHANGE_SOURCES)}.")
+        sys.exit(1)
+    rules_changed = (state.get_meta(PATH_FILTER_KEY) or NO_FILTER.fingerprint) != path_filter.fingerprint
+    if rules_changed:
+        # Directories pruned by their summaries may hold files the new rules take in.
+        print("Scan rules changed since the last run; checking every directory.")
+        previous_dirs = {}
+    if kind == 'walk':
+        return FullWalkSource(source_dir, workers, previous_dirs, paranoid, path_filter=path_filter)
+    if not journal_path or not Path(journal_path).is_file():
+        print(f"Change journal '{journal_path}' not found; walking the whole source directory.")
+        return FullWalkSource(source_dir, workers, previous_dirs, paranoid, path_filter=path_filter)
+    try:
+        journal = ChangeJournal(journal_path)
+        # Position before checking, so an overflow logged in between is caught.
+        position = journal.position(source_dir)
+        if full:
+            problem = 'full archive'
+        elif rules_changed:
+            problem = 'scan rules changed'
+        elif paranoid:
+            problem = 'paranoid mode'
+        else:
+            problem = journal.check(source_dir, parse_position(state.get_meta(JOURNAL_POSITION_KEY)))
+    except sqlite3.Error as e:
+        print(f"Warning: Could not read change journal '{journal_path}': {e}")
+        return FullWalkSource(source_dir, workers, previous_dirs, paranoid, path_filter=path_filter)
+    if problem is not None:
+        print(f"Change journal not used ({problem}); walking the whole source directory.")
+        return FullWalkSource(source_dir, workers, previous_dirs, paranoid, journal, path_filter)
+    since = parse_position(state.get_meta(JOURNAL_POSITION_KEY))
+    print(f"Reading changes logged since journal event {since.seq}.")
+    return JournalSource(source_dir, journal, since, position, workers, path_filter)
@@ -0,0 +1,131 @@
+import json
+from pathlib import Path
+
+from .manifest import MANIFEST_FORMAT, MANIFEST_SUFFIX
+
+
+# The manifest of an archive still being written doubles as its journal:
+# ManifestWriter streams records to this file and flushes it to disk after
+# every completed volume.
+JOURNAL_SUFFIX = MANIFEST_SUFFIX + '.tmp'
+
+# Header fields that must match for a journaled run to be resumed.
+RESUME_SETTINGS = ('source', 'codec', 'volume_size', 'checksum', 'encryption', 'partition')
+
+
+def journal_path(destination_dir, archive_stem):
+    """Returns the path of the journal of an unfinished archive."""
+    return Path(destination_dir) / f"{archive_stem}{JOURNAL_SUFFIX}"
+
+
+class Checkpoint:
+    """
+    The completed part of an interrupted archive run.
+
+    Only volumes that were fully written, recorded in the journal and are
+    still on disk with the recorded size count as complete. Everything the
+    journal holds after the last complete volume belongs to the volume that
+    was being written and is dropped on resume.
+    """
+
+    def __init__(self, path, header, volumes, files, resume_offset):
+        """
+        Args:
+            path: Path of the journal
+            header: Fields of the journal's 'archive' record
+            volumes: Complete volume records by index
+            files: File records of complete volumes by relative path
+            resume_offset: Byte offset in the journal just after the last complete volume
+        """
+        self.path = Path(path)
+        self.header = header
+        self.volumes = volumes
+        self.files = files
+        self.resume_offset = resume_offset
+
+    @property
+    def archive_id(self):
+        return self.header.get('archive_id')
+
+    @property
+    def next_volume_index(self):
+        """Index of the first volume still to be written."""
+        return max(self.volumes) + 1 if self.volumes else 0
+
+    def matches(self, **settings):
+        """True if the interrupted run used the same settings (see RESUME_SETTINGS)."""
+        return all(self.header.get(key) == settings.get(key) for key in RESUME_SETTINGS)
+
+    def is_archived(self, relative_path, size, mtime_ns):
+        """True if this version of the file is already in a complete volume."""
+        record = self.files.get(relative_path)
+        return record is not None and record.get('size') == size and record.get('mtime_ns') == mtime_ns
+
+    def discard(self):
+        """Deletes the journal and every volume it recorded."""
+        for volume in self.volumes.values():
+            volume_path = self.path.with_name(volume['name'])
+            if volume_path.exists():
+                volume_path.unlink()
+        if self.path.exists():
+            self.path.unlink()
+        self.volumes = {}
+        self.files = {}
+
+
+def load_checkpoint(destination_dir, archive_stem):
+    """
+    Loads the journal left behind by an interrupted archive run.
+
+    Args:
+        destination_dir: Directory the archive was being written to
+        archive_stem: Archive name (the source directory name)
+
+    Returns:
+        Checkpoint object, or None if there is no usable journal
+    """
+    path = journal_path(destination_dir, archive_stem)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+
+    header = None
+    volumes = {}
+    files = {}
+    pending = {}  # File records of the volume being written
+    resume_offset = 0
+    offset = 0
+    with f:
+        for line in f:
+            offset += len(line)
+            if not line.endswith(b'\n'):
+                break  # Torn write at the moment of the interruption
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            record_type = record.pop('type', None)
+            if header is None:
+                if record_type != 'archive' or record.get('format') != MANIFEST_FORMAT:
+                    return None
+                header = record
+                resume_offset = offset
+            elif record_type == 'file':
+                pending[record['path']] = record
+            elif record_type == 'volume':
+                volume_path = path.with_name(record['name'])
+                try:
+                    complete = volume_path.stat().st_size == record['bytes']
+                except OSError:
+                    complete = False
+                if not complete:
+                    break
+                volumes[record['index']] = record
+                files.update(pending)
+                pending = {}
+                resume_offset = offset
+
+    if header is None:
+        return None
+    return Checkpoint(path, header, volumes, files, resume_offset)
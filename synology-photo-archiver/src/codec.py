@@ -0,0 +1,299 @@
+import lzma
+import os
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+
+class _StoreCompressor:
+    """Pass-through 'compressor' for data that is not worth compressing."""
+
+    def compress(self, data):
+        return bytes(data)
+
+    def flush(self):
+        return b''
+
+
+class _StoreDecompressor:
+    """Pass-through 'decompressor'; a stored stream never ends a member."""
+
+    eof = False
+    unused_data = b''
+
+    def decompress(self, data):
+        return bytes(data)
+
+
+class Codec:
+    """
+    A compression format for the tar stream.
+
+    Every codec hands out compressor objects with the zlib-style
+    ``compress(data) -> bytes`` / ``flush() -> bytes`` interface. Each
+    compressor produces one self-contained member (gzip member, xz stream or
+    zstd frame); members can be concatenated and are decoded in sequence by
+    the standard tools, which lets a writer switch to ``store_level`` (the
+    cheapest setting) for data that does not compress. Member boundaries
+    are also where a reader can start decoding in the middle of a volume.
+
+    Decompressor objects decode one member and expose ``eof`` and
+    ``unused_data`` like zlib's, so a reader can chain them.
+    """
+
+    def __init__(self, name, extension, default_level, store_level, factory, decompressor_factory=None,
+                 available=True):
+        self.name = name
+        self.extension = extension
+        self.default_level = default_level
+        self.store_level = store_level
+        self.available = available
+        self._factory = factory
+        self._decompressor_factory = decompressor_factory
+
+    def __repr__(self):
+        return f"Codec({self.name!r})"
+
+    def compressor(self, level=None):
+        """
+        Creates a compressor for one member.
+
+        Args:
+            level: Compression level (codec specific); None for the codec default
+
+        Returns:
+            Object with compress(data) and flush() methods
+        """
+        return self._factory(self.default_level if level is None else level)
+
+    def decompressor(self):
+        """Creates a decompressor for one member."""
+        return self._decompressor_factory()
+
+
+def _gzip_compressor(level):
+    # wbits=31 writes a gzip header with a zero mtime, keeping output deterministic.
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _xz_compressor(level):
+    return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=level)
+
+
+def _zstd_compressor(level):
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def _zstd_decompressor():
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+# What decompressors raise on corrupt data.
+DECODE_ERRORS = (zlib.error, lzma.LZMAError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# Parallel compression cuts the stream into blocks of this size; each block
+# becomes an independent member, costing a little ratio for the parallelism.
+PARALLEL_BLOCK_SIZE = 1024 * 1024
+
+CODECS = {
+    'store': Codec('store', '.tar', 0, 0, lambda level: _StoreCompressor(), _StoreDecompressor),
+    # gzip level 0 emits stored deflate blocks: only a CRC is computed.
+    'gzip': Codec('gzip', '.tar.gz', 6, 0, _gzip_compressor, lambda: zlib.decompressobj(31)),
+    'xz': Codec('xz', '.tar.xz', 6, 0, _xz_compressor, lambda: lzma.LZMADecompressor(format=lzma.FORMAT_XZ)),
+    'zstd': Codec('zstd', '.tar.zst', 3, 1, _zstd_compressor, _zstd_decompressor,
+                  available=zstandard is not None),
+}
+
+
+def get_codec(name):
+    """
+    Looks up a codec by name.
+
+    Args:
+        name: Codec name ('store', 'gzip', 'xz' or 'zstd'), case insensitive
+
+    Returns:
+        Codec object
+
+    Raises:
+        SystemExit: If the codec is unknown or its optional dependency is missing
+    """
+    codec = CODECS.get(str(name).strip().lower())
+    if codec is None:
+        print(f"Error: Unknown codec '{name}'. Choose one of: {', '.join(CODECS)}.")
+        sys.exit(1)
+    if not codec.available:
+        print(f"Error: Codec '{codec.name}' is not available. Install the 'zstandard' package to use it.")
+        sys.exit(1)
+    return codec
+
+
+class StreamCompressor:
+    """
+    Compresses a byte stream as a sequence of members on the calling thread.
+
+    ``set_level`` ends the current member and starts the next one at a new
+    level; ``restart`` does the same at the current level. ``cpu_seconds``
+    accumulates the CPU time spent compressing, and ``boundaries`` lists the
+    (uncompressed offset, compressed offset) at which every member starts.
+    """
+
+    def __init__(self, codec, level=None):
+        self._codec = codec
+        self.level = codec.default_level if level is None else level
+        self._compressor = codec.compressor(self.level)
+        self.cpu_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.boundaries = [(0, 0)]
+
+    def compress(self, data):
+        started = time.thread_time()
+        compressed = self._compressor.compress(data)
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed)
+        return compressed
+
+    def _next_member(self, level):
+        tail = self._compressor.flush()
+        self.bytes_out += len(tail)
+        self._compressor = self._codec.compressor(level)
+        self.level = level
+        self.boundaries.append((self.bytes_in, self.bytes_out))
+        return tail
+
+    def set_level(self, level):
+        """Switches level; returns the tail of the member that was ended (if any)."""
+        if level == self.level:
+            return b''
+        return self._next_member(level)
+
+    def restart(self):
+        """Ends the current member so that decoding can start here; returns its tail."""
+        return self._next_member(self.level)
+
+    def flush(self):
+        started = time.thread_time()
+        tail = self._compressor.flush()
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_out += len(tail)
+        return tail
+
+    def close(self):
+        """Releases the compressor; nothing to do on the calling thread."""
+
+
+def _compress_block(codec, level, block):
+    started = time.thread_time()
+    compressor = codec.compressor(level)
+    compressed = compressor.compress(block) + compressor.flush()
+    return compressed, time.thread_time() - started
+
+
+class ParallelStreamCompressor:
+    """
+    Compresses a byte stream on several cores, pigz style.
+
+    Input is cut into fixed-size blocks that are compressed concurrently as
+    independent members and emitted strictly in input order, so the output
+    only depends on the input and the block size, never on timing. zlib, lzma
+    and zstd release the GIL while compressing, so worker threads give real
+    parallelism without copying every block to another process.
+
+    Same interface as StreamCompressor.
+    """
+
+    def __init__(self, codec, level=None, workers=2, block_size=PARALLEL_BLOCK_SIZE):
+        self._codec = codec
+        self.level = codec.default_level if level is None else level
+        self._block_size = block_size
+        self._block = bytearray()
+        self._block_start = 0  # Uncompressed offset of the current block
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compress')
+        self._pending = deque()
+        # Bound the blocks held in memory; compress() blocks beyond this.
+        self._max_pending = workers * 2
+        self.cpu_seconds = 0.0
+        self.bytes_out = 0
+        self.boundaries = []
+
+    def _submit_block(self):
+        if self._block:
+            future = self._pool.submit(_compress_block, self._codec, self.level, bytes(self._block))
+            self._pending.append((future, self._block_start))
+            self._block_start += len(self._block)
+            self._block.clear()
+
+    def _collect(self, wait_all=False):
+        output = bytearray()
+        while self._pending and (wait_all or len(self._pending) > self._max_pending or self._pending[0][0].done()):
+            future, block_start = self._pending.popleft()
+            compressed, cpu_seconds = future.result()
+            self.cpu_seconds += cpu_seconds
+            # Every block is a member of its own.
+            self.boundaries.append((block_start, self.bytes_out))
+            self.bytes_out += len(compressed)
+            output += compressed
+        return bytes(output)
+
+    def compress(self, data):
+        view = memoryview(data)
+        while view:
+            take = self._block_size - len(self._block)
+            self._block += view[:take]
+            view = view[take:]
+            if len(self._block) >= self._block_size:
+                self._submit_block()
+        return self._collect()
+
+    def set_level(self, level):
+        """Switches level; the current block is cut short so it keeps the old level."""
+        if level == self.level:
+            return b''
+        self._submit_block()
+        self.level = level
+        return self._collect()
+
+    def restart(self):
+        """Cuts the current block short so that a member starts here."""
+        self._submit_block()
+        return self._collect()
+
+    def flush(self):
+        self._submit_block()
+        try:
+            return self._collect(wait_all=True)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the worker threads, dropping blocks not compressed yet; safe to call more than once."""
+        self._pool.shutdown(cancel_futures=True)
+        self._pending.clear()
+
+
+def open_compressor(codec, level=None, workers=1):
+    """
+    Creates a stream compressor for a codec.
+
+    Args:
+        codec: Codec object
+        level: Initial compression level; None for the codec default
+        workers: Number of compression threads; 1 compresses serially, 0 uses every CPU
+
+    Returns:
+        StreamCompressor or ParallelStreamCompressor
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers > 1 and codec.name != 'store':
+        return ParallelStreamCompressor(codec, level, workers)
+    return StreamCompressor(codec, level)
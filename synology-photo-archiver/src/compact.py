@@ -0,0 +1,211 @@
+"""
+Compaction: merges the current full generation and its deltas into a new full.
+
+    python3 -m src.compact
+
+Members are copied out of the existing volumes in archive order and checked
+against their recorded checksums on the way, so the source directory is not
+read again and a damaged member fails the compaction instead of being carried
+into the new full. The archiver compacts on its own every compact_after deltas.
+"""
+import argparse
+import sys
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+from .capture_date import load_partition
+from .chain import ChainView, load_chain, new_archive_id
+from .codec import get_codec
+from .compression import CHECKSUM_ALGORITHMS, DEFAULT_CHECKSUM, DEFAULT_CODEC, StoredFile, create_archive
+from .config import load_config
+from .dedup import Reference
+from .encryption import configured_password, open_key
+from .jobs import select_job
+from .metrics import Phase
+from .restore import VolumeReader, read_member
+from .state import StateStore
+from .writeout import load_write_options
+
+
+# Deltas after which a run compacts the chain into a new full; 0 never does.
+DEFAULT_COMPACT_AFTER = 7
+
+# Source volumes kept open at once while compacting.
+MAX_OPEN_VOLUMES = 16
+
+# A new full generation and the dedup.Reference tuples of the files it stores under another path.
+Compaction = namedtuple('Compaction', ['archive_id', 'references'])
+
+
+class _MemberReaders:
+    """Opens members of the chain's volumes, keeping recently used volumes open."""
+
+    def __init__(self, view, password):
+        self._view = view
+        self._password = password
+        self._keys = {}
+        self._readers = OrderedDict()
+
+    def _reader(self, archive_id, index):
+        reader = self._readers.pop((archive_id, index), None)
+        if reader is None:
+            manifest_path, manifest = self._view.manifests[archive_id]
+            if archive_id not in self._keys:
+                self._keys[archive_id] = open_key(manifest.header, self._password)
+            volume = manifest.volumes[index]
+            reader = VolumeReader(manifest_path.with_name(volume['name']),
+                                  get_codec(manifest.header.get('codec', DEFAULT_CODEC)),
+                                  volume.get('seek_points'), key=self._keys[archive_id])
+            if len(self._readers) >= MAX_OPEN_VOLUMES:
+                self._readers.popitem(last=False)[1].close()
+        self._readers[(archive_id, index)] = reader
+        return reader
+
+    def opener(self, archive_id, record):
+        """Returns a StoredFile opener that also checks the content against the manifest checksum."""
+        def open_member():
+            checksum = self._view.manifests[archive_id][1].header.get('checksum')
+            info, chunks = read_member(self._reader(archive_id, record['volume']), record)
+            if not checksum or not record.get('checksum'):
+                return info, chunks
+
+            def checked():
+                digest = CHECKSUM_ALGORITHMS[checksum]()
+                for data in chunks:
+                    digest.update(data)
+                    yield data
+                if digest.hexdigest() != record['checksum']:
+                    raise ValueError(f"checksum mismatch in archive {archive_id} for '{record['path']}'")
+            return info, checked()
+        return open_member
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+
+
+def compact(chain, source_dir, password=None, key=None, volume_size='', codec=DEFAULT_CODEC,
+            checksum=DEFAULT_CHECKSUM, workers=1, policy=None, phase=None, write_options=None, partition=None,
+            group_small_files=False):
+    """
+    Merges the current full and its deltas into a new full generation.
+
+    Every file of the library is copied from the volume that holds it, in
+    archive order, and checked against its recorded checksum on the way.
+    Files sharing content (deduplicated files) are stored once and recorded
+    as references within the new full. The source directory is not read.
+
+    Args:
+        chain: ArchiveChain to compact
+        source_dir: Source directory of the archive (names member paths)
+        password: Password of encrypted generations, and for the new full
+        key: Optional encryption.ArchiveKey for the new full instead of password
+        volume_size, codec, checksum, workers, policy, write_options, partition, group_small_files: As for
+            create_archive; files are partitioned by the capture dates their generations recorded
+        phase: Optional metrics.Phase advanced with the files copied
+
+    Returns:
+        Compaction of the new full, or None if there was nothing to compact,
+        a file's content could not be located in the chain, or compaction
+        failed (the chain is then left unchanged)
+    """
+    generations = chain.current()
+    if len(generations) < 2:
+        print("Nothing to compact: the chain has no deltas.")
+        return None
+    view = ChainView(chain, generations)
+    order = {generation['archive_id']: i for i, generation in enumerate(generations)}
+
+    stored = {}  # (archive id, target) -> first path stored with that content
+    files = []
+    references = []
+    missing = []
+    for path in sorted(view.entries):
+        located = view.record(path)
+        if located is None:
+            missing.append(path)
+            continue
+        archive_id, _, _, record = located
+        content = (archive_id, record['path'])
+        if content in stored:
+            references.append((path, stored[content]))
+            continue
+        stored[content] = path
+        files.append((order[archive_id], record['volume'], record.get('offset', 0), path, archive_id, record))
+    if missing:
+        # The chain is the only copy of these files: pruning it after a new full without them would lose them.
+        print(f"Error: {len(missing)} files are stored outside the chain (first: '{missing[0]}'); "
+              "not compacting.")
+        return None
+    files.sort(key=lambda item: item[:3])
+
+    archive_id = new_archive_id(chain)
+    compacted_from = [generation['archive_id'] for generation in generations]
+    name = chain.begin(archive_id, 'full', compacted_from=compacted_from)
+    print(f"Compacting {len(generations)} generations ({len(files)} files) into {name}.")
+    references = [Reference(path, target, archive_id, 'duplicate') for path, target in references]
+    readers = _MemberReaders(view, password)
+    try:
+        stored_files = (
+            StoredFile(path, record['member'], record['size'], record['mtime_ns'], readers.opener(source_id, record),
+                       record.get('taken'))
+            for _, _, _, path, source_id, record in files
+        )
+        success = create_archive(
+            stored_files, source_dir, chain.path.parent, None, password, volume_size, codec=codec,
+            policy=policy, workers=workers, checksum=checksum, archive_id=archive_id, phase=phase, key=key,
+            archive_name=name, header_fields={'kind': 'full', 'compacted_from': compacted_from},
+            write_options=write_options, partition=partition, group_small_files=group_small_files,
+            references=references,
+        )
+    finally:
+        readers.close()
+    if not success:
+        chain.abandon(archive_id)
+        return None
+    chain.complete(archive_id)
+    return Compaction(archive_id, references)
+
+
+def main(argv=None):
+    """Entry point for compacting the configured archive chain."""
+    parser = argparse.ArgumentParser(description='Merge the archive chain into a new full archive.')
+    parser.add_argument('--config', default='config.ini', help='Configuration file (default: config.ini)')
+    parser.add_argument('--job', help='Job whose archive to use, when the configuration has [Job ...] sections')
+    args = parser.parse_args(argv)
+
+    config = select_job(load_config(args.config), args.job)
+    source_dir = config.get('Paths', 'source_dir')
+    try:
+        chain = load_chain(config.get('Paths', 'destination_dir'), Path(source_dir).name)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read the archive chain: {e}")
+        sys.exit(1)
+    if chain.pending is not None:
+        print("Error: A generation is still being written; run the archiver first.")
+        sys.exit(1)
+    password = configured_password(config.get('Archive', 'password', fallback=''))
+    checksum = config.get('Archive', 'checksum', fallback=DEFAULT_CHECKSUM).strip().lower()
+    try:
+        with Phase('compact', progress_interval=None) as phase:
+            compacted = compact(
+                chain, source_dir, password, volume_size=config.get('Archive', 'volume_size', fallback=''),
+                codec=config.get('Archive', 'codec', fallback=DEFAULT_CODEC),
+                checksum=None if checksum == 'none' else checksum,
+                workers=config.getint('Archive', 'workers', fallback=1), phase=phase,
+                write_options=load_write_options(config), partition=load_partition(config),
+                group_small_files=config.getboolean('Archive', 'group_small_files', fallback=True),
+            )
+    except ValueError as e:
+        print(f"Error: Could not compact the archive chain: {e}")
+        sys.exit(1)
+    if compacted is None:
+        sys.exit(1 if chain.deltas_since_full else 0)
+    with StateStore(config.get('State', 'file')) as state:
+        state.reassign_archive(*compacted)
+    print(f"Compacted into {compacted.archive_id} in {phase.seconds:.2f}s.")
+
+
+if __name__ == '__main__':
+    main()
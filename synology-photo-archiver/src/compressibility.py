@@ -0,0 +1,126 @@
+import os
+import zlib
+
+
+# Formats that are already compressed; deflating them again saves ~1-2%.
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    '.jpg', '.jpeg', '.heic', '.heif', '.avif', '.webp', '.png', '.gif',
+    '.mp4', '.m4v', '.mov', '.mkv', '.avi', '.3gp', '.hevc', '.mts', '.m2ts',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar',
+})
+
+# Text and metadata formats that always compress well.
+COMPRESSIBLE_EXTENSIONS = frozenset({
+    '.xmp', '.json', '.xml', '.txt', '.csv', '.log', '.ini', '.html', '.aae',
+    '.bmp', '.tif', '.tiff', '.psd', '.svg',
+})
+
+# How much of the start of a file the probe compresses, and the compressed/raw
+# ratio above which compressing is considered not worth the CPU.
+PROBE_BYTES = 16 * 1024
+PROBE_RATIO_THRESHOLD = 0.95
+
+
+def probe_compressibility(sample):
+    """
+    Compresses a sample with the fastest zlib level to estimate compressibility.
+
+    Args:
+        sample: Bytes-like object with the start of a file
+
+    Returns:
+        bool: True if the data is worth compressing
+    """
+    sample = sample[:PROBE_BYTES]
+    if len(sample) < 512:
+        return True  # Too small to tell, and too small to matter
+    return len(zlib.compress(sample, 1)) < len(sample) * PROBE_RATIO_THRESHOLD
+
+
+class CompressibilityPolicy:
+    """
+    Decides per file whether to compress or just store it.
+
+    Known extensions decide immediately. Anything else is probed by
+    compressing a sample of its first bytes; probe results are looked up in
+    and added to a cache keyed by path and validated by (size, mtime_ns), so
+    an unchanged file is never probed twice.
+    """
+
+    def __init__(self, cache=None):
+        """
+        Args:
+            cache: Optional mapping (anything with .get()) from cache key to
+                (size, mtime_ns, compress) tuples from previous runs
+        """
+        self._cache = cache if cache is not None else {}
+        self.decisions = {}  # New probe results, to be saved in the state
+        self.cache_hits = 0
+
+    def should_compress(self, key, stat_result, sample):
+        """
+        Decides whether a file should be compressed.
+
+        Args:
+            key: Cache key for the file (its relative path)
+            stat_result: os.stat_result of the file
+            sample: Bytes-like object with the first bytes of the file
+
+        Returns:
+            bool: True to compress, False to store
+        """
+        extension = os.path.splitext(key)[1].lower()
+        if extension in INCOMPRESSIBLE_EXTENSIONS:
+            return False
+        if extension in COMPRESSIBLE_EXTENSIONS:
+            return True
+
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == stat_result.st_size and cached[1] == stat_result.st_mtime_ns:
+            self.cache_hits += 1
+            return bool(cached[2])
+
+        compress = probe_compressibility(sample)
+        self.decisions[key] = (stat_result.st_size, stat_result.st_mtime_ns, compress)
+        return compress
+
+
+class CompressionReport:
+    """
+    Per file type totals of bytes in/out and compressor CPU time.
+
+    Compressed sizes are attributed to the file being written when the
+    compressor emitted them; compressors buffer internally, so per-type
+    figures are approximate but even out over many files.
+    """
+
+    def __init__(self):
+        self._rows = {}
+
+    def add(self, extension, bytes_in, bytes_out, cpu_seconds, compressed):
+        """Accumulates the figures for one archived file."""
+        row = self._rows.setdefault(extension or '(none)', [0, 0, 0, 0.0, 0])
+        row[0] += 1
+        row[1] += bytes_in
+        row[2] += bytes_out
+        row[3] += cpu_seconds
+        row[4] += 0 if compressed else 1
+
+    def rows(self):
+        """
+        Returns:
+            List of (extension, files, bytes_in, bytes_out, cpu_seconds, stored_files),
+            largest input first
+        """
+        return sorted(((ext, *row) for ext, row in self._rows.items()), key=lambda r: -r[2])
+
+    def format(self):
+        """Returns the report as printable lines."""
+        lines = [f"{'type':<8} {'files':>8} {'in MB':>10} {'out MB':>10} {'saved MB':>10} {'cpu s':>8} {'stored':>7}"]
+        for extension, files, bytes_in, bytes_out, cpu_seconds, stored in self.rows():
+            lines.append(
+                f"{extension:<8} {files:>8} {bytes_in / 1e6:>10.1f} {bytes_out / 1e6:>10.1f} "
+                f"{(bytes_in - bytes_out) / 1e6:>10.1f} {cpu_seconds:>8.2f} {stored:>7}"
+            )
+        return lines
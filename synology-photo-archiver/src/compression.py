@@ -1,127 +1,789 @@
-import datetime
-import subprocess
+import glob
+import hashlib
+import os
+import re
+import stat
 import sys
+import tarfile
+from collections import namedtuple
 from pathlib import Path
 
+from .codec import DECODE_ERRORS, get_codec, open_compressor
+from .compressibility import CompressionReport
+from .dedup import PARTIAL_HASH_BYTES
+from .encryption import ENCRYPTED_SUFFIX, configured_password, derive_run_key
+from .manifest import MANIFEST_SUFFIX, ManifestWriter
+from .readahead import PrefetchedFile, ReadAhead
+from .volumes import iter_partitioned_volumes, iter_volumes
+from .writeout import PARTIAL_SUFFIX, WriteOptions, drop_cached_pages
 
-def create_archive(files_to_archive, source_dir, destination_dir, seven_zip_exec, password, volume_size):
+
+# Large reads keep spinning disks streaming instead of seeking between files.
+READ_BUFFER_SIZE = 1024 * 1024
+
+# A file starting this many uncompressed bytes after the last member boundary
+# starts a new compressed member, so a restore never has to decode more than
+# this before reaching it. Each boundary costs a few bytes and a dictionary reset.
+SEEK_POINT_INTERVAL = 1024 * 1024
+
+# Files up to this size (sidecars, thumbnails, .xmp) are read in one call and
+# written to the compressor together with their header and padding. Kept at
+# dedup's sample size, so such a file's partial hash is its full hash.
+SMALL_FILE_BYTES = PARTIAL_HASH_BYTES
+
+DEFAULT_CODEC = 'gzip'
+
+# Per-file checksum algorithms for the manifest. blake2b matches the content
+# hashes used by dedup, so its digests are also stored in the state.
+CHECKSUM_ALGORITHMS = {
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+    'sha256': hashlib.sha256,
+}
+DEFAULT_CHECKSUM = 'blake2b'
+
+# What the writer reports for every member. ``offset`` is where the member's
+# header starts in the uncompressed tar stream; checksums are raw digests
+# (None without a checksum algorithm).
+ArchivedMember = namedtuple(
+    'ArchivedMember', ['name', 'size', 'mtime_ns', 'offset', 'checksum', 'partial_checksum']
+)
+
+# The parts of os.stat_result the writer uses, for content that is not read from a file.
+_MemberStat = namedtuple('_MemberStat', ['st_size', 'st_mtime', 'st_mtime_ns', 'st_mode', 'st_uid', 'st_gid'])
+
+
+class StoredFile:
+    """
+    A file to archive whose content is read from an existing archive member
+    rather than from the source directory (used to compact archive chains).
+    """
+
+    def __init__(self, relative_path, member, size, mtime_ns, open_member, taken=None):
+        """
+        Args:
+            relative_path: Path of the file relative to the source directory
+            member: Member name to store it under
+            size: Size of the content in bytes
+            mtime_ns: Modification time to record in the manifest
+            open_member: Callable returning (tarfile.TarInfo, iterator over the
+                content in chunks), e.g. restore.read_member on an open volume
+            taken: Capture date ('YYYY-MM-DD') recorded for it, if any
+        """
+        self.relative_path = relative_path
+        self.member = member
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.open = open_member
+        self.taken = taken
+
+
+class _ChunkReader:
+    """readinto() over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readinto(self, view):
+        while not self._pending:
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                self._pending = b''
+                return 0
+        read = min(len(view), len(self._pending))
+        view[:read] = self._pending[:read]
+        self._pending = self._pending[read:]
+        return read
+
+
+def parse_volume_size(volume_size):
+    """
+    Parses a volume size such as '500m' or '1g' into bytes.
+
+    Args:
+        volume_size: Size string with an optional k/m/g suffix, an int, or empty
+
+    Returns:
+        int: Size in bytes; 0 means no splitting
+    """
+    size_str = str(volume_size or '').lower().strip()
+    if not size_str:
+        return 0
+    suffix = size_str[-1]
+    if suffix.isdigit():
+        return int(size_str)
+    value = int(size_str[:-1])
+    if suffix == 'k':
+        return value * 1024
+    elif suffix == 'm':
+        return value * 1024 * 1024
+    elif suffix == 'g':
+        return value * 1024 * 1024 * 1024
+    print(f"Warning: Unknown volume size suffix '{suffix}'. Ignoring volume splitting.")
+    return 0
+
+
+class ArchiveSink:
+    """
+    Write-only byte sink for one compressed archive volume.
+
+    Optionally hashes the compressed bytes on their way to disk, giving a
+    whole-volume checksum without reading the volume back. With a key the
+    bytes are encrypted first (see encryption.FrameEncryptor); the checksum
+    and ``bytes_written`` then describe the encrypted file. The bytes reach
+    the disk through writeout.VolumeOutput.
+    """
+
+    def __init__(self, archive_path, checksum=None, key=None, write_options=None):
+        self.path = Path(archive_path)
+        self.bytes_written = 0
+        self._digest = CHECKSUM_ALGORITHMS[checksum]() if checksum else None
+        self.encryptor = key.encryptor() if key is not None else None
+        self.output = (write_options or WriteOptions()).open(self.path)
+
+    def write(self, data):
+        if self.encryptor is not None:
+            data = self.encryptor.update(data)
+        self._write(data)
+
+    def _write(self, data):
+        self.output.write(data)
+        if self._digest is not None:
+            self._digest.update(data)
+        self.bytes_written += len(data)
+
+    def hexdigest(self):
+        """Returns the checksum of everything written, or None."""
+        return self._digest.hexdigest() if self._digest is not None else None
+
+    def close(self, fsync=False):
+        """Completes the volume under its final name, optionally making sure it reached the disk first."""
+        if self.encryptor is not None:
+            self._write(self.encryptor.finalize())
+        self.output.close(fsync)
+
+    def discard(self):
+        """Closes and deletes the volume."""
+        self.output.discard()
+
+
+class TarStreamWriter:
+    """
+    Streams files into a tar archive through a codec.
+
+    Headers are generated by ``tarfile`` (PAX format, as written by GNU tar
+    with ``--format=posix``); file data is copied with a single reused
+    buffer, so no temporary file list or intermediate copy is needed.
+
+    With a compressibility policy, each file is compressed or stored
+    depending on its content. Switching ends the current compressed member
+    and starts a new one at the codec's store level, so runs of JPEGs cost a
+    CRC instead of a full deflate pass.
+
+    With several workers the stream is compressed in parallel blocks (see
+    ParallelStreamCompressor); the output is the same for every run.
+
+    With drop_cache, each source file is dropped from the page cache once
+    it has been read.
+
+    With a checksum algorithm, each file is hashed from the same buffer that
+    feeds the compressor, so checksums cost no extra reads.
+
+    Compressed members are started at file headers at least every
+    SEEK_POINT_INTERVAL bytes; ``seek_points()`` lists them, so a single
+    member can later be read without decoding the volume from its start.
+    """
+
+    def __init__(self, sink, codec, policy=None, report=None, workers=1, checksum=None, drop_cache=False):
+        self._sink = sink
+        self._drop_cache = drop_cache
+        self._codec = codec
+        self._policy = policy
+        self._report = report
+        self._new_hash = CHECKSUM_ALGORITHMS[checksum] if checksum else None
+        self._compressing = True
+        self._compressor = open_compressor(codec, workers=workers)
+        self._buffer = bytearray(READ_BUFFER_SIZE)
+        self.offset = 0  # Uncompressed bytes written so far
+        self._bytes_out = 0
+        self._last_seek_point = 0
+
+    def _emit(self, compressed):
+        if compressed:
+            self._bytes_out += len(compressed)
+            self._sink.write(compressed)
+
+    def _write(self, data):
+        self.offset += len(data)
+        self._emit(self._compressor.compress(data))
+
+    def _set_compressing(self, compressing):
+        if compressing == self._compressing:
+            return
+        level = self._codec.default_level if compressing else self._codec.store_level
+        self._emit(self._compressor.set_level(level))
+        self._compressing = compressing
+        self._last_seek_point = self.offset
+
+    def _mark_seek_point(self):
+        # A stored tar stream can be entered anywhere; no members needed.
+        if self._codec.name != 'store' and self.offset - self._last_seek_point >= SEEK_POINT_INTERVAL:
+            self._emit(self._compressor.restart())
+            self._last_seek_point = self.offset
+
+    def seek_points(self):
+        """
+        Returns where decoding can start, once the writer is closed.
+
+        Returns:
+            List of [uncompressed offset, compressed offset] pairs in stream
+            order; empty for the store codec, whose offsets are the same
+        """
+        if self._codec.name == 'store':
+            return []
+        return [list(boundary) for boundary in self._compressor.boundaries]
+
+    def add_file(self, path, arcname, cache_key=None, opened=None):
+        """
+        Appends one regular file to the archive.
+
+        Args:
+            path: Path of the file to read
+            arcname: Member name inside the archive
+            cache_key: Key identifying the file in the compressibility cache
+                (defaults to arcname)
+            opened: Optional readahead.PrefetchedFile of path to read from
+                instead of opening it; closed once archived
+
+        Returns:
+            ArchivedMember describing the member written
+
+        Raises:
+            OSError: If the file cannot be opened or read
+        """
+        with opened if opened is not None else open(path, 'rb', buffering=0) as f:
+            member = self._add(path, arcname, os.fstat(f.fileno()), f, cache_key)
+            if self._drop_cache:
+                drop_cached_pages(f.fileno())  # Archived photos are not read again soon
+            return member
+
+    def add_stored(self, stored):
+        """
+        Appends a file whose content comes from another archive.
+
+        Args:
+            stored: StoredFile to copy
+
+        Returns:
+            ArchivedMember describing the member written
+
+        Raises:
+            OSError, ValueError, EOFError: If the source member cannot be read
+        """
+        info, chunks = stored.open()
+        st = _MemberStat(stored.size, stored.mtime_ns // 10 ** 9, stored.mtime_ns, info.mode, info.uid, info.gid)
+        return self._add(stored.relative_path, stored.member, st, _ChunkReader(chunks), stored.relative_path)
+
+    def _add(self, path, arcname, st, f, cache_key):
+        self._bytes_out = 0
+        cpu_seconds_before = self._compressor.cpu_seconds
+        offset = self.offset
+        digest = partial_digest = None
+        if self._new_hash is not None:
+            digest = self._new_hash()
+            partial_digest = self._new_hash()
+        partial_remaining = PARTIAL_HASH_BYTES
+        info = tarfile.TarInfo(arcname)
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)  # A float mtime would force a PAX header per file
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+
+        # Read the first chunk up front so the policy can sample it.
+        view = memoryview(self._buffer)
+        remaining = info.size
+        read = f.readinto(view[:min(remaining, len(view))]) if remaining else 0
+        if self._policy is not None:
+            self._set_compressing(
+                self._policy.should_compress(cache_key or arcname, st, view[:read])
+            )
+        self._mark_seek_point()
+
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        padding = -info.size % tarfile.BLOCKSIZE
+        if read == info.size <= SMALL_FILE_BYTES:
+            # The whole file is in the buffer: one compressor call instead of three.
+            self._write(b''.join((header, view[:read], bytes(padding))))
+            if digest is not None:
+                digest.update(view[:read])
+            read = remaining = padding = 0
+        else:
+            self._write(header)
+        while read:
+            chunk = view[:read]
+            self._write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+                if partial_remaining > 0:
+                    partial_digest.update(chunk[:partial_remaining])
+                    partial_remaining -= read
+            remaining -= read
+            if not remaining:
+                break
+            read = f.readinto(view[:min(remaining, len(view))])
+
+        if remaining:
+            # The file shrank after we stat'ed it; keep the header honest.
+            print(f"Warning: '{path}' changed while being archived; padding {remaining} missing bytes.")
+            self._write(bytes(remaining))
+            if digest is not None:
+                digest.update(bytes(remaining))
+        if padding:
+            self._write(bytes(padding))
+
+        if self._report is not None:
+            extension = os.path.splitext(arcname)[1].lower()
+            cpu_seconds = self._compressor.cpu_seconds - cpu_seconds_before
+            self._report.add(extension, info.size, self._bytes_out, cpu_seconds, self._compressing)
+        if digest is not None:
+            digest = digest.digest()
+            # Small files are their own sample, as for dedup's partial hash.
+            partial_digest = digest if info.size <= PARTIAL_HASH_BYTES else partial_digest.digest()
+        return ArchivedMember(arcname, info.size, st.st_mtime_ns, offset, digest, partial_digest)
+
+    def close(self):
+        """Writes the end-of-archive marker and flushes the compressor."""
+        self._write(bytes(2 * tarfile.BLOCKSIZE))
+        padding = -self.offset % tarfile.RECORDSIZE
+        if padding:
+            self._write(bytes(padding))
+        self._emit(self._compressor.flush())
+
+    def discard(self):
+        """Abandons the archive after a failure: stops the compressor's threads without finishing the stream."""
+        self._compressor.close()
+
+
+def archive_member_name(file_path):
+    """
+    Returns the tar member name for a file.
+
+    Matches what ``tar -T`` stores for the same path: the path as given, with
+    any leading '/' removed.
+    """
+    return str(file_path).lstrip('/')
+
+
+def _cache_key(file_path, source_path):
+    """Returns the path of a file relative to the source directory when possible."""
+    try:
+        return str(file_path.relative_to(source_path))
+    except ValueError:
+        return str(file_path)
+
+
+def volume_name(archive_stem, codec, index, volume_bytes, encrypted=False, bucket=None):
+    """
+    Returns the file name of an archive volume.
+
+    Without a volume size the single volume keeps the plain
+    ``<source>.tar.gz`` name; otherwise volumes are numbered
+    ``<source>.000.tar.gz``, ``<source>.001.tar.gz``, ... Volumes of a
+    partitioned archive carry their partition and are always numbered
+    (``<source>.2023-07.004.tar.gz``). Encrypted volumes end in ``.enc``.
+    """
+    extension = codec.extension + (ENCRYPTED_SUFFIX if encrypted else '')
+    if bucket is not None:
+        return f"{archive_stem}.{bucket}.{index:03d}{extension}"
+    if not volume_bytes:
+        return f"{archive_stem}{extension}"
+    return f"{archive_stem}.{index:03d}{extension}"
+
+
+def _volume_files(destination_path, archive_stem, codec, encrypted=False):
+    """Returns the numbered volumes of an archive present in the destination."""
+    extension = codec.extension + (ENCRYPTED_SUFFIX if encrypted else '')
+    pattern = re.compile(re.escape(archive_stem) + r'(\.\d{4}(-\d{2})?)?\.\d{3,}' + re.escape(extension))
+    return [path for path in destination_path.glob(f"{archive_stem}.*{extension}")
+            if pattern.fullmatch(path.name)]
+
+
+def create_archive(files_to_archive, source_dir, destination_dir, seven_zip_exec, password, volume_size,
+                   codec=DEFAULT_CODEC, policy=None, workers=1, references=(),
+                   checksum=DEFAULT_CHECKSUM, content_hashes=None, archive_id=None,
+                   resumable=False, checkpoint=None, phase=None, key=None, archive_name=None,
+                   tombstones=(), header_fields=None, write_options=None, partition=None,
+                   group_small_files=False, read_options=None, vanished=None):
     """
-    Creates a tar.gz archive with the given files.
-    
+    Creates a tar archive with the given files.
+
+    With a volume size, files are bin-packed into self-contained volumes of
+    roughly that size (see volumes.iter_volumes), so any volume can be read
+    on its own. A manifest (``<source>.manifest.jsonl``) recording which
+    volume holds each file is written next to the volumes.
+
+    The files are consumed as a stream: a single archive is written while
+    the input is still being produced, and volumes are written as soon as
+    the packer closes them, so memory use does not grow with the input.
+
+    A resumable archive syncs every volume to disk before journaling it in
+    the unfinished manifest, and keeps the completed volumes when it fails.
+    Passing the resulting checkpoint to the next call continues the archive
+    from the first incomplete volume: files already in a completed volume
+    (same size and mtime) are skipped and the partial volume is rewritten.
+
+    With a password (or a key derived from it once per run), every volume is
+    encrypted as it is written (see encryption); the manifest records the
+    key derivation parameters, never the key.
+
+    Files can also be StoredFile objects, whose content is copied from an
+    earlier archive; that is how archive chains are compacted (see chain).
+
+    Volumes are written out as described in writeout: in large chunks on a
+    writer thread, optionally throttled, and under their final name only
+    once complete.
+
+    With a partition, every volume holds files of a single capture year or
+    month (see capture_date), named after it, and the manifest records each
+    file's capture date, so a period can be restored from its volumes alone.
+
+    With group_small_files, files of at most SMALL_FILE_BYTES (sidecars,
+    thumbnails) are written after the other files of their volume, in one
+    contiguous run of members: the compressibility policy switches once for
+    them instead of between every photo and its sidecar, and restoring or
+    compacting them reads a single stretch of the volume. Volumes stay
+    plain tar archives and the manifest indexes every member as usual.
+
+    With read options, source files are opened and read on reader threads
+    ahead of the writer (see readahead), in inode order within each volume
+    unless configured otherwise.
+
     Args:
-        files_to_archive: List of Path objects to include in the archive
-        source_dir: Source directory path (for reference)
+        files_to_archive: Iterable of Path (or StoredFile) objects to include in the archive
+        source_dir: Source directory path (names the archive unless archive_name is given)
         destination_dir: Directory where the archive will be created
-        seven_zip_exec: Path to the tar executable (repurposed argument)
-        password: Password for the archive (Ignored for tar)
-        volume_size: Volume size for splitting the archive (Ignored for tar)
-        
+        seven_zip_exec: Path to the archiver executable (unused; archives are written in-process)
+        password: Password for the archive; empty (or the template placeholder) for
+            no encryption. Ignored when key is given
+        volume_size: Target volume size (e.g. '1g'); 0 or empty writes a single archive
+        codec: Compression codec name: 'store', 'gzip', 'xz' or 'zstd'
+        policy: Optional CompressibilityPolicy deciding per file whether to compress
+            or store; without one every file is compressed
+        workers: Number of compression threads; 1 compresses serially, 0 uses every CPU
+        references: Optional dedup.Reference tuples for files left out because their
+            content is already archived; recorded in the manifest
+        checksum: Checksum algorithm ('blake2b', 'sha256') for the per-file and
+            per-volume checksums in the manifest; None disables them
+        content_hashes: Optional dictionary (or anything supporting item
+            assignment) filled, for blake2b checksums, with relative path ->
+            (size, mtime_ns, partial_hash, full_hash) of every archived file,
+            ready to be stored in the state
+        archive_id: Optional id of the archive, recorded in the manifest
+        resumable: Journal completed volumes so an interrupted run can be resumed
+        checkpoint: Optional checkpoint.Checkpoint of an interrupted run to
+            continue; discarded if it was written with other settings
+        phase: Optional metrics.Phase advanced with the files and bytes read
+            and the compressed bytes written
+        key: Optional encryption.ArchiveKey to encrypt with instead of deriving
+            one from password
+        archive_name: Optional stem of the volume and manifest names (default: the
+            source directory name); archive chains give every generation its own
+        tombstones: Optional iterable of relative paths deleted from the source
+            since the archive this one builds on; consumed after every file
+            and recorded in the manifest
+        header_fields: Optional extra fields for the manifest header
+        write_options: Optional writeout.WriteOptions (rate limits, fsync policy,
+            cache dropping); by default volumes are written as fast as possible
+            and synced only when resumable
+        partition: Optional capture_date.CaptureDates assigning files to date
+            partitions; without one volumes mix files of any date
+        group_small_files: Write the small files of each volume after the others
+        read_options: Optional readahead.ReadOptions; without them (or with a
+            read_ahead of 0) the writer reads every file itself, in order
+        vanished: Optional list extended with the relative paths of files that
+            could no longer be found and were left out, and of references to
+            them, so the caller does not record them as archived
+
     Returns:
         bool: True if archive creation was successful, False otherwise
-        
+
     Raises:
-        SystemExit: If tar executable is not found
+        SystemExit: If the codec is unknown or unavailable, the checksum is unknown,
+            or a password is set and the 'cryptography' package is missing
     """
+    codec = get_codec(codec)
+    if checksum and checksum not in CHECKSUM_ALGORITHMS:
+        print(f"Error: Unknown checksum '{checksum}'. Choose one of: {', '.join(CHECKSUM_ALGORITHMS)}, none.")
+        sys.exit(1)
     source_path_obj = Path(source_dir)
-    archive_name = f"{source_path_obj.name}.tar.gz"
-    archive_path = Path(destination_dir) / archive_name
+    archive_stem = archive_name or source_path_obj.name
+    destination_path = Path(destination_dir)
 
     # Ensure destination directory exists
-    archive_path.parent.mkdir(parents=True, exist_ok=True)
-
-    # Create a temporary file list
-    # tar -T expects file paths. relative paths are safer if we change cwd, but we can stick to absolute.
-    # However, tar might complain about leading '/'. standard tar removes it.
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    file_list_path = Path(f"file_list_{timestamp}.txt")
-    with open(file_list_path, 'w', encoding='utf-8') as f:
+    destination_path.mkdir(parents=True, exist_ok=True)
+    # Volumes an interrupted run was still writing never got their final name.
+    for stale in destination_path.glob(glob.escape(archive_stem) + '.*' + PARTIAL_SUFFIX):
+        stale.unlink()
+    if write_options is None:
+        write_options = WriteOptions()
+    throttled_before = write_options.limiter.throttled_seconds
+
+    if key is None:
+        password = configured_password(password)
+        if password:
+            key = derive_run_key(password, checkpoint.header.get('encryption') if checkpoint is not None else None)
+    encrypted = key is not None
+    if codec.name == 'store':
+        policy = None  # Nothing is compressed anyway
+    report = CompressionReport()
+
+    bytes_size = parse_volume_size(volume_size)
+    partition_name = partition.partition if partition is not None else None
+    first_index = 0
+    resumed_volumes = 0
+    if checkpoint is not None:
+        if checkpoint.matches(source=str(source_dir), codec=codec.name, volume_size=bytes_size, checksum=checksum,
+                              encryption=key.params if encrypted else None, partition=partition_name):
+            first_index = checkpoint.next_volume_index
+            resumed_volumes = len(checkpoint.volumes)
+            print(f"Resuming interrupted archive: {resumed_volumes} volume(s) with "
+                  f"{len(checkpoint.files)} files already complete.")
+            # Volumes that were being written when the previous run stopped
+            for stale in _volume_files(destination_path, archive_stem, codec, encrypted):
+                if stale.name not in {volume['name'] for volume in checkpoint.volumes.values()}:
+                    stale.unlink()
+        else:
+            print("Discarding interrupted archive written with different settings.")
+            checkpoint.discard()
+            checkpoint = None
+
+    skipped = 0
+    small = set()  # Small files packed but not yet written, when grouping them
+    inodes = {}  # Inode numbers of the files not yet read ahead, to order their reads
+    order_reads = bool(read_options) and read_options.order == 'inode'
+    small_files = 0
+    taken_dates = {}  # Relative path -> capture date, for the manifest
+    gone = set()  # Relative paths of files that vanished before they could be archived
+
+    def leave_out(file_path, error):
+        # Gone since the scan; the next run archives it again or records its deletion.
+        print(f"Warning: Could not read '{file_path}', leaving it out: {error}")
+        gone.add(_cache_key(file_path, source_path_obj))
+        small.discard(file_path)
+
+    def sized_files():
+        # Files are stat'ed as they arrive, so the input can be a lazy stream.
+        nonlocal skipped
         for file_path in files_to_archive:
-            f.write(str(file_path) + '\n')
-
-    command = [
-        seven_zip_exec,
-        '-czf',
-        str(archive_path),
-        '-T',
-        str(file_list_path)
-    ]
-
-    print(f"Running tar command: {' '.join(command)}")
-    if password and password != "YOUR_SECRET_PASSWORD":
-        print("Warning: Password protection is not supported with tar.gz in this implementation.")
-    
-    try:
-        # Check if volume splitting is requested
-        if volume_size:
-            # Parse volume size
-            size_str = str(volume_size).lower().strip()
-            suffix = size_str[-1]
-            if suffix.isdigit():
-                 bytes_size = int(size_str)
+            if isinstance(file_path, StoredFile):
+                relative_path, size, mtime_ns = file_path.relative_path, file_path.size, file_path.mtime_ns
+                taken = file_path.taken
             else:
-                value = int(size_str[:-1])
-                if suffix == 'k':
-                    bytes_size = value * 1024
-                elif suffix == 'm':
-                    bytes_size = value * 1024 * 1024
-                elif suffix == 'g':
-                    bytes_size = value * 1024 * 1024 * 1024
-                else:
-                    print(f"Warning: Unknown volume size suffix '{suffix}'. Ignoring volume splitting.")
-                    bytes_size = 0
-            
-            if bytes_size > 0:
-                print(f"Volume splitting enabled. Size: {bytes_size} bytes.")
-                # Use shell pipeline for splitting
-                # tar -cz -T list | split -b size - archive_prefix.
-                # Note: split prefix should include the full path base
-                
-                # Archive name is like "source.tar.gz"
-                # Split files will be "source.tar.gz.aa", "source.tar.gz.ab", etc.
-                split_prefix = str(archive_path) + "."
-                
-                # We need to use Shell=True for piping, or manually connect streams.
-                # Manual formatting of the command string for logging
-                tar_cmd_str = f"{seven_zip_exec} -cz -T {file_list_path}"
-                split_cmd_str = f"split -b {bytes_size} - {split_prefix}"
-                full_cmd_str = f"{tar_cmd_str} | {split_cmd_str}"
-                print(f"Running split command: {full_cmd_str}")
-
-                # Using shell=True involves security risks if inputs are untrusted.
-                # Here inputs come from config and are relatively trusted paths.
-                # Alternative: Use subprocess.Popen to pipe.
-                
-                # Popen approach (safer):
-                p1 = subprocess.Popen([seven_zip_exec, '-cz', '-T', str(file_list_path)], stdout=subprocess.PIPE)
-                p2 = subprocess.Popen(['split', '-d', '-b', str(bytes_size), '-', split_prefix], stdin=p1.stdout)
-                p1.stdout.close()  # Allow p1 to receive a SIGPIPE if p2 exits.
-                output = p2.communicate()
-                
-                if p2.returncode == 0:
-                    print("Compression and splitting successful.")
-                    file_list_path.unlink()
-                    return True
+                file_path = Path(file_path)
+                try:
+                    st = os.stat(file_path)
+                except OSError as e:
+                    leave_out(file_path, e)
+                    continue
+                relative_path, size, mtime_ns = _cache_key(file_path, source_path_obj), st.st_size, st.st_mtime_ns
+                taken = None
+            if checkpoint is not None and checkpoint.is_archived(relative_path, size, mtime_ns):
+                skipped += 1
+                continue
+            if group_small_files and size <= SMALL_FILE_BYTES:
+                small.add(file_path)
+            if order_reads and not isinstance(file_path, StoredFile):
+                inodes[file_path] = st.st_ino
+            if partition is None:
+                yield file_path, size
+                continue
+            if not isinstance(file_path, StoredFile):
+                taken = partition.capture_date(file_path, relative_path, st)
+            if taken is not None:
+                taken_dates[relative_path] = taken
+            yield file_path, size, partition.bucket(taken, mtime_ns)
+
+    if partition is not None:
+        print(f"Partitioning volumes by capture {partition.partition}.")
+        batches = ((volume.index, volume.files, volume.oversized, volume.bucket)
+                   for volume in iter_partitioned_volumes(sized_files(), bytes_size, first_index=first_index))
+    elif bytes_size > 0:
+        print(f"Volume packing enabled. Size: {bytes_size} bytes.")
+        batches = ((volume.index, volume.files, volume.oversized, None)
+                   for volume in iter_volumes(sized_files(), bytes_size, first_index=first_index))
+    else:
+        # A single archive needs no planning: files go in as they arrive.
+        batches = [(first_index, (file_path for file_path, _ in sized_files()), False, None)]
+    print(f"Writing {'encrypted ' if encrypted else ''}{codec.name} archive to {destination_path}.")
+
+    def grouped(volume_files):
+        # Small files keep their order among themselves, so reads from an
+        # earlier archive (compaction) stay sequential within each run.
+        nonlocal small_files
+        deferred = []
+        for file_path in volume_files:
+            if file_path in small:
+                deferred.append(file_path)
+            else:
+                yield file_path
+        small_files += len(deferred)
+        yield from deferred
+
+    def read_order(file_path):
+        # Grouped small files stay after the others.
+        return file_path in small, inodes.pop(file_path, 0)
+
+    sinks = []
+    unjournaled = None  # Volume being written, until the manifest journal records it
+    writer = None
+    readers = []
+    manifest = None
+    archived_files = 0
+    oversized = 0
+    try:
+        manifest_path = destination_path / f"{archive_stem}{MANIFEST_SUFFIX}"
+        if checkpoint is not None:
+            manifest = ManifestWriter(manifest_path, resume_offset=checkpoint.resume_offset)
+        else:
+            manifest = ManifestWriter(
+                manifest_path, source=str(source_dir), codec=codec.name, volume_size=bytes_size,
+                checksum=checksum, archive_id=archive_id, encryption=key.params if encrypted else None,
+                partition=partition_name, **(header_fields or {}),
+            )
+        for index, volume_files, volume_oversized, bucket in batches:
+            name = volume_name(archive_stem, codec, index, bytes_size, encrypted, bucket)
+            sink = ArchiveSink(destination_path / name, checksum, key, write_options)
+            sinks.append(sink)
+            unjournaled = sink
+            writer = TarStreamWriter(sink, codec, policy, report, workers, checksum, write_options.drop_cache)
+            reported_out = 0
+            file_count = 0
+            if group_small_files:
+                volume_files = grouped(volume_files)
+            if read_options:
+                readers.append(ReadAhead(volume_files, read_options, read_order))
+                volume_files = readers[-1]
+            for file_path in volume_files:
+                opened = None
+                if isinstance(file_path, PrefetchedFile):
+                    opened, file_path = file_path, file_path.path
+                if isinstance(file_path, StoredFile):
+                    relative_path = file_path.relative_path
+                    member = writer.add_stored(file_path)
                 else:
-                     raise subprocess.CalledProcessError(p2.returncode, "split")
-
-        # Fallback to normal non-split archive if no volume size or parsing failed
-        result = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8')
-        print("Compression successful.")
-        print(result.stdout)
-        file_list_path.unlink()  # Clean up the temporary file list
-        return True
-    except subprocess.CalledProcessError as e:
+                    relative_path = _cache_key(file_path, source_path_obj)
+                    try:
+                        member = writer.add_file(file_path, archive_member_name(file_path), relative_path, opened)
+                    except FileNotFoundError as e:
+                        leave_out(file_path, e)  # Deleted after it was packed; nothing was written for it
+                        continue
+                small.discard(file_path)
+                file_count += 1
+                taken = taken_dates.pop(relative_path, None)
+                manifest.add_file(relative_path, index, member=member.name, size=member.size,
+                                  mtime_ns=member.mtime_ns, offset=member.offset,
+                                  checksum=member.checksum.hex() if member.checksum else None,
+                                  **({'taken': taken} if taken is not None else {}))
+                if content_hashes is not None and checksum == 'blake2b':
+                    content_hashes[relative_path] = (
+                        member.size, member.mtime_ns, member.partial_checksum, member.checksum
+                    )
+                if phase is not None:
+                    phase.advance(files=1, bytes_in=member.size, bytes_out=sink.bytes_written - reported_out)
+                    reported_out = sink.bytes_written
+            if read_options:
+                for file_path, error in readers[-1].vanished:
+                    leave_out(file_path, error)
+            writer.close()
+            sink.close(fsync=write_options.sync_volume(resumable))
+            if phase is not None:
+                phase.advance(bytes_out=sink.bytes_written - reported_out)
+            manifest.add_volume(index, sink.path.name, files=file_count,
+                                bytes=sink.bytes_written, oversized=volume_oversized,
+                                checksum=sink.hexdigest(), seek_points=writer.seek_points(),
+                                **({'bucket': bucket} if bucket is not None else {}))
+            if resumable:
+                manifest.checkpoint()
+                unjournaled = None
+            archived_files += file_count
+            oversized += volume_oversized
+        # References go last so a resumed run never records them twice.
+        for reference in references:
+            if reference.target_archive_id == archive_id and reference.target_path in gone:
+                gone.add(reference.path)  # Its content was never written
+                continue
+            manifest.add_reference(*reference)
+        tombstone_count = 0
+        for relative_path in tombstones:
+            manifest.add_tombstone(relative_path)
+            tombstone_count += 1
+        manifest.commit()
+        if vanished is not None:
+            vanished.extend(sorted(gone))
+    except (OSError, EOFError, ValueError, *DECODE_ERRORS) as e:
         print("Error during compression.")
-        # e.cmd might be None if raised manually
-        print(f"Command: {e.cmd}") 
-        print(f"Return Code: {e.returncode}")
-        # stdout/stderr might be on the process object if using Popen/communicate logic differently,
-        # but here 'e' comes mostly from the fallback run or manual raise.
-        if hasattr(e, 'stdout'): print(f"Output: {e.stdout}")
-        if hasattr(e, 'stderr'): print(f"Error Output: {e.stderr}")
-        if file_list_path.exists():
-             file_list_path.unlink()
+        print(f"Error: {e}")
+        if resumable and manifest is not None:
+            # Keep the completed volumes and their journal for the next run.
+            if unjournaled is not None:
+                sinks.remove(unjournaled)
+                unjournaled.discard()
+            manifest.close()
+            print(f"Kept {resumed_volumes + len(sinks)} completed volume(s); the next run resumes from there.")
+            return False
+        for sink in sinks:
+            sink.discard()
+        if manifest is not None:
+            manifest.discard()
         return False
-    except FileNotFoundError:
-        print(f"Error: Executable not found at '{seven_zip_exec}'. Please check your config.ini.")
-        sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.discard()  # A no-op once the writer was closed
+        for reader in readers:
+            reader.close()
+
+    print(f"Compression successful. Wrote {archived_files} files in {len(sinks)} volume(s), {oversized} oversized.")
+    if resumed_volumes:
+        print(f"{resumed_volumes} volume(s) with {skipped} files were kept from the interrupted run.")
+    if tombstone_count:
+        print(f"Recorded {tombstone_count} deleted files.")
+    if phase is not None:
+        phase.note(volumes=len(sinks), oversized_volumes=oversized, resumed_volumes=resumed_volumes,
+                   deleted=tombstone_count)
+    for line in report.format():
+        print(line)
+    throttled = write_options.limiter.throttled_seconds - throttled_before
+    stalled = sum(sink.output.stall_seconds for sink in sinks)
+    writes = sum(sink.output.writes for sink in sinks)
+    print(f"Write-out: {writes} writes of up to {write_options.chunk_size // 1024} KB; compression waited "
+          f"{stalled:.2f}s for the disk; writes were throttled for {throttled:.2f}s.")
+    if phase is not None:
+        phase.note(writes=writes, write_wait_seconds=round(stalled, 3), throttled_seconds=round(throttled, 3))
+    if readers:
+        read_wait = sum(reader.wait_seconds for reader in readers)
+        print(f"Read-ahead: {sum(reader.files for reader in readers)} files read by {read_options.threads} "
+              f"threads, in {read_options.order} order; the writer waited {read_wait:.2f}s for input.")
+        if phase is not None:
+            phase.note(read_wait_seconds=round(read_wait, 3))
+    if encrypted:
+        encrypted_bytes = sum(sink.encryptor.bytes_in for sink in sinks)
+        encryption_seconds = sum(sink.encryptor.cpu_seconds for sink in sinks)
+        rate = encrypted_bytes / encryption_seconds / 1e6 if encryption_seconds else 0.0
+        print(f"Encryption: {encrypted_bytes / 1e6:.1f} MB in {encryption_seconds:.2f}s CPU ({rate:.0f} MB/s).")
+        if phase is not None:
+            share = encryption_seconds / phase.seconds if phase.seconds else 0.0
+            print(f"Encryption took {share:.1%} of the archive phase.")
+            phase.note(encrypted_bytes=encrypted_bytes, encryption_seconds=round(encryption_seconds, 3),
+                       encryption_mb_per_second=round(rate, 1), encryption_share=round(share, 4))
+    if policy is not None:
+        print(f"Compressibility: {len(policy.decisions)} files probed, {policy.cache_hits} cached decisions used.")
+    if group_small_files:
+        print(f"Grouped {small_files} small files at the end of their volumes.")
+        if phase is not None:
+            phase.note(small_files=small_files)
+    if partition is not None:
+        print(f"Capture dates: {len(partition.extracted)} files read, {partition.cache_hits} cached dates used.")
+        if phase is not None:
+            phase.note(capture_dates_read=len(partition.extracted), capture_date_cache_hits=partition.cache_hits)
+    return True
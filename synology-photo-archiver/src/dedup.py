@@ -0,0 +1,206 @@
+import hashlib
+import os
+from collections import defaultdict, namedtuple
+from pathlib import Path
+
+
+HASH_BUFFER_SIZE = 1024 * 1024
+PARTIAL_HASH_BYTES = 64 * 1024
+
+# Below this size a reference saves less than it costs to check.
+MIN_DEDUP_SIZE = 4096
+
+# A file that is not archived again because its content already is.
+# ``reason`` is 'moved' (same inode as an archived file that changed path)
+# or 'duplicate' (byte-identical to an archived file). ``target_archive_id``
+# names the archive holding ``target_path``.
+Reference = namedtuple('Reference', ['path', 'target_path', 'target_archive_id', 'reason'])
+
+
+class NoArchivedFiles:
+    """Stands in for the state when nothing archived may be referenced (a full archive)."""
+
+    def files_with_inode(self, inode):
+        return []
+
+    def files_with_size(self, size):
+        return []
+
+    def stored_at(self, path):
+        return None
+
+
+def _hash_file(path, limit=None):
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    remaining = limit
+    with open(path, 'rb', buffering=0) as f:
+        while remaining is None or remaining > 0:
+            read = f.readinto(view if remaining is None else view[:min(remaining, len(view))])
+            if not read:
+                break
+            digest.update(view[:read])
+            if remaining is not None:
+                remaining -= read
+    return digest.digest()
+
+
+class _Hasher:
+    """
+    Computes partial and full hashes on demand, at most once per file.
+
+    Stored hashes are reused while the file's (size, mtime_ns) still match;
+    new results are collected in ``new_hashes`` for the state.
+    """
+
+    def __init__(self, source_path, hash_cache):
+        self._source_path = source_path
+        self._cache = hash_cache if hash_cache is not None else {}
+        self.new_hashes = {}
+        self.files_read = 0
+
+    def _entry(self, relative_path, record):
+        entry = self.new_hashes.get(relative_path)
+        if entry is None:
+            cached = self._cache.get(relative_path)
+            if cached is not None and cached[0] == record.size and cached[1] == record.mtime_ns:
+                entry = tuple(cached)
+            else:
+                entry = (record.size, record.mtime_ns, None, None)
+        return entry
+
+    def _readable(self, relative_path, record):
+        """True if the file on disk is still the version described by record."""
+        try:
+            st = os.stat(self._source_path / relative_path)
+        except OSError:
+            return False
+        return st.st_size == record.size and st.st_mtime_ns == record.mtime_ns
+
+    def _compute(self, relative_path, record, full):
+        entry = self._entry(relative_path, record)
+        index = 3 if full else 2
+        if entry[index] is None:
+            if not self._readable(relative_path, record):
+                return None
+            limit = None if full else PARTIAL_HASH_BYTES
+            digest = _hash_file(self._source_path / relative_path, limit)
+            self.files_read += 1
+            entry = entry[:index] + (digest,) + entry[index + 1:]
+            if full and record.size <= PARTIAL_HASH_BYTES:
+                entry = entry[:2] + (digest, digest)  # The whole file is the partial sample
+            self.new_hashes[relative_path] = entry
+        return entry[index]
+
+    def partial(self, relative_path, record):
+        """Returns the hash of the first PARTIAL_HASH_BYTES, or None if unavailable."""
+        if record.size <= PARTIAL_HASH_BYTES:
+            return self._compute(relative_path, record, full=True)
+        return self._compute(relative_path, record, full=False)
+
+    def full(self, relative_path, record):
+        """Returns the hash of the whole file, or None if unavailable."""
+        return self._compute(relative_path, record, full=True)
+
+
+def _stored_location(path, record, archived):
+    """
+    Returns (path, archive id) of the stored copy of an archived file.
+
+    A file that was itself deduplicated is only a reference in its archive, so
+    anything referring to it must refer to the copy its reference points to.
+    """
+    stored = archived.stored_at(path)
+    return stored if stored is not None else (path, record.archive_id)
+
+
+def _find_moved(relative_path, record, archived):
+    for old_path, old_record in archived.files_with_inode(record.inode):
+        if (old_path != relative_path and old_record.size == record.size
+                and old_record.mtime_ns == record.mtime_ns and old_record.archive_id):
+            return _stored_location(old_path, old_record, archived)
+    return None
+
+
+def deduplicate(changed_files, source_dir, archived, archive_id, hash_cache=None):
+    """
+    Separates files whose content is already archived from those that need archiving.
+
+    Checks are staged so that most files are never read:
+
+    1. Moves and hard links: an archived file with the same inode, size and
+       mtime holds the same content.
+    2. Size: a file no other file (changed or archived) shares its size with
+       is unique.
+    3. Partial hash of the first 64 KiB for files sharing a size.
+    4. Full hash only when the partial hashes collide.
+
+    Archived files are compared through stored hashes, or by reading them
+    from the source directory if they are still unchanged there.
+
+    Args:
+        changed_files: List of (relative path, FileRecord) tuples from the scan
+        source_dir: Source directory the relative paths belong to
+        archived: Object with files_with_inode(inode) and files_with_size(size)
+            methods returning archived (relative path, FileRecord) tuples, and
+            stored_at(path) returning where a deduplicated file's content is
+            stored (a StateStore); references always name a stored copy
+        archive_id: Id of the archive about to be written; duplicates within
+            changed_files refer to their first occurrence in it
+        hash_cache: Optional mapping of relative path to stored
+            (size, mtime_ns, partial_hash, full_hash) tuples
+
+    Returns:
+        Tuple of (unique files as (relative path, FileRecord) tuples in input
+        order, list of Reference tuples, dictionary of new hashes for the state)
+    """
+    source_path = Path(source_dir)
+    hasher = _Hasher(source_path, hash_cache)
+    changed_paths = {relative_path for relative_path, _ in changed_files}
+    references = []
+
+    by_size = defaultdict(list)
+    for relative_path, record in changed_files:
+        if record.size < MIN_DEDUP_SIZE:
+            continue
+        moved = _find_moved(relative_path, record, archived)
+        if moved is not None:
+            references.append(Reference(relative_path, *moved, 'moved'))
+            continue
+        by_size[record.size].append((relative_path, record))
+
+    for size, group in by_size.items():
+        # Archived versions of changed files are stale and cannot be targets.
+        candidates = [
+            (path, record) for path, record in archived.files_with_size(size)
+            if path not in changed_paths and record.archive_id
+        ]
+        if len(group) == 1 and not candidates:
+            continue
+
+        # Originals seen so far, bucketed by partial hash, with where their content is stored.
+        originals = defaultdict(list)
+        for path, record in candidates:
+            partial = hasher.partial(path, record)
+            if partial is not None:
+                originals[partial].append((path, record, _stored_location(path, record, archived)))
+
+        for relative_path, record in group:
+            partial = hasher.partial(relative_path, record)
+            if partial is None:
+                continue  # Vanished since the scan; let the archiver report it
+            target = None
+            for original_path, original_record, stored in originals[partial]:
+                full = hasher.full(relative_path, record)
+                if full is not None and full == hasher.full(original_path, original_record):
+                    target = Reference(relative_path, *stored, 'duplicate')
+                    break
+            if target is not None:
+                references.append(target)
+            else:
+                originals[partial].append((relative_path, record, (relative_path, archive_id)))
+
+    referenced = {reference.path for reference in references}
+    unique = [(relative_path, record) for relative_path, record in changed_files if relative_path not in referenced]
+    return unique, references, hasher.new_hashes
@@ -0,0 +1,327 @@
+"""
+Authenticated encryption of archive volumes, applied to the compressed stream.
+
+An encrypted volume is a short header followed by frames. Every frame holds
+FRAME_SIZE bytes of the compressed stream (the last one may be shorter) and
+is sealed with AES-256-GCM on its own, so volumes are encrypted and decrypted
+as a stream and reading can start at any frame: plaintext offset x lives in
+frame x // FRAME_SIZE. Frame nonces are a random per-volume prefix, the frame
+number and a last-frame flag (the STREAM construction), and the header is
+authenticated with every frame, so frames cannot be reordered, dropped,
+swapped between volumes or cut off at the end without failing authentication.
+
+The key is derived from the password with scrypt once per run; the salt and
+cost parameters are stored in the manifest header and in every volume header.
+"""
+import hashlib
+import hmac
+import os
+import struct
+import sys
+import time
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # Optional dependency
+    AESGCM = None
+    InvalidTag = None
+
+
+CIPHER = 'aes-256-gcm'
+KDF = 'scrypt'
+
+# scrypt costs about 0.1 s and 32 MiB; paid once per run, not per volume.
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Compressed bytes per frame. Each frame adds a 16-byte tag (0.02%).
+FRAME_SIZE = 64 * 1024
+TAG_BYTES = 16
+
+# Volume header: magic, key salt, nonce prefix, frame size.
+MAGIC = b'SPAENC01'
+NONCE_PREFIX_BYTES = 7
+VOLUME_HEADER = struct.Struct(f'>8s{SALT_BYTES}s{NONCE_PREFIX_BYTES}sI')
+
+# Appended to the codec extension: 'photo.000.tar.gz.enc'.
+ENCRYPTED_SUFFIX = '.enc'
+
+# The value shipped in config.ini.template; never used as a real password.
+PLACEHOLDER_PASSWORD = 'YOUR_SECRET_PASSWORD'
+
+
+class AuthenticationError(ValueError):
+    """A frame of an encrypted volume is corrupt, truncated or was tampered with."""
+
+
+def configured_password(password):
+    """
+    Returns the password to encrypt with, or None for no encryption.
+
+    An empty password disables encryption; the template placeholder does too,
+    with a warning, so an unedited configuration never looks protected.
+    """
+    password = (password or '').strip()
+    if password == PLACEHOLDER_PASSWORD:
+        print("Warning: The archive password is still the template placeholder; archives will not be encrypted.")
+        return None
+    return password or None
+
+
+def _require_backend():
+    if AESGCM is None:
+        print("Error: Encryption is not available. Install the 'cryptography' package to use a password.")
+        sys.exit(1)
+
+
+class ArchiveKey:
+    """
+    An encryption key derived from the password, shared by every volume of a run.
+
+    ``params`` are the public derivation parameters stored in the manifest;
+    ``key_check`` lets a reader tell a wrong password from a damaged volume.
+    """
+
+    def __init__(self, key, salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.salt = salt
+        self._n, self._r, self._p = n, r, p
+        self._aead = AESGCM(key)
+        self.key_check = hmac.new(key, b'synology-photo-archiver key check', hashlib.sha256).hexdigest()[:16]
+
+    @property
+    def params(self):
+        """Derivation parameters for the manifest header; contains no secret."""
+        return {
+            'cipher': CIPHER, 'kdf': KDF, 'salt': self.salt.hex(), 'n': self._n, 'r': self._r, 'p': self._p,
+            'frame_size': FRAME_SIZE, 'key_check': self.key_check,
+        }
+
+    def encryptor(self):
+        """Creates the encryptor of one volume."""
+        return FrameEncryptor(self._aead, self.salt)
+
+    def open_volume(self, path, digest=None):
+        """Opens an encrypted volume for reading; see DecryptingFile."""
+        return DecryptingFile(path, self._aead, self.salt, digest)
+
+
+def derive_key(password, params=None):
+    """
+    Derives the archive key from a password.
+
+    Args:
+        password: The configured password
+        params: Optional parameters from a manifest header; the key is then
+            derived with their salt and cost and checked against their key check
+
+    Returns:
+        ArchiveKey
+
+    Raises:
+        SystemExit: If the 'cryptography' package is missing
+        ValueError: If params are not supported or the password does not match them
+    """
+    _require_backend()
+    if params is None:
+        salt, n, r, p = os.urandom(SALT_BYTES), SCRYPT_N, SCRYPT_R, SCRYPT_P
+    else:
+        if params.get('cipher') != CIPHER or params.get('kdf') != KDF or params.get('frame_size') != FRAME_SIZE:
+            raise ValueError(f"unsupported encryption {params.get('cipher')}/{params.get('kdf')}")
+        salt, n, r, p = bytes.fromhex(params['salt']), params['n'], params['r'], params['p']
+    key = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                         maxmem=2 * 128 * r * n, dklen=KEY_BYTES)
+    archive_key = ArchiveKey(key, salt, n, r, p)
+    if params is not None and not hmac.compare_digest(archive_key.key_check, params.get('key_check', '')):
+        raise ValueError('wrong password for this archive')
+    return archive_key
+
+
+def derive_run_key(password, previous=None):
+    """
+    Derives the key of an archive run.
+
+    Args:
+        password: The configured password
+        previous: Optional encryption parameters of an interrupted run; they
+            are reused when the password still matches, so that run can be
+            resumed under the same key
+
+    Returns:
+        ArchiveKey with a fresh salt unless previous could be reused
+    """
+    if previous:
+        try:
+            return derive_key(password, previous)
+        except ValueError:
+            pass  # Different password or format: the interrupted run is not resumable
+    return derive_key(password)
+
+
+def open_key(header, password):
+    """
+    Returns the key needed to read an archive.
+
+    Args:
+        header: Header fields of the archive's manifest
+        password: Password to try; may be None for unencrypted archives
+
+    Returns:
+        ArchiveKey, or None if the archive is not encrypted
+
+    Raises:
+        ValueError: If the archive is encrypted and the password is missing or wrong
+    """
+    params = header.get('encryption')
+    if not params:
+        return None
+    if not password:
+        raise ValueError('the archive is encrypted; set the password in the configuration')
+    return derive_key(password, params)
+
+
+def _nonce(prefix, counter, last):
+    return prefix + struct.pack('>IB', counter, last)
+
+
+class FrameEncryptor:
+    """
+    Encrypts one volume as a stream of frames.
+
+    ``update()`` returns the frames completed so far (the volume header comes
+    first); ``finalize()`` seals the last frame, which is never empty unless
+    the whole stream is. ``cpu_seconds`` and ``bytes_in`` measure the
+    encryption overhead.
+    """
+
+    def __init__(self, aead, salt):
+        self._aead = aead
+        self._prefix = os.urandom(NONCE_PREFIX_BYTES)
+        self.header = VOLUME_HEADER.pack(MAGIC, salt, self._prefix, FRAME_SIZE)
+        self._pending = self.header
+        self._buffer = bytearray()
+        self._counter = 0
+        self.cpu_seconds = 0.0
+        self.bytes_in = 0
+
+    def _seal(self, data, last):
+        sealed = self._aead.encrypt(_nonce(self._prefix, self._counter, last), data, self.header)
+        self._counter += 1
+        return sealed
+
+    def update(self, data):
+        started = time.thread_time()
+        self.bytes_in += len(data)
+        self._buffer += data
+        output = [self._pending]
+        self._pending = b''
+        # A full buffer is only sealed once more data follows: the last frame is flagged.
+        start = 0
+        with memoryview(self._buffer) as view:
+            while len(self._buffer) - start > FRAME_SIZE:
+                output.append(self._seal(view[start:start + FRAME_SIZE], False))
+                start += FRAME_SIZE
+        del self._buffer[:start]
+        self.cpu_seconds += time.thread_time() - started
+        return b''.join(output)
+
+    def finalize(self):
+        started = time.thread_time()
+        tail = self._pending + self._seal(bytes(self._buffer), True)
+        self._pending = b''
+        self._buffer.clear()
+        self.cpu_seconds += time.thread_time() - started
+        return tail
+
+
+class DecryptingFile:
+    """
+    Read-only file object over the decrypted stream of an encrypted volume.
+
+    Supports ``seek()`` to any plaintext offset and ``read()``, which is all
+    restore.VolumeReader needs. Only the frame being read is held in memory.
+    """
+
+    def __init__(self, path, aead, expected_salt, digest=None):
+        """
+        Args:
+            path: Path of the encrypted volume
+            aead: AESGCM object holding the archive key
+            expected_salt: Key salt the volume header must carry
+            digest: Optional hash object updated with the raw bytes read;
+                meaningful when the volume is read once from the start
+
+        Raises:
+            ValueError: If the file is not a volume encrypted with this key
+        """
+        self._aead = aead
+        self._digest = digest
+        self._file = open(path, 'rb')
+        try:
+            self.header = self._file.read(VOLUME_HEADER.size)
+            if len(self.header) < VOLUME_HEADER.size:
+                raise ValueError(f"'{path}' is truncated")
+            magic, salt, self._prefix, frame_size = VOLUME_HEADER.unpack(self.header)
+            if magic != MAGIC or frame_size != FRAME_SIZE:
+                raise ValueError(f"'{path}' is not an encrypted volume")
+            if salt != expected_salt:
+                raise ValueError(f"'{path}' was encrypted with another key")
+            size = os.fstat(self._file.fileno()).st_size - VOLUME_HEADER.size
+        except BaseException:
+            self._file.close()
+            raise
+        if digest is not None:
+            digest.update(self.header)
+        # An empty stream still has one (empty) last frame.
+        self._frames = max(1, -(-size // (FRAME_SIZE + TAG_BYTES)))
+        self._frame = 0  # Next frame to decrypt
+        self._plain = b''
+        self._plain_offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def seek(self, offset):
+        """Positions the stream at a plaintext offset."""
+        self._frame = offset // FRAME_SIZE
+        self._file.seek(VOLUME_HEADER.size + self._frame * (FRAME_SIZE + TAG_BYTES))
+        self._plain = b''
+        self._plain_offset = 0
+        skip = offset - self._frame * FRAME_SIZE
+        if skip and self._next_frame():
+            self._plain_offset = min(skip, len(self._plain))
+
+    def _next_frame(self):
+        if self._frame >= self._frames:
+            return False
+        sealed = self._file.read(FRAME_SIZE + TAG_BYTES)
+        if self._digest is not None:
+            self._digest.update(sealed)
+        last = self._frame == self._frames - 1
+        try:
+            self._plain = self._aead.decrypt(_nonce(self._prefix, self._frame, last), sealed, self.header)
+        except InvalidTag:
+            raise AuthenticationError(
+                f"frame {self._frame} failed authentication (corrupt or truncated volume)"
+            ) from None
+        self._plain_offset = 0
+        self._frame += 1
+        return True
+
+    def read(self, size=-1):
+        """Reads up to size plaintext bytes (a frame at most); b'' at the end."""
+        if self._plain_offset >= len(self._plain) and not self._next_frame():
+            return b''
+        end = len(self._plain) if size < 0 else self._plain_offset + size
+        data = self._plain[self._plain_offset:end]
+        self._plain_offset += len(data)
+        return data
@@ -0,0 +1,287 @@
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from pathlib import Path
+
+from .state import FileRecord
+
+
+# On-disk layout: a fixed header followed by 8-byte aligned sections.
+#   size, mtime_ns, inode        int64[count]
+#   directory                    uint32[count]  (ids into the tables below)
+#   archive                      uint16[count]  (one archive per run: 65535 runs)
+#   name_offset                  uint32[count + 1] into the names blob
+#   slots                        int32[slot_count]  open-addressing hash table
+#   directories, archive ids     NUL-separated UTF-8 tables
+#   names                        concatenated UTF-8 basenames
+INDEX_MAGIC = b'SPAIDX01'
+_HEADER = struct.Struct('<8sqqqqqq')  # magic, generation, count, slots, dirs, archives, names bytes
+
+# Slots per file in the hash table; lower means more probing.
+_SLOT_FACTOR = 1.5
+
+# Paths are stored as bytes; undecodable names from os.fsdecode round-trip.
+_ENCODING = 'utf-8'
+_ERRORS = 'surrogateescape'
+
+
+def _slot_count(count):
+    return int(count * _SLOT_FACTOR) + 1
+
+
+def _split(relative_path):
+    directory, _, name = relative_path.rpartition(os.sep)
+    return directory, name.encode(_ENCODING, _ERRORS)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+class FileIndex:
+    """
+    Compact, read-only index of processed files.
+
+    Replaces a dict of relative path -> FileRecord, which costs 200+ bytes
+    per file in CPython, with typed columns: directories and archive ids are
+    interned in small tables, basenames are packed into one blob, and lookups
+    go through an open-addressing hash table keyed by a stable CRC32 of the
+    (directory, basename) pair. That is about 40 bytes per file plus the
+    basename, and because nothing hashes with Python's per-process seed, the
+    whole structure can be written to disk once and memory-mapped by later
+    runs without parsing.
+
+    Supports ``get(path)``, ``in``, ``len()`` and ``items()``, so it can be
+    passed wherever the scanner expects the processed-files mapping.
+    """
+
+    def __init__(self, buffer):
+        """
+        Args:
+            buffer: Bytes-like object (e.g. an mmap) holding a serialized index
+
+        Raises:
+            ValueError: If the buffer does not hold a valid index
+        """
+        if len(buffer) < _HEADER.size:
+            raise ValueError('file index is truncated')
+        magic, self.generation, count, slots, dirs_bytes, archives_bytes, names_bytes = \
+            _HEADER.unpack_from(buffer)
+        if magic != INDEX_MAGIC:
+            raise ValueError('not a file index')
+        sections = (8 * count, 8 * count, 8 * count, 4 * count, 2 * count, 4 * (count + 1), 4 * slots,
+                    dirs_bytes, archives_bytes, names_bytes)
+        if _HEADER.size + sum(_align(length) for length in sections) > len(buffer):
+            raise ValueError('file index is truncated')
+        self._buffer = buffer
+        view = memoryview(buffer)
+        offset = _HEADER.size
+
+        def column(fmt, length):
+            nonlocal offset
+            size = array(fmt).itemsize * length
+            data = view[offset:offset + size].cast(fmt)
+            offset = _align(offset + size)
+            return data
+
+        def blob(length):
+            nonlocal offset
+            data = view[offset:offset + length]
+            offset = _align(offset + length)
+            return data
+
+        self._count = count
+        self._size = column('q', count)
+        self._mtime_ns = column('q', count)
+        self._inode = column('q', count)
+        self._directory = column('I', count)
+        self._archive = column('H', count)
+        self._name_offset = column('I', count + 1)
+        self._slots = column('i', slots)
+        self._slot_total = slots
+        directories = bytes(blob(dirs_bytes)).decode(_ENCODING, _ERRORS).split('\0') if count else []
+        self._directories = directories
+        self._directory_ids = {directory: i for i, directory in enumerate(directories)}
+        archive_ids = bytes(blob(archives_bytes)).decode(_ENCODING, _ERRORS).split('\0') if count else []
+        self._archive_ids = [archive_id or None for archive_id in archive_ids]
+        self._names = blob(names_bytes)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, relative_path):
+        return self._find(relative_path) >= 0
+
+    def _find(self, relative_path):
+        directory, name = _split(relative_path)
+        directory_id = self._directory_ids.get(directory)
+        if directory_id is None:
+            return -1
+        total = self._slot_total
+        slot = zlib.crc32(name, directory_id) % total
+        names, offsets, directories, slots = self._names, self._name_offset, self._directory, self._slots
+        while True:
+            i = slots[slot]
+            if i < 0:
+                return -1
+            if directories[i] == directory_id and names[offsets[i]:offsets[i + 1]] == name:
+                return i
+            slot += 1
+            if slot == total:
+                slot = 0
+
+    def _record(self, i):
+        return FileRecord(self._size[i], self._mtime_ns[i], self._inode[i], self._archive_ids[self._archive[i]])
+
+    def get(self, relative_path, default=None):
+        """Returns the FileRecord of a relative path, or default."""
+        i = self._find(relative_path)
+        return self._record(i) if i >= 0 else default
+
+    def items(self):
+        """Yields (relative path, FileRecord) tuples, grouped by directory."""
+        for i in range(self._count):
+            name = bytes(self._names[self._name_offset[i]:self._name_offset[i + 1]]).decode(_ENCODING, _ERRORS)
+            directory = self._directories[self._directory[i]]
+            yield (os.path.join(directory, name) if directory else name), self._record(i)
+
+    def close(self):
+        """Releases the views on the underlying buffer (needed before closing an mmap)."""
+        for name in ('_size', '_mtime_ns', '_inode', '_directory', '_archive', '_name_offset', '_slots', '_names'):
+            getattr(self, name).release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+def build_index(records, generation=0):
+    """
+    Serializes file records into the index format.
+
+    Args:
+        records: Iterable of (relative path, FileRecord) tuples; sorting them
+            by path keeps each directory's files together
+        generation: State generation the records belong to
+
+    Returns:
+        bytes of the serialized index (see FileIndex)
+    """
+    directory_ids = {}
+    archive_ids = {}
+    size, mtime_ns, inode = array('q'), array('q'), array('q')
+    directory_col, archive_col, name_offset = array('I'), array('H'), array('I', [0])
+    names = bytearray()
+    keys = array('I')
+    for relative_path, record in records:
+        directory, name = _split(relative_path)
+        directory_id = directory_ids.setdefault(directory, len(directory_ids))
+        size.append(record.size)
+        mtime_ns.append(record.mtime_ns)
+        inode.append(record.inode)
+        directory_col.append(directory_id)
+        archive_col.append(archive_ids.setdefault(record.archive_id or '', len(archive_ids)))
+        names += name
+        name_offset.append(len(names))
+        keys.append(zlib.crc32(name, directory_id))
+
+    count = len(size)
+    slot_total = _slot_count(count)
+    slots = array('i', [-1]) * slot_total
+    for i, key in enumerate(keys):
+        slot = key % slot_total
+        while slots[slot] >= 0:
+            slot += 1
+            if slot == slot_total:
+                slot = 0
+        slots[slot] = i
+
+    directories_blob = '\0'.join(directory_ids).encode(_ENCODING, _ERRORS)
+    archives_blob = '\0'.join(archive_ids).encode(_ENCODING, _ERRORS)
+    out = bytearray(_HEADER.pack(INDEX_MAGIC, generation, count, slot_total,
+                                 len(directories_blob), len(archives_blob), len(names)))
+    for section in (size, mtime_ns, inode, directory_col, archive_col, name_offset, slots,
+                    directories_blob, archives_blob, names):
+        out += section.tobytes() if isinstance(section, array) else section
+        out += b'\0' * (_align(len(out)) - len(out))
+    return bytes(out)
+
+
+def write_index(path, records, generation=0):
+    """
+    Builds an index and writes it atomically (temporary file, fsync, rename).
+
+    Args:
+        path: Path of the index file
+        records: Iterable of (relative path, FileRecord) tuples
+        generation: State generation the records belong to
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    data = build_index(records, generation)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def open_index(path):
+    """
+    Memory-maps an index file written by write_index.
+
+    Args:
+        path: Path of the index file
+
+    Returns:
+        FileIndex backed by the mapped file, or None if the file is missing or invalid
+    """
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError:
+        return None
+    try:
+        return FileIndex(buffer)
+    except ValueError:
+        buffer.close()
+        return None
+
+
+def index_path(state_path):
+    """Returns the path of the index snapshot kept next to a state database."""
+    return Path(str(state_path) + '.index')
+
+
+def load_index(state):
+    """
+    Returns the processed-files index of a state store.
+
+    The snapshot next to the state database is memory-mapped if it matches
+    the state's generation; otherwise it is rebuilt from the database first.
+    Rebuilding right after a commit therefore makes the next start-up cheap.
+
+    Args:
+        state: StateStore to index
+
+    Returns:
+        FileIndex
+    """
+    path = index_path(state.path)
+    generation = state.generation()
+    index = open_index(path)
+    if index is not None:
+        if index.generation == generation:
+            return index
+        index.close()
+    try:
+        write_index(path, state.iter_files(), generation)
+        index = open_index(path)
+    except OSError as e:
+        print(f"Warning: Could not write file index '{path}': {e}")
+        index = None
+    if index is None:
+        index = FileIndex(build_index(state.iter_files(), generation))
+    return index
@@ -0,0 +1,281 @@
+"""
+Several sources archived by one run: job definitions and the archive budget they share.
+
+Every ``[Job <name>]`` section of the configuration is a source archived on
+its own, with its own destination, state and archive chain:
+
+    [Job photo]
+    source_dir = /volume1/photo
+    priority = 10
+
+    [Job homes]
+    source_dir = /volume1/homes/*/Photos    one job per match: homes-alice, homes-bob, ...
+
+    [Job video]
+    source_dir = /volume1/video
+    codec = store                           any other key overrides [Archive]
+
+Jobs scan concurrently; their archive phases are admitted through an
+ArchiveBudget (``[Jobs] archive_jobs`` at once, sharing ``cpu_budget``
+compression threads), highest priority first and, among equals, largest
+first, so the run takes about as long as its longest job.
+"""
+import configparser
+import glob
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+JOB_SECTION_PREFIX = 'Job '
+
+# Archive phases (the disk-heavy part of a job) running at once.
+DEFAULT_ARCHIVE_JOBS = 2
+
+# Job keys that are not [Archive] overrides, and where they go in the job's configuration.
+_JOB_KEYS = {
+    'source_dir': ('Paths', 'source_dir'),
+    'destination_dir': ('Paths', 'destination_dir'),
+    'state_file': ('State', 'file'),
+    'journal': ('Scan', 'journal'),
+}
+
+
+class Job:
+    """One source to archive: its name, priority and configuration."""
+
+    def __init__(self, name, config, priority=0):
+        """
+        Args:
+            name: Job name, unique within the configuration
+            config: ConfigParser with the job's settings in the usual sections
+            priority: Higher priorities are archived first
+        """
+        self.name = name
+        self.config = config
+        self.priority = priority
+
+    @property
+    def source_dir(self):
+        return self.config.get('Paths', 'source_dir')
+
+    @property
+    def compression_workers(self):
+        """Compression threads the job's archive phase uses."""
+        workers = self.config.getint('Archive', 'workers', fallback=1)
+        return workers if workers > 0 else (os.cpu_count() or 1)
+
+    def __repr__(self):
+        return f"Job({self.name!r}, source_dir={self.source_dir!r}, priority={self.priority})"
+
+
+def _with_job_name(path, name):
+    """Returns a shared file path made specific to a job: 'state.db' -> 'state.<name>.db'."""
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.{name}{path.suffix}"))
+
+
+def _expand_sources(name, source_dir):
+    """Returns (job name, source directory) pairs for a source_dir that may hold wildcards."""
+    if not glob.has_magic(source_dir):
+        return [(name, source_dir)]
+    pattern = Path(source_dir).parts
+    wild = [i for i, part in enumerate(pattern) if glob.has_magic(part)]
+    matches = []
+    for match in sorted(glob.glob(source_dir)):
+        if os.path.isdir(match):
+            parts = Path(match).parts
+            matches.append((f"{name}-{'-'.join(parts[i] for i in wild)}", match))
+    return matches
+
+
+def _job_config(config, name, section, source_dir):
+    job_config = configparser.ConfigParser()
+    job_config.read_dict({other: dict(config.items(other, raw=True)) for other in config.sections()})
+    for key, value in config.items(section, raw=True):
+        if key in config.defaults() and config.defaults()[key] == value:
+            continue
+        if key == 'priority':
+            continue
+        target_section, target_key = _JOB_KEYS.get(key, ('Archive', key))
+        if not job_config.has_section(target_section):
+            job_config.add_section(target_section)
+        job_config.set(target_section, target_key, value)
+    job_config.set('Paths', 'source_dir', source_dir)
+    if not config.has_option(section, 'destination_dir'):
+        job_config.set('Paths', 'destination_dir', str(Path(config.get('Paths', 'destination_dir')) / name))
+    if not config.has_option(section, 'state_file'):
+        job_config.set('State', 'file', _with_job_name(config.get('State', 'file'), name))
+    journal = config.get('Scan', 'journal', fallback='').strip()
+    if journal and not config.has_option(section, 'journal'):
+        job_config.set('Scan', 'journal', _with_job_name(journal, name))
+    return job_config
+
+
+def load_jobs(config):
+    """
+    Reads the jobs of the configuration.
+
+    Unless set in the job's section, a job's destination is a directory
+    named after the job inside [Paths] destination_dir, and its state file
+    (and change journal) is the configured one with the job name added.
+
+    Args:
+        config: ConfigParser with the configuration
+
+    Returns:
+        List of Job objects in configuration order; empty if there are no
+        [Job ...] sections (then [Paths] source_dir is the only source)
+
+    Raises:
+        SystemExit: If a job is incomplete or job names clash
+    """
+    jobs = []
+    for section in config.sections():
+        if not section.startswith(JOB_SECTION_PREFIX):
+            continue
+        name = section[len(JOB_SECTION_PREFIX):].strip()
+        source_dir = config.get(section, 'source_dir', fallback='').strip()
+        if not name or not source_dir:
+            print(f"Error: Section [{section}] needs a name and a source_dir.")
+            sys.exit(1)
+        try:
+            priority = config.getint(section, 'priority', fallback=0)
+        except ValueError:
+            print(f"Error: Invalid priority in [{section}].")
+            sys.exit(1)
+        expanded = _expand_sources(name, source_dir)
+        if not expanded:
+            print(f"Warning: No directories match source_dir '{source_dir}' of job '{name}'.")
+        for job_name, job_source in expanded:
+            jobs.append(Job(job_name, _job_config(config, job_name, section, job_source), priority))
+    names = [job.name for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        print(f"Error: Duplicate job names: {', '.join(duplicates)}.")
+        sys.exit(1)
+    return jobs
+
+
+def select_job(config, name):
+    """
+    Returns the configuration of one job, for tools working on a single archive.
+
+    Args:
+        config: ConfigParser with the configuration
+        name: Job name (as printed by the archiver, e.g. 'homes-alice'); None
+            returns config unchanged
+
+    Raises:
+        SystemExit: If there is no such job
+    """
+    if name is None:
+        return config
+    jobs = load_jobs(config)
+    for job in jobs:
+        if job.name == name:
+            return job.config
+    print(f"Error: No job '{name}' in the configuration. Jobs: {', '.join(job.name for job in jobs) or 'none'}.")
+    sys.exit(1)
+
+
+class ArchiveBudget:
+    """
+    Admits archive phases of concurrent jobs within an I/O and CPU budget.
+
+    At most ``archive_jobs`` phases run at once, using at most ``cpu_budget``
+    compression threads between them (a job needing more than the whole
+    budget runs alone). Waiting jobs are admitted strictly in order of
+    priority, then estimated size, largest first: starting the longest work
+    early keeps the total wall time close to that of the longest job.
+    Thread-safe.
+    """
+
+    def __init__(self, archive_jobs=DEFAULT_ARCHIVE_JOBS, cpu_budget=0):
+        """
+        Args:
+            archive_jobs: Archive phases running at once (at least 1)
+            cpu_budget: Compression threads shared by running phases; 0 for every CPU
+        """
+        self.archive_jobs = max(1, archive_jobs)
+        self.cpu_budget = cpu_budget if cpu_budget > 0 else (os.cpu_count() or 1)
+        self._condition = threading.Condition()
+        self._waiting = []  # Heap of (-priority, -estimate, order)
+        self._order = itertools.count()
+        self._running = 0
+        self._threads = 0
+        self.admitted = []  # Job names in the order they were admitted
+
+    def _fits(self, threads):
+        if self._running >= self.archive_jobs:
+            return False
+        return self._running == 0 or self._threads + threads <= self.cpu_budget
+
+    @contextmanager
+    def slot(self, name, priority=0, estimate=0, threads=1):
+        """
+        Waits for the job's turn, holds a slot while the block runs, then releases it.
+
+        Args:
+            name: Job name
+            priority: Job priority; higher goes first
+            estimate: Estimated bytes the job will archive
+            threads: Compression threads the job uses
+
+        Yields:
+            Seconds spent waiting
+        """
+        entry = (-priority, -estimate, next(self._order))
+        started = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while self._waiting[0] != entry or not self._fits(threads):
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._running += 1
+            self._threads += threads
+            self.admitted.append(name)
+            self._condition.notify_all()  # The next in line may fit as well
+        try:
+            yield time.monotonic() - started
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._threads -= threads
+                self._condition.notify_all()
+
+
+def run_jobs(jobs, run):
+    """
+    Runs every job on its own thread and waits for them all.
+
+    Args:
+        jobs: List of Job objects
+        run: Callable(job) returning the job's result; a job that raises
+            (including SystemExit from a configuration error) fails alone
+
+    Returns:
+        Dictionary mapping job names to their result, or to the exception they raised
+    """
+    results = {}
+
+    def target(job):
+        try:
+            results[job.name] = run(job)
+        except SystemExit as e:  # Its error has been printed; the other jobs carry on
+            results[job.name] = e
+        except Exception as e:
+            print(f"Error: Job '{job.name}' failed: {e}")
+            results[job.name] = e
+
+    threads = [threading.Thread(target=target, args=(job,), name=f"job {job.name}") for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from pathlib import Path
+
+
+# Seconds between the watcher's heartbeats, and how many may be missed
+# before the watcher is considered dead (and the journal incomplete).
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TOLERANCE = 3
+
+# Event kinds. 'file' and 'delete' name a file, 'dir' a directory whose
+# whole subtree appeared (created or moved in), 'overflow' marks lost events.
+EVENT_KINDS = ('file', 'dir', 'delete', 'overflow')
+
+# Position in the journal: the watcher session and the last event seen.
+JournalPosition = namedtuple('JournalPosition', ['session', 'seq'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL,
+    ready REAL,
+    heartbeat REAL,
+    stopped REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+"""
+
+
+def _root(root):
+    return os.path.abspath(os.fspath(root))
+
+
+class ChangeJournal:
+    """
+    Persistent log of file system changes under a source directory.
+
+    Written by the watcher daemon (see watcher.py) and read by the archiver;
+    both sides open the same SQLite database. Every watcher run is a session:
+    events are only trustworthy from the moment the session is ready (all
+    directories watched) for as long as it keeps sending heartbeats and no
+    'overflow' event says that changes were lost.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    # Writer side (the watcher)
+
+    def start_session(self, root):
+        """Registers a new watcher session; returns its id."""
+        now = time.time()
+        cursor = self._conn.execute(
+            'INSERT INTO sessions (root, pid, started, heartbeat) VALUES (?, ?, ?, ?)',
+            (_root(root), os.getpid(), now, now)
+        )
+        return cursor.lastrowid
+
+    def mark_ready(self, session):
+        """Marks a session as watching every directory; events count from here on."""
+        self._conn.execute('UPDATE sessions SET ready = ?, heartbeat = ? WHERE id = ?',
+                           (time.time(), time.time(), session))
+
+    def heartbeat(self, session):
+        self._conn.execute('UPDATE sessions SET heartbeat = ? WHERE id = ?', (time.time(), session))
+
+    def stop_session(self, session):
+        self._conn.execute('UPDATE sessions SET stopped = ? WHERE id = ?', (time.time(), session))
+
+    def add_events(self, session, events):
+        """
+        Appends events in one transaction.
+
+        Args:
+            session: Session id from start_session
+            events: Iterable of (kind, relative path) tuples
+        """
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT INTO events (session, kind, path) VALUES (?, ?, ?)',
+                ((session, kind, path) for kind, path in events)
+            )
+
+    # Reader side (the archiver)
+
+    def _live_session(self, root):
+        row = self._conn.execute(
+            'SELECT id, ready, heartbeat, stopped FROM sessions WHERE root = ? ORDER BY id DESC LIMIT 1',
+            (_root(root),)
+        ).fetchone()
+        if row is None:
+            return None, 'no watcher has run for this source directory'
+        session, ready, heartbeat, stopped = row
+        if stopped is not None:
+            return None, 'the watcher has stopped'
+        if ready is None:
+            return None, 'the watcher is still setting up its watches'
+        if time.time() - heartbeat > HEARTBEAT_INTERVAL * HEARTBEAT_TOLERANCE:
+            return None, 'the watcher is not responding'
+        return session, None
+
+    def position(self, root):
+        """
+        Returns the current position of a live, ready session for root, or None.
+
+        Everything that changed before this position has been either logged
+        or picked up by a walk started after it.
+        """
+        session, _ = self._live_session(root)
+        if session is None:
+            return None
+        # The AUTOINCREMENT high-water mark survives pruning, unlike MAX(seq).
+        row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return JournalPosition(session, row[0] if row is not None else 0)
+
+    def check(self, root, since):
+        """
+        Checks that the journal holds every change made after a position.
+
+        Args:
+            root: Source directory the journal must describe
+            since: JournalPosition consumed by the previous run, or None
+
+        Returns:
+            None if the journal is complete, otherwise the reason why not
+        """
+        if since is None:
+            return 'no journal position from a previous run'
+        session, problem = self._live_session(root)
+        if problem is not None:
+            return problem
+        if session != since.session:
+            return 'the watcher was restarted since the previous run'
+        row = self._conn.execute(
+            "SELECT 1 FROM events WHERE session = ? AND seq > ? AND kind = 'overflow' LIMIT 1",
+            (session, since.seq)
+        ).fetchone()
+        if row is not None:
+            return 'the watcher lost events'
+        return None
+
+    def events(self, after, upto):
+        """
+        Returns the events logged in (after, upto], oldest first.
+
+        Returns:
+            List of (kind, relative path) tuples
+        """
+        return self._conn.execute(
+            'SELECT kind, path FROM events WHERE seq > ? AND seq <= ? ORDER BY seq', (after, upto)
+        ).fetchall()
+
+    def prune(self, upto):
+        """Deletes events up to and including seq ``upto`` once they are archived."""
+        self._conn.execute('DELETE FROM events WHERE seq <= ?', (upto,))
+
+
+def format_position(position):
+    """Serializes a JournalPosition for the state's meta table."""
+    return f"{position.session}:{position.seq}"
+
+
+def parse_position(value):
+    """Parses format_position output; returns None for a missing or malformed value."""
+    try:
+        session, seq = value.split(':')
+        return JournalPosition(int(session), int(seq))
+    except (AttributeError, ValueError):
+        return None
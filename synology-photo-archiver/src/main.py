@@ -1,53 +1,448 @@
+import argparse
+import datetime
+import os
 import sys
+import time
+from contextlib import ExitStack
 from pathlib import Path
 
+from .capture_date import load_partition
 from .config import load_config
-from .scanner import scan_for_new_and_modified_files
-from .compression import create_archive
+from .scanner import DEFAULT_SCAN_WORKERS
+from .chain import DEFAULT_KEEP_CHAINS, load_chain, new_archive_id
+from .change_sources import DEFAULT_CHANGE_SOURCE, PATH_FILTER_KEY, open_change_source
+from .checkpoint import load_checkpoint
+from .compact import DEFAULT_COMPACT_AFTER, compact
+from .codec import get_codec
+from .compression import DEFAULT_CHECKSUM, DEFAULT_CODEC, create_archive, parse_volume_size
+from .compressibility import CompressibilityPolicy
+from .dedup import NoArchivedFiles, deduplicate
+from .encryption import configured_password, derive_run_key
+from .file_index import load_index
+from .jobs import DEFAULT_ARCHIVE_JOBS, ArchiveBudget, load_jobs, run_jobs
+from .metrics import DEFAULT_PROGRESS_INTERVAL, RunMetrics, load_reports, write_report
+from .path_filter import load_path_filter
+from .pipeline import drain, peek, prefetch, tee_batches
+from .plan import format_plan, make_plan, save_plan
+from .readahead import load_read_options
+from .state import STAGE_BATCH_SIZE, StateStore
+from .writeout import load_write_options
 
 
-def main():
-    """
-    Main function for the archiver.
-    Orchestrates configuration loading, file scanning, archiving, and state management.
+def _finish_run(metrics, report_file, **fields):
+    """Prints the phase timings and appends the run report to the history file."""
+    for line in metrics.format():
+        print(line)
+    if report_file:
+        try:
+            write_report(report_file, metrics.report(**fields))
+        except OSError as e:
+            print(f"Warning: Could not write run report to '{report_file}': {e}")
+
+
+def run_job(config, admit=None):
     """
-    config = load_config()
-    print("Configuration loaded successfully.")
+    Archives one source: scan, archive, state commit, chain maintenance.
+
+    Args:
+        config: ConfigParser with the source's configuration
+        admit: Optional callable (estimated bytes) -> context manager, entered
+            around the archive work of a job sharing a budget with others
+            (see jobs.ArchiveBudget). The scan then completes first, so the
+            job can be ranked by the size of its changes.
 
+    Returns:
+        Tuple of (outcome: 'archived', 'unchanged' or 'failed', RunMetrics,
+        dictionary of run report fields)
+
+    Raises:
+        SystemExit: If the archive chain cannot be read or a setting is invalid
+    """
     # Get config values
     source_dir = config.get('Paths', 'source_dir')
     destination_dir = config.get('Paths', 'destination_dir')
     seven_zip_exec = config.get('Paths', '7z_executable')
-    password = config.get('Archive', 'password')
+    password = configured_password(config.get('Archive', 'password', fallback=''))
     volume_size = config.get('Archive', 'volume_size')
+    codec = get_codec(config.get('Archive', 'codec', fallback=DEFAULT_CODEC)).name
+    detect_compressibility = config.getboolean('Archive', 'detect_compressibility', fallback=True)
+    compression_workers = config.getint('Archive', 'workers', fallback=1)
+    deduplicate_files = config.getboolean('Archive', 'deduplicate', fallback=False)
+    group_small_files = config.getboolean('Archive', 'group_small_files', fallback=True)
+    checksum = config.get('Archive', 'checksum', fallback=DEFAULT_CHECKSUM).strip().lower()
+    if checksum == 'none':
+        checksum = None
+    resume = config.getboolean('Archive', 'resume', fallback=True)
+    state_file = config.get('State', 'file')
+    scan_workers = config.getint('Scan', 'workers', fallback=DEFAULT_SCAN_WORKERS)
+    paranoid = config.getboolean('Scan', 'paranoid', fallback=False)
+    change_source = config.get('Scan', 'change_source', fallback=DEFAULT_CHANGE_SOURCE).strip().lower()
+    journal_file = config.get('Scan', 'journal', fallback='').strip()
+    path_filter = load_path_filter(config)
+    progress_interval = config.getfloat('Report', 'progress_interval', fallback=DEFAULT_PROGRESS_INTERVAL)
+    compact_after = config.getint('Chain', 'compact_after', fallback=DEFAULT_COMPACT_AFTER)
+    keep_chains = config.getint('Chain', 'keep_chains', fallback=DEFAULT_KEEP_CHAINS)
+    write_options = load_write_options(config)
+    read_options = load_read_options(config)
     print(f"Source directory: {source_dir}")
     print(f"Destination directory: {destination_dir}")
 
-    processed_files = {}  # Always start with an empty state
+    metrics = RunMetrics(progress_interval)
+    run_fields = {'source': source_dir, 'codec': codec, 'volume_size': volume_size, 'workers': compression_workers,
+                  'encrypted': bool(password)}
 
-    # Scan for new and modified files
-    files_to_archive = scan_for_new_and_modified_files(source_dir, processed_files)
-    
-    if not files_to_archive:
-        print("No new or modified files to archive.")
-        sys.exit(0)
-    
-    print(f"Found {len(files_to_archive)} new or modified files to archive.")
-
-    # Create archive
-    success = create_archive(
-        files_to_archive,
-        source_dir,
-        destination_dir,
-        seven_zip_exec,
-        password,
-        volume_size
-    )
-
-    if success:
-        print("Archive created successfully.")
-    else:
+    try:
+        chain = load_chain(destination_dir, Path(source_dir).name)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read the archive chain: {e}")
+        sys.exit(1)
+    # An interrupted generation is finished under its own id, or cleaned up.
+    archive_id = name = checkpoint = None
+    pending = chain.pending
+    if pending is not None:
+        if not pending.get('compacted_from'):
+            checkpoint = load_checkpoint(destination_dir, pending['name'])
+        if checkpoint is not None and not resume:
+            print("Discarding interrupted archive (resume is disabled).")
+            checkpoint.discard()
+            checkpoint = None
+        if checkpoint is None:
+            chain.abandon(pending['archive_id'])
+        else:
+            archive_id, name = pending['archive_id'], pending['name']
+    # Without a full generation to build on, this run archives the whole library.
+    full = pending['kind'] == 'full' if archive_id is not None else not chain.current()
+    run_fields['kind'] = 'full' if full else 'delta'
+
+    with StateStore(state_file) as state, ExitStack() as slot:
+        with metrics.phase('load') as phase:
+            processed_files = load_index(state)
+            previous_dirs = state.load_dir_summaries()
+            phase.note(known_files=len(processed_files))
+        print(f"Loaded state for {len(processed_files)} files from {state_file}.")
+        if paranoid:
+            print("Paranoid mode: every file will be re-checked.")
+        if full:
+            print("Writing a full archive of the library.")
+
+        # Scan for new and modified files. The scan runs on its own thread and
+        # streams changes through the stages below as they are found. A full
+        # archive walks everything as if nothing had been archived yet.
+        source = open_change_source(change_source, source_dir, state, journal_file, scan_workers,
+                                    {} if full else previous_dirs, paranoid, full, path_filter)
+        run_fields['change_source'] = source.name
+        scan_meta = {**(source.meta or {}), PATH_FILTER_KEY: path_filter.fingerprint}
+        scan_phase = metrics.phase('scan')
+        changed_files = prefetch(source.changes({} if full else processed_files, scan_phase))
+        changed_files = tee_batches(changed_files, state.stage_files, STAGE_BATCH_SIZE)
+
+        first_change, changed_files = peek(changed_files)
+        deleted = None
+        if first_change is None and not full:
+            deleted = list(source.deletions(processed_files))
+        if first_change is None and not deleted:
+            del processed_files, previous_dirs
+            # Still remember the directory listings so the next scan can prune.
+            with metrics.phase('commit'):
+                state.commit_files({}, source.dir_summaries, meta=scan_meta)
+            source.acknowledge()
+            source.close()
+            print("No new or modified files to archive.")
+            return 'unchanged', metrics, dict(archive_id=None, success=True, **run_fields)
+
+        if full:
+            tombstones = ()
+        elif deleted is not None:
+            tombstones = deleted
+        else:
+            # Looked for once every change is archived, when the scan is complete.
+            deleted = []
+
+            def find_deletions():
+                for relative_path in source.deletions(processed_files):
+                    deleted.append(relative_path)
+                    yield relative_path
+            tombstones = find_deletions()
+
+        if archive_id is None:
+            archive_id = new_archive_id(chain)
+            current = chain.current()
+            name = chain.begin(archive_id, run_fields['kind'], base=None if full else current[0]['archive_id'])
+        # Derived once for every volume; an interrupted run's salt is reused so it can be resumed.
+        key = None
+        if password:
+            key = derive_run_key(password, checkpoint.header.get('encryption') if checkpoint is not None else None)
+
+        if admit is not None:
+            # The scan finishes first so the job can be ranked by the size of its changes.
+            changed_files = list(changed_files)
+            estimate = sum(record.size for _, record in changed_files)
+            with metrics.phase('queue') as phase:
+                slot.enter_context(admit(estimate))
+                phase.note(estimated_bytes=estimate)
+
+        references = []
+        new_hashes = {}
+        if deduplicate_files:
+            # Grouping by size needs every change, so dedup waits for the scan.
+            # A full archive must not refer to content stored in older generations.
+            changed_files = list(changed_files)
+            with metrics.phase('dedup') as phase:
+                changed_files, references, new_hashes = deduplicate(
+                    changed_files, source_dir, NoArchivedFiles() if full else state, archive_id, state.hash_cache()
+                )
+                phase.advance(files=scan_phase.notes['changed'])
+                phase.note(references=len(references), hashed=len(new_hashes))
+            print(f"Deduplication: {len(references)} files already archived under another path.")
+        files_to_archive = (Path(source_dir) / relative_path for relative_path, _ in changed_files)
+
+        # Create archive
+        policy = CompressibilityPolicy(state.compressibility_cache()) if detect_compressibility else None
+        partition = load_partition(config, state.capture_date_cache())
+        vanished = []
+        with metrics.phase('archive') as phase:
+            success = create_archive(
+                files_to_archive,
+                source_dir,
+                destination_dir,
+                seven_zip_exec,
+                password,
+                volume_size,
+                codec=codec,
+                policy=policy,
+                workers=compression_workers,
+                references=references,
+                checksum=checksum,
+                content_hashes=state.staged_hashes(),
+                archive_id=archive_id,
+                resumable=resume,
+                checkpoint=checkpoint,
+                phase=phase,
+                key=key,
+                archive_name=name,
+                tombstones=tombstones,
+                header_fields={'kind': run_fields['kind'], 'base': chain.pending.get('base')},
+                write_options=write_options,
+                partition=partition,
+                group_small_files=group_small_files,
+                read_options=read_options,
+                vanished=vanished
+            )
+
+        if success:
+            # The archiver consumed every change, so the scan is complete too.
+            drain(changed_files)
+            del processed_files, previous_dirs
+            print(f"Found {scan_phase.notes['changed']} new or modified files.")
+            # Completed first: a crash before the state commit only makes the
+            # next run archive these files again in a delta.
+            chain.complete(archive_id)
+            # Only now is it safe to remember these files as processed; files
+            # that vanished before they were archived are left for the next run.
+            with metrics.phase('commit'):
+                if vanished:
+                    state.unstage_files(vanished)
+                    gone = set(vanished)
+                    references = [reference for reference in references if reference.path not in gone]
+                    # Their directories must be scanned again even if the listing looks the same.
+                    for relative_path in gone if source.dir_summaries is not None else ():
+                        source.dir_summaries.pop(os.path.dirname(relative_path), None)
+                state.commit_staged(archive_id, source.dir_summaries, policy.decisions if policy else None,
+                                    new_hashes, meta=scan_meta, deleted=deleted or (), replace=full,
+                                    capture_dates=partition.extracted if partition else None,
+                                    references=references)
+            source.acknowledge()
+            source.close()
+            if compact_after > 0 and chain.deltas_since_full >= compact_after:
+                with metrics.phase('compact') as phase:
+                    compacted = compact(chain, source_dir, password, key, volume_size, codec, checksum,
+                                        compression_workers, phase=phase, write_options=write_options,
+                                        partition=partition, group_small_files=group_small_files)
+                if compacted is not None:
+                    state.reassign_archive(*compacted)
+                else:
+                    print("Warning: Compacting the archive chain failed; it will be retried on the next run.")
+            if keep_chains > 0:
+                removed = chain.prune(keep_chains)
+                if removed:
+                    print(f"Removed {len(removed)} generations older than the last {keep_chains} chains.")
+            slot.close()  # Let the next job archive while this one finishes up
+            with metrics.phase('index') as phase:
+                # Rebuilt now so the next run only has to map it.
+                phase.advance(files=len(load_index(state)))
+            print("Archive created successfully.")
+            return 'archived', metrics, dict(archive_id=archive_id, success=True, **run_fields)
+        if not resume:
+            chain.abandon(archive_id)
         print("Archive creation failed.")
+        return 'failed', metrics, dict(archive_id=archive_id, success=False, **run_fields)
+
+
+# Plans are saved next to the state file, like its index.
+PLAN_SUFFIX = '.plan.json'
+
+
+def plan_job(config, report_file=None):
+    """
+    Scans one source and estimates the archive a run would write, without writing it.
+
+    The scan reads the state but records nothing, and a change journal is
+    not consumed, so the next run finds the same changes. The plan is
+    printed and saved as ``<state file>.plan.json``.
+
+    Args:
+        config: ConfigParser with the source's configuration
+        report_file: Optional run report history the duration is estimated from
+
+    Returns:
+        Plan dictionary (see plan.make_plan)
+
+    Raises:
+        SystemExit: If the archive chain cannot be read or a setting is invalid
+    """
+    source_dir = config.get('Paths', 'source_dir')
+    destination_dir = config.get('Paths', 'destination_dir')
+    volume_size = config.get('Archive', 'volume_size')
+    codec = get_codec(config.get('Archive', 'codec', fallback=DEFAULT_CODEC))
+    detect_compressibility = config.getboolean('Archive', 'detect_compressibility', fallback=True)
+    compression_workers = config.getint('Archive', 'workers', fallback=1)
+    state_file = config.get('State', 'file')
+    scan_workers = config.getint('Scan', 'workers', fallback=DEFAULT_SCAN_WORKERS)
+    paranoid = config.getboolean('Scan', 'paranoid', fallback=False)
+    change_source = config.get('Scan', 'change_source', fallback=DEFAULT_CHANGE_SOURCE).strip().lower()
+    journal_file = config.get('Scan', 'journal', fallback='').strip()
+    path_filter = load_path_filter(config)
+    print(f"Planning the archive of {source_dir}; nothing will be written to {destination_dir}.")
+
+    try:
+        chain = load_chain(destination_dir, Path(source_dir).name)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read the archive chain: {e}")
+        sys.exit(1)
+    full = not chain.current()
+    metrics = RunMetrics(config.getfloat('Report', 'progress_interval', fallback=DEFAULT_PROGRESS_INTERVAL))
+    with StateStore(state_file) as state:
+        processed_files = {} if full else load_index(state)
+        source = open_change_source(change_source, source_dir, state, journal_file, scan_workers,
+                                    {} if full else state.load_dir_summaries(), paranoid, full, path_filter)
+        try:
+            with metrics.phase('scan') as phase:
+                files = list(source.changes(processed_files, phase))
+        finally:
+            source.close()
+        del processed_files
+        print(f"Found {len(files)} new or modified files; sampling them to estimate the archive.")
+        policy = CompressibilityPolicy(state.compressibility_cache()) if detect_compressibility else None
+        plan = make_plan(
+            files, source_dir, codec, parse_volume_size(volume_size), policy,
+            partition=load_partition(config, state.capture_date_cache()),
+            reports=load_reports(report_file) if report_file else (),
+            workers=compression_workers if compression_workers > 0 else (os.cpu_count() or 1),
+            scan_seconds=phase.seconds, source=source_dir, kind='full' if full else 'delta',
+            volume_size=volume_size,
+        )
+    for line in format_plan(plan):
+        print(line)
+    plan_path = state_file + PLAN_SUFFIX
+    try:
+        save_plan(plan_path, plan)
+        print(f"Plan saved to {plan_path}.")
+    except OSError as e:
+        print(f"Warning: Could not save the plan to '{plan_path}': {e}")
+    return plan
+
+
+def _run_jobs(config, jobs, report_file):
+    """
+    Archives every job concurrently within the [Jobs] budget and writes one report for the run.
+
+    Returns:
+        bool: True if every job succeeded
+    """
+    try:
+        budget = ArchiveBudget(config.getint('Jobs', 'archive_jobs', fallback=DEFAULT_ARCHIVE_JOBS),
+                               config.getint('Jobs', 'cpu_budget', fallback=0))
+    except ValueError as e:
+        print(f"Error: Invalid [Jobs] setting: {e}")
+        sys.exit(1)
+    print(f"Running {len(jobs)} jobs ({', '.join(job.name for job in jobs)}); {budget.archive_jobs} archive at once "
+          f"with {budget.cpu_budget} compression threads between them.")
+    started_at = datetime.datetime.now()
+    started = time.monotonic()
+
+    def run(job):
+        print(f"Starting job '{job.name}'.")
+        return run_job(job.config, lambda estimate: budget.slot(job.name, job.priority, estimate,
+                                                                job.compression_workers))
+    results = run_jobs(jobs, run)
+    seconds = time.monotonic() - started
+
+    reports = []
+    for job in jobs:
+        result = results[job.name]
+        if isinstance(result, BaseException):
+            reports.append({'job': job.name, 'source': job.source_dir, 'outcome': 'failed', 'success': False,
+                            'error': str(result)})
+            continue
+        outcome, metrics, fields = result
+        print(f"Job {job.name}:")
+        for line in metrics.format():
+            print(line)
+        reports.append({'job': job.name, 'outcome': outcome, 'priority': job.priority, **metrics.report(**fields)})
+    # What the jobs would have taken one after another, without waiting for each other.
+    serial = sum(report.get('seconds', 0.0) - sum(phase['seconds'] for phase in report.get('phases', ())
+                                                  if phase['name'] == 'queue')
+                 for report in reports)
+    success = all(report['success'] for report in reports)
+    for report in reports:
+        print(f"{report['job']:<24} {report['outcome']:<10} {report.get('seconds', 0.0):>9.2f}s")
+    print(f"{len(jobs)} jobs finished in {seconds:.2f}s; one after another they would have taken {serial:.2f}s.")
+    if report_file:
+        try:
+            write_report(report_file, {
+                'started': started_at.isoformat(timespec='seconds'), 'seconds': round(seconds, 3),
+                'serial_seconds': round(serial, 3), 'success': success, 'archive_order': budget.admitted,
+                'jobs': reports,
+            })
+        except OSError as e:
+            print(f"Warning: Could not write run report to '{report_file}': {e}")
+    return success
+
+
+def main(argv=None):
+    """
+    Main function for the archiver.
+    Orchestrates configuration loading, file scanning, archiving, and state management.
+    With [Job ...] sections, every job's source is archived in the same run (see jobs).
+    With --plan, the sources are only scanned and their archives estimated (see plan).
+    """
+    parser = argparse.ArgumentParser(description='Archive new and modified photos.')
+    parser.add_argument('--config', default='config.ini', help='Configuration file (default: config.ini)')
+    parser.add_argument('--plan', action='store_true',
+                        help='Estimate output size, volumes and duration without writing an archive')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    print("Configuration loaded successfully.")
+    report_file = config.get('Report', 'file', fallback='').strip()
+    jobs = load_jobs(config)
+    if args.plan:
+        plans = [plan_job(job.config, report_file) for job in jobs] if jobs else [plan_job(config, report_file)]
+        if len(plans) > 1:
+            print(f"All {len(plans)} jobs: {sum(plan['bytes_out'] for plan in plans) / 1e9:.2f} GB out in "
+                  f"{sum(plan['volumes'] for plan in plans)} volume(s); about "
+                  f"{sum(plan['seconds'] for plan in plans) / 3600:.1f}h one after another.")
+        return
+    if jobs:
+        if not _run_jobs(config, jobs, report_file):
+            sys.exit(1)
+        return
+
+    outcome, metrics, fields = run_job(config)
+    _finish_run(metrics, report_file, **fields)
+    if outcome == 'unchanged':
+        sys.exit(0)
+    if outcome == 'failed':
         sys.exit(1)
 
 
@@ -0,0 +1,135 @@
+import json
+import os
+from pathlib import Path
+
+
+MANIFEST_FORMAT = 1
+MANIFEST_SUFFIX = '.manifest.jsonl'
+
+
+class ManifestWriter:
+    """
+    Writes an archive manifest as JSON Lines.
+
+    The manifest maps every archived file to the volume holding it. Records
+    are streamed to a temporary file and only renamed into place by
+    ``commit()``, so a manifest on disk always describes a complete archive.
+    Until then the temporary file is the journal of the run (see checkpoint).
+    """
+
+    def __init__(self, path, resume_offset=None, **header):
+        """
+        Args:
+            path: Final path of the manifest
+            resume_offset: Continue the existing temporary file of an
+                interrupted run, cut back to this byte offset, instead of
+                starting a new one
+            **header: Fields stored in the leading 'archive' record
+        """
+        self.path = Path(path)
+        self._tmp_path = self.path.with_name(self.path.name + '.tmp')
+        if resume_offset is not None:
+            os.truncate(self._tmp_path, resume_offset)
+            self._file = open(self._tmp_path, 'a', encoding='utf-8')
+        else:
+            self._file = open(self._tmp_path, 'w', encoding='utf-8')
+            self._write({'type': 'archive', 'format': MANIFEST_FORMAT, **header})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        self._file.write('\n')
+
+    def add_volume(self, index, name, **fields):
+        """Records a completed volume."""
+        self._write({'type': 'volume', 'index': index, 'name': name, **fields})
+
+    def add_file(self, path, volume, **fields):
+        """Records that a file (by relative path) was written to a volume."""
+        self._write({'type': 'file', 'path': path, 'volume': volume, **fields})
+
+    def add_reference(self, path, target_path, target_archive_id, reason):
+        """Records a file that was not archived because its content is stored under another path."""
+        self._write({'type': 'ref', 'path': path, 'target': target_path,
+                     'target_archive': target_archive_id, 'reason': reason})
+
+    def add_tombstone(self, path):
+        """Records that a file (by relative path) was deleted from the source."""
+        self._write({'type': 'tombstone', 'path': path})
+
+    def checkpoint(self):
+        """Forces the records written so far to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def commit(self):
+        """Flushes the manifest to disk and moves it into place."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def close(self):
+        """Closes the temporary file, keeping it as the journal for a later resume."""
+        self._file.close()
+
+    def discard(self):
+        """Abandons the manifest."""
+        self._file.close()
+        if self._tmp_path.exists():
+            self._tmp_path.unlink()
+
+
+class Manifest:
+    """
+    A loaded manifest: header fields, volumes by index, files by path,
+    references (deduplicated files) by path and the set of deleted paths
+    (tombstones).
+    """
+
+    def __init__(self, header, volumes, files, references=None, tombstones=None):
+        self.header = header
+        self.volumes = volumes
+        self.files = files
+        self.references = references or {}
+        self.tombstones = tombstones or set()
+
+    def files_in_volume(self, index):
+        """Returns the file records stored in one volume, in archive order."""
+        return [record for record in self.files.values() if record['volume'] == index]
+
+
+def load_manifest(path):
+    """
+    Loads a manifest written by ManifestWriter.
+
+    Args:
+        path: Path to the manifest file
+
+    Returns:
+        Manifest object
+
+    Raises:
+        ValueError: If the file is not a supported manifest
+    """
+    header = None
+    volumes = {}
+    files = {}
+    references = {}
+    tombstones = set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            record_type = record.pop('type')
+            if record_type == 'archive':
+                header = record
+            elif record_type == 'volume':
+                volumes[record['index']] = record
+            elif record_type == 'file':
+                files[record['path']] = record
+            elif record_type == 'ref':
+                references[record['path']] = record
+            elif record_type == 'tombstone':
+                tombstones.add(record['path'])
+    if header is None or header.get('format') != MANIFEST_FORMAT:
+        raise ValueError(f"'{path}' is not a supported archive manifest")
+    return Manifest(header, volumes, files, references, tombstones)
@@ -0,0 +1,187 @@
+import datetime
+import json
+import os
+import time
+from pathlib import Path
+
+
+# Seconds between progress lines of a running phase.
+DEFAULT_PROGRESS_INTERVAL = 30.0
+
+
+class Phase:
+    """
+    Wall time and throughput counters of one phase of a run (scan, archive, ...).
+
+    ``advance()`` is cheap enough to call once per file; while the phase runs
+    it prints a progress line every ``progress_interval`` seconds.
+    """
+
+    def __init__(self, name, progress_interval=DEFAULT_PROGRESS_INTERVAL, total_bytes=None):
+        """
+        Args:
+            name: Phase name, used in progress lines and the report
+            progress_interval: Seconds between progress lines; None or 0 disables them
+            total_bytes: Optional number of input bytes the phase will process,
+                used to show a percentage
+        """
+        self.name = name
+        self.progress_interval = progress_interval
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.notes = {}
+        self._started = None
+        self._elapsed = 0.0
+        self._last_progress = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._started = time.monotonic()
+        self._last_progress = self._started
+        return self
+
+    def stop(self):
+        if self._started is not None:
+            self._elapsed += time.monotonic() - self._started
+            self._started = None
+
+    @property
+    def seconds(self):
+        """Wall time spent in the phase so far."""
+        if self._started is None:
+            return self._elapsed
+        return self._elapsed + time.monotonic() - self._started
+
+    def advance(self, files=0, bytes_in=0, bytes_out=0):
+        """Adds to the counters and prints a progress line when one is due."""
+        self.files += files
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        if self.progress_interval and self._started is not None:
+            now = time.monotonic()
+            if now - self._last_progress >= self.progress_interval:
+                self._last_progress = now
+                print(self.progress_line())
+
+    def note(self, **values):
+        """Records extra figures (e.g. number of changed files) for the report."""
+        self.notes.update(values)
+
+    def progress_line(self):
+        seconds = self.seconds
+        line = f"[{self.name}] {self.files} files, {self.bytes_in / 1e6:.1f} MB"
+        if self.total_bytes:
+            line += f" ({100.0 * self.bytes_in / self.total_bytes:.0f}%)"
+        return line + f", {_rate(self.files, seconds):.0f} files/s, {_rate(self.bytes_in, seconds) / 1e6:.1f} MB/s"
+
+    def summary(self):
+        """Returns the phase figures as a dictionary for the run report."""
+        seconds = self.seconds
+        return {
+            'name': self.name,
+            'seconds': round(seconds, 3),
+            'files': self.files,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'files_per_second': round(_rate(self.files, seconds), 1),
+            'mb_per_second': round(_rate(self.bytes_in, seconds) / 1e6, 2),
+            'ratio': round(self.bytes_out / self.bytes_in, 4) if self.bytes_in and self.bytes_out else None,
+            **self.notes,
+        }
+
+
+def _rate(amount, seconds):
+    return amount / seconds if seconds > 0 else 0.0
+
+
+class RunMetrics:
+    """The phases of one archiver run, in the order they were started."""
+
+    def __init__(self, progress_interval=DEFAULT_PROGRESS_INTERVAL):
+        self.progress_interval = progress_interval
+        self.phases = []
+        self.started_at = datetime.datetime.now()
+        self._started = time.monotonic()
+
+    def phase(self, name, total_bytes=None):
+        """Creates and starts a phase; use it as a context manager to stop it."""
+        phase = Phase(name, self.progress_interval, total_bytes)
+        self.phases.append(phase)
+        return phase.start()
+
+    def report(self, **fields):
+        """
+        Builds the run report.
+
+        Args:
+            **fields: Extra top-level fields (archive id, outcome, settings)
+
+        Returns:
+            Dictionary ready to be serialized as JSON
+        """
+        return {
+            'started': self.started_at.isoformat(timespec='seconds'),
+            'seconds': round(time.monotonic() - self._started, 3),
+            **fields,
+            'phases': [phase.summary() for phase in self.phases],
+        }
+
+    def format(self):
+        """Returns the phase timings as printable lines."""
+        lines = [f"{'phase':<10} {'seconds':>9} {'files':>9} {'files/s':>9} {'in MB':>10} {'MB/s':>8} {'ratio':>6}"]
+        for phase in self.phases:
+            summary = phase.summary()
+            ratio = f"{summary['ratio']:.3f}" if summary['ratio'] is not None else '-'
+            lines.append(
+                f"{phase.name:<10} {summary['seconds']:>9.2f} {phase.files:>9} {summary['files_per_second']:>9.0f} "
+                f"{phase.bytes_in / 1e6:>10.1f} {summary['mb_per_second']:>8.1f} {ratio:>6}"
+            )
+        return lines
+
+
+def write_report(path, report):
+    """
+    Appends a run report to a JSON Lines history file, one run per line.
+
+    Args:
+        path: Path of the history file (created with its directory if missing)
+        report: Dictionary from RunMetrics.report()
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(report, ensure_ascii=False, separators=(',', ':')))
+        f.write('\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_reports(path):
+    """
+    Loads the run reports written by write_report.
+
+    Args:
+        path: Path of the history file
+
+    Returns:
+        List of report dictionaries, oldest first; empty if the file does not exist.
+        Lines that cannot be parsed are skipped.
+    """
+    reports = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    reports.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return reports
@@ -0,0 +1,124 @@
+"""
+Include and exclude rules deciding which files of the source are archived.
+
+Rules are compiled once into a few regular expressions and applied by the
+scanner to directory entries before anything is stat'ed, so an excluded
+directory (Synology's ``@eaDir`` thumbnails, ``#recycle``) is never even
+listed. A rule is one of:
+
+- a glob without '/', matched against the name of every file and
+  directory (``@eaDir``, ``*.tmp``, ``.DS_Store``);
+- a glob with '/', matched against the whole relative path, where '*'
+  also matches '/' (``album/2019/*.mov``);
+- ``re:`` followed by a regular expression searched in the relative path.
+
+Exclude rules apply to files and directories; include rules, when given,
+only to files: a file must match one of them to be archived.
+"""
+import fnmatch
+import hashlib
+import re
+import sys
+
+
+REGEX_PREFIX = 're:'
+
+
+def parse_patterns(value):
+    """Splits a configuration value into patterns (separated by commas or newlines)."""
+    return [pattern.strip() for pattern in re.split(r'[,\n]', value or '') if pattern.strip()]
+
+
+class _Rules:
+    """A compiled set of name globs, path globs and regular expressions."""
+
+    def __init__(self, patterns):
+        names, paths, regexes = [], [], []
+        for pattern in patterns:
+            if pattern.startswith(REGEX_PREFIX):
+                regexes.append(f"(?:{pattern[len(REGEX_PREFIX):]})")
+            elif '/' in pattern:
+                paths.append(fnmatch.translate(pattern.strip('/')))
+            else:
+                names.append(fnmatch.translate(pattern))
+        self._names = re.compile('|'.join(names)) if names else None
+        self._paths = re.compile('|'.join(paths)) if paths else None
+        self._regex = re.compile('|'.join(regexes)) if regexes else None
+
+    def __bool__(self):
+        return any(rule is not None for rule in (self._names, self._paths, self._regex))
+
+    def match(self, relative_path, name):
+        return ((self._names is not None and self._names.match(name) is not None)
+                or (self._paths is not None and self._paths.match(relative_path) is not None)
+                or (self._regex is not None and self._regex.search(relative_path) is not None))
+
+
+class PathFilter:
+    """
+    Compiled include and exclude rules.
+
+    ``fingerprint`` identifies the rules, so a run can tell that they
+    changed since the previous one.
+    """
+
+    def __init__(self, exclude=(), include=()):
+        """
+        Args:
+            exclude: Patterns of files and directories to leave out
+            include: Patterns of files to archive; empty archives every file
+
+        Raises:
+            ValueError: If a regular expression is invalid
+        """
+        try:
+            self._exclude = _Rules(exclude)
+            self._include = _Rules(include)
+        except re.error as e:
+            raise ValueError(f"invalid pattern: {e}") from e
+        self._includes_only = bool(self._include)
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(repr((sorted(exclude), sorted(include))).encode('utf-8'))
+        self.fingerprint = digest.hexdigest()
+
+    def __bool__(self):
+        return bool(self._exclude) or bool(self._include)
+
+    def skips_directory(self, relative_path, name):
+        """True if a directory (and everything below it) is left out."""
+        return self._exclude.match(relative_path, name)
+
+    def skips_file(self, relative_path, name):
+        """True if a file is left out (its directories are not checked)."""
+        if self._exclude.match(relative_path, name):
+            return True
+        return self._includes_only and not self._include.match(relative_path, name)
+
+    def skips(self, relative_path, directory=False):
+        """True if a file (or directory) is left out, by its own rules or those of a directory it is in."""
+        parts = relative_path.split('/')
+        for depth in range(1, len(parts)):
+            if self.skips_directory('/'.join(parts[:depth]), parts[depth - 1]):
+                return True
+        if directory:
+            return self.skips_directory(relative_path, parts[-1])
+        return self.skips_file(relative_path, parts[-1])
+
+
+# Filter that archives everything.
+NO_FILTER = PathFilter()
+
+
+def load_path_filter(config):
+    """
+    Reads the [Scan] exclude and include rules of the configuration.
+
+    Raises:
+        SystemExit: If a rule is invalid
+    """
+    try:
+        return PathFilter(parse_patterns(config.get('Scan', 'exclude', fallback='')),
+                          parse_patterns(config.get('Scan', 'include', fallback='')))
+    except ValueError as e:
+        print(f"Error: Invalid [Scan] rule: {e}")
+        sys.exit(1)
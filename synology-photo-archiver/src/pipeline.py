@@ -0,0 +1,119 @@
+import queue
+import threading
+
+
+# Items buffered between the scanner thread and the archiver. When the
+# archiver falls behind the scanner blocks, so memory stays bounded however
+# large the library is.
+SCAN_QUEUE_SIZE = 4096
+
+_DONE = object()
+
+
+class _Failure:
+    """Carries an exception (including SystemExit) from the producer thread."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, maxsize=SCAN_QUEUE_SIZE):
+    """
+    Runs an iterator on a background thread, up to ``maxsize`` items ahead.
+
+    Lets a producer (the directory walk) run while the consumer (the
+    archiver) works, with backpressure through a bounded queue. Exceptions
+    raised by the producer are re-raised in the consumer. Abandoning the
+    returned generator stops the producer.
+
+    Args:
+        iterable: Iterable to consume on the background thread
+        maxsize: Maximum number of items buffered
+
+    Yields:
+        The items of iterable, in order
+    """
+    buffer = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:  # Forwarded to the consumer, even SystemExit
+            put(_Failure(e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def peek(iterator):
+    """
+    Returns the first item of an iterator without losing it.
+
+    Returns:
+        Tuple of (first item or None if empty, iterator over all items)
+    """
+    iterator = iter(iterator)
+    for first in iterator:
+        return first, _chain_first(first, iterator)
+    return None, iter(())
+
+
+def _chain_first(first, iterator):
+    yield first
+    yield from iterator
+
+
+def tee_batches(iterable, sink, batch_size):
+    """
+    Passes items through while handing them to ``sink`` in lists of ``batch_size``.
+
+    The last, partial batch is handed over once the iterable is exhausted,
+    so every item has reached the sink when the generator finishes.
+
+    Yields:
+        The items of iterable, in order
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            sink(batch)
+            batch = []
+        yield item
+    if batch:
+        sink(batch)
+
+
+def drain(iterable):
+    """Consumes whatever is left of an iterable."""
+    for _ in iterable:
+        pass
@@ -0,0 +1,290 @@
+"""
+Estimates what an archive run would write and how long it would take, without writing it.
+
+The estimate starts from the files a scan found:
+
+- output size: the files of every type (extension) are sampled at random,
+  the start of each sampled file is compressed with the configured codec
+  (or stored, where the compressibility policy would store it), and the
+  type's compression ratio is the ratio estimate over the sample, with a
+  95% confidence interval. Types that are always stored are not read;
+- volumes: the files are bin-packed exactly as the archiver would (with
+  cached capture dates, or modification times, when partitioned);
+- duration: the archive throughput (MB/s) of recent runs with the same
+  codec in the run reports, or, without history, the compression speed
+  measured on the sample and an assumed disk speed.
+
+Scanning is the only work that touches every file, and it is the fast part.
+"""
+import datetime
+import json
+import math
+import os
+import random
+import statistics
+import time
+from pathlib import Path
+
+from .compressibility import INCOMPRESSIBLE_EXTENSIONS
+from .volumes import TAR_MEMBER_OVERHEAD, iter_partitioned_volumes, iter_volumes
+
+
+# Files sampled per type, and bytes compressed from the start of each.
+SAMPLE_FILES_PER_TYPE = 20
+SAMPLE_BYTES = 1024 * 1024
+
+# Archive phases of previous runs used for the throughput, most recent first;
+# smaller ones are mostly fixed costs and would understate it.
+HISTORY_RUNS = 10
+MIN_HISTORY_BYTES = 64 * 1024 * 1024
+
+# Read speed assumed without history: one spinning disk, reading sequentially.
+ASSUMED_DISK_BYTES_PER_SECOND = 100 * 1000 * 1000
+
+# Two-sided 95% normal quantile for the confidence interval.
+_Z95 = 1.96
+
+
+class TypeEstimate:
+    """Sizes of the files of one type and what the sample says about their compression."""
+
+    def __init__(self, extension):
+        self.extension = extension
+        self.files = 0
+        self.bytes_in = 0
+        self.sampled = 0
+        self.ratio = 1.0
+        self.ratio_error = 0.0  # Standard error of the ratio
+        self.compressed_bytes = 0  # Sample bytes that went through the compressor
+        self.cpu_seconds = 0.0
+
+    @property
+    def bytes_out(self):
+        return round(self.bytes_in * self.ratio)
+
+    def summary(self):
+        return {
+            'extension': self.extension, 'files': self.files, 'bytes_in': self.bytes_in, 'sampled': self.sampled,
+            'ratio': round(self.ratio, 4), 'ratio_error': round(self.ratio_error, 4), 'bytes_out': self.bytes_out,
+        }
+
+
+def _sample_ratio(path, key, codec, policy):
+    """
+    Compresses the start of a file.
+
+    Returns:
+        (compressed/raw ratio, raw bytes compressed, CPU seconds), or None if
+        the file cannot be read any more
+    """
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            chunk = f.read(SAMPLE_BYTES)
+    except OSError:
+        return None
+    if not chunk:
+        return 1.0, 0, 0.0
+    if codec.name == 'store' or (policy is not None and not policy.should_compress(key, st, chunk)):
+        return 1.0, 0, 0.0
+    started = time.thread_time()
+    compressor = codec.compressor()
+    size = len(compressor.compress(chunk)) + len(compressor.flush())
+    return size / len(chunk), len(chunk), time.thread_time() - started
+
+
+def estimate_types(files, source_dir, codec, policy=None, seed=0):
+    """
+    Estimates the compressed size of every type of file by sampling.
+
+    Args:
+        files: List of (relative path, FileRecord) tuples
+        source_dir: Source directory the paths are relative to
+        codec: codec.Codec the archive would use
+        policy: Optional CompressibilityPolicy; without one every file is compressed
+        seed: Seed of the random sample, so a plan can be repeated
+
+    Returns:
+        List of TypeEstimate objects, largest input first
+    """
+    rng = random.Random(seed)
+    by_type = {}
+    for relative_path, record in files:
+        extension = os.path.splitext(relative_path)[1].lower()
+        by_type.setdefault(extension, []).append((relative_path, record.size))
+
+    estimates = []
+    for extension, members in by_type.items():
+        estimate = TypeEstimate(extension or '(none)')
+        estimate.files = len(members)
+        estimate.bytes_in = sum(size + TAR_MEMBER_OVERHEAD for _, size in members)
+        estimates.append(estimate)
+        if codec.name == 'store' or (policy is not None and extension in INCOMPRESSIBLE_EXTENSIONS):
+            continue  # Always stored: nothing to learn from reading them
+        sizes, outputs = [], []
+        for relative_path, size in rng.sample(members, min(len(members), SAMPLE_FILES_PER_TYPE)):
+            sampled = _sample_ratio(Path(source_dir) / relative_path, relative_path, codec, policy)
+            if sampled is None:
+                continue
+            ratio, compressed_bytes, cpu_seconds = sampled
+            sizes.append(size + TAR_MEMBER_OVERHEAD)
+            outputs.append(size * ratio + TAR_MEMBER_OVERHEAD)  # Headers are mostly zeros; a bound
+            estimate.compressed_bytes += compressed_bytes
+            estimate.cpu_seconds += cpu_seconds
+        estimate.sampled = len(sizes)
+        if not sizes or not sum(sizes):
+            continue
+        # Ratio estimator: larger files weigh more, as they do in the output.
+        estimate.ratio = sum(outputs) / sum(sizes)
+        n = len(sizes)
+        if 1 < n < estimate.files:
+            residuals = sum((y - estimate.ratio * x) ** 2 for x, y in zip(sizes, outputs)) / (n - 1)
+            mean_size = sum(sizes) / n
+            estimate.ratio_error = math.sqrt((1 - n / estimate.files) * residuals / n) / mean_size
+    return sorted(estimates, key=lambda estimate: -estimate.bytes_in)
+
+
+def estimate_volumes(files, volume_bytes, partition=None):
+    """
+    Packs files into volumes as the archiver would.
+
+    Args:
+        files: List of (relative path, FileRecord) tuples
+        volume_bytes: Target volume size in bytes; 0 for a single archive
+        partition: Optional capture_date.CaptureDates; files are bucketed by
+            their cached capture date, or their modification time (no file is read)
+
+    Returns:
+        Tuple of (volumes, oversized volumes)
+    """
+    if partition is not None:
+        volumes = list(iter_partitioned_volumes(
+            ((path, record.size, partition.bucket(partition.cached_date(path, record.size, record.mtime_ns),
+                                                  record.mtime_ns))
+             for path, record in files), volume_bytes))
+    elif volume_bytes > 0:
+        volumes = list(iter_volumes(((path, record.size) for path, record in files), volume_bytes))
+    else:
+        return (1 if files else 0), 0
+    return len(volumes), sum(volume.oversized for volume in volumes)
+
+
+def archive_rate(reports, codec_name):
+    """
+    Returns the median archive throughput of recent runs with a codec.
+
+    Args:
+        reports: Run reports (see metrics.load_reports), oldest first; the
+            reports of multi-job runs are searched too
+        codec_name: Codec the runs must have used
+
+    Returns:
+        Tuple of (bytes per second or None, number of runs it is based on)
+    """
+    runs = []
+    for report in reports:
+        for run in [report, *report.get('jobs', ())]:
+            if str(run.get('codec', '')).strip().lower() != codec_name:  # Older reports kept the setting as written
+                continue
+            for phase in run.get('phases', ()):
+                if phase['name'] == 'archive' and phase['bytes_in'] >= MIN_HISTORY_BYTES and phase['seconds'] > 0:
+                    runs.append(phase['bytes_in'] / phase['seconds'])
+    runs = runs[-HISTORY_RUNS:]
+    if not runs:
+        return None, 0
+    return statistics.median(runs), len(runs)
+
+
+def make_plan(files, source_dir, codec, volume_bytes, policy=None, partition=None, reports=(), workers=1,
+              scan_seconds=0.0, **fields):
+    """
+    Estimates an archive of the given files.
+
+    Args:
+        files: List of (relative path, FileRecord) tuples the run would archive
+        source_dir: Source directory the paths are relative to
+        codec: codec.Codec the archive would use
+        volume_bytes: Target volume size in bytes; 0 for a single archive
+        policy: Optional CompressibilityPolicy deciding what would be stored
+        partition: Optional capture_date.CaptureDates the volumes are partitioned by
+        reports: Run reports of previous runs, oldest first
+        workers: Compression threads of the archive
+        scan_seconds: Time the scan took, included in the total
+        **fields: Extra fields for the plan (source, kind, settings)
+
+    Returns:
+        Plan dictionary, ready to be printed with format_plan or saved as JSON
+    """
+    types = estimate_types(files, source_dir, codec, policy)
+    bytes_in = sum(estimate.bytes_in for estimate in types)
+    bytes_out = sum(estimate.bytes_out for estimate in types)
+    margin = _Z95 * math.sqrt(sum((estimate.ratio_error * estimate.bytes_in) ** 2 for estimate in types))
+    volumes, oversized = estimate_volumes(files, volume_bytes, partition)
+
+    rate, history_runs = archive_rate(reports, codec.name)
+    if rate is not None:
+        archive_seconds = bytes_in / rate
+        basis = 'history'
+    else:
+        # Compression and reading overlap; whichever is slower sets the pace.
+        compressed_in = sum(estimate.compressed_bytes for estimate in types)
+        cpu_seconds = sum(estimate.cpu_seconds for estimate in types)
+        compressible = sum(estimate.bytes_in for estimate in types if estimate.compressed_bytes)
+        cpu_total = compressible * cpu_seconds / compressed_in / max(1, workers) if compressed_in else 0.0
+        archive_seconds = max(cpu_total, bytes_in / ASSUMED_DISK_BYTES_PER_SECOND)
+        basis = 'sample'
+    seconds = scan_seconds + archive_seconds
+    planned = datetime.datetime.now()
+    return {
+        'planned': planned.isoformat(timespec='seconds'),
+        **fields,
+        'codec': codec.name,
+        'files': len(files),
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'bytes_out_low': max(0, round(bytes_out - margin)),
+        'bytes_out_high': round(bytes_out + margin),
+        'volumes': volumes,
+        'oversized_volumes': oversized,
+        'scan_seconds': round(scan_seconds, 3),
+        'archive_seconds': round(archive_seconds, 3),
+        'seconds': round(seconds, 3),
+        'finishes': (planned + datetime.timedelta(seconds=seconds)).isoformat(timespec='minutes'),
+        'throughput_basis': basis,
+        'history_runs': history_runs,
+        'types': [estimate.summary() for estimate in types],
+    }
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def format_plan(plan):
+    """Returns a plan as printable lines."""
+    lines = [f"{'type':<8} {'files':>8} {'in MB':>10} {'sampled':>8} {'ratio':>12} {'out MB':>10}"]
+    for row in plan['types']:
+        ratio = f"{row['ratio']:.3f}" + (f"±{_Z95 * row['ratio_error']:.3f}" if row['ratio_error'] else '')
+        lines.append(f"{row['extension']:<8} {row['files']:>8} {row['bytes_in'] / 1e6:>10.1f} {row['sampled']:>8} "
+                     f"{ratio:>12} {row['bytes_out'] / 1e6:>10.1f}")
+    lines.append(f"Plan: {plan['files']} files, {plan['bytes_in'] / 1e9:.2f} GB in; about "
+                 f"{plan['bytes_out'] / 1e9:.2f} GB out ({plan['bytes_out_low'] / 1e9:.2f}-"
+                 f"{plan['bytes_out_high'] / 1e9:.2f} GB) in {plan['volumes']} volume(s), "
+                 f"{plan['oversized_volumes']} oversized.")
+    if plan['throughput_basis'] == 'history':
+        basis = f"the archive throughput of the last {plan['history_runs']} {plan['codec']} run(s)"
+    else:
+        basis = "the sample's compression speed and an assumed disk speed (no run history yet)"
+    lines.append(f"Estimated duration: {_duration(plan['seconds'])} (scan {_duration(plan['scan_seconds'])}, "
+                 f"archive {_duration(plan['archive_seconds'])}), based on {basis}; "
+                 f"if started now, done around {plan['finishes'].replace('T', ' ')}.")
+    return lines
+
+
+def save_plan(path, plan):
+    """Writes a plan as JSON, replacing an earlier plan."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(plan, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
@@ -0,0 +1,504 @@
+"""
+Restores single files or globs from an archive without decoding whole volumes.
+
+    python3 -m src.restore --target /volume1/restore 'album/2023/*.jpg' [more patterns]
+
+The manifest written with the archive records the uncompressed offset of
+every member and, per volume, the points where a compressed member starts.
+A member is read by seeking to the last such point before it, so the work
+done is proportional to the requested bytes, not to their place in the set.
+
+With an archive chain, files come from the generation holding their latest
+content; ``--as-of <archive id>`` restores the library as it was then.
+
+``--taken 2023`` or ``--taken 2023-07`` selects the photos taken then (by
+their capture date, or the partition of their volume where none was read);
+with a partitioned archive only that period's volumes are read.
+"""
+import argparse
+import bisect
+import fnmatch
+import os
+import re
+import sys
+import tarfile
+from pathlib import Path
+
+from .chain import ChainView, load_chain
+from .codec import DECODE_ERRORS, get_codec
+from .compression import CHECKSUM_ALGORITHMS, SEEK_POINT_INTERVAL
+from .config import load_config
+from .encryption import configured_password, open_key
+from .jobs import select_job
+from .manifest import MANIFEST_SUFFIX, load_manifest
+from .metrics import Phase
+
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Headers that precede the header of the member they describe.
+_EXTENSION_HEADERS = (tarfile.XHDTYPE, tarfile.XGLTYPE, tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK)
+
+# Largest size the plain ustar size field holds; bigger sizes live in the PAX header.
+_USTAR_MAX_SIZE = 8 ** 11 - 1
+
+
+class VolumeReader:
+    """
+    Reads the uncompressed tar stream of one volume, starting at any offset.
+
+    Seeking goes to the last seek point at or before the offset and decodes
+    forward from there; moving forward within reach of the current position
+    just keeps decoding, so members read in archive order never re-decode.
+    """
+
+    def __init__(self, path, codec, seek_points=None, digest=None, key=None):
+        """
+        Args:
+            path: Path of the volume
+            codec: Codec object the volume was written with
+            seek_points: [uncompressed offset, compressed offset] pairs from
+                the manifest; None or empty means decoding from the start
+                (or, for the store codec, that every offset is a seek point)
+            digest: Optional hash object updated with the bytes read from
+                disk; meaningful when the volume is read once from the start
+            key: encryption.ArchiveKey of an encrypted volume; offsets (and
+                seek points) then refer to the decrypted stream
+        """
+        if key is not None:
+            self._file = key.open_volume(path, digest)
+            digest = None  # Hashed by the decrypting file, which sees the encrypted bytes
+        else:
+            self._file = open(path, 'rb')
+        self._digest = digest
+        self._codec = codec
+        points = seek_points or [[0, 0]]
+        self._uncompressed = [point[0] for point in points]
+        self._compressed = [point[1] for point in points]
+        self._decompressor = None
+        self._buffer = bytearray()
+        self.position = None  # Uncompressed offset of the next byte read
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _start(self, uncompressed, compressed):
+        self._file.seek(compressed)
+        self._decompressor = self._codec.decompressor()
+        self._buffer.clear()
+        self.position = uncompressed
+
+    def seek(self, offset):
+        """Positions the reader at an uncompressed offset."""
+        if self._codec.name == 'store':
+            # Any offset is a seek point; short gaps are cheaper to read through.
+            if self.position is None or not self.position <= offset < self.position + SEEK_POINT_INTERVAL:
+                self._start(offset, offset)
+            self.skip(offset - self.position)
+            return
+        i = bisect.bisect_right(self._uncompressed, offset) - 1
+        point = self._uncompressed[i]
+        # Restart only if that gets us closer than where we already are.
+        if self.position is None or offset < self.position or point > self.position:
+            self._start(point, self._compressed[i])
+        self.skip(offset - self.position)
+
+    def _decode_more(self):
+        data = self._file.read(READ_CHUNK_SIZE)
+        if not data:
+            return False
+        if self._digest is not None:
+            self._digest.update(data)
+        while data:
+            self._buffer += self._decompressor.decompress(data)
+            if self._decompressor.eof:
+                # Next member of the concatenation.
+                data = self._decompressor.unused_data
+                self._decompressor = self._codec.decompressor()
+            else:
+                data = b''
+        return True
+
+    def read(self, size):
+        """Reads up to size bytes; fewer only at the end of the volume."""
+        while len(self._buffer) < size and self._decode_more():
+            pass
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.position += len(data)
+        return data
+
+    def drain(self):
+        """Decodes the rest of the volume; returns the number of uncompressed bytes."""
+        if self.position is None:
+            self.seek(0)  # Nothing read yet, e.g. a volume without members
+        drained = 0
+        while True:
+            data = self.read(READ_CHUNK_SIZE)
+            if not data:
+                return drained
+            drained += len(data)
+
+    def skip(self, size):
+        """Reads and drops size bytes."""
+        while size > 0:
+            data = self.read(min(size, READ_CHUNK_SIZE))
+            if not data:
+                raise EOFError('unexpected end of volume')
+            size -= len(data)
+
+
+def _read_member_header(reader, record):
+    """Reads the headers of a member; leaves the reader at the start of its data."""
+    while True:
+        block = reader.read(tarfile.BLOCKSIZE)
+        info = tarfile.TarInfo.frombuf(block, 'utf-8', 'surrogateescape')
+        if info.type not in _EXTENSION_HEADERS:
+            break
+        reader.skip(-(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE)
+    if not info.isreg() or (record['size'] <= _USTAR_MAX_SIZE and info.size != record['size']):
+        raise ValueError(f"member at offset {record['offset']} does not match the manifest")
+    return info
+
+
+def read_member(reader, record):
+    """
+    Positions a reader at a member and checks its headers.
+
+    Args:
+        reader: VolumeReader of the volume holding the member
+        record: The member's file record from the manifest
+
+    Returns:
+        Tuple of (tarfile.TarInfo, iterator over the member's data in chunks)
+
+    Raises:
+        ValueError: If the archive does not match the manifest
+        EOFError: If the volume is truncated
+    """
+    reader.seek(record['offset'])
+    info = _read_member_header(reader, record)
+
+    def chunks():
+        remaining = record['size']
+        while remaining:
+            data = reader.read(min(remaining, READ_CHUNK_SIZE))
+            if not data:
+                raise EOFError('unexpected end of volume')
+            remaining -= len(data)
+            yield data
+
+    return info, chunks()
+
+
+def restore_member(reader, record, target_path, checksum=None):
+    """
+    Extracts one member to a file.
+
+    Args:
+        reader: VolumeReader of the volume holding the member
+        record: The member's file record from the manifest
+        target_path: Path to write the file to (parent directories are created)
+        checksum: Checksum algorithm of the manifest, to check the restored content
+
+    Returns:
+        Number of bytes restored
+
+    Raises:
+        ValueError: If the archive does not match the manifest or the checksum differs
+        EOFError: If the volume is truncated
+    """
+    info, chunks = read_member(reader, record)
+    digest = CHECKSUM_ALGORITHMS[checksum]() if checksum and record.get('checksum') else None
+    target_path = Path(target_path)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target_path.with_name(target_path.name + '.part')
+    try:
+        with open(tmp_path, 'wb') as f:
+            for data in chunks:
+                f.write(data)
+                if digest is not None:
+                    digest.update(data)
+        if digest is not None and digest.hexdigest() != record['checksum']:
+            raise ValueError(f"checksum mismatch for '{record['path']}'")
+        os.chmod(tmp_path, info.mode)
+        mtime_ns = record.get('mtime_ns', info.mtime * 10 ** 9)
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return record['size']
+
+
+def _restore_sequentially(volume_path, records, target_dir):
+    """Fallback for manifests written without member offsets: streams the volume with tarfile."""
+    wanted = {record['member']: record for record in records}
+    restored = 0
+    with tarfile.open(volume_path) as tar:
+        for info in tar:
+            record = wanted.pop(info.name, None)
+            if record is None:
+                continue
+            target_path = Path(target_dir) / record['path']
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            with tar.extractfile(info) as source, open(target_path, 'wb') as f:
+                while True:
+                    data = source.read(READ_CHUNK_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+            restored += record['size']
+            if not wanted:
+                break
+    if wanted:
+        raise ValueError(f"{len(wanted)} member(s) not found in '{volume_path}'")
+    return restored
+
+
+_TAKEN = re.compile(r'\d{4}(-\d{2}(-\d{2})?)?')
+
+
+def taken_matches(manifest, record, taken):
+    """
+    True if a file was taken in a period.
+
+    Args:
+        manifest: Manifest holding the record
+        record: File record
+        taken: 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD'; None matches every file
+    """
+    if not taken:
+        return True
+    date = record.get('taken') or manifest.volumes.get(record['volume'], {}).get('bucket') or ''
+    return date.startswith(taken)
+
+
+def select_files(manifest, patterns, taken=None):
+    """
+    Returns the manifest's file records matching any of the patterns.
+
+    Patterns are shell globs matched against relative paths ('*' also
+    matches '/'); a pattern naming a directory selects everything below it.
+    Deduplicated files are resolved to the record holding their content.
+    With taken, only files taken in that period are selected (see taken_matches).
+
+    Returns:
+        Tuple of (list of (relative path, record) sorted by volume and offset,
+        list of deduplicated paths whose content lives in another archive)
+    """
+    selected = {}
+    elsewhere = []
+    candidates = list(manifest.files) + list(manifest.references)
+    for path in candidates:
+        if not any(fnmatch.fnmatchcase(path, pattern) or path.startswith(pattern.rstrip('/') + '/')
+                   for pattern in patterns):
+            continue
+        record = manifest.files.get(path)
+        if record is None:
+            reference = manifest.references[path]
+            record = manifest.files.get(reference['target'])
+            if record is None or reference.get('target_archive') not in (None, manifest.header.get('archive_id')):
+                elsewhere.append(path)
+                continue
+        if not taken_matches(manifest, record, taken):
+            continue
+        selected[path] = record
+    ordered = sorted(selected.items(), key=lambda item: (item[1]['volume'], item[1].get('offset', 0)))
+    return ordered, elsewhere
+
+
+def restore(manifest_path, patterns, target_dir, overwrite=False, phase=None, password=None, taken=None):
+    """
+    Restores the files matching patterns from an archive.
+
+    Args:
+        manifest_path: Path of the archive's manifest; volumes are expected next to it
+        patterns: Shell globs of relative paths to restore
+        target_dir: Directory the files are restored into, under their relative paths
+        overwrite: Replace files that already exist in target_dir
+        phase: Optional metrics.Phase advanced for every file restored
+        password: Password of an encrypted archive
+        taken: Optional period ('YYYY', 'YYYY-MM' or 'YYYY-MM-DD') the files were taken in
+
+    Returns:
+        Tuple of (files restored, files that failed)
+
+    Raises:
+        ValueError: If the manifest is not supported, or the archive is
+            encrypted and the password is missing or wrong
+    """
+    manifest_path = Path(manifest_path)
+    manifest = load_manifest(manifest_path)
+    key = open_key(manifest.header, password)
+    selected, elsewhere = select_files(manifest, patterns, taken)
+    for path in elsewhere:
+        print(f"Warning: '{path}' is stored in an earlier archive; restore it from there.")
+    return _restore_entries(manifest_path, manifest, selected, target_dir, overwrite, phase, key)
+
+
+def restore_chain(view, patterns, target_dir, overwrite=False, phase=None, password=None, taken=None):
+    """
+    Restores the files matching patterns from an archive chain.
+
+    Every file is read from the generation holding its latest content;
+    files deleted before the view's last generation are not restored.
+
+    Args:
+        view: chain.ChainView of the library to restore from
+        patterns, target_dir, overwrite, phase, password, taken: As for restore
+
+    Returns:
+        Tuple of (files restored, files that failed)
+
+    Raises:
+        ValueError: If a generation holding selected files is encrypted and
+            the password is missing or wrong
+    """
+    by_archive = {}
+    failed = 0
+    for path in view.select(patterns):
+        located = view.record(path)
+        if located is None:
+            print(f"Error: The content of '{path}' is stored outside the archive chain.")
+            failed += 1
+            continue
+        archive_id, _, manifest, record = located
+        if not taken_matches(manifest, record, taken):
+            continue
+        by_archive.setdefault(archive_id, []).append((path, record))
+
+    restored = 0
+    for archive_id, selected in by_archive.items():
+        manifest_path, manifest = view.manifests[archive_id]
+        selected.sort(key=lambda item: (item[1]['volume'], item[1].get('offset', 0)))
+        done, lost = _restore_entries(manifest_path, manifest, selected, target_dir, overwrite, phase,
+                                      open_key(manifest.header, password))
+        restored += done
+        failed += lost
+    return restored, failed
+
+
+def _restore_entries(manifest_path, manifest, selected, target_dir, overwrite, phase, key):
+    """Restores (relative path, record) pairs of one archive, sorted by volume and offset."""
+    codec = get_codec(manifest.header.get('codec', 'gzip'))
+    checksum = manifest.header.get('checksum')
+
+    by_volume = {}
+    for path, record in selected:
+        if not overwrite and (Path(target_dir) / path).exists():
+            print(f"Skipping '{path}': already exists in the target directory.")
+            continue
+        by_volume.setdefault(record['volume'], []).append((path, record))
+
+    restored = failed = 0
+    for index, entries in sorted(by_volume.items()):
+        volume = manifest.volumes.get(index)
+        if volume is None:
+            print(f"Error: Volume {index} is missing from the manifest.")
+            failed += len(entries)
+            continue
+        volume_path = manifest_path.with_name(volume['name'])
+        if any('offset' not in record for _, record in entries):
+            try:
+                size = _restore_sequentially(volume_path, [dict(record, path=path) for path, record in entries],
+                                             target_dir)
+                restored += len(entries)
+                if phase is not None:
+                    phase.advance(files=len(entries), bytes_out=size)
+            except (OSError, tarfile.TarError, ValueError) as e:
+                print(f"Error: Could not restore from '{volume_path}': {e}")
+                failed += len(entries)
+            continue
+        try:
+            reader = VolumeReader(volume_path, codec, volume.get('seek_points'), key=key)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not open volume '{volume_path}': {e}")
+            failed += len(entries)
+            continue
+        with reader:
+            for path, record in entries:
+                try:
+                    size = restore_member(reader, dict(record, path=path), Path(target_dir) / path, checksum)
+                except (OSError, EOFError, ValueError, tarfile.TarError, *DECODE_ERRORS) as e:
+                    print(f"Error: Could not restore '{path}': {e}")
+                    failed += 1
+                    reader.position = None  # Start over from a seek point
+                    continue
+                restored += 1
+                if phase is not None:
+                    phase.advance(files=1, bytes_out=size)
+    return restored, failed
+
+
+def main(argv=None):
+    """Entry point for restoring files from the configured archive."""
+    parser = argparse.ArgumentParser(description='Restore files from an archive without unpacking it whole.')
+    parser.add_argument('patterns', nargs='*', help="Relative paths or globs, e.g. 'album/2023/*.jpg'")
+    parser.add_argument('--target', required=True, help='Directory to restore into')
+    parser.add_argument('--config', default='config.ini', help='Configuration file (default: config.ini)')
+    parser.add_argument('--job', help='Job whose archive to use, when the configuration has [Job ...] sections')
+    parser.add_argument('--manifest', help='Manifest of the archive (default: from the configuration)')
+    parser.add_argument('--overwrite', action='store_true', help='Replace files that exist in the target')
+    parser.add_argument('--as-of', help='Archive id of the generation to restore from (default: the latest)')
+    parser.add_argument('--taken', help='Only photos taken in this year or month, e.g. 2023 or 2023-07')
+    args = parser.parse_args(argv)
+    if args.taken is not None and not _TAKEN.fullmatch(args.taken):
+        parser.error(f"--taken expects YYYY, YYYY-MM or YYYY-MM-DD, not '{args.taken}'")
+    if not args.patterns:
+        if args.taken is None:
+            parser.error('give the paths to restore, --taken, or both')
+        args.patterns = ['*']
+
+    manifest_path = args.manifest
+    config = load_config(args.config) if not manifest_path or Path(args.config).exists() else None
+    if config is not None:
+        config = select_job(config, args.job)
+    chain = None
+    if not manifest_path:
+        source_dir = config.get('Paths', 'source_dir')
+        destination_dir = config.get('Paths', 'destination_dir')
+        manifest_path = Path(destination_dir) / f"{Path(source_dir).name}{MANIFEST_SUFFIX}"
+        try:
+            chain = load_chain(destination_dir, Path(source_dir).name)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not read the archive chain: {e}")
+            sys.exit(1)
+        if not chain.current():
+            chain = None  # An archive written before chains
+    if chain is not None:
+        try:
+            generations = chain.current(args.as_of)
+        except KeyError:
+            print(f"Error: No generation '{args.as_of}' in the archive chain.")
+            sys.exit(1)
+    password = configured_password(config.get('Archive', 'password', fallback='')) if config else None
+    try:
+        with Phase('restore', progress_interval=None) as phase:
+            if chain is not None:
+                view = ChainView(chain, generations)
+                restored, failed = restore_chain(view, args.patterns, args.target, args.overwrite, phase, password,
+                                                 args.taken)
+            else:
+                restored, failed = restore(manifest_path, args.patterns, args.target, args.overwrite, phase,
+                                           password, args.taken)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read manifest '{manifest_path if chain is None else chain.path}': {e}")
+        sys.exit(1)
+    summary = phase.summary()
+    print(f"Restored {restored} files ({summary['bytes_out']} bytes) in {summary['seconds']:.2f}s.")
+    if failed:
+        print(f"{failed} files could not be restored.")
+        sys.exit(1)
+    if not restored:
+        print("No files matched.")
+
+
+if __name__ == '__main__':
+    main()
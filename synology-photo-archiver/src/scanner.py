@@ -1,34 +1,242 @@
+import hashlib
+import os
 import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
+from .state import DirSummary, FileRecord
 
-def scan_for_new_and_modified_files(source_dir, processed_files):
+
+# Directory listings are I/O bound (and slow on Btrfs/NFS), so a handful of
+# threads keeps several readdir/stat calls in flight at once.
+DEFAULT_SCAN_WORKERS = 8
+
+
+def is_modified(previous, stat_result):
     """
-    Scans the source directory and returns a list of new or modified files.
-    
+    Decides whether a file changed since it was last processed.
+
+    Args:
+        previous: FileRecord from the state, a bare mtime (legacy state) or None
+        stat_result: os.stat_result of the file as it is now
+
+    Returns:
+        bool: True if the file is new or has been modified
+    """
+    if previous is None:
+        return True
+    if isinstance(previous, FileRecord):
+        return previous.size != stat_result.st_size or previous.mtime_ns != stat_result.st_mtime_ns
+    return previous < stat_result.st_mtime
+
+
+def _listing_digest(names):
+    """Returns a short digest identifying a directory's (sorted) child names."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in names:
+        digest.update(os.fsencode(name))
+        digest.update(b'\0')
+    return digest.digest()
+
+
+def _scan_directory(directory, relative_prefix, previous_dirs, paranoid, path_filter=None):
+    """
+    Lists a single directory.
+
+    The directory's mtime and child listing are summarised. When both match the
+    summary from the previous run (and paranoid mode is off) the directory is
+    considered unchanged: its files are not stat'ed or returned, but its
+    subdirectories are still returned so that they get checked in turn.
+
+    Args:
+        directory: Absolute path of the directory to list
+        relative_prefix: Relative path of the directory (with trailing separator, or '')
+        previous_dirs: Dictionary of DirSummary tuples from the previous run
+        paranoid: If True, never treat a directory as unchanged
+        path_filter: Optional path_filter.PathFilter; entries it skips are
+            neither stat'ed nor returned (the summary still covers them)
+
+    Returns:
+        Tuple of (files, subdirectories, summary) where files is a list of
+        (relative path, os.stat_result), subdirectories is a list of
+        (absolute path, relative prefix) ready to be scanned in turn and
+        summary is the DirSummary of this directory (None if unreadable)
+    """
+    files = []
+    subdirectories = []
+    try:
+        # Stat before listing: if the directory changes in between, the stored
+        # mtime is stale and the next run simply rescans it.
+        directory_mtime_ns = os.stat(directory).st_mtime_ns
+        with os.scandir(directory) as iterator:
+            entries = list(iterator)
+    except OSError as e:
+        print(f"Warning: Could not read directory '{directory}': {e}")
+        return files, subdirectories, None
+
+    names = sorted(entry.name for entry in entries)
+    summary = DirSummary(directory_mtime_ns, len(names), _listing_digest(names))
+    unchanged = not paranoid and previous_dirs.get(relative_prefix[:-1]) == summary
+
+    for entry in entries:
+        try:
+            # Like Path.rglob, do not descend into symlinked directories
+            # but do include symlinks that point at regular files.
+            if entry.is_dir(follow_symlinks=False):
+                if path_filter is None or not path_filter.skips_directory(relative_prefix + entry.name, entry.name):
+                    subdirectories.append((entry.path, relative_prefix + entry.name + os.sep))
+            elif unchanged:
+                continue
+            elif path_filter is not None and path_filter.skips_file(relative_prefix + entry.name, entry.name):
+                continue
+            elif entry.is_file():
+                files.append((relative_prefix + entry.name, entry.stat()))
+        except OSError:
+            # Vanished or dangling entry; nothing to archive.
+            continue
+    return files, subdirectories, summary
+
+
+def walk_tree(source_dir, workers=DEFAULT_SCAN_WORKERS, previous_dirs=None, current_dirs=None, paranoid=False,
+              path_filter=None, relative_root=''):
+    """
+    Walks a directory tree with os.scandir, listing directories in parallel.
+
+    Subdirectories are fanned out over a bounded thread pool and files are
+    yielded as soon as their directory has been listed, so callers can start
+    consuming results before the walk finishes. The order of results is not
+    defined.
+
+    Directories whose mtime and child listing match ``previous_dirs`` are
+    pruned: every directory is still listed, but the files of unchanged ones
+    are neither stat'ed nor yielded. Note that rewriting a file in place does
+    not touch its directory, so such edits are only picked up in paranoid mode.
+
+    Args:
+        source_dir: Root directory to walk
+        workers: Maximum number of directories listed concurrently
+        previous_dirs: Optional dictionary of DirSummary tuples from the previous run
+        current_dirs: Optional dictionary filled with the DirSummary of every directory walked
+        paranoid: If True, ignore previous_dirs and stat every file
+        path_filter: Optional path_filter.PathFilter of files and directories to leave out
+        relative_root: Relative path of source_dir within the tree the paths (and
+            the filter's rules) are relative to; '' when source_dir is its root
+
+    Yields:
+        Tuples of (relative path string, os.stat_result) for regular files
+    """
+    workers = max(1, workers)
+    previous_dirs = previous_dirs or {}
+    path_filter = path_filter or None  # An empty filter costs nothing
+    pending = deque([(os.fspath(source_dir), os.path.join(relative_root, '') if relative_root else '')])
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or in_flight:
+            # Cap queued work so huge trees do not pile up futures in memory.
+            while pending and len(in_flight) < workers * 2:
+                directory, relative_prefix = pending.popleft()
+                future = pool.submit(_scan_directory, directory, relative_prefix, previous_dirs, paranoid,
+                                     path_filter)
+                in_flight[future] = relative_prefix
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative_prefix = in_flight.pop(future)
+                files, subdirectories, summary = future.result()
+                if current_dirs is not None and summary is not None:
+                    current_dirs[relative_prefix[:-1]] = summary
+                pending.extend(subdirectories)
+                yield from files
+
+
+def iter_changed_files(source_dir, processed_files, workers=DEFAULT_SCAN_WORKERS,
+                       previous_dirs=None, current_dirs=None, paranoid=False, phase=None, path_filter=None):
+    """
+    Scans the source directory for new or modified files, yielding them as they are found.
+
+    The source directory is checked immediately; the walk itself only runs
+    as the result is consumed. ``current_dirs`` is complete once the
+    iterator is exhausted.
+
     Args:
         source_dir: Path to the source directory to scan
-        processed_files: Dictionary mapping relative file paths to their last processed mtime
-        
+        processed_files: Mapping of relative file paths to their FileRecord
+            (or, for legacy state, their last processed mtime)
+        workers: Number of directories listed concurrently
+        previous_dirs: Optional DirSummary tuples from the previous run, used to
+            skip the files of unchanged directories
+        current_dirs: Optional dictionary filled with the DirSummary of every directory
+        paranoid: If True, stat every file regardless of previous_dirs
+        phase: Optional metrics.Phase advanced for every file stat'ed and
+            stopped when the walk ends
+        path_filter: Optional path_filter.PathFilter of files and directories to leave out
+
     Returns:
-        List of Path objects for files that are new or have been modified
-        
+        Iterator of (relative path string, FileRecord) tuples for files that
+        are new or have been modified. The records carry no archive id yet.
+
     Raises:
         SystemExit: If source directory is not found or is not a directory
     """
-    to_process = []
     source_path = Path(source_dir)
-    
+
     if not source_path.is_dir():
         print(f"Error: Source directory '{source_dir}' not found or is not a directory.")
         sys.exit(1)
 
-    for file_path in source_path.rglob('*'):
-        if file_path.is_file():
-            relative_path_str = str(file_path.relative_to(source_path))
-            current_mtime = file_path.stat().st_mtime
+    return _iter_changed_files(source_path, processed_files, workers, previous_dirs, current_dirs, paranoid, phase,
+                               path_filter)
+
+
+def _iter_changed_files(source_path, processed_files, workers, previous_dirs, current_dirs, paranoid, phase,
+                        path_filter):
+    changed = 0
+    for relative_path_str, st in walk_tree(source_path, workers, previous_dirs, current_dirs, paranoid,
+                                           path_filter):
+        if phase is not None:
+            phase.advance(files=1)
+        if is_modified(processed_files.get(relative_path_str), st):
+            changed += 1
+            yield relative_path_str, FileRecord(st.st_size, st.st_mtime_ns, st.st_ino, None)
+    if phase is not None:
+        phase.note(directories=len(current_dirs) if current_dirs is not None else None, changed=changed)
+        phase.stop()
+
+
+def find_changed_files(source_dir, processed_files, workers=DEFAULT_SCAN_WORKERS,
+                       previous_dirs=None, current_dirs=None, paranoid=False, phase=None):
+    """
+    Scans the source directory for new or modified files.
+
+    Same as iter_changed_files, but returns the complete list.
+
+    Returns:
+        List of (relative path string, FileRecord) tuples for files that are new
+        or have been modified. The records carry no archive id yet.
+
+    Raises:
+        SystemExit: If source directory is not found or is not a directory
+    """
+    return list(iter_changed_files(source_dir, processed_files, workers, previous_dirs, current_dirs,
+                                   paranoid, phase))
+
+
+def scan_for_new_and_modified_files(source_dir, processed_files):
+    """
+    Scans the source directory and returns a list of new or modified files.
+
+    Args:
+        source_dir: Path to the source directory to scan
+        processed_files: Dictionary mapping relative file paths to their last processed mtime
+            (or FileRecord)
+
+    Returns:
+        List of Path objects for files that are new or have been modified
 
-            if relative_path_str not in processed_files or processed_files[relative_path_str] < current_mtime:
-                to_process.append(file_path)
-    
-    return to_process
+    Raises:
+        SystemExit: If source directory is not found or is not a directory
+    """
+    source_path = Path(source_dir)
+    return [source_path / relative_path for relative_path, _ in find_changed_files(source_dir, processed_files)]
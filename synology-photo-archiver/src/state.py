@@ -0,0 +1,504 @@
+import sqlite3
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+
+# What we remember about every archived file. ``archive_id`` names the run
+# whose archive holds the current version of the file (for a deduplicated
+# file, the one holding its content; see StateStore.stored_at).
+FileRecord = namedtuple('FileRecord', ['size', 'mtime_ns', 'inode', 'archive_id'])
+
+# What we remember about every scanned directory, used to skip re-statting the
+# files of directories whose listing has not changed since the last run.
+DirSummary = namedtuple('DirSummary', ['mtime_ns', 'child_count', 'listing_digest'])
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    archive_id TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    child_count INTEGER NOT NULL,
+    listing_digest BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS compressibility (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    compress INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial_hash BLOB,
+    full_hash BLOB
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS capture_dates (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    taken TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT PRIMARY KEY,
+    target_path TEXT NOT NULL,
+    target_archive TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_by_size ON files (size);
+CREATE INDEX IF NOT EXISTS files_by_inode ON files (inode);
+"""
+
+# Per-connection tables (SQLite spills them to a temporary file) holding the
+# records of a run until its archive is complete.
+_STAGING_SCHEMA = """
+CREATE TEMP TABLE IF NOT EXISTS staged_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TEMP TABLE IF NOT EXISTS staged_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial_hash BLOB,
+    full_hash BLOB
+) WITHOUT ROWID;
+"""
+
+# Rows buffered in memory before staged hashes are written out.
+STAGE_BATCH_SIZE = 1000
+
+
+class StateStore:
+    """
+    On-disk index of processed files, backed by an SQLite database.
+
+    SQLite gives us a compact B-tree keyed by relative path that can be read
+    row by row (no giant document to parse) and transactional commits that
+    survive a crash or power loss half-way through a write.
+    """
+
+    def __init__(self, state_path):
+        """
+        Opens (and if needed creates) the state database.
+
+        Args:
+            state_path: Path to the state database file
+
+        Raises:
+            SystemExit: If the file exists but is not a usable state database
+        """
+        self.path = Path(state_path)
+        self._staged_hashes = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Autocommit mode; every write goes through _transaction().
+            self._conn = sqlite3.connect(str(self.path), isolation_level=None)
+            self._conn.execute('PRAGMA synchronous=FULL')
+            self._conn.executescript(_SCHEMA)
+            self._conn.executescript(_STAGING_SCHEMA)
+            self._check_schema_version()
+        except sqlite3.DatabaseError as e:
+            print(f"Error: State file '{state_path}' is not a valid state database: {e}")
+            sys.exit(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the underlying database connection."""
+        self._conn.close()
+
+    def _check_schema_version(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row is None:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),)
+            )
+        elif int(row[0]) > SCHEMA_VERSION:
+            raise sqlite3.DatabaseError(
+                f"schema version {row[0]} is newer than supported version {SCHEMA_VERSION}"
+            )
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def load_files(self):
+        """
+        Loads the processed-files index.
+
+        Returns:
+            Dictionary mapping relative file paths to FileRecord tuples
+        """
+        cursor = self._conn.execute('SELECT path, size, mtime_ns, inode, archive_id FROM files')
+        return {row[0]: FileRecord(row[1], row[2], row[3], row[4]) for row in cursor}
+
+    def iter_files(self):
+        """
+        Yields every processed file, ordered by path, without loading them all.
+
+        Yields:
+            Tuples of (relative path, FileRecord)
+        """
+        cursor = self._conn.execute('SELECT path, size, mtime_ns, inode, archive_id FROM files ORDER BY path')
+        for row in cursor:
+            yield row[0], FileRecord(row[1], row[2], row[3], row[4])
+
+    def generation(self):
+        """
+        Returns a number that changes whenever file records are committed.
+
+        Used to tell whether a snapshot of the files table is still current.
+        """
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def _bump_generation(self):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (str(self.generation() + 1),)
+        )
+
+    def get_meta(self, key):
+        """Returns a value stored with the ``meta`` argument of a commit, or None."""
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def load_dir_summaries(self):
+        """
+        Loads the directory summaries recorded by the last successful run.
+
+        Returns:
+            Dictionary mapping relative directory paths ('' for the root) to DirSummary tuples
+        """
+        cursor = self._conn.execute('SELECT path, mtime_ns, child_count, listing_digest FROM dirs')
+        return {row[0]: DirSummary(row[1], row[2], row[3]) for row in cursor}
+
+    def files_with_size(self, size):
+        """
+        Returns archived files of a given size.
+
+        Returns:
+            List of (relative path, FileRecord) tuples
+        """
+        cursor = self._conn.execute(
+            'SELECT path, size, mtime_ns, inode, archive_id FROM files WHERE size = ?', (size,)
+        )
+        return [(row[0], FileRecord(row[1], row[2], row[3], row[4])) for row in cursor]
+
+    def files_with_inode(self, inode):
+        """
+        Returns archived files that had a given inode number.
+
+        Returns:
+            List of (relative path, FileRecord) tuples
+        """
+        cursor = self._conn.execute(
+            'SELECT path, size, mtime_ns, inode, archive_id FROM files WHERE inode = ?', (inode,)
+        )
+        return [(row[0], FileRecord(row[1], row[2], row[3], row[4])) for row in cursor]
+
+    def stored_at(self, path):
+        """
+        Returns where the bytes of a deduplicated file are stored.
+
+        Returns:
+            Tuple of (relative path, archive id) of the stored copy, or None if
+            the file is stored under its own path
+        """
+        row = self._conn.execute('SELECT target_path, target_archive FROM refs WHERE path = ?', (path,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def hash_cache(self):
+        """
+        Returns a read-only view of stored content hashes.
+
+        Returns:
+            Object whose get(path) returns a (size, mtime_ns, partial_hash, full_hash)
+            tuple or None
+        """
+        return _HashCache(self._conn)
+
+    def compressibility_cache(self):
+        """
+        Returns a read-only view of cached compressibility probe results.
+
+        Lookups go straight to the database, so only the files actually being
+        archived are ever read.
+
+        Returns:
+            Object whose get(path) returns a (size, mtime_ns, compress) tuple or None
+        """
+        return _CompressibilityCache(self._conn)
+
+    def capture_date_cache(self):
+        """
+        Returns a read-only view of cached capture dates.
+
+        Returns:
+            Object whose get(path) returns a (size, mtime_ns, capture date or None) tuple or None
+        """
+        return _CaptureDateCache(self._conn)
+
+    def commit_files(self, records, dir_summaries=None, compressibility=None, hashes=None, meta=None,
+                     capture_dates=None):
+        """
+        Atomically records files as archived.
+
+        Either every record is written or, if anything fails (including a
+        crash), none of them are.
+
+        Args:
+            records: Dictionary mapping relative file paths to FileRecord tuples
+            dir_summaries: Optional dictionary of every directory seen by the scan,
+                mapping relative paths to DirSummary tuples. Replaces the stored
+                summaries in the same transaction.
+            compressibility: Optional dictionary mapping relative paths to new
+                (size, mtime_ns, compress) probe results
+            hashes: Optional dictionary mapping relative paths to new
+                (size, mtime_ns, partial_hash, full_hash) tuples
+            meta: Optional dictionary of string values to store (see get_meta),
+                e.g. how far the change journal has been consumed
+            capture_dates: Optional dictionary mapping relative paths to new
+                (size, mtime_ns, capture date or None) tuples
+        """
+        with self._transaction():
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, archive_id) '
+                'VALUES (?, ?, ?, ?, ?)',
+                ((path, *record) for path, record in records.items())
+            )
+            if records:
+                self._bump_generation()
+            self._write_run_data(dir_summaries, compressibility, hashes, meta, capture_dates)
+
+    def stage_files(self, records):
+        """
+        Stages changed files until their archive is complete (see commit_staged).
+
+        Staged records live in a temporary table rather than in memory, so a
+        run can stream millions of changes.
+
+        Args:
+            records: Iterable of (relative path, FileRecord) tuples; archive ids are ignored
+        """
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO staged_files (path, size, mtime_ns, inode) VALUES (?, ?, ?, ?)',
+            ((path, record.size, record.mtime_ns, record.inode) for path, record in records)
+        )
+
+    def unstage_files(self, paths):
+        """
+        Drops staged files that did not make it into the archive, so the next run looks at them again.
+
+        Args:
+            paths: Iterable of relative paths
+        """
+        paths = [(path,) for path in paths]
+        if self._staged_hashes is not None:
+            self._staged_hashes.flush()
+        self._conn.executemany('DELETE FROM staged_files WHERE path = ?', paths)
+        self._conn.executemany('DELETE FROM staged_hashes WHERE path = ?', paths)
+
+    def staged_hashes(self):
+        """
+        Returns a write-only mapping staging content hashes in batches.
+
+        Assigning ``staged[path] = (size, mtime_ns, partial_hash, full_hash)``
+        stages a hash; staged hashes are stored by commit_staged.
+        """
+        if self._staged_hashes is None:
+            self._staged_hashes = _StagedHashes(self._conn)
+        return self._staged_hashes
+
+    def commit_staged(self, archive_id, dir_summaries=None, compressibility=None, hashes=None, meta=None,
+                      deleted=(), replace=False, capture_dates=None, references=()):
+        """
+        Atomically records every staged file as archived under archive_id.
+
+        Also stores the staged hashes, and otherwise works like commit_files;
+        staged hashes take precedence over ``hashes``. The staging tables are
+        emptied afterwards.
+
+        Args:
+            archive_id: Id of the archive holding the staged files
+            dir_summaries: See commit_files
+            compressibility: See commit_files
+            hashes: See commit_files
+            meta: See commit_files
+            deleted: Relative paths of files deleted from the source; they are forgotten
+            replace: The staged files are the whole library (a full archive):
+                forget every file that is not staged
+            capture_dates: See commit_files
+            references: dedup.Reference tuples of staged files that were not
+                stored again; they are recorded as held by the archive and path
+                of their target instead
+        """
+        if self._staged_hashes is not None:
+            self._staged_hashes.flush()
+        with self._transaction():
+            if replace:
+                self._conn.execute('DELETE FROM files WHERE path NOT IN (SELECT path FROM staged_files)')
+                self._conn.execute('DELETE FROM refs')
+            self._conn.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in deleted))
+            for table in ('hashes', 'capture_dates', 'refs'):
+                self._conn.executemany(f'DELETE FROM {table} WHERE path = ?', ((path,) for path in deleted))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, archive_id) '
+                'SELECT path, size, mtime_ns, inode, ? FROM staged_files', (archive_id,)
+            )
+            self._conn.execute('DELETE FROM refs WHERE path IN (SELECT path FROM staged_files)')
+            self._write_refs(references)
+            self._bump_generation()
+            self._write_run_data(dir_summaries, compressibility, hashes, meta, capture_dates)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO hashes (path, size, mtime_ns, partial_hash, full_hash) '
+                'SELECT path, size, mtime_ns, partial_hash, full_hash FROM staged_hashes'
+            )
+            self._conn.execute('DELETE FROM staged_files')
+            self._conn.execute('DELETE FROM staged_hashes')
+
+    def reassign_archive(self, archive_id, references=()):
+        """
+        Records every file as held by archive_id (after its archive chain was compacted into it).
+
+        Args:
+            archive_id: Id of the new full generation
+            references: dedup.Reference tuples of the files the new full stores
+                under another path; they replace the recorded references
+        """
+        with self._transaction():
+            self._conn.execute('UPDATE files SET archive_id = ?', (archive_id,))
+            self._conn.execute('DELETE FROM refs')
+            self._write_refs(references)
+            self._bump_generation()
+
+    def _write_refs(self, references):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO refs (path, target_path, target_archive) VALUES (?, ?, ?)',
+            ((reference.path, reference.target_path, reference.target_archive_id) for reference in references)
+        )
+        self._conn.executemany(
+            'UPDATE files SET archive_id = ? WHERE path = ?',
+            ((reference.target_archive_id, reference.path) for reference in references)
+        )
+
+    def _write_run_data(self, dir_summaries, compressibility, hashes, meta, capture_dates=None):
+        if dir_summaries is not None:
+            self._conn.execute('DELETE FROM dirs')
+            self._conn.executemany(
+                'INSERT INTO dirs (path, mtime_ns, child_count, listing_digest) VALUES (?, ?, ?, ?)',
+                ((path, *summary) for path, summary in dir_summaries.items())
+            )
+        if compressibility:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO compressibility (path, size, mtime_ns, compress) VALUES (?, ?, ?, ?)',
+                ((path, size, mtime_ns, int(compress))
+                 for path, (size, mtime_ns, compress) in compressibility.items())
+            )
+        if hashes:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO hashes (path, size, mtime_ns, partial_hash, full_hash) '
+                'VALUES (?, ?, ?, ?, ?)',
+                ((path, *entry) for path, entry in hashes.items())
+            )
+        if capture_dates:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO capture_dates (path, size, mtime_ns, taken) VALUES (?, ?, ?, ?)',
+                ((path, *entry) for path, entry in capture_dates.items())
+            )
+        if meta:
+            self._conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', meta.items())
+
+
+class _StagedHashes:
+    """Write-only mapping buffering hashes into the staged_hashes table."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._batch = []
+
+    def __setitem__(self, path, entry):
+        self._batch.append((path, *entry))
+        if len(self._batch) >= STAGE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO staged_hashes (path, size, mtime_ns, partial_hash, full_hash) '
+            'VALUES (?, ?, ?, ?, ?)', self._batch
+        )
+        self._batch = []
+
+
+class _CompressibilityCache:
+    """Mapping-like, read-only view of the compressibility table."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, path, default=None):
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, compress FROM compressibility WHERE path = ?', (path,)
+        ).fetchone()
+        return row if row is not None else default
+
+
+class _CaptureDateCache:
+    """Mapping-like, read-only view of the capture_dates table."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, path, default=None):
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, taken FROM capture_dates WHERE path = ?', (path,)
+        ).fetchone()
+        return row if row is not None else default
+
+
+class _HashCache:
+    """Mapping-like, read-only view of the hashes table."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, path, default=None):
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, partial_hash, full_hash FROM hashes WHERE path = ?', (path,)
+        ).fetchone()
+        return row if row is not None else default
+
+
+class _Transaction:
+    """Context manager wrapping a BEGIN IMMEDIATE ... COMMIT/ROLLBACK block."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._conn.execute('COMMIT')
+        else:
+            self._conn.execute('ROLLBACK')
+        return False
@@ -0,0 +1,343 @@
+"""
+Verifies an archive against its manifest, at a cost chosen to fit the maintenance window.
+
+    python3 -m src.verify --tier quick
+    python3 -m src.verify --tier sample --sample 2% --time-limit 1800
+    python3 -m src.verify --tier full --workers 4
+
+Tiers, from cheapest to most thorough:
+
+    quick   every volume exists, has the recorded size and, when the manifest
+            has volume checksums, hashes to them (reads, never decodes)
+    sample  every volume has the recorded size, and a random subset of
+            members is decoded (seeking straight to them) and checked
+            against its checksum
+    full    every volume is read once, start to end: its hash and every
+            member's checksum are checked in the same pass
+
+Volumes are checked in parallel and in random order, so a time limit that
+cuts a run short still spreads coverage over the archive from night to night.
+With an archive chain, every generation kept is verified in turn.
+"""
+import argparse
+import random
+import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .chain import load_chain
+from .codec import DECODE_ERRORS, get_codec
+from .compression import CHECKSUM_ALGORITHMS
+from .config import load_config
+from .encryption import AuthenticationError, configured_password, open_key
+from .jobs import select_job
+from .manifest import MANIFEST_SUFFIX, load_manifest
+from .metrics import Phase
+from .restore import VolumeReader, read_member
+
+
+TIERS = ('quick', 'sample', 'full')
+DEFAULT_TIER = 'quick'
+DEFAULT_SAMPLE = '100'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class _Deadline:
+    """Tells whether the time limit (if any) has passed."""
+
+    def __init__(self, seconds):
+        self._end = time.monotonic() + seconds if seconds else None
+
+    def passed(self):
+        return self._end is not None and time.monotonic() >= self._end
+
+
+def parse_sample(sample, total):
+    """
+    Turns a sample size into a number of members.
+
+    Args:
+        sample: A count ('200') or a percentage of the members ('2%')
+        total: Number of members in the archive
+
+    Returns:
+        int: Members to sample, at most total
+
+    Raises:
+        ValueError: If sample is not a count or a percentage
+    """
+    sample = str(sample).strip()
+    if sample.endswith('%'):
+        count = round(total * float(sample[:-1]) / 100)
+    else:
+        count = int(sample)
+    return max(0, min(total, count))
+
+
+def _check_size(volume_path, volume):
+    try:
+        size = volume_path.stat().st_size
+    except OSError as e:
+        return f"volume '{volume['name']}' is missing: {e.strerror}"
+    if size != volume['bytes']:
+        return f"volume '{volume['name']}' is {size} bytes, the manifest says {volume['bytes']}"
+    return None
+
+
+def _check_member(reader, path, record, checksum):
+    """Decodes one member and compares it with the manifest; returns a problem or None."""
+    _, chunks = read_member(reader, record)
+    digest = CHECKSUM_ALGORITHMS[checksum]() if checksum and record.get('checksum') else None
+    for data in chunks:
+        if digest is not None:
+            digest.update(data)
+    if digest is not None and digest.hexdigest() != record['checksum']:
+        return f"'{path}': checksum mismatch"
+    return None
+
+
+def _verify_quick(volume_path, volume, checksum, deadline):
+    problem = _check_size(volume_path, volume)
+    if problem is not None:
+        return [problem], 0, 0
+    if not checksum or not volume.get('checksum'):
+        return [], 0, 0
+    digest = CHECKSUM_ALGORITHMS[checksum]()
+    read = 0
+    with open(volume_path, 'rb') as f:
+        while True:
+            if deadline.passed():
+                return [], 0, None  # Unfinished: neither good nor bad
+            data = f.read(HASH_CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+            read += len(data)
+    if digest.hexdigest() != volume['checksum']:
+        return [f"volume '{volume['name']}': checksum mismatch"], 0, read
+    return [], 0, read
+
+
+def _verify_members(volume_path, volume, codec, checksum, members, deadline, digest=None, key=None):
+    """Checks members in offset order; with digest, also reads the volume to its end."""
+    problem = _check_size(volume_path, volume)
+    if problem is not None:
+        return [problem], 0, 0
+    problems = []
+    checked = 0
+    read = 0
+    seek_points = None if digest is not None else volume.get('seek_points')
+    try:
+        reader = VolumeReader(volume_path, codec, seek_points, digest, key)
+    except (OSError, ValueError) as e:
+        return [f"volume '{volume['name']}' cannot be opened: {e}"], 0, 0
+    with reader:
+        for path, record in sorted(members, key=lambda item: item[1]['offset']):
+            if deadline.passed():
+                return problems, checked, None
+            try:
+                problem = _check_member(reader, path, record, checksum)
+            except AuthenticationError as e:
+                problems.append(f"volume '{volume['name']}' is unreadable from '{path}' on: {e}")
+                return problems, checked, read
+            except ValueError as e:
+                problem = f"'{path}': {e}"
+            except (EOFError, OSError, tarfile.TarError, *DECODE_ERRORS) as e:
+                # The stream cannot be followed past this point.
+                problems.append(f"volume '{volume['name']}' is unreadable from '{path}' on: {e}")
+                return problems, checked, read
+            if problem is not None:
+                problems.append(problem)
+            checked += 1
+            read += record['size']
+        if digest is not None:
+            try:
+                reader.drain()
+            except (EOFError, OSError, AuthenticationError, *DECODE_ERRORS) as e:
+                problems.append(f"volume '{volume['name']}' is unreadable at its end: {e}")
+                return problems, checked, read
+            if digest.hexdigest() != volume['checksum']:
+                problems.append(f"volume '{volume['name']}': checksum mismatch")
+    return problems, checked, read
+
+
+def verify_archive(manifest_path, tier=DEFAULT_TIER, sample=DEFAULT_SAMPLE, workers=1, time_limit=None,
+                   seed=None, phase=None, password=None):
+    """
+    Verifies the volumes and members of an archive against its manifest.
+
+    Args:
+        manifest_path: Path of the archive's manifest; volumes are expected next to it
+        tier: 'quick', 'sample' or 'full' (see the module docstring)
+        sample: Members to decode in the sample tier: a count or a percentage ('2%')
+        workers: Volumes verified concurrently
+        time_limit: Optional seconds after which no new work is started
+        seed: Random seed for the volume order and the sample (None: a new one per run)
+        phase: Optional metrics.Phase advanced with the members and bytes checked
+        password: Password of an encrypted archive; only the quick tier,
+            which never decrypts, works without it
+
+    Returns:
+        Dictionary with the tier, volumes and members checked and in total,
+        bytes checked, whether everything planned was checked ('complete')
+        and the list of problems found
+
+    Raises:
+        ValueError: If tier or sample is invalid, the manifest is not supported, or
+            a decoding tier needs a password that is missing or wrong
+    """
+    if tier not in TIERS:
+        raise ValueError(f"unknown verification tier '{tier}'")
+    manifest_path = Path(manifest_path)
+    manifest = load_manifest(manifest_path)
+    codec = get_codec(manifest.header.get('codec', 'gzip'))
+    checksum = manifest.header.get('checksum')
+    key = open_key(manifest.header, password) if tier != 'quick' else None
+    rng = random.Random(seed)
+    deadline = _Deadline(time_limit)
+
+    members = {index: [] for index in manifest.volumes}
+    missing_volumes = set()
+    for path, record in manifest.files.items():
+        if record['volume'] in members:
+            members[record['volume']].append((path, record))
+        else:
+            missing_volumes.add(record['volume'])
+    problems = [f"volume {index} holds files but is missing from the manifest" for index in sorted(missing_volumes)]
+    has_offsets = all('offset' in record for record in manifest.files.values())
+    if tier != 'quick' and not has_offsets:
+        problems.append("the manifest predates member offsets; only the quick tier can verify it")
+        tier = 'quick'
+
+    if tier == 'sample':
+        everything = [(path, record) for volume_members in members.values() for path, record in volume_members]
+        chosen = rng.sample(everything, parse_sample(sample, len(everything)))
+        planned = {index: [] for index in manifest.volumes}
+        for path, record in chosen:
+            planned[record['volume']].append((path, record))
+    else:
+        planned = members
+
+    order = list(manifest.volumes)
+    rng.shuffle(order)
+
+    def verify_volume(index):
+        volume = manifest.volumes[index]
+        volume_path = manifest_path.with_name(volume['name'])
+        if deadline.passed():
+            return [], 0, None
+        if tier == 'quick':
+            return _verify_quick(volume_path, volume, checksum, deadline)
+        digest = None
+        if tier == 'full' and checksum and volume.get('checksum'):
+            digest = CHECKSUM_ALGORITHMS[checksum]()
+        if tier == 'sample' and not planned[index]:
+            problem = _check_size(volume_path, volume)
+            return ([problem] if problem else []), 0, 0
+        return _verify_members(volume_path, volume, codec, checksum, planned[index], deadline, digest, key)
+
+    volumes_checked = members_checked = bytes_checked = 0
+    complete = True
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for volume_problems, checked, read in pool.map(verify_volume, order):
+            problems += volume_problems
+            members_checked += checked
+            if read is None:
+                complete = False
+                continue
+            volumes_checked += 1
+            bytes_checked += read
+            if phase is not None:
+                phase.advance(files=checked, bytes_in=read)
+
+    return {
+        'tier': tier,
+        'volumes_checked': volumes_checked,
+        'volumes_total': len(manifest.volumes),
+        'members_checked': members_checked,
+        'members_planned': sum(len(volume_members) for volume_members in planned.values()) if tier != 'quick' else 0,
+        'bytes_checked': bytes_checked,
+        'complete': complete,
+        'problems': problems,
+    }
+
+
+def _combine(result, archive_result):
+    """Adds the result of one archive of a chain to the results so far."""
+    if result is None:
+        return archive_result
+    for field in ('volumes_checked', 'volumes_total', 'members_checked', 'members_planned', 'bytes_checked',
+                  'problems'):
+        result[field] += archive_result[field]
+    result['complete'] = result['complete'] and archive_result['complete']
+    return result
+
+
+def main(argv=None):
+    """Entry point for verifying the configured archive (every generation of its chain)."""
+    parser = argparse.ArgumentParser(description='Verify an archive against its manifest.')
+    parser.add_argument('--tier', choices=TIERS, default=DEFAULT_TIER, help='How thoroughly to verify (default: quick)')
+    parser.add_argument('--sample', default=DEFAULT_SAMPLE,
+                        help="Members decoded by the sample tier: a count or a percentage like '2%%' (default: 100)")
+    parser.add_argument('--workers', type=int, default=1, help='Volumes verified in parallel (default: 1)')
+    parser.add_argument('--time-limit', type=float, help='Stop starting new work after this many seconds')
+    parser.add_argument('--seed', type=int, help='Random seed for the volume order and the sample')
+    parser.add_argument('--config', default='config.ini', help='Configuration file (default: config.ini)')
+    parser.add_argument('--job', help='Job whose archive to use, when the configuration has [Job ...] sections')
+    parser.add_argument('--manifest', help='Manifest of the archive (default: from the configuration)')
+    args = parser.parse_args(argv)
+
+    manifest_path = args.manifest
+    config = load_config(args.config) if not manifest_path or Path(args.config).exists() else None
+    if config is not None:
+        config = select_job(config, args.job)
+    manifest_paths = [Path(manifest_path)] if manifest_path else []
+    if not manifest_path:
+        source_dir = config.get('Paths', 'source_dir')
+        destination_dir = config.get('Paths', 'destination_dir')
+        try:
+            chain = load_chain(destination_dir, Path(source_dir).name)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not read the archive chain: {e}")
+            sys.exit(1)
+        # Every generation still kept, not only the current chain: older ones are restorable too.
+        manifest_paths = [chain.manifest_path(generation) for generation in chain.generations
+                          if generation['status'] == 'complete']
+        if not manifest_paths:  # An archive written before chains
+            manifest_paths = [Path(destination_dir) / f"{Path(source_dir).name}{MANIFEST_SUFFIX}"]
+    password = configured_password(config.get('Archive', 'password', fallback='')) if config else None
+
+    result = None
+    with Phase('verify', progress_interval=None) as phase:
+        for manifest_path in manifest_paths:
+            time_limit = args.time_limit - phase.seconds if args.time_limit is not None else None
+            try:
+                archive_result = verify_archive(manifest_path, args.tier, args.sample, args.workers, time_limit,
+                                                args.seed, phase, password)
+            except (OSError, ValueError) as e:
+                print(f"Error: Could not verify '{manifest_path}': {e}")
+                sys.exit(1)
+            if len(manifest_paths) > 1:
+                name = manifest_path.name[:-len(MANIFEST_SUFFIX)]
+                archive_result['problems'] = [f"{name}: {problem}" for problem in archive_result['problems']]
+            result = _combine(result, archive_result)
+
+    for problem in result['problems']:
+        print(f"Problem: {problem}")
+    summary = phase.summary()
+    members = f", {result['members_checked']}/{result['members_planned']} members" if result['tier'] != 'quick' else ''
+    print(f"Verified ({result['tier']}) {result['volumes_checked']}/{result['volumes_total']} volumes{members}, "
+          f"{result['bytes_checked']} bytes in {summary['seconds']:.2f}s ({summary['mb_per_second']:.1f} MB/s).")
+    if not result['complete']:
+        print("Time limit reached; the rest was not verified.")
+    if result['problems']:
+        print(f"Verification found {len(result['problems'])} problem(s).")
+        sys.exit(1)
+    print("No problems found.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import tarfile
+
+
+# Worst-case bytes a member adds on top of its data: one header block plus
+# padding up to the next block boundary.
+TAR_MEMBER_OVERHEAD = 2 * tarfile.BLOCKSIZE
+
+# Number of most recent volumes still open for back-filling. Keeping it small
+# keeps planning linear and neighbouring files (albums) in the same volume.
+DEFAULT_PACKING_WINDOW = 8
+
+
+class Volume:
+    """A planned self-contained archive volume."""
+
+    __slots__ = ('index', 'files', 'bytes', 'oversized', 'bucket')
+
+    def __init__(self, index, oversized=False, bucket=None):
+        self.index = index
+        self.files = []
+        self.bytes = 0
+        self.oversized = oversized
+        self.bucket = bucket
+
+    def __repr__(self):
+        return (f"Volume({self.index}, files={len(self.files)}, bytes={self.bytes}, oversized={self.oversized}, "
+                f"bucket={self.bucket!r})")
+
+    def add(self, item, size):
+        self.files.append(item)
+        self.bytes += size + TAR_MEMBER_OVERHEAD
+
+
+def iter_volumes(files, volume_bytes, window=DEFAULT_PACKING_WINDOW, first_index=0):
+    """
+    Bin-packs files into volumes of roughly ``volume_bytes`` each, yielding
+    every volume as soon as no more files can be added to it.
+
+    Files are placed first-fit, in input order, into the last ``window``
+    volumes that still have room, so volumes fill up well while files from
+    the same directory stay together. A file larger than a whole volume gets
+    a volume of its own, flagged as oversized. Sizes are uncompressed tar
+    bytes, so compressed volumes never exceed the target.
+
+    A volume is complete once it drops out of the window (or is oversized),
+    so at most ``window`` volumes' worth of file names are held at a time and
+    the first volume can be written long before the input ends. Volumes are
+    therefore not necessarily yielded in index order.
+
+    Args:
+        files: Iterable of (item, size in bytes) tuples; items are returned as given
+        volume_bytes: Target volume size in bytes; 0 puts everything in one volume
+        window: Number of recent volumes considered for each file
+        first_index: Index of the first volume (when continuing an archive)
+
+    Yields:
+        Complete Volume objects; nothing for empty input
+    """
+    if volume_bytes <= 0:
+        volume = Volume(first_index)
+        for item, size in files:
+            volume.add(item, size)
+        if volume.files:
+            yield volume
+        return
+
+    next_index = first_index
+    open_volumes = []
+    for item, size in files:
+        if size + TAR_MEMBER_OVERHEAD > volume_bytes:
+            volume = Volume(next_index, oversized=True)
+            next_index += 1
+            volume.add(item, size)
+            yield volume
+            continue
+
+        for volume in open_volumes:
+            if volume.bytes + size + TAR_MEMBER_OVERHEAD <= volume_bytes:
+                break
+        else:
+            volume = Volume(next_index)
+            next_index += 1
+            open_volumes.append(volume)
+            if len(open_volumes) > window:
+                yield open_volumes.pop(0)
+        volume.add(item, size)
+
+    yield from open_volumes
+
+
+def iter_partitioned_volumes(files, volume_bytes, window=DEFAULT_PACKING_WINDOW, first_index=0):
+    """
+    Bin-packs files like iter_volumes, keeping every volume to a single partition.
+
+    Each partition (bucket) is packed on its own, with its own window of
+    open volumes; indexes are shared, so volumes are numbered across
+    partitions. Without a volume size every partition gets one volume,
+    yielded once the input ends.
+
+    Args:
+        files: Iterable of (item, size in bytes, bucket) tuples
+        volume_bytes, window, first_index: As for iter_volumes
+
+    Yields:
+        Complete Volume objects with their bucket set
+    """
+    next_index = first_index
+    open_volumes = {}  # Bucket -> its open volumes, oldest first
+    for item, size, bucket in files:
+        if 0 < volume_bytes < size + TAR_MEMBER_OVERHEAD:
+            volume = Volume(next_index, oversized=True, bucket=bucket)
+            next_index += 1
+            volume.add(item, size)
+            yield volume
+            continue
+
+        volumes = open_volumes.setdefault(bucket, [])
+        for volume in volumes:
+            if volume_bytes <= 0 or volume.bytes + size + TAR_MEMBER_OVERHEAD <= volume_bytes:
+                break
+        else:
+            volume = Volume(next_index, bucket=bucket)
+            next_index += 1
+            volumes.append(volume)
+            if len(volumes) > window:
+                yield volumes.pop(0)
+        volume.add(item, size)
+
+    for volumes in open_volumes.values():
+        yield from volumes
+
+
+def plan_volumes(files, volume_bytes, window=DEFAULT_PACKING_WINDOW, first_index=0):
+    """
+    Bin-packs files into volumes of roughly ``volume_bytes`` each (see iter_volumes).
+
+    Args:
+        files: Iterable of (item, size in bytes) tuples; items are returned as given
+        volume_bytes: Target volume size in bytes; 0 puts everything in one volume
+        window: Number of recent volumes considered for each file
+        first_index: Index of the first volume (when continuing an archive)
+
+    Returns:
+        List of Volume objects, in index order (at least one, possibly empty)
+    """
+    volumes = sorted(iter_volumes(files, volume_bytes, window, first_index), key=lambda volume: volume.index)
+    return volumes or [Volume(first_index)]
@@ -0,0 +1,253 @@
+"""
+Watches the source directory with inotify and logs changes to the change journal.
+
+Run it as a long-lived process next to the archiver (e.g. a Synology
+triggered task at boot), with the same configuration file:
+
+    python3 -m src.watcher [config.ini]
+
+With ``[Scan] change_source = journal`` the archiver then reads the changed
+files from the journal instead of walking the whole library.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+from .config import load_config
+from .journal import HEARTBEAT_INTERVAL, ChangeJournal
+
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len; followed by the name
+
+# Seconds events are coalesced in memory before they are written out.
+FLUSH_INTERVAL = 1.0
+
+
+class Inotify:
+    """Minimal ctypes binding for the Linux inotify API."""
+
+    def __init__(self):
+        """
+        Raises:
+            OSError: If inotify is not available
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available on this system')
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        Watches a directory; returns its watch descriptor.
+
+        Watching the same directory again returns the same descriptor.
+
+        Raises:
+            OSError: e.g. ENOSPC when fs.inotify.max_user_watches is exhausted
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events.
+
+        Returns:
+            List of (watch descriptor, mask, name) tuples
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Turns inotify events under a source directory into journal events.
+
+    Every directory is watched (inotify is not recursive). New or moved-in
+    directories are watched as they appear and logged as 'dir' events, so
+    the archiver walks them: files created in them before their watch was
+    added are found that way. Events are coalesced for FLUSH_INTERVAL.
+    """
+
+    def __init__(self, source_dir, journal, inotify=None):
+        self.root = os.path.abspath(source_dir)
+        self.journal = journal
+        self.inotify = inotify or Inotify()
+        self.session = None
+        self._directories = {}  # watch descriptor -> relative directory ('' for the root)
+        self._pending = {}  # (kind, relative path) -> None, in arrival order
+
+    def _record(self, kind, relative_path):
+        self._pending[(kind, relative_path)] = None
+
+    def watch_tree(self, relative_dir):
+        """
+        Watches a directory and every directory below it.
+
+        Raises:
+            OSError: If a watch cannot be added for lack of resources
+        """
+        stack = [relative_dir]
+        while stack:
+            relative = stack.pop()
+            path = os.path.join(self.root, relative) if relative else self.root
+            try:
+                # A moved directory keeps its descriptor; this updates its path.
+                self._directories[self.inotify.add_watch(path)] = relative
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(os.path.join(relative, entry.name) if relative else entry.name)
+            except OSError as e:
+                if e.errno in (errno.ENOSPC, errno.ENOMEM):
+                    raise
+                # Vanished in the meantime; its parent's event covers it.
+
+    def handle(self, wd, mask, name):
+        """Translates one inotify event."""
+        if mask & IN_Q_OVERFLOW:
+            self._record('overflow', '')
+            return
+        if mask & IN_IGNORED:
+            self._directories.pop(wd, None)
+            return
+        directory = self._directories.get(wd)
+        if directory is None or not name:
+            return
+        relative_path = os.path.join(directory, name) if directory else name
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._record('delete', relative_path)
+        elif mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.watch_tree(relative_path)
+                except OSError as e:
+                    print(f"Warning: Could not watch '{relative_path}': {e}")
+                    self._record('overflow', relative_path)
+                self._record('dir', relative_path)
+        else:
+            self._record('file', relative_path)
+
+    def flush(self):
+        """Writes the coalesced events to the journal."""
+        if self._pending:
+            self.journal.add_events(self.session, list(self._pending))
+            self._pending = {}
+
+    def start(self):
+        """
+        Starts a journal session and watches the whole tree.
+
+        Raises:
+            OSError: If the tree cannot be watched (e.g. too few inotify watches)
+        """
+        self.session = self.journal.start_session(self.root)
+        self.watch_tree('')
+        self.journal.mark_ready(self.session)
+        print(f"Watching {len(self._directories)} directories under {self.root}.")
+
+    def run(self, should_stop):
+        """
+        Processes events until should_stop() returns True, then ends the session.
+        """
+        last_heartbeat = time.monotonic()
+        try:
+            while not should_stop():
+                for wd, mask, name in self.inotify.read(FLUSH_INTERVAL):
+                    self.handle(wd, mask, name)
+                self.flush()
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    self.journal.heartbeat(self.session)
+                    last_heartbeat = time.monotonic()
+        finally:
+            self.flush()
+            self.journal.stop_session(self.session)
+
+
+def main(argv=None):
+    """Entry point: watches the configured source directory until SIGTERM or SIGINT."""
+    argv = sys.argv[1:] if argv is None else argv
+    config = load_config(argv[0] if argv else 'config.ini')
+    source_dir = config.get('Paths', 'source_dir')
+    journal_path = config.get('Scan', 'journal', fallback='').strip()
+    if not journal_path:
+        print("Error: Set [Scan] journal to the path of the change journal.")
+        sys.exit(1)
+    if not os.path.isdir(source_dir):
+        print(f"Error: Source directory '{source_dir}' not found or is not a directory.")
+        sys.exit(1)
+
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.append(True))
+
+    with ChangeJournal(journal_path) as journal:
+        try:
+            watcher = Watcher(source_dir, journal)
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        try:
+            watcher.start()
+        except OSError as e:
+            if watcher.session is not None:
+                journal.stop_session(watcher.session)
+            print(f"Error: Could not watch '{source_dir}': {e}")
+            if e.errno == errno.ENOSPC:
+                print("Raise fs.inotify.max_user_watches (sysctl) above the number of directories.")
+            sys.exit(1)
+        watcher.run(lambda: bool(stopping))
+    print("Watcher stopped.")
+
+
+if __name__ == '__main__':
+    main()
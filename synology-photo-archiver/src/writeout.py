@@ -0,0 +1,264 @@
+"""
+Writes archive volumes to the destination without starving everything else on the NAS.
+
+The destination is often a USB or network volume shared with Synology Photos
+indexing and SMB clients. Volumes are therefore written:
+
+- in large aligned chunks (DEFAULT_CHUNK_SIZE), one write call each, instead
+  of many small buffered writes;
+- on a writer thread fed through a short queue, so compression carries on
+  while a write stalls or is throttled;
+- at no more than ``bandwidth_limit`` MB and ``iops_limit`` writes per
+  second, when set;
+- to ``<volume>.partial`` first and renamed once complete, so a volume under
+  its final name is always whole;
+- with cache dropping: written data is synced every DROP_CACHE_WINDOW bytes
+  and dropped from the page cache, as are source files once archived, so a
+  nightly run neither floods the disk with dirty pages nor evicts the cache
+  the rest of the NAS relies on.
+"""
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+PARTIAL_SUFFIX = '.partial'
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+ALIGNMENT = 4096
+
+# Chunks queued for the writer thread; bounds the memory held by write-out.
+PIPELINE_DEPTH = 4
+
+# With drop_cache, written data is synced and dropped in windows of this size.
+DROP_CACHE_WINDOW = 32 * 1024 * 1024
+
+# Unused budget a limiter may save up, so short pauses do not lead to bursts.
+MAX_BURST_SECONDS = 0.5
+
+# 'auto' syncs volumes only when they are journaled for resuming.
+FSYNC_POLICIES = ('auto', 'volume', 'never')
+
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+
+def drop_cached_pages(fd, offset=0, length=0):
+    """Tells the kernel the range of an open file will not be read again; a no-op where unsupported."""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass  # Advice only
+
+
+class RateLimiter:
+    """
+    Paces writes to a byte rate and an operation rate shared by every volume of a run.
+
+    Thread-safe; ``throttled_seconds`` is the time spent waiting.
+    """
+
+    def __init__(self, bytes_per_second=0, ops_per_second=0, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            bytes_per_second: Byte rate cap; 0 for none
+            ops_per_second: Write calls per second cap; 0 for none
+            clock, sleep: Time functions (replaceable in tests)
+        """
+        self.bytes_per_second = bytes_per_second
+        self.ops_per_second = ops_per_second
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._available_at = None
+        self.throttled_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.bytes_per_second or self.ops_per_second)
+
+    def acquire(self, size):
+        """Waits until a write of size bytes fits within the limits."""
+        cost = max(size / self.bytes_per_second if self.bytes_per_second else 0.0,
+                   1.0 / self.ops_per_second if self.ops_per_second else 0.0)
+        if not cost:
+            return
+        with self._lock:
+            now = self._clock()
+            if self._available_at is None:
+                self._available_at = now
+            self._available_at = max(self._available_at, now - MAX_BURST_SECONDS)
+            wait = self._available_at - now
+            self._available_at += cost
+        if wait > 0:
+            self._sleep(wait)
+            with self._lock:
+                self.throttled_seconds += wait
+
+
+class WriteOptions:
+    """How volumes are written out; one instance (and rate limiter) per run."""
+
+    def __init__(self, bandwidth_limit=0, iops_limit=0, chunk_size=DEFAULT_CHUNK_SIZE, fsync='auto',
+                 drop_cache=False):
+        """
+        Args:
+            bandwidth_limit: Bytes per second written at most; 0 for no limit
+            iops_limit: Write calls per second at most; 0 for no limit
+            chunk_size: Bytes per write call, rounded up to a multiple of ALIGNMENT
+            fsync: 'auto' (sync volumes of resumable archives), 'volume' (always) or 'never'
+            drop_cache: Sync and drop written data, and archived source files, from the page cache
+
+        Raises:
+            ValueError: If fsync is not a known policy
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy '{fsync}'; choose one of: {', '.join(FSYNC_POLICIES)}")
+        self.chunk_size = max(ALIGNMENT, -(-chunk_size // ALIGNMENT) * ALIGNMENT)
+        self.fsync = fsync
+        self.drop_cache = drop_cache
+        self.limiter = RateLimiter(bandwidth_limit, iops_limit)
+
+    def sync_volume(self, resumable):
+        """True if a finished volume must reach the disk before it is renamed."""
+        return self.fsync == 'volume' or (self.fsync == 'auto' and resumable)
+
+    def open(self, path):
+        """Opens a volume for writing; see VolumeOutput."""
+        return VolumeOutput(path, self)
+
+
+def load_write_options(config):
+    """
+    Reads the [Write] section of the configuration.
+
+    Raises:
+        SystemExit: If a value is invalid
+    """
+    try:
+        return WriteOptions(
+            bandwidth_limit=int(config.getfloat('Write', 'bandwidth_limit', fallback=0) * 1024 * 1024),
+            iops_limit=config.getint('Write', 'iops_limit', fallback=0),
+            fsync=config.get('Write', 'fsync', fallback='auto').strip().lower(),
+            drop_cache=config.getboolean('Write', 'drop_cache', fallback=True),
+        )
+    except ValueError as e:
+        print(f"Error: Invalid [Write] setting: {e}")
+        sys.exit(1)
+
+
+class VolumeOutput:
+    """
+    Write-only file for one volume: aligned chunks, written on a thread.
+
+    Data is written to ``<path>.partial`` and renamed to path by ``close()``.
+    A failed write is raised from the next ``write()`` or from ``close()``.
+    ``stall_seconds`` is the time the producer waited for the writer thread.
+    """
+
+    def __init__(self, path, options):
+        self.path = Path(path)
+        self.partial_path = self.path.with_name(self.path.name + PARTIAL_SUFFIX)
+        self._options = options
+        self._file = open(self.partial_path, 'wb', buffering=0)
+        self._buffer = bytearray()
+        self._queue = queue.Queue(maxsize=PIPELINE_DEPTH)
+        self._error = None
+        self._written = 0
+        self._dropped = 0  # Bytes synced and dropped from the page cache
+        self.writes = 0
+        self.stall_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"write {self.path.name}", daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        self._buffer += data
+        chunk_size = self._options.chunk_size
+        if len(self._buffer) >= chunk_size:
+            end = len(self._buffer) - len(self._buffer) % chunk_size
+            for start in range(0, end, chunk_size):
+                self._put(bytes(self._buffer[start:start + chunk_size]))
+            del self._buffer[:end]
+
+    def _put(self, chunk):
+        if self._error is not None:
+            raise self._error
+        started = time.monotonic()
+        self._queue.put(chunk)
+        self.stall_seconds += time.monotonic() - started
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._error is not None:
+                continue  # Keep draining so the producer never blocks
+            try:
+                self._write_chunk(chunk)
+            except BaseException as e:  # Anything, so the thread outlives it and the caller sees it
+                self._error = e
+
+    def _write_chunk(self, chunk):
+        self._options.limiter.acquire(len(chunk))
+        view = memoryview(chunk)
+        while view:
+            view = view[self._file.write(view):]
+        self.writes += 1
+        self._written += len(chunk)
+        if self._options.drop_cache and self._written - self._dropped >= DROP_CACHE_WINDOW:
+            self._drop_written()
+
+    def _drop_written(self):
+        # Dirty pages cannot be dropped: write them back first.
+        _fdatasync(self._file.fileno())
+        drop_cached_pages(self._file.fileno(), self._dropped, self._written - self._dropped)
+        self._dropped = self._written
+
+    def _stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def close(self, fsync=False):
+        """Writes what is left, optionally syncs, and renames the volume to its final name."""
+        try:
+            if self._buffer:
+                self._put(bytes(self._buffer))
+                self._buffer.clear()
+        finally:
+            self._stop()
+        if self._error is not None:
+            raise self._error
+        if fsync:
+            os.fsync(self._file.fileno())
+        if self._options.drop_cache:
+            self._drop_written()
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+        if fsync:
+            _sync_directory(self.path.parent)
+
+    def discard(self):
+        """Stops writing and deletes the volume."""
+        self._stop()
+        self._file.close()
+        for path in (self.partial_path, self.path):
+            if path.exists():
+                path.unlink()
+
+
+def _sync_directory(path):
+    """Makes a rename in the directory durable; not possible on every platform."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
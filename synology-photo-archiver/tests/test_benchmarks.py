@@ -0,0 +1,94 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from benchmarks import run
+from benchmarks.synthetic import DEFAULT_SPEC, apply_churn, generate_library
+
+
+SMALL_SPEC = DEFAULT_SPEC._replace(files=40, depth=2, fanout=2, jpeg_size=4096, raw_size=8192, xmp_size=1024)
+
+
+class TestBenchmarks(unittest.TestCase):
+    """Tests for the benchmark harness and synthetic library generator."""
+
+    def setUp(self):
+        """Create a temporary directory for tests."""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def _snapshot(self, root):
+        """Helper method returning {relative path: (bytes, mtime_ns)} for a tree."""
+        return {
+            str(path.relative_to(root)): (path.read_bytes(), path.stat().st_mtime_ns)
+            for path in Path(root).rglob('*') if path.is_file()
+        }
+
+    def test_generate_library_is_reproducible(self):
+        """Test the same spec produces identical libraries and a different seed does not."""
+        first = os.path.join(self.test_dir, 'first')
+        second = os.path.join(self.test_dir, 'second')
+        other = os.path.join(self.test_dir, 'other')
+
+        totals = generate_library(first, SMALL_SPEC)
+        generate_library(second, SMALL_SPEC)
+        generate_library(other, SMALL_SPEC._replace(seed=2))
+
+        self.assertEqual(self._snapshot(first), self._snapshot(second))
+        self.assertNotEqual(self._snapshot(first), self._snapshot(other))
+        self.assertEqual(sum(kind['files'] for kind in totals.values()), 40)
+        self.assertEqual(len([p for p in Path(first).rglob('*') if p.is_dir()]), 2 + 4)
+
+    def test_payloads_have_expected_compressibility(self):
+        """Test JPEG-like files are incompressible while RAW and XMP-like files compress."""
+        import zlib
+        root = Path(self.test_dir) / 'library'
+        generate_library(root, SMALL_SPEC._replace(files=200))
+
+        for kind, (low, high) in {'jpg': (0.98, 1.1), 'raw': (0.3, 0.8), 'xmp': (0.0, 0.5)}.items():
+            data = b''.join(path.read_bytes() for path in root.rglob(f'*.{kind}'))
+            with self.subTest(kind=kind):
+                self.assertTrue(low < len(zlib.compress(data)) / len(data) < high)
+
+    def test_apply_churn(self):
+        """Test churn modifies and adds the requested share of files."""
+        root = Path(self.test_dir) / 'library'
+        generate_library(root, SMALL_SPEC)
+        before = self._snapshot(root)
+
+        churned = apply_churn(root, 0.25, SMALL_SPEC)
+
+        after = self._snapshot(root)
+        self.assertEqual(churned, {'modified': 5, 'added': 5})
+        self.assertEqual(len(after), 45)
+        self.assertEqual(sum(1 for path, value in before.items() if after[path] != value), 5)
+
+    def test_run_and_compare(self):
+        """Test a small benchmark run reports every benchmark and compares to a baseline."""
+        results = run.run(SMALL_SPEC, self.test_dir, churn=0.1, codecs=('store',), volume_sizes=('', '64k'))
+
+        names = [result['name'] for result in results['results']]
+        self.assertEqual(names, ['scan_cold', 'scan_warm', 'rescan_churn', 'rescan_churn_paranoid',
+                                 'archive_store_single', 'archive_store_64k'])
+        by_name = {result['name']: result for result in results['results']}
+        self.assertEqual(by_name['scan_cold']['changed'], 40)
+        self.assertEqual(by_name['scan_warm']['changed'], 0)
+        self.assertEqual(by_name['rescan_churn_paranoid']['changed'], 4)
+        self.assertEqual(by_name['archive_store_64k']['files'], 42)
+
+        slower = {'spec': results['spec'], 'results': [dict(r, seconds=r['seconds'] * 2 + 1) for r in results['results']]}
+        _, regressions = run.compare(slower, results)
+        self.assertEqual(regressions, names)
+        _, regressions = run.compare(results, slower)
+        self.assertEqual(regressions, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import datetime
+import os
+import shutil
+import struct
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compression, restore
+from src.capture_date import CaptureDates, read_capture_date
+from src.manifest import load_manifest
+
+
+def make_tiff(date, order='>'):
+    """Returns a TIFF structure whose Exif IFD holds DateTimeOriginal."""
+    value = date.encode('ascii') + b'\0'
+    header = (b'MM' if order == '>' else b'II') + struct.pack(order + 'HI', 42, 8)
+    ifd0 = struct.pack(order + 'H', 1) + struct.pack(order + 'HHII', 0x8769, 4, 1, 26) + struct.pack(order + 'I', 0)
+    exif = struct.pack(order + 'H', 1) + struct.pack(order + 'HHII', 0x9003, 2, len(value), 44)
+    exif += struct.pack(order + 'I', 0)
+    return header + ifd0 + exif + value
+
+
+def make_jpeg(date):
+    tiff = make_tiff(date)
+    app1 = b'\xff\xe1' + struct.pack('>H', 2 + 6 + len(tiff)) + b'Exif\0\0' + tiff
+    return b'\xff\xd8' + app1 + b'\xff\xda' + os.urandom(2000) + b'\xff\xd9'
+
+
+def _box(kind, payload):
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
+
+
+def make_heic(date):
+    ftyp = _box(b'ftyp', b'heic' + b'\0\0\0\0' + b'mif1heic')
+    infe = _box(b'infe', b'\x02\0\0\0' + struct.pack('>HH', 1, 0) + b'Exif' + b'\0')
+    iinf = _box(b'iinf', b'\0\0\0\0' + struct.pack('>H', 1) + infe)
+    item = b'\0\0\0\x06' + b'Exif\0\0' + make_tiff(date)
+
+    def meta(offset):
+        iloc = _box(b'iloc', b'\0\0\0\0' + b'\x44\x00' + struct.pack('>HHHHII', 1, 1, 0, 1, offset, len(item)))
+        return _box(b'meta', b'\0\0\0\0' + iinf + iloc)
+    offset = len(ftyp) + len(meta(0)) + 8  # The item starts the media data
+    return ftyp + meta(offset) + _box(b'mdat', item + os.urandom(2000))
+
+
+class TestReadCaptureDate(unittest.TestCase):
+    """Tests for reading capture dates from file headers."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, name, content):
+        path = self.test_dir / name
+        path.write_bytes(content)
+        return path
+
+    def test_formats(self):
+        """Test the EXIF date is found in JPEG, TIFF (both byte orders) and HEIC files."""
+        self.assertEqual(read_capture_date(self._write('a.jpg', make_jpeg('2021:05:01 10:00:00'))), '2021-05-01')
+        self.assertEqual(read_capture_date(self._write('b.tif', make_tiff('2019:12:31 23:59:59', '<'))),
+                         '2019-12-31')
+        self.assertEqual(read_capture_date(self._write('c.dng', make_tiff('2018:01:02 00:00:00', '>'))),
+                         '2018-01-02')
+        self.assertEqual(read_capture_date(self._write('d.heic', make_heic('2023:07:14 12:00:00'))), '2023-07-14')
+
+    def test_missing_or_unusable_dates(self):
+        """Test files without a plausible capture date give None instead of failing."""
+        self.assertIsNone(read_capture_date(self._write('a.jpg', make_jpeg('0000:00:00 00:00:00'))))
+        self.assertIsNone(read_capture_date(self._write('b.txt', b'not a photo')))
+        self.assertIsNone(read_capture_date(self._write('c.jpg', make_jpeg('2021:05:01 10:00:00')[:30])))
+
+    def test_cache_and_fallback(self):
+        """Test cached dates are used while size and mtime match, and the mtime is the fallback."""
+        photo = self._write('a.jpg', make_jpeg('2021:05:01 10:00:00'))
+        other = self._write('b.txt', b'no date')
+        mtime = datetime.datetime(2022, 3, 4, 12, 0).timestamp()
+        os.utime(other, (mtime, mtime))
+
+        first = CaptureDates('month')
+        self.assertEqual(first.bucket(first.capture_date(photo, 'a.jpg', photo.stat()), 0), '2021-05')
+        st = other.stat()
+        self.assertEqual(first.bucket(first.capture_date(other, 'b.txt', st), st.st_mtime_ns), '2022-03')
+        self.assertEqual(set(first.extracted), {'a.jpg', 'b.txt'})
+
+        second = CaptureDates('year', cache=first.extracted)
+        self.assertEqual(second.capture_date(photo, 'a.jpg', photo.stat()), '2021-05-01')
+        self.assertEqual((second.cache_hits, second.extracted), (1, {}))
+        photo.write_bytes(make_jpeg('2020:01:01 00:00:00'))  # Changed: read again
+        self.assertEqual(second.capture_date(photo, 'a.jpg', photo.stat()), '2020-01-01')
+        self.assertIn('a.jpg', second.extracted)
+        with self.assertRaises(ValueError):
+            CaptureDates('week')
+
+
+class TestPartitionedArchive(unittest.TestCase):
+    """Tests for archives whose volumes are partitioned by capture date."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.source_dir = self.test_dir / 'source'
+        self.dest_dir = self.test_dir / 'dest'
+        self.source_dir.mkdir()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_volumes_hold_one_year_each(self):
+        """Test every volume holds a single year and a year can be restored from its volumes alone."""
+        contents = {
+            'a.jpg': make_jpeg('2021:05:01 10:00:00'),
+            'b.heic': make_heic('2023:07:14 12:00:00'),
+            'c.jpg': make_jpeg('2021:11:30 08:00:00'),
+            'notes.txt': b'no capture date',
+        }
+        for name, content in contents.items():
+            (self.source_dir / name).write_bytes(content)
+        mtime = datetime.datetime(2022, 6, 1, 12, 0).timestamp()
+        os.utime(self.source_dir / 'notes.txt', (mtime, mtime))
+
+        partition = CaptureDates('year')
+        files = [self.source_dir / name for name in sorted(contents)]
+        self.assertTrue(compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                                   partition=partition))
+        manifest_path = self.dest_dir / 'source.manifest.jsonl'
+        manifest = load_manifest(manifest_path)
+        self.assertEqual(manifest.header['partition'], 'year')
+        buckets = {volume['bucket']: volume['name'] for volume in manifest.volumes.values()}
+        self.assertEqual(sorted(buckets), ['2021', '2022', '2023'])
+        self.assertEqual(buckets['2021'], f"source.2021.{manifest.files['a.jpg']['volume']:03d}.tar.gz")
+        self.assertEqual(manifest.files['c.jpg']['volume'], manifest.files['a.jpg']['volume'])
+        self.assertEqual(manifest.files['b.heic']['taken'], '2023-07-14')
+        self.assertNotIn('taken', manifest.files['notes.txt'])
+
+        # Only the 2021 volume is needed.
+        for name in ('2022', '2023'):
+            (self.dest_dir / buckets[name]).unlink()
+        target = self.test_dir / 'restored'
+        restored, failed = restore.restore(manifest_path, ['*'], target, taken='2021')
+        self.assertEqual((restored, failed), (2, 0))
+        self.assertEqual(sorted(path.name for path in target.iterdir()), ['a.jpg', 'c.jpg'])
+        self.assertEqual((target / 'c.jpg').read_bytes(), contents['c.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
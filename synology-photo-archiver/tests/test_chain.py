@@ -0,0 +1,243 @@
+import unittest
+import json
+import os
+import sqlite3
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compact, main, restore, verify
+from src.chain import ArchiveChain, ChainView, load_chain
+from src.config import load_config
+from src.manifest import load_manifest
+from src.state import StateStore
+
+
+class TestArchiveChain(unittest.TestCase):
+    """Tests for full and delta generations written by the archiver."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.test_dir, 'config.ini')
+        self.state_path = os.path.join(self.test_dir, 'state.db')
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        self.dest_dir = os.path.join(self.test_dir, 'dest')
+        os.makedirs(self.source_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _create_config(self, compact_after=0):
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            f.write('[Paths]\n')
+            f.write(f'source_dir = {self.source_dir}\n')
+            f.write(f'destination_dir = {self.dest_dir}\n')
+            f.write('7z_executable = /usr/bin/7z\n')
+            f.write('[Archive]\n')
+            f.write('password =\n')
+            f.write('volume_size = 0\n')
+            f.write('deduplicate = true\n')
+            f.write('[State]\n')
+            f.write(f'file = {self.state_path}\n')
+            f.write('[Chain]\n')
+            f.write(f'compact_after = {compact_after}\n')
+
+    def _write(self, relative_path, content):
+        path = Path(self.source_dir) / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+    def _run(self):
+        with patch('src.main.load_config', return_value=load_config(self.config_path)):
+            main.main([])
+
+    def _chain(self):
+        return load_chain(self.dest_dir, 'source')
+
+    def _restore(self, *extra):
+        target = tempfile.mkdtemp(dir=self.test_dir)
+        restore.main(['--config', self.config_path, '--target', target, '*', *extra])
+        return {str(path.relative_to(target)): path.read_bytes() for path in Path(target).rglob('*') if path.is_file()}
+
+    def test_delta_holds_changes_and_tombstones(self):
+        """Test a run after the first writes only what changed, and deletions as tombstones."""
+        self._create_config()
+        self._write('album/a.jpg', b'a' * 5000)
+        self._write('album/b.jpg', b'b' * 5000)
+        self._run()
+        self._write('album/a.jpg', b'A' * 6000)
+        os.remove(Path(self.source_dir) / 'album' / 'b.jpg')
+        self._write('album/c.jpg', b'c' * 7000)
+        self._run()
+
+        chain = self._chain()
+        full, delta = chain.current()
+        self.assertEqual((full['kind'], delta['kind'], delta['base']), ('full', 'delta', full['archive_id']))
+        manifest = load_manifest(chain.manifest_path(delta))
+        self.assertEqual(sorted(manifest.files), ['album/a.jpg', 'album/c.jpg'])
+        self.assertEqual(manifest.tombstones, {'album/b.jpg'})
+        self.assertEqual(sorted(ChainView(chain, chain.current()).entries), ['album/a.jpg', 'album/c.jpg'])
+        with StateStore(self.state_path) as state:
+            self.assertNotIn('album/b.jpg', state.load_files())
+
+        self.assertEqual(self._restore(), {'album/a.jpg': b'A' * 6000, 'album/c.jpg': b'c' * 7000})
+        # The library as of the first generation still has the deleted file.
+        self.assertEqual(self._restore('--as-of', full['archive_id']),
+                         {'album/a.jpg': b'a' * 5000, 'album/b.jpg': b'b' * 5000})
+
+    def test_deletions_alone_write_a_delta(self):
+        """Test a run that only finds deleted files still records them."""
+        self._create_config()
+        self._write('a.jpg', b'a' * 5000)
+        self._write('b.jpg', b'b' * 5000)
+        self._run()
+        os.remove(Path(self.source_dir) / 'b.jpg')
+        self._run()
+
+        delta = self._chain().current()[-1]
+        self.assertEqual(delta['kind'], 'delta')
+        self.assertEqual(load_manifest(self._chain().manifest_path(delta)).tombstones, {'b.jpg'})
+
+    def test_file_moved_twice_refers_to_its_stored_copy(self):
+        """Test a reference to a moved file points at the generation holding its bytes, not at another reference."""
+        self._create_config()
+        self._write('a.jpg', b'a' * 5000)
+        self._run()
+        os.rename(Path(self.source_dir) / 'a.jpg', Path(self.source_dir) / 'b.jpg')
+        self._run()
+        os.rename(Path(self.source_dir) / 'b.jpg', Path(self.source_dir) / 'c.jpg')
+        self._run()
+
+        chain = self._chain()
+        full, _, second = chain.current()
+        reference = load_manifest(chain.manifest_path(second)).references['c.jpg']
+        self.assertEqual((reference['target'], reference['target_archive']), ('a.jpg', full['archive_id']))
+        with StateStore(self.state_path) as state:
+            self.assertEqual(state.stored_at('c.jpg'), ('a.jpg', full['archive_id']))
+            self.assertEqual(state.load_files()['c.jpg'].archive_id, full['archive_id'])
+        self.assertEqual(self._restore(), {'c.jpg': b'a' * 5000})
+
+    def test_file_unreadable_during_the_archive_is_archived_next_run(self):
+        """Test a file that cannot be stat'ed by the archiver is not recorded, so the next run archives it."""
+        self._create_config()
+        self._write('album/a.jpg', b'a' * 5000)
+        self._write('album/b.jpg', b'b' * 5000)
+        stat = os.stat
+
+        def failing_stat(path, *args, **kwargs):
+            if Path(path).name == 'b.jpg':
+                raise FileNotFoundError(2, 'No such file or directory', str(path))
+            return stat(path, *args, **kwargs)
+        with patch('src.compression.os.stat', failing_stat):
+            self._run()
+        with StateStore(self.state_path) as state:
+            self.assertEqual(list(state.load_files()), ['album/a.jpg'])
+
+        self._run()
+        delta = self._chain().current()[-1]
+        self.assertEqual(list(load_manifest(self._chain().manifest_path(delta)).files), ['album/b.jpg'])
+        self.assertEqual(self._restore(), {'album/a.jpg': b'a' * 5000, 'album/b.jpg': b'b' * 5000})
+
+    def _reference_chain(self):
+        """Moves a file twice with a state that does not record where references point, as older versions did."""
+        self._create_config()
+        self._write('a.jpg', b'a' * 5000)
+        self._run()
+        os.rename(Path(self.source_dir) / 'a.jpg', Path(self.source_dir) / 'b.jpg')
+        self._run()
+        with sqlite3.connect(self.state_path) as conn:
+            conn.execute('DELETE FROM refs')
+            conn.execute('UPDATE files SET archive_id = ?', (self._chain().current()[1]['archive_id'],))
+        os.rename(Path(self.source_dir) / 'b.jpg', Path(self.source_dir) / 'c.jpg')
+        self._run()
+        chain = self._chain()
+        _, first, second = chain.current()
+        self.assertEqual(load_manifest(chain.manifest_path(second)).references['c.jpg']['target'], 'b.jpg')
+        return chain, first
+
+    def test_reference_to_a_reference_is_restored_compacted_and_pruned(self):
+        """Test references are followed through other references until the stored copy."""
+        chain, _ = self._reference_chain()
+        self.assertEqual(self._restore(), {'c.jpg': b'a' * 5000})
+
+        compacted = compact.compact(chain, self.source_dir)
+        self.assertIsNotNone(compacted)
+        self.assertEqual(sorted(load_manifest(chain.manifest_path(chain.current()[0])).files), ['c.jpg'])
+        self.assertEqual(len(chain.prune(keep_chains=1)), 3)
+        self.assertEqual(self._restore(), {'c.jpg': b'a' * 5000})
+
+    def test_compaction_stops_when_content_cannot_be_located(self):
+        """Test a reference cycle aborts compaction and leaves the chain, so nothing is pruned."""
+        chain, first = self._reference_chain()
+        manifest_path = chain.manifest_path(first)
+        records = [json.loads(line) for line in manifest_path.read_text(encoding='utf-8').splitlines()]
+        for record in records:
+            if record['type'] == 'ref':  # b.jpg now points back at c.jpg, which points at b.jpg
+                record.update(target='c.jpg', target_archive=chain.current()[2]['archive_id'])
+        manifest_path.write_text(''.join(json.dumps(record) + '\n' for record in records), encoding='utf-8')
+        generations = [generation['archive_id'] for generation in chain.generations]
+
+        self.assertIsNone(ChainView(chain, chain.current()).record('c.jpg'))
+        self.assertIsNone(compact.compact(chain, self.source_dir))
+        self.assertEqual([generation['archive_id'] for generation in self._chain().generations], generations)
+        self.assertEqual(chain.prune(keep_chains=1), [])
+
+    def test_compaction_merges_deltas_into_a_new_full(self):
+        """Test the chain is compacted after compact_after deltas, without reading the source."""
+        self._create_config(compact_after=2)
+        self._write('a.jpg', b'a' * 5000)
+        self._write('b.jpg', b'b' * 5000)
+        self._run()
+        self._write('copy_of_a.jpg', b'a' * 5000)  # Deduplicated against the full
+        self._run()
+        os.remove(Path(self.source_dir) / 'b.jpg')
+        self._write('c.jpg', b'c' * 5000)
+        self._run()
+
+        chain = self._chain()
+        current = chain.current()
+        self.assertEqual(len(current), 1)
+        self.assertEqual(len(current[0]['compacted_from']), 3)
+        manifest = load_manifest(chain.manifest_path(current[0]))
+        self.assertEqual(sorted(manifest.files), ['a.jpg', 'c.jpg'])
+        self.assertEqual(manifest.references['copy_of_a.jpg']['target'], 'a.jpg')
+        with StateStore(self.state_path) as state:
+            self.assertEqual({record.archive_id for record in state.load_files().values()},
+                             {current[0]['archive_id']})
+
+        expected = {'a.jpg': b'a' * 5000, 'copy_of_a.jpg': b'a' * 5000, 'c.jpg': b'c' * 5000}
+        self.assertEqual(self._restore(), expected)
+        verify.main(['--config', self.config_path, '--tier', 'full'])  # Exits non-zero on problems
+
+
+class TestChainRetention(unittest.TestCase):
+    """Tests for pruning old chains."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_prune_keeps_the_most_recent_chains(self):
+        """Test pruning deletes the generations and files of older chains only."""
+        chain = ArchiveChain(self.test_dir / 'photo.chain.json')
+        for archive_id, kind in [('1', 'full'), ('2', 'delta'), ('3', 'full'), ('4', 'delta'), ('5', 'full')]:
+            name = chain.begin(archive_id, kind)
+            (self.test_dir / f"{name}.000.tar.gz").write_bytes(b'x')
+            chain.complete(archive_id)
+
+        removed = chain.prune(keep_chains=2)
+        self.assertEqual([generation['archive_id'] for generation in removed], ['1', '2'])
+        self.assertEqual(sorted(path.name for path in self.test_dir.glob('*.tar.gz')),
+                         ['photo.3.full.000.tar.gz', 'photo.4.delta.000.tar.gz', 'photo.5.full.000.tar.gz'])
+        reloaded = load_chain(self.test_dir, 'photo')
+        self.assertEqual([generation['archive_id'] for generation in reloaded.current()], ['5'])
+        self.assertEqual(chain.prune(keep_chains=2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
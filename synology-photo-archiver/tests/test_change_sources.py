@@ -0,0 +1,142 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import change_sources
+from src.journal import ChangeJournal, JournalPosition, format_position, parse_position
+from src.state import FileRecord, StateStore
+
+
+class TestChangeSources(unittest.TestCase):
+    """Tests for the change journal and the change sources."""
+
+    def setUp(self):
+        """Create a source directory, a state store and a journal."""
+        self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        os.makedirs(os.path.join(self.source_dir, 'album'))
+        self.journal_path = os.path.join(self.test_dir, 'changes.db')
+        self.journal = ChangeJournal(self.journal_path)
+        self.state = StateStore(os.path.join(self.test_dir, 'state.db'))
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        self.state.close()
+        self.journal.close()
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, relative_path, data=b'data'):
+        path = Path(self.source_dir) / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return path
+
+    def _open(self):
+        return change_sources.open_change_source('journal', self.source_dir, self.state, self.journal_path)
+
+    def _commit(self, source, processed):
+        """Runs a source to completion and commits like main does; returns the changed paths."""
+        changed = dict(source.changes(processed))
+        processed.update((path, record._replace(archive_id='run')) for path, record in changed.items())
+        self.state.commit_files({}, source.dir_summaries, meta=source.meta)
+        source.acknowledge()
+        return sorted(changed)
+
+    def test_position_round_trip(self):
+        """Test journal positions survive the state's meta table."""
+        self.assertEqual(parse_position(format_position(JournalPosition(3, 42))), (3, 42))
+        self.assertIsNone(parse_position(None))
+        self.assertIsNone(parse_position('garbage'))
+
+    def test_walk_when_no_watcher(self):
+        """Test the full walk is used while no watcher session is live."""
+        self._write('album/a.jpg')
+        source = self._open()
+        self.assertEqual(source.name, 'walk')
+        self.assertIsNone(source.meta)
+        self.assertEqual(self._commit(source, {}), ['album/a.jpg'])
+
+    def test_journal_after_first_walk(self):
+        """Test a walk records the journal position, and the next run reads only logged changes."""
+        session = self.journal.start_session(self.source_dir)
+        self.journal.mark_ready(session)
+        self._write('album/a.jpg')
+        self._write('album/b.jpg')
+        processed = {}
+
+        first = self._open()
+        self.assertEqual(first.name, 'walk')  # No position from a previous run yet
+        self.assertEqual(self._commit(first, processed), ['album/a.jpg', 'album/b.jpg'])
+
+        # b changes without an event: only the journal's events are looked at.
+        self._write('album/b.jpg', b'changed')
+        self._write('album/c.jpg')
+        self._write('new/deep/d.jpg')
+        self.journal.add_events(session, [('file', 'album/c.jpg'), ('dir', 'new'),
+                                          ('file', 'new/deep/d.jpg'), ('delete', 'album/gone.jpg')])
+        second = self._open()
+        self.assertEqual(second.name, 'journal')
+        self.assertIsNone(second.dir_summaries)
+        self.assertEqual(self._commit(second, processed), ['album/c.jpg', 'new/deep/d.jpg'])
+
+        # Consumed events are pruned and nothing is left to do.
+        self.assertEqual(self.journal.events(0, 1000), [])
+        self.assertEqual(self._commit(self._open(), processed), [])
+
+    def test_gaps_fall_back_to_walk(self):
+        """Test overflows, restarts and stopped or silent watchers force a full walk."""
+        session = self.journal.start_session(self.source_dir)
+        self.journal.mark_ready(session)
+        self._write('album/a.jpg')
+        processed = {}
+        self._commit(self._open(), processed)
+
+        self.journal.add_events(session, [('overflow', '')])
+        self.assertEqual(self._open().name, 'walk')
+        self._commit(self._open(), processed)
+        self.assertEqual(self._open().name, 'journal')
+
+        self.journal._conn.execute('UPDATE sessions SET heartbeat = ?', (time.time() - 3600,))
+        self.assertEqual(self._open().name, 'walk')
+
+        self.journal.stop_session(session)
+        restarted = self.journal.start_session(self.source_dir)
+        self.journal.mark_ready(restarted)
+        self.assertEqual(self._open().name, 'walk')
+
+    def test_paranoid_and_walk_ignore_journal(self):
+        """Test paranoid mode and the walk source never trust the journal."""
+        session = self.journal.start_session(self.source_dir)
+        self.journal.mark_ready(session)
+        self.state.commit_files({}, meta={change_sources.JOURNAL_POSITION_KEY: '1:0'})
+        source = change_sources.open_change_source('journal', self.source_dir, self.state, self.journal_path,
+                                                   paranoid=True)
+        self.assertEqual(source.name, 'walk')
+        source = change_sources.open_change_source('walk', self.source_dir, self.state, self.journal_path)
+        self.assertEqual(source.name, 'walk')
+        self.assertIsNone(source.meta)
+
+    def test_unknown_source(self):
+        """Test an unknown change source is a configuration error."""
+        with self.assertRaises(SystemExit):
+            change_sources.open_change_source('btrfs', self.source_dir, self.state)
+
+    def test_journal_source_skips_unchanged_files(self):
+        """Test logged files that match the processed record are not reported."""
+        session = self.journal.start_session(self.source_dir)
+        self.journal.mark_ready(session)
+        path = self._write('album/a.jpg')
+        st = path.stat()
+        processed = {'album/a.jpg': FileRecord(st.st_size, st.st_mtime_ns, st.st_ino, 'run')}
+        self._commit(self._open(), processed)
+        self.journal.add_events(session, [('file', 'album/a.jpg')])
+        self.assertEqual(self._commit(self._open(), processed), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
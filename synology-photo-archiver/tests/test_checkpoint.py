@@ -0,0 +1,159 @@
+import unittest
+import os
+import shutil
+import tarfile
+import tempfile
+import sys
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compression
+from src.checkpoint import journal_path, load_checkpoint
+from src.manifest import load_manifest
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Tests for resuming interrupted archive runs."""
+
+    def setUp(self):
+        """Create a source tree of files that fill several volumes."""
+        self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        self.dest_dir = os.path.join(self.test_dir, 'dest')
+        os.makedirs(self.source_dir)
+        self.files = []
+        for i in range(8):
+            path = Path(self.source_dir) / f'photo{i}.jpg'
+            path.write_bytes(os.urandom(30000))
+            self.files.append(path)
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def _archive(self, **kwargs):
+        return compression.create_archive(self.files, self.source_dir, self.dest_dir, 'tar', '', '64k',
+                                          archive_id='run1', resumable=True, **kwargs)
+
+    def _interrupted_archive(self, fail_at):
+        """Helper method running an archive whose fail_at-th file cannot be read."""
+        add_file = compression.TarStreamWriter.add_file
+        calls = []
+
+        def failing_add_file(writer, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == fail_at:
+                raise OSError('simulated interruption')
+            return add_file(writer, *args, **kwargs)
+
+        with mock.patch.object(compression.TarStreamWriter, 'add_file', failing_add_file):
+            self.assertFalse(self._archive())
+
+    def test_failed_run_keeps_completed_volumes(self):
+        """Test completed volumes and the journal survive a failure; the partial volume does not."""
+        self._interrupted_archive(fail_at=6)
+
+        checkpoint = load_checkpoint(self.dest_dir, 'source')
+
+        self.assertEqual(checkpoint.archive_id, 'run1')
+        self.assertEqual(sorted(checkpoint.volumes), [0, 1])
+        self.assertEqual(checkpoint.next_volume_index, 2)
+        self.assertEqual(len(checkpoint.files), 4)
+        self.assertTrue(Path(self.dest_dir, 'source.001.tar.gz').exists())
+        self.assertFalse(Path(self.dest_dir, 'source.002.tar.gz').exists())
+        self.assertFalse(Path(self.dest_dir, 'source.manifest.jsonl').exists())
+
+    def test_failure_after_the_last_volume_keeps_it(self):
+        """Test a failure once every volume is journaled (here, while finding deletions) deletes no volume."""
+        def failing_tombstones():
+            raise OSError('simulated interruption')
+            yield
+
+        self.assertFalse(self._archive(tombstones=failing_tombstones()))
+
+        checkpoint = load_checkpoint(self.dest_dir, 'source')
+        self.assertEqual(sorted(checkpoint.volumes), [0, 1, 2, 3])
+        self.assertEqual(len(checkpoint.files), 8)
+        self.assertTrue(Path(self.dest_dir, 'source.003.tar.gz').exists())
+
+    def test_resume_only_writes_unfinished_volumes(self):
+        """Test a resumed run keeps completed volumes untouched and finishes the archive."""
+        self._interrupted_archive(fail_at=6)
+        first_volume = Path(self.dest_dir, 'source.000.tar.gz')
+        first_volume_stat = first_volume.stat()
+        checkpoint = load_checkpoint(self.dest_dir, 'source')
+
+        with mock.patch.object(compression.TarStreamWriter, 'add_file',
+                               autospec=True, side_effect=compression.TarStreamWriter.add_file) as add_file:
+            self.assertTrue(self._archive(checkpoint=checkpoint))
+
+        self.assertEqual(add_file.call_count, 4)
+        self.assertEqual(first_volume.stat().st_mtime_ns, first_volume_stat.st_mtime_ns)
+        self.assertFalse(journal_path(self.dest_dir, 'source').exists())
+        manifest = load_manifest(os.path.join(self.dest_dir, 'source.manifest.jsonl'))
+        self.assertEqual(manifest.header['archive_id'], 'run1')
+        self.assertEqual(sorted(manifest.volumes), [0, 1, 2, 3])
+        self.assertEqual(set(manifest.files), {path.name for path in self.files})
+        for index, volume in manifest.volumes.items():
+            with tarfile.open(os.path.join(self.dest_dir, volume['name'])) as tar:
+                expected = {record['member'] for record in manifest.files_in_volume(index)}
+                self.assertEqual(set(tar.getnames()), expected)
+
+    def test_file_changed_since_interruption_is_archived_again(self):
+        """Test a file in a completed volume that changed afterwards goes into a new volume."""
+        self._interrupted_archive(fail_at=6)
+        checkpoint = load_checkpoint(self.dest_dir, 'source')
+        changed = next(path for path in self.files if path.name in checkpoint.files)
+        changed.write_bytes(os.urandom(100))
+
+        self.assertTrue(self._archive(checkpoint=checkpoint))
+
+        manifest = load_manifest(os.path.join(self.dest_dir, 'source.manifest.jsonl'))
+        self.assertGreaterEqual(manifest.files[changed.name]['volume'], 2)
+        self.assertEqual(manifest.files[changed.name]['size'], 100)
+
+    def test_truncated_volume_is_not_complete(self):
+        """Test a journaled volume that is shorter on disk ends the completed part."""
+        self._interrupted_archive(fail_at=6)
+        with open(Path(self.dest_dir, 'source.001.tar.gz'), 'r+b') as f:
+            f.truncate(100)
+
+        checkpoint = load_checkpoint(self.dest_dir, 'source')
+
+        self.assertEqual(sorted(checkpoint.volumes), [0])
+        self.assertEqual(len(checkpoint.files), 2)
+
+    def test_torn_journal_line_is_ignored(self):
+        """Test a half-written record at the end of the journal is dropped."""
+        self._interrupted_archive(fail_at=6)
+        path = journal_path(self.dest_dir, 'source')
+        with open(path, 'ab') as f:
+            f.write(b'{"type":"volume","ind')
+
+        checkpoint = load_checkpoint(self.dest_dir, 'source')
+
+        self.assertEqual(sorted(checkpoint.volumes), [0, 1])
+        self.assertLess(checkpoint.resume_offset, path.stat().st_size)
+
+    def test_changed_settings_discard_checkpoint(self):
+        """Test a checkpoint written with another codec is discarded, not continued."""
+        self._interrupted_archive(fail_at=6)
+        checkpoint = load_checkpoint(self.dest_dir, 'source')
+
+        self.assertTrue(self._archive(checkpoint=checkpoint, codec='store'))
+
+        self.assertEqual(sorted(p.name for p in Path(self.dest_dir).glob('*.tar.gz')), [])
+        manifest = load_manifest(os.path.join(self.dest_dir, 'source.manifest.jsonl'))
+        self.assertEqual(manifest.header['codec'], 'store')
+        self.assertEqual(len(manifest.files), len(self.files))
+
+    def test_no_journal(self):
+        """Test there is no checkpoint without an interrupted run."""
+        self.assertIsNone(load_checkpoint(self.dest_dir, 'source'))
+        self.assertTrue(self._archive())
+        self.assertIsNone(load_checkpoint(self.dest_dir, 'source'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import gzip
+import lzma
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import codec
+
+
+class TestCodec(unittest.TestCase):
+    """Tests for the codec module."""
+
+    def _compress(self, name, *chunks, level=None):
+        """Helper method compressing chunks into one member."""
+        compressor = codec.get_codec(name).compressor(level)
+        return b''.join(compressor.compress(chunk) for chunk in chunks) + compressor.flush()
+
+    def test_store_is_passthrough(self):
+        """Test the store codec does not alter data."""
+        self.assertEqual(self._compress('store', b'abc', b'def'), b'abcdef')
+
+    def test_gzip_round_trip_and_deterministic(self):
+        """Test gzip members decode and identical input gives identical output."""
+        data = b'photo' * 1000
+        first = self._compress('gzip', data)
+        self.assertEqual(gzip.decompress(first), data)
+        self.assertEqual(first, self._compress('gzip', data))
+
+    def test_xz_round_trip(self):
+        """Test xz members decode."""
+        data = b'raw' * 1000
+        self.assertEqual(lzma.decompress(self._compress('xz', data, level=1)), data)
+
+    def test_concatenated_members_decode(self):
+        """Test independently compressed members can be concatenated."""
+        joined = self._compress('gzip', b'first ') + self._compress('gzip', b'second', level=0)
+        self.assertEqual(gzip.decompress(joined), b'first second')
+
+    @unittest.skipUnless(codec.zstandard, 'zstandard not installed')
+    def test_zstd_round_trip(self):
+        """Test zstd frames decode."""
+        data = b'raw' * 1000
+        decompressor = codec.zstandard.ZstdDecompressor()
+        self.assertEqual(decompressor.decompressobj().decompress(self._compress('zstd', data)), data)
+
+    def _stream(self, compressor, chunks, levels=()):
+        """Helper method feeding chunks (switching level before chunk i if given)."""
+        output = bytearray()
+        for i, chunk in enumerate(chunks):
+            if i in dict(levels):
+                output += compressor.set_level(dict(levels)[i])
+            output += compressor.compress(chunk)
+        return bytes(output + compressor.flush())
+
+    def test_parallel_matches_serial_content(self):
+        """Test parallel blocks decode to the same stream as serial compression."""
+        chunks = [os.urandom(1000) * 70 for _ in range(10)]
+        gzip_codec = codec.get_codec('gzip')
+
+        serial = self._stream(codec.StreamCompressor(gzip_codec), chunks, levels=[(4, 0), (7, 6)])
+        parallel = self._stream(
+            codec.ParallelStreamCompressor(gzip_codec, workers=3, block_size=50000), chunks, levels=[(4, 0), (7, 6)]
+        )
+
+        self.assertEqual(gzip.decompress(serial), b''.join(chunks))
+        self.assertEqual(gzip.decompress(parallel), b''.join(chunks))
+
+    def test_parallel_output_is_deterministic(self):
+        """Test repeated parallel runs give byte-identical output."""
+        chunks = [os.urandom(20000) for _ in range(20)]
+        xz_codec = codec.get_codec('xz')
+
+        outputs = {
+            self._stream(codec.ParallelStreamCompressor(xz_codec, level=0, workers=4, block_size=30000), chunks)
+            for _ in range(3)
+        }
+
+        self.assertEqual(len(outputs), 1)
+        self.assertEqual(lzma.decompress(outputs.pop()), b''.join(chunks))
+
+    def test_parallel_close_stops_workers(self):
+        """Test closing an unfinished parallel compressor stops its threads, and closing again is harmless."""
+        compressor = codec.ParallelStreamCompressor(codec.get_codec('gzip'), workers=2, block_size=1000)
+        compressor.compress(os.urandom(20000))
+        compressor.close()
+        compressor.close()
+        self.assertFalse(any(thread.is_alive() for thread in compressor._pool._threads))
+
+    def test_open_compressor_selects_implementation(self):
+        """Test workers > 1 selects the parallel compressor (except for store)."""
+        self.assertIsInstance(codec.open_compressor(codec.get_codec('gzip')), codec.StreamCompressor)
+        parallel = codec.open_compressor(codec.get_codec('gzip'), workers=2)
+        self.assertIsInstance(parallel, codec.ParallelStreamCompressor)
+        parallel.flush()
+        self.assertIsInstance(codec.open_compressor(codec.get_codec('store'), workers=4), codec.StreamCompressor)
+
+    def test_get_codec_is_case_insensitive(self):
+        """Test codec names are normalised."""
+        self.assertIs(codec.get_codec(' GZip '), codec.CODECS['gzip'])
+
+    def test_unavailable_codec_exits(self):
+        """Test asking for a codec whose dependency is missing exits."""
+        missing = codec.Codec('fake', '.tar.fake', 0, 0, None, available=False)
+        codec.CODECS['fake'] = missing
+        try:
+            with self.assertRaises(SystemExit) as cm:
+                codec.get_codec('fake')
+            self.assertEqual(cm.exception.code, 1)
+        finally:
+            del codec.CODECS['fake']
+
+
+if __name__ == '__main__':
+    unittest.main()
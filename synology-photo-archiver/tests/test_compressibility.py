@@ -0,0 +1,67 @@
+import unittest
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compressibility
+from src.compressibility import CompressibilityPolicy, CompressionReport
+
+
+def _stat(size, mtime_ns):
+    """Helper building the stat fields the policy looks at."""
+    return SimpleNamespace(st_size=size, st_mtime_ns=mtime_ns)
+
+
+class TestCompressibility(unittest.TestCase):
+    """Tests for the compressibility module."""
+
+    def test_probe_detects_random_and_text(self):
+        """Test the probe rejects random data and accepts repetitive data."""
+        self.assertFalse(compressibility.probe_compressibility(os.urandom(32 * 1024)))
+        self.assertTrue(compressibility.probe_compressibility(b'<x:xmpmeta>' * 3000))
+
+    def test_known_extensions_skip_probe(self):
+        """Test known extensions decide without probing or caching."""
+        policy = CompressibilityPolicy()
+
+        self.assertFalse(policy.should_compress('2020/IMG_0001.JPG', _stat(10, 1), b'a' * 4096))
+        self.assertTrue(policy.should_compress('2020/IMG_0001.xmp', _stat(10, 1), os.urandom(4096)))
+        self.assertEqual(policy.decisions, {})
+
+    def test_unknown_extension_is_probed_and_recorded(self):
+        """Test unknown extensions are probed and the result recorded for the state."""
+        policy = CompressibilityPolicy()
+
+        self.assertFalse(policy.should_compress('raw/IMG_0001.CR3', _stat(4096, 7), os.urandom(4096)))
+        self.assertEqual(policy.decisions, {'raw/IMG_0001.CR3': (4096, 7, False)})
+
+    def test_cache_used_only_when_size_and_mtime_match(self):
+        """Test cached results apply only to the same version of a file."""
+        cache = {'raw/a.dng': (4096, 7, True)}
+        policy = CompressibilityPolicy(cache)
+
+        # Same version: cached answer, even though the sample looks random
+        self.assertTrue(policy.should_compress('raw/a.dng', _stat(4096, 7), os.urandom(4096)))
+        self.assertEqual(policy.cache_hits, 1)
+        # Modified: probed again
+        self.assertFalse(policy.should_compress('raw/a.dng', _stat(4096, 8), os.urandom(4096)))
+        self.assertEqual(policy.decisions, {'raw/a.dng': (4096, 8, False)})
+
+    def test_report_totals_per_type(self):
+        """Test the report aggregates per extension, largest input first."""
+        report = CompressionReport()
+        report.add('.jpg', 1000, 1000, 0.01, False)
+        report.add('.jpg', 3000, 3000, 0.02, False)
+        report.add('.xmp', 500, 100, 0.5, True)
+
+        rows = report.rows()
+
+        self.assertEqual(rows[0][:3], ('.jpg', 2, 4000))
+        self.assertEqual(rows[0][5], 2)
+        self.assertEqual(rows[1][:4], ('.xmp', 1, 500, 100))
+        self.assertEqual(len(report.format()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
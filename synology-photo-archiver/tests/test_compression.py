@@ -1,14 +1,21 @@
 import unittest
+import hashlib
 import os
 import shutil
 import subprocess
+import tarfile
 import tempfile
 import sys
 from pathlib import Path
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import patch
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
 from src import compression
+from src.codec import CODECS, ParallelStreamCompressor
+from src.compressibility import CompressibilityPolicy
+from src import dedup
+from src.manifest import load_manifest
+from src.readahead import ReadOptions
 
 
 class TestCompression(unittest.TestCase):
@@ -17,107 +24,307 @@ class TestCompression(unittest.TestCase):
     def setUp(self):
         """Create a temporary directory for tests."""
         self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        self.dest_dir = os.path.join(self.test_dir, 'dest')
+        os.makedirs(os.path.join(self.source_dir, 'album'))
 
     def tearDown(self):
         """Remove the directory after the test."""
         shutil.rmtree(self.test_dir)
 
-    @patch('subprocess.run')
-    def test_create_archive_no_split_success(self, mock_run):
+    def _make_files(self):
+        """Helper method creating a few files with distinct contents."""
+        contents = {
+            'file1.jpg': os.urandom(3000),
+            os.path.join('album', 'file2.png'): b'png' * 50000,
+            'empty.txt': b'',
+        }
+        files = []
+        for relative_path, data in contents.items():
+            path = Path(self.source_dir) / relative_path
+            path.write_bytes(data)
+            files.append(path)
+        return files, contents
+
+    def _read_members(self, archive_path):
+        """Helper method returning {member name: bytes} from a tar archive."""
+        with tarfile.open(archive_path) as tar:
+            return {m.name: tar.extractfile(m).read() for m in tar.getmembers()}
+
+    def _expected_members(self, contents):
+        return {
+            compression.archive_member_name(Path(self.source_dir) / rel): data
+            for rel, data in contents.items()
+        }
+
+    def test_create_archive_no_split_success(self):
         """Test successful archive creation without splitting."""
-        mock_run.return_value = MagicMock(returncode=0, stdout="Everything is fine")
-        
-        files = [Path('file1.jpg'), Path('file2.png')]
-        source_dir = '/tmp/source'
-        dest_dir = self.test_dir
-        seven_zip = 'tar' # Mimic standard tar executable name
-        password = 'secret_pass'
-        volume = '0' # Disable splitting
-        
-        success = compression.create_archive(files, source_dir, dest_dir, seven_zip, password, volume)
-        
+        files, contents = self._make_files()
+
+        success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '0')
+
+        self.assertTrue(success)
+        archive_path = os.path.join(self.dest_dir, 'source.tar.gz')
+        self.assertEqual(self._read_members(archive_path), self._expected_members(contents))
+
+    def test_create_archive_all_codecs(self):
+        """Test every available codec produces a readable archive."""
+        files, contents = self._make_files()
+
+        for codec in CODECS.values():
+            if not codec.available:
+                continue
+            with self.subTest(codec=codec.name):
+                success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                                     codec=codec.name)
+                self.assertTrue(success)
+                archive_path = os.path.join(self.dest_dir, 'source' + codec.extension)
+                self.assertEqual(self._read_members(archive_path), self._expected_members(contents))
+
+    def test_create_archive_with_compressibility_policy(self):
+        """Test stored and compressed members mix into one readable archive."""
+        files, contents = self._make_files()
+        extra = Path(self.source_dir) / 'notes.bin'
+        extra.write_bytes(b'abc' * 10000)
+        files.append(extra)
+        contents['notes.bin'] = extra.read_bytes()
+        policy = CompressibilityPolicy()
+
+        for codec in ('gzip', 'xz'):
+            with self.subTest(codec=codec):
+                success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                                     codec=codec, policy=policy)
+                self.assertTrue(success)
+                archive_path = next(Path(self.dest_dir).glob('source.tar.*'))
+                self.assertEqual(self._read_members(archive_path), self._expected_members(contents))
+                archive_path.unlink()
+
+        self.assertEqual(policy.decisions['notes.bin'][2], True)
+
+    def test_create_archive_parallel_is_deterministic(self):
+        """Test parallel compression gives identical, readable archives."""
+        files, contents = self._make_files()
+        archive_path = Path(self.dest_dir) / 'source.tar.gz'
+
+        outputs = set()
+        for _ in range(2):
+            success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                                 policy=CompressibilityPolicy(), workers=3)
+            self.assertTrue(success)
+            outputs.add(archive_path.read_bytes())
+
+        self.assertEqual(len(outputs), 1)
+        self.assertEqual(self._read_members(archive_path), self._expected_members(contents))
+
+    def test_create_archive_volumes_are_self_contained(self):
+        """Test volume splitting produces independent archives plus a manifest."""
+        files, contents = self._make_files()
+        for i in range(6):
+            path = Path(self.source_dir) / 'album' / f'small{i}.jpg'
+            path.write_bytes(os.urandom(20000))
+            files.append(path)
+            contents[os.path.join('album', f'small{i}.jpg')] = path.read_bytes()
+
+        success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '64k')
+
+        self.assertTrue(success)
+        manifest = load_manifest(os.path.join(self.dest_dir, 'source.manifest.jsonl'))
+        self.assertEqual(set(manifest.files), set(contents))
+        self.assertGreater(len(manifest.volumes), 2)
+
+        # Every volume is a complete archive holding exactly its manifest entries
+        for index, volume in manifest.volumes.items():
+            members = self._read_members(os.path.join(self.dest_dir, volume['name']))
+            expected = {record['member'] for record in manifest.files_in_volume(index)}
+            self.assertEqual(set(members), expected)
+
+        # The 150 KB file does not fit in 64 KB and gets a volume of its own
+        big = manifest.files[os.path.join('album', 'file2.png')]
+        self.assertTrue(manifest.volumes[big['volume']]['oversized'])
+        self.assertEqual(manifest.volumes[big['volume']]['files'], 1)
+        self.assertEqual(manifest.volumes[0]['name'], 'source.000.tar.gz')
+
+    def test_small_files_are_grouped_last(self):
+        """Test small files follow the other files of their volume and round-trip unchanged."""
+        files, contents = self._make_files()
+        xmp = Path(self.source_dir) / 'file1.jpg.xmp'
+        xmp.write_bytes(b'<x:xmpmeta/>' * 100)
+        large = Path(self.source_dir) / 'large.jpg'
+        large.write_bytes(os.urandom(compression.SMALL_FILE_BYTES + 1))
+        files[1:1] = [xmp, large]
+        contents.update({'file1.jpg.xmp': xmp.read_bytes(), 'large.jpg': large.read_bytes()})
+        content_hashes = {}
+
+        self.assertTrue(compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                                   content_hashes=content_hashes, group_small_files=True))
+
+        manifest = load_manifest(os.path.join(self.dest_dir, 'source.manifest.jsonl'))
+        order = sorted(manifest.files, key=lambda path: manifest.files[path]['offset'])
+        self.assertEqual(order, ['large.jpg', 'album/file2.png', 'file1.jpg', 'file1.jpg.xmp', 'empty.txt'])
+        self.assertEqual(self._read_members(os.path.join(self.dest_dir, manifest.volumes[0]['name'])),
+                         self._expected_members(contents))
+        _, _, partial, full = content_hashes['file1.jpg.xmp']
+        self.assertEqual(partial, full)
+        self.assertEqual(full, hashlib.blake2b(contents['file1.jpg.xmp'], digest_size=32).digest())
+
+    def test_create_archive_streams_its_input(self):
+        """Test writing starts before the input ends, so a lazy stream is never held in memory."""
+        files, contents = self._make_files()
+        archive_path = Path(self.dest_dir) / 'source.tar.gz'
+        partial_path = Path(self.dest_dir) / 'source.tar.gz.partial'  # Renamed once complete
+        seen_archive = []
+
+        def stream():
+            for path in files:
+                yield path
+                seen_archive.append(partial_path.exists())
+
+        success = compression.create_archive(stream(), self.source_dir, self.dest_dir, 'tar', '', '')
+
+        self.assertTrue(success)
+        self.assertTrue(seen_archive[0])
+        self.assertFalse(partial_path.exists())
+        self.assertEqual(self._read_members(archive_path), self._expected_members(contents))
+
+    def test_manifest_checksums_match_content(self):
+        """Test per-file and per-volume checksums are computed while writing."""
+        files, contents = self._make_files()
+        content_hashes = {}
+
+        success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                             content_hashes=content_hashes)
+
         self.assertTrue(success)
-        mock_run.assert_called_once()
-        
-        # Verify tar arguments
-        args = mock_run.call_args[0][0]
-        self.assertEqual(args[0], 'tar')
-        self.assertIn('-czf', args)
-        self.assertIn('-T', args)
-
-    @patch('subprocess.Popen')
-    def test_create_archive_split_success(self, mock_popen):
-        """Test successful archive creation WITH splitting."""
-        # Mock Popen instances
-        process_mock1 = MagicMock()
-        process_mock1.stdout.close = MagicMock()
-        
-        process_mock2 = MagicMock()
-        process_mock2.communicate.return_value = (b'', b'')
-        process_mock2.returncode = 0
-        
-        # side_effect to return different mocks for p1 and p2 calls
-        mock_popen.side_effect = [process_mock1, process_mock2]
-        
-        files = [Path('file1.jpg')]
-        source_dir = '/tmp/source'
-        dest_dir = self.test_dir
-        seven_zip = 'tar'
-        password = 'secret_pass'
-        volume = '1m' # Enable splitting
-        
-        success = compression.create_archive(files, source_dir, dest_dir, seven_zip, password, volume)
-        
+        manifest = load_manifest(os.path.join(self.dest_dir, 'source.manifest.jsonl'))
+        self.assertEqual(manifest.header['checksum'], 'blake2b')
+        for relative_path, data in contents.items():
+            expected = hashlib.blake2b(data, digest_size=32).digest()
+            self.assertEqual(manifest.files[relative_path]['checksum'], expected.hex())
+            # Same digests dedup would compute by reading the file
+            path = Path(self.source_dir) / relative_path
+            size, _, partial, full = content_hashes[relative_path]
+            self.assertEqual((size, full), (len(data), expected))
+            self.assertEqual(partial, dedup._hash_file(path, dedup.PARTIAL_HASH_BYTES))
+
+        volume = manifest.volumes[0]
+        volume_bytes = Path(self.dest_dir, volume['name']).read_bytes()
+        self.assertEqual(volume['checksum'], hashlib.blake2b(volume_bytes, digest_size=32).hexdigest())
+
+    def test_sha256_and_disabled_checksums(self):
+        """Test the checksum algorithm can be changed or turned off."""
+        files, contents = self._make_files()
+        manifest_path = os.path.join(self.dest_dir, 'source.manifest.jsonl')
+
+        compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '', checksum='sha256')
+        manifest = load_manifest(manifest_path)
+        self.assertEqual(manifest.files['file1.jpg']['checksum'],
+                         hashlib.sha256(contents['file1.jpg']).hexdigest())
+
+        compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '', checksum=None)
+        manifest = load_manifest(manifest_path)
+        self.assertIsNone(manifest.files['file1.jpg']['checksum'])
+        self.assertIsNone(manifest.volumes[0]['checksum'])
+
+        with self.assertRaises(SystemExit):
+            compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '', checksum='md4')
+
+    @unittest.skipUnless(shutil.which('tar'), 'tar executable not available')
+    def test_archive_readable_by_system_tar(self):
+        """Test the output can be listed by the standard tar tool."""
+        files, contents = self._make_files()
+        compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '')
+
+        result = subprocess.run(['tar', '-tzf', os.path.join(self.dest_dir, 'source.tar.gz')],
+                                check=True, capture_output=True, text=True)
+
+        self.assertEqual(sorted(result.stdout.split()), sorted(self._expected_members(contents)))
+
+    def test_create_archive_skips_vanished_file(self):
+        """Test a file gone since the scan is left out and reported, with the references to it."""
+        files, _ = self._make_files()
+        files.append(Path(self.source_dir) / 'vanished.jpg')
+        references = [dedup.Reference('copy.jpg', 'vanished.jpg', 'run1', 'duplicate'),
+                      dedup.Reference('moved.jpg', 'vanished.jpg', 'run0', 'moved')]
+        vanished = []
+
+        success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                             archive_id='run1', references=references, vanished=vanished)
+
         self.assertTrue(success)
-        
-        # Verify we had 2 Popen calls (tar and split)
-        self.assertEqual(mock_popen.call_count, 2)
-        
-        # Verify 1st call (tar)
-        args1 = mock_popen.call_args_list[0][0][0]
-        self.assertEqual(args1[0], 'tar')
-        self.assertIn('-cz', args1) # -cz for pipe (no f)
-        
-        # Verify 2nd call (split)
-        args2 = mock_popen.call_args_list[1][0][0]
-        self.assertEqual(args2[0], 'split')
-        self.assertIn('-d', args2) # Ensure numeric suffix flag is there
-        self.assertIn(str(1024*1024), args2) # 1m in bytes
-
-    @patch('subprocess.Popen')
-    def test_create_archive_split_failure(self, mock_popen):
-        """Test split failure."""
-        process_mock1 = MagicMock()
-        process_mock1.stdout.close = MagicMock()
-        
-        process_mock2 = MagicMock()
-        process_mock2.communicate.return_value = (b'', b'Error')
-        process_mock2.returncode = 1 # Simulate failure
-        
-        mock_popen.side_effect = [process_mock1, process_mock2]
-        
-        files = [Path('file1.jpg')]
-        
-        # create_archive might raise or return False depending on impl
-        # In current impl, it re-raises CalledProcessError if returncode != 0
-        # Then catches it and returns False
-        
-        success = compression.create_archive(files, '/tmp', self.test_dir, 'tar', 'pass', '1m')
-        
+        self.assertEqual(vanished, ['copy.jpg', 'vanished.jpg'])
+        manifest = load_manifest(Path(self.dest_dir) / 'source.manifest.jsonl')
+        self.assertEqual(len(manifest.files), len(files) - 1)
+        self.assertNotIn('vanished.jpg', manifest.files)
+        self.assertEqual(list(manifest.references), ['moved.jpg'])  # Stored in an earlier archive
+
+    def test_create_archive_skips_file_deleted_after_stat(self):
+        """Test a file deleted between being packed into a volume and being opened is left out and reported."""
+        a, b = Path(self.source_dir) / 'a.jpg', Path(self.source_dir) / 'b.jpg'
+
+        def files():
+            yield a
+            a.unlink()  # a.jpg is stat'ed and waits in the packer's volume
+            yield b
+
+        for read_options in (None, ReadOptions(read_ahead=2)):
+            with self.subTest(read_ahead=bool(read_options)):
+                a.write_bytes(os.urandom(5000))
+                b.write_bytes(os.urandom(5000))
+                dest_dir = Path(self.dest_dir) / str(bool(read_options))
+                vanished = []
+
+                self.assertTrue(compression.create_archive(files(), self.source_dir, dest_dir, 'tar', '', '1m',
+                                                           read_options=read_options, vanished=vanished))
+
+                self.assertEqual(vanished, ['a.jpg'])
+                manifest = load_manifest(dest_dir / 'source.manifest.jsonl')
+                self.assertEqual(list(manifest.files), ['b.jpg'])
+                self.assertEqual(manifest.volumes[0]['files'], 1)
+                with tarfile.open(dest_dir / manifest.volumes[0]['name']) as tar:
+                    self.assertEqual([Path(name).name for name in tar.getnames()], ['b.jpg'])
+
+    def test_create_archive_unreadable_file_removes_partial_volumes(self):
+        """Test a read failure mid-archive removes volumes and the manifest."""
+        files, _ = self._make_files()
+        os.chmod(files[-1], 0)
+        if os.access(files[-1], os.R_OK):
+            self.skipTest('running with permissions that ignore file modes')
+
+        success = compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '1k')
+
         self.assertFalse(success)
+        self.assertEqual(list(Path(self.dest_dir).iterdir()), [])
+
+    def test_create_archive_failure_stops_compression_threads(self):
+        """Test a failure mid-volume leaves no parallel compression threads behind."""
+        files, _ = self._make_files()
+        broken = Path(self.source_dir) / 'not_a_file.jpg'
+        broken.mkdir()  # Stat'ed like a file, but cannot be opened as one
 
-    @patch('subprocess.run')
-    def test_create_archive_executable_not_found(self, mock_run):
-        """Test missing executable."""
-        mock_run.side_effect = FileNotFoundError()
-        
-        files = [Path('file1.jpg')]
-        
+        with patch.object(ParallelStreamCompressor, 'close', autospec=True,
+                          side_effect=ParallelStreamCompressor.close) as close:
+            success = compression.create_archive(files + [broken], self.source_dir, self.dest_dir, 'tar', '', '',
+                                                 workers=2)
+
+        self.assertFalse(success)
+        close.assert_called_once()
+        self.assertFalse(any(thread.is_alive() for thread in close.call_args.args[0]._pool._threads))
+
+    def test_create_archive_unknown_codec(self):
+        """Test an unknown codec exits."""
         with self.assertRaises(SystemExit) as cm:
-            # Only trigger normal run, so volume=0
-            compression.create_archive(files, '/tmp', self.test_dir, 'nonexistent', 'pass', 0)
-        
+            compression.create_archive([], self.source_dir, self.dest_dir, 'tar', '', '', codec='rar')
+
         self.assertEqual(cm.exception.code, 1)
 
+    def test_parse_volume_size(self):
+        """Test volume size strings are converted to bytes."""
+        self.assertEqual(compression.parse_volume_size('1m'), 1024 * 1024)
+        self.assertEqual(compression.parse_volume_size('2g'), 2 * 1024 ** 3)
+        self.assertEqual(compression.parse_volume_size('512'), 512)
+        self.assertEqual(compression.parse_volume_size(0), 0)
+        self.assertEqual(compression.parse_volume_size(''), 0)
+        self.assertEqual(compression.parse_volume_size('5x'), 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import dedup
+from src.scanner import find_changed_files
+from src.state import StateStore
+
+
+class TestDedup(unittest.TestCase):
+    """Tests for the dedup module."""
+
+    def setUp(self):
+        """Create a temporary directory and state for tests."""
+        self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        os.makedirs(os.path.join(self.source_dir, 'album'))
+        self.state = StateStore(os.path.join(self.test_dir, 'state.db'))
+
+    def tearDown(self):
+        """Close the state and remove the directory after the test."""
+        self.state.close()
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, relative_path, data):
+        Path(self.source_dir, relative_path).write_bytes(data)
+
+    def _run(self, archive_id):
+        """Helper method scanning, deduplicating and committing like main does."""
+        changed = find_changed_files(self.source_dir, self.state.load_files())
+        unique, references, hashes = dedup.deduplicate(
+            changed, self.source_dir, self.state, archive_id, self.state.hash_cache()
+        )
+        self.state.commit_files({p: r._replace(archive_id=archive_id) for p, r in changed}, hashes=hashes)
+        return sorted(p for p, _ in unique), sorted(references)
+
+    def test_unique_files_are_not_read(self):
+        """Test files with distinct sizes are never hashed."""
+        self._write('a.jpg', os.urandom(10000))
+        self._write('b.jpg', os.urandom(20000))
+
+        unique, references = self._run('run1')
+
+        self.assertEqual(unique, ['a.jpg', 'b.jpg'])
+        self.assertEqual(references, [])
+        self.assertIsNone(self.state.hash_cache().get('a.jpg'))
+
+    def test_duplicates_within_one_run(self):
+        """Test byte-identical copies are archived once."""
+        data = os.urandom(100000)
+        self._write('a.jpg', data)
+        self._write(os.path.join('album', 'a copy.jpg'), data)
+
+        unique, references = self._run('run1')
+
+        self.assertEqual(len(unique), 1)
+        self.assertEqual(len(references), 1)
+        self.assertEqual(references[0].reason, 'duplicate')
+        self.assertEqual(references[0].target_archive_id, 'run1')
+        self.assertEqual(references[0].target_path, unique[0])
+
+    def test_duplicate_of_archived_file(self):
+        """Test a new copy of an already archived file becomes a reference."""
+        data = os.urandom(100000)
+        self._write('a.jpg', data)
+        self._run('run1')
+
+        self._write(os.path.join('album', 'backup.jpg'), data)
+        unique, references = self._run('run2')
+
+        self.assertEqual(unique, [])
+        self.assertEqual(references, [dedup.Reference(os.path.join('album', 'backup.jpg'), 'a.jpg', 'run1', 'duplicate')])
+
+    def test_stored_hashes_replace_reading_archived_files(self):
+        """Test archived files are matched by stored hashes even once deleted."""
+        data = os.urandom(100000)
+        self._write('a.jpg', data)
+        changed = find_changed_files(self.source_dir, {})
+        record = changed[0][1]._replace(archive_id='run1')
+        full = dedup._hash_file(Path(self.source_dir, 'a.jpg'))
+        partial = dedup._hash_file(Path(self.source_dir, 'a.jpg'), dedup.PARTIAL_HASH_BYTES)
+        self.state.commit_files({'a.jpg': record}, hashes={'a.jpg': (record.size, record.mtime_ns, partial, full)})
+
+        os.remove(os.path.join(self.source_dir, 'a.jpg'))
+        self._write('b.jpg', data)
+        unique, references = self._run('run2')
+
+        self.assertEqual(unique, [])
+        self.assertEqual(references, [dedup.Reference('b.jpg', 'a.jpg', 'run1', 'duplicate')])
+
+    def test_moved_file_detected_by_inode(self):
+        """Test a renamed file is referenced without being read."""
+        self._write('a.jpg', os.urandom(100000))
+        self._run('run1')
+
+        os.rename(os.path.join(self.source_dir, 'a.jpg'), os.path.join(self.source_dir, 'album', 'a.jpg'))
+        unique, references = self._run('run2')
+
+        self.assertEqual(unique, [])
+        self.assertEqual(references, [dedup.Reference(os.path.join('album', 'a.jpg'), 'a.jpg', 'run1', 'moved')])
+
+    def test_same_start_different_content(self):
+        """Test files that only differ after the partial hash are told apart."""
+        head = os.urandom(dedup.PARTIAL_HASH_BYTES)
+        self._write('a.jpg', head + b'A' * 1000)
+        self._write('b.jpg', head + b'B' * 1000)
+
+        unique, references = self._run('run1')
+
+        self.assertEqual(unique, ['a.jpg', 'b.jpg'])
+        self.assertEqual(references, [])
+
+    def test_small_files_are_always_archived(self):
+        """Test tiny identical files are not worth a reference."""
+        self._write('a.xmp', b'same')
+        self._write('b.xmp', b'same')
+
+        unique, references = self._run('run1')
+
+        self.assertEqual(unique, ['a.xmp', 'b.xmp'])
+        self.assertEqual(references, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
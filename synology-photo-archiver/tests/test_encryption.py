@@ -0,0 +1,150 @@
+import unittest
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compression
+from src import encryption
+from src import restore
+from src import verify
+from src.manifest import MANIFEST_SUFFIX, load_manifest
+
+
+@unittest.skipUnless(encryption.AESGCM, 'cryptography not installed')
+class TestEncryption(unittest.TestCase):
+    """Tests for the encryption module."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Derive one key for every test, as a run does."""
+        cls.key = encryption.derive_key('correct horse')
+
+    def setUp(self):
+        """Create a temporary directory for tests."""
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, 'volume.enc')
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def _encrypt(self, data, chunk=10000):
+        """Helper method encrypting data in arbitrary pieces into self.path."""
+        encryptor = self.key.encryptor()
+        with open(self.path, 'wb') as f:
+            for start in range(0, len(data), chunk):
+                f.write(encryptor.update(data[start:start + chunk]))
+            f.write(encryptor.finalize())
+
+    def _read_all(self, f):
+        data = bytearray()
+        while True:
+            chunk = f.read(7000)
+            if not chunk:
+                return bytes(data)
+            data += chunk
+
+    def test_round_trip_and_seek(self):
+        """Test frames decrypt back to the stream, also when starting mid-volume."""
+        data = random.Random(1).randbytes(3 * encryption.FRAME_SIZE + 123)
+        self._encrypt(data)
+        with self.key.open_volume(self.path) as f:
+            self.assertEqual(self._read_all(f), data)
+            for offset in (0, 5, encryption.FRAME_SIZE, 2 * encryption.FRAME_SIZE + 77, len(data)):
+                f.seek(offset)
+                self.assertEqual(self._read_all(f), data[offset:])
+
+    def test_empty_and_frame_aligned_streams(self):
+        """Test an empty stream and a stream of exactly one frame round-trip."""
+        for data in (b'', bytes(encryption.FRAME_SIZE)):
+            with self.subTest(size=len(data)):
+                self._encrypt(data)
+                with self.key.open_volume(self.path) as f:
+                    self.assertEqual(self._read_all(f), data)
+
+    def test_truncation_and_tampering_are_detected(self):
+        """Test dropping the last frame or flipping a bit fails authentication."""
+        data = bytes(2 * encryption.FRAME_SIZE + 10)
+        self._encrypt(data)
+        with open(self.path, 'r+b') as f:
+            f.truncate(encryption.VOLUME_HEADER.size + 2 * (encryption.FRAME_SIZE + encryption.TAG_BYTES))
+        with self.key.open_volume(self.path) as f, self.assertRaises(encryption.AuthenticationError):
+            self._read_all(f)
+
+        self._encrypt(data)
+        with open(self.path, 'r+b') as f:
+            f.seek(encryption.VOLUME_HEADER.size + encryption.FRAME_SIZE + 100)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 1]))
+        with self.key.open_volume(self.path) as f:
+            f.seek(0)
+            self.assertEqual(f.read(10), bytes(10))  # Other frames are still readable
+            with self.assertRaises(encryption.AuthenticationError):
+                f.seek(encryption.FRAME_SIZE + 50)
+
+    def test_derive_key_from_params(self):
+        """Test the stored parameters reproduce the key and reject a wrong password."""
+        params = self.key.params
+        self.assertNotIn('correct horse', str(params))
+        self.assertEqual(encryption.derive_key('correct horse', params).key_check, self.key.key_check)
+        with self.assertRaises(ValueError):
+            encryption.derive_key('wrong', params)
+        # An interrupted run keeps its salt only while the password matches
+        self.assertEqual(encryption.derive_run_key('correct horse', params).salt, self.key.salt)
+        self.assertNotEqual(encryption.derive_run_key('wrong', params).salt, self.key.salt)
+
+    def test_placeholder_password_disables_encryption(self):
+        """Test the template placeholder and empty passwords mean no encryption."""
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(encryption.configured_password(encryption.PLACEHOLDER_PASSWORD))
+        self.assertIsNone(encryption.configured_password(''))
+        self.assertEqual(encryption.configured_password(' secret '), 'secret')
+
+    def test_encrypted_archive_restores_and_verifies(self):
+        """Test an encrypted archive end to end: volumes, restore and verify."""
+        source_dir = os.path.join(self.test_dir, 'source')
+        dest_dir = os.path.join(self.test_dir, 'dest')
+        rng = random.Random(2)
+        contents = {}
+        files = []
+        for i in range(8):
+            relative_path = os.path.join('album', f'IMG_{i}.jpg')
+            contents[relative_path] = rng.randbytes(100000) + bytes(100000)
+            path = Path(source_dir) / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(contents[relative_path])
+            files.append(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(compression.create_archive(files, source_dir, dest_dir, None, '', '500k', key=self.key))
+        manifest_path = Path(dest_dir) / f'source{MANIFEST_SUFFIX}'
+        manifest = load_manifest(manifest_path)
+        self.assertEqual(manifest.header['encryption'], self.key.params)
+        for volume in manifest.volumes.values():
+            self.assertTrue(volume['name'].endswith('.tar.gz.enc'))
+            self.assertFalse((Path(dest_dir) / volume['name']).read_bytes()[:8].startswith(b'\x1f\x8b'))
+
+        target_dir = os.path.join(self.test_dir, 'restored')
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(ValueError):
+                restore.restore(manifest_path, ['*'], target_dir)
+            restored, failed = restore.restore(manifest_path, ['album/IMG_5.jpg', 'album/IMG_1.jpg'], target_dir,
+                                               password='correct horse')
+        self.assertEqual((restored, failed), (2, 0))
+        self.assertEqual((Path(target_dir) / 'album' / 'IMG_5.jpg').read_bytes(), contents['album/IMG_5.jpg'])
+
+        for tier in ('quick', 'full'):
+            with self.subTest(tier=tier):
+                result = verify.verify_archive(manifest_path, tier, password='correct horse')
+                self.assertEqual(result['problems'], [])
+        self.assertEqual(verify.verify_archive(manifest_path, 'full', password='correct horse')['members_checked'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src.file_index import FileIndex, build_index, index_path, load_index, open_index, write_index
+from src.state import FileRecord, StateStore
+
+
+class TestFileIndex(unittest.TestCase):
+    """Tests for the file_index module."""
+
+    def setUp(self):
+        """Create a temporary directory and a few records for tests."""
+        self.test_dir = tempfile.mkdtemp()
+        self.records = {
+            'top.jpg': FileRecord(1, 1000, 11, 'run1'),
+            os.path.join('2024', 'album', 'IMG_0001.HEIC'): FileRecord(2, 2000, 12, 'run1'),
+            os.path.join('2024', 'album', 'IMG_0002.HEIC'): FileRecord(3, 3000, 13, 'run2'),
+            os.path.join('相册', '照片.jpg'): FileRecord(4, 4000, 14, None),
+            os.path.join('raw', 'bad\udcff.cr2'): FileRecord(5, 5000, 15, 'run2'),
+        }
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def test_lookup(self):
+        """Test every record is found by its relative path and others are not."""
+        index = FileIndex(build_index(sorted(self.records.items()), generation=3))
+
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.generation, 3)
+        for relative_path, record in self.records.items():
+            self.assertEqual(index.get(relative_path), record)
+            self.assertIn(relative_path, index)
+        self.assertIsNone(index.get(os.path.join('2024', 'album', 'IMG_0003.HEIC')))
+        self.assertIsNone(index.get(os.path.join('unknown', 'top.jpg')))
+        self.assertNotIn('IMG_0001.HEIC', index)
+        self.assertEqual(dict(index.items()), self.records)
+
+    def test_many_files_in_one_directory(self):
+        """Test lookups stay correct when hash slots collide."""
+        records = {os.path.join('d', f'IMG_{i:05d}.jpg'): FileRecord(i, i, i, 'run1') for i in range(5000)}
+        index = FileIndex(build_index(records.items()))
+
+        for relative_path, record in records.items():
+            self.assertEqual(index.get(relative_path), record)
+        self.assertIsNone(index.get(os.path.join('d', 'IMG_99999.jpg')))
+
+    def test_empty_index(self):
+        """Test an empty index finds nothing."""
+        index = FileIndex(build_index([]))
+
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.get('a.jpg'))
+        self.assertEqual(list(index.items()), [])
+
+    def test_write_and_map(self):
+        """Test an index written to disk is memory-mapped back, and bad files are rejected."""
+        path = Path(self.test_dir) / 'files.index'
+        write_index(path, sorted(self.records.items()), generation=7)
+
+        index = open_index(path)
+        self.assertEqual(index.generation, 7)
+        self.assertEqual(dict(index.items()), self.records)
+        index.close()
+
+        path.write_bytes(path.read_bytes()[:100])
+        self.assertIsNone(open_index(path))
+        path.write_bytes(b'')
+        self.assertIsNone(open_index(path))
+        self.assertIsNone(open_index(Path(self.test_dir) / 'missing.index'))
+
+    def test_load_index_follows_state_generation(self):
+        """Test the snapshot is reused until the state commits new files."""
+        state_path = os.path.join(self.test_dir, 'state.db')
+        records = {path: record for path, record in self.records.items() if path.isprintable()}
+        with StateStore(state_path) as state:
+            state.commit_files(records)
+            index = load_index(state)
+            self.assertEqual(dict(index.items()), records)
+            snapshot_mtime = index_path(state_path).stat().st_mtime_ns
+
+            # Only directory summaries: the snapshot stays valid
+            state.commit_files({}, {})
+            self.assertEqual(load_index(state).generation, index.generation)
+            self.assertEqual(index_path(state_path).stat().st_mtime_ns, snapshot_mtime)
+
+            state.stage_files([('new.jpg', FileRecord(9, 9000, 19, None))])
+            state.commit_staged('run3')
+            index = load_index(state)
+
+            self.assertEqual(index.get('new.jpg'), FileRecord(9, 9000, 19, 'run3'))
+            self.assertEqual(len(index), len(records) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
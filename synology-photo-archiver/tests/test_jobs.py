@@ -0,0 +1,157 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import main, restore
+from src.chain import load_chain
+from src.config import load_config
+from src.jobs import ArchiveBudget, load_jobs, select_job
+from src.metrics import load_reports
+
+
+class TestLoadJobs(unittest.TestCase):
+    """Tests for reading [Job ...] sections."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.config_path = self.test_dir / 'config.ini'
+        for user in ('alice', 'bob'):
+            (self.test_dir / 'homes' / user / 'Photos').mkdir(parents=True)
+        (self.test_dir / 'homes' / 'carol').mkdir()  # No Photos folder: no job
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _load(self, text):
+        self.config_path.write_text(text, encoding='utf-8')
+        return load_config(str(self.config_path))
+
+    def test_jobs_get_their_own_destination_and_state(self):
+        """Test defaults derived from the shared settings, overrides, and wildcard sources."""
+        config = self._load(
+            '[Paths]\ndestination_dir = /archives\n'
+            '[Archive]\ncodec = gzip\nworkers = 2\n'
+            '[State]\nfile = /state/processed_files.db\n'
+            '[Job photo]\nsource_dir = /volume1/photo\npriority = 5\ncodec = store\n'
+            f"[Job homes]\nsource_dir = {self.test_dir / 'homes' / '*' / 'Photos'}\n"
+            'destination_dir = /other\n'
+        )
+        jobs = load_jobs(config)
+
+        self.assertEqual([job.name for job in jobs], ['photo', 'homes-alice', 'homes-bob'])
+        photo, alice, _ = jobs
+        self.assertEqual(photo.priority, 5)
+        self.assertEqual(photo.config.get('Paths', 'destination_dir'), str(Path('/archives') / 'photo'))
+        self.assertEqual(photo.config.get('State', 'file'), str(Path('/state/processed_files.photo.db')))
+        self.assertEqual(photo.config.get('Archive', 'codec'), 'store')
+        self.assertEqual(alice.config.get('Archive', 'codec'), 'gzip')
+        self.assertEqual(alice.source_dir, str(self.test_dir / 'homes' / 'alice' / 'Photos'))
+        self.assertEqual(alice.config.get('Paths', 'destination_dir'), '/other')
+        self.assertEqual(alice.compression_workers, 2)
+        self.assertIs(select_job(config, None), config)
+        self.assertEqual(select_job(config, 'homes-bob').get('Paths', 'source_dir'), jobs[2].source_dir)
+        with self.assertRaises(SystemExit):
+            select_job(config, 'homes-carol')
+
+    def test_no_jobs(self):
+        """Test a configuration without job sections has no jobs."""
+        self.assertEqual(load_jobs(self._load('[Paths]\nsource_dir = /volume1/photo\n')), [])
+
+
+class TestArchiveBudget(unittest.TestCase):
+    """Tests for admitting archive phases of concurrent jobs."""
+
+    def _wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_waiting_jobs_go_by_priority_then_size(self):
+        """Test a released slot goes to the highest priority, then the largest job."""
+        budget = ArchiveBudget(archive_jobs=1, cpu_budget=4)
+        release = threading.Event()
+
+        def hold():
+            with budget.slot('first'):
+                release.wait()
+
+        def queue(name, priority, estimate):
+            with budget.slot(name, priority, estimate):
+                pass
+
+        threads = [threading.Thread(target=hold)]
+        threads[0].start()
+        self._wait_for(lambda: budget.admitted == ['first'])
+        for args in [('small', 0, 10), ('urgent', 1, 1), ('large', 0, 1000)]:
+            threads.append(threading.Thread(target=queue, args=args))
+            threads[-1].start()
+        self._wait_for(lambda: len(budget._waiting) == 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(budget.admitted, ['first', 'urgent', 'large', 'small'])
+
+    def test_cpu_budget_is_shared(self):
+        """Test jobs run side by side only while their compression threads fit the budget."""
+        budget = ArchiveBudget(archive_jobs=3, cpu_budget=4)
+        with budget.slot('a', threads=2):
+            with budget.slot('b', threads=2):
+                self.assertFalse(budget._fits(1))
+            self.assertTrue(budget._fits(2))
+        with budget.slot('huge', threads=16):  # More than the budget: runs alone
+            self.assertFalse(budget._fits(1))
+
+
+class TestMultiSourceRun(unittest.TestCase):
+    """Tests for archiving several sources in one run."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.config_path = self.test_dir / 'config.ini'
+        self.dest_dir = self.test_dir / 'dest'
+        self.report_path = self.test_dir / 'runs.jsonl'
+        for name, count in (('photo', 3), ('video', 1), ('empty', 0)):
+            (self.test_dir / name).mkdir()
+            for i in range(count):
+                (self.test_dir / name / f'{i}.jpg').write_bytes(os.urandom(2000 * (i + 1)))
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            f.write(f'[Paths]\ndestination_dir = {self.dest_dir}\n7z_executable = /usr/bin/7z\n')
+            f.write('[Archive]\npassword =\nvolume_size = 0\n')
+            f.write(f"[State]\nfile = {self.test_dir / 'state.db'}\n")
+            f.write(f'[Report]\nfile = {self.report_path}\n')
+            f.write('[Jobs]\narchive_jobs = 1\n')
+            for name in ('photo', 'video', 'empty'):
+                f.write(f"[Job {name}]\nsource_dir = {self.test_dir / name}\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_every_job_is_archived_and_reported_once(self):
+        """Test each source gets its own chain and state, and the run writes one aggregate report."""
+        with patch('src.main.load_config', return_value=load_config(str(self.config_path))):
+            main.main([])
+
+        for name in ('photo', 'video'):
+            self.assertEqual(len(load_chain(self.dest_dir / name, name).current()), 1)
+            self.assertTrue((self.test_dir / f'state.{name}.db').exists())
+        (report,) = load_reports(self.report_path)
+        self.assertTrue(report['success'])
+        outcomes = {job['job']: job['outcome'] for job in report['jobs']}
+        self.assertEqual(outcomes, {'photo': 'archived', 'video': 'archived', 'empty': 'unchanged'})
+        self.assertEqual(sorted(report['archive_order']), ['photo', 'video'])  # The empty job never queued
+
+        target = self.test_dir / 'restored'
+        restore.main(['--config', str(self.config_path), '--job', 'video', '--target', str(target), '*'])
+        self.assertEqual([path.name for path in target.iterdir()], ['0.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -44,6 +44,16 @@ class TestMain(unittest.TestCase):
             f.write('[State]\n')
             f.write(f'file = {self.state_path}\n')
 
+    def _record_archived_files(self, mock_create_archive):
+        """Helper method making the mocked create_archive consume its file stream like the real one."""
+        self.archived = []
+
+        def create_archive(files, *args, **kwargs):
+            self.archived.append(list(files))
+            return mock_create_archive.return_value
+
+        mock_create_archive.side_effect = create_archive
+
     @patch('src.main.create_archive')
     @patch('src.main.load_config')
     def test_main_with_new_files(self, mock_load_config, mock_create_archive):
@@ -61,7 +71,7 @@ class TestMain(unittest.TestCase):
         mock_create_archive.return_value = True
         
         # Run main - should complete successfully without raising SystemExit
-        main.main()
+        main.main([])
         
         # Verify create_archive was called
         mock_create_archive.assert_called_once()
@@ -78,11 +88,107 @@ class TestMain(unittest.TestCase):
         
         # Run main
         with self.assertRaises(SystemExit) as cm:
-            main.main()
+            main.main([])
         
         # Should exit with 0 (no files to archive)
         self.assertEqual(cm.exception.code, 0)
 
+    @patch('src.main.create_archive')
+    @patch('src.main.load_config')
+    def test_main_second_run_skips_archived_files(self, mock_load_config, mock_create_archive):
+        """Test state committed by a successful run makes the next run incremental."""
+        from src.config import load_config
+        mock_load_config.return_value = load_config(self.config_path)
+        mock_create_archive.return_value = True
+        self._record_archived_files(mock_create_archive)
+
+        Path(os.path.join(self.source_dir, 'file1.jpg')).touch()
+        main.main([])
+
+        # Nothing changed: the second run should find no work
+        with self.assertRaises(SystemExit) as cm:
+            main.main([])
+        self.assertEqual(cm.exception.code, 0)
+
+        # A new file is picked up on its own
+        Path(os.path.join(self.source_dir, 'file2.jpg')).touch()
+        main.main([])
+        self.assertEqual([f.name for f in self.archived[-1]], ['file2.jpg'])
+        self.assertEqual(mock_create_archive.call_count, 2)
+
+    @patch('src.main.create_archive')
+    @patch('src.main.load_config')
+    def test_main_failed_archive_does_not_update_state(self, mock_load_config, mock_create_archive):
+        """Test files from a failed run are offered again on the next run."""
+        from src.config import load_config
+        mock_load_config.return_value = load_config(self.config_path)
+        self._record_archived_files(mock_create_archive)
+
+        Path(os.path.join(self.source_dir, 'file1.jpg')).touch()
+        mock_create_archive.return_value = False
+        with self.assertRaises(SystemExit):
+            main.main([])
+
+        mock_create_archive.return_value = True
+        main.main([])
+        self.assertEqual([f.name for f in self.archived[-1]], ['file1.jpg'])
+
+    @patch('src.main.load_config')
+    def test_main_writes_run_report(self, mock_load_config):
+        """Test every run appends a report with its phases to the history file."""
+        report_path = os.path.join(self.test_dir, 'reports', 'runs.jsonl')
+        with open(self.config_path, 'a', encoding='utf-8') as f:
+            f.write('[Report]\n')
+            f.write(f'file = {report_path}\n')
+        from src.config import load_config
+        mock_load_config.return_value = load_config(self.config_path)
+        mock_load_config.return_value.set('Archive', 'codec', 'GZIP')
+
+        Path(os.path.join(self.source_dir, 'file1.jpg')).write_bytes(b'x' * 1000)
+        main.main([])
+        with self.assertRaises(SystemExit):
+            main.main([])
+
+        from src.metrics import load_reports
+        first, second = load_reports(report_path)
+        self.assertTrue(first['success'])
+        self.assertEqual(first['codec'], 'gzip')  # As --plan looks it up
+        phases = {phase['name']: phase for phase in first['phases']}
+        self.assertEqual(list(phases), ['load', 'scan', 'archive', 'commit', 'index'])
+        self.assertEqual(phases['scan']['changed'], 1)
+        self.assertEqual((phases['archive']['files'], phases['archive']['bytes_in']), (1, 1000))
+        self.assertGreater(phases['archive']['bytes_out'], 0)
+        self.assertIsNone(second['archive_id'])
+        self.assertEqual([phase['name'] for phase in second['phases']], ['load', 'scan', 'commit'])
+
+    @patch('src.main.create_archive')
+    @patch('src.main.load_config')
+    def test_main_reads_changes_from_journal(self, mock_load_config, mock_create_archive):
+        """Test runs after the first one take changed files from a live watcher's journal."""
+        from src.journal import ChangeJournal
+        journal_path = os.path.join(self.test_dir, 'changes.db')
+        with open(self.config_path, 'a', encoding='utf-8') as f:
+            f.write('[Scan]\n')
+            f.write('change_source = journal\n')
+            f.write(f'journal = {journal_path}\n')
+        from src.config import load_config
+        mock_load_config.return_value = load_config(self.config_path)
+        mock_create_archive.return_value = True
+        self._record_archived_files(mock_create_archive)
+
+        with ChangeJournal(journal_path) as journal:
+            session = journal.start_session(self.source_dir)
+            journal.mark_ready(session)
+            Path(os.path.join(self.source_dir, 'file1.jpg')).touch()
+            main.main([])  # Full walk; remembers the journal position
+
+            # Only the logged file is looked at, although both are new.
+            Path(os.path.join(self.source_dir, 'file2.jpg')).touch()
+            Path(os.path.join(self.source_dir, 'unlogged.jpg')).touch()
+            journal.add_events(session, [('file', 'file2.jpg')])
+            main.main([])
+        self.assertEqual([f.name for f in self.archived[-1]], ['file2.jpg'])
+
     @patch('src.main.create_archive')
     @patch('src.main.load_config')
     def test_main_archive_failure(self, mock_load_config, mock_create_archive):
@@ -101,7 +207,7 @@ class TestMain(unittest.TestCase):
         
         # Run main
         with self.assertRaises(SystemExit) as cm:
-            main.main()
+            main.main([])
         
         # Should exit with 1 (failure)
         self.assertEqual(cm.exception.code, 1)
@@ -0,0 +1,62 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src.manifest import ManifestWriter, load_manifest
+
+
+class TestManifest(unittest.TestCase):
+    """Tests for the manifest module."""
+
+    def setUp(self):
+        """Create a temporary directory for tests."""
+        self.test_dir = tempfile.mkdtemp()
+        self.manifest_path = Path(self.test_dir) / 'source.manifest.jsonl'
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def test_round_trip(self):
+        """Test written records load back by volume and path."""
+        writer = ManifestWriter(self.manifest_path, codec='gzip')
+        writer.add_file('a.jpg', 0, size=10)
+        writer.add_file('相册/b.jpg', 1, size=20)
+        writer.add_volume(0, 'source.000.tar.gz', files=1)
+        writer.add_volume(1, 'source.001.tar.gz', files=1)
+        writer.add_reference('copy.jpg', 'a.jpg', 'run1', 'duplicate')
+        writer.commit()
+
+        manifest = load_manifest(self.manifest_path)
+
+        self.assertEqual(manifest.header['codec'], 'gzip')
+        self.assertEqual(manifest.files['相册/b.jpg']['volume'], 1)
+        self.assertEqual(manifest.volumes[0]['name'], 'source.000.tar.gz')
+        self.assertEqual([r['path'] for r in manifest.files_in_volume(0)], ['a.jpg'])
+        self.assertEqual(manifest.references['copy.jpg']['target'], 'a.jpg')
+        self.assertEqual(manifest.references['copy.jpg']['target_archive'], 'run1')
+
+    def test_manifest_only_appears_on_commit(self):
+        """Test nothing is visible at the final path until commit."""
+        writer = ManifestWriter(self.manifest_path)
+        writer.add_file('a.jpg', 0)
+        self.assertFalse(self.manifest_path.exists())
+
+        writer.discard()
+
+        self.assertEqual(list(Path(self.test_dir).iterdir()), [])
+
+    def test_load_rejects_other_files(self):
+        """Test loading a file that is not a manifest fails."""
+        self.manifest_path.write_text('{"type": "file", "path": "a.jpg", "volume": 0}\n', encoding='utf-8')
+
+        with self.assertRaises(ValueError):
+            load_manifest(self.manifest_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src.metrics import Phase, RunMetrics, load_reports, write_report
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for the metrics module."""
+
+    def setUp(self):
+        """Create a temporary directory for tests."""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def test_phase_summary(self):
+        """Test counters, rates and the compression ratio of a phase."""
+        metrics = RunMetrics(progress_interval=None)
+        with metrics.phase('archive') as phase:
+            phase.advance(files=2, bytes_in=4000, bytes_out=1000)
+            phase.advance(files=1, bytes_in=4000, bytes_out=1000)
+            phase.note(volumes=3)
+
+        summary = phase.summary()
+
+        self.assertEqual((summary['files'], summary['bytes_in'], summary['bytes_out']), (3, 8000, 2000))
+        self.assertEqual(summary['ratio'], 0.25)
+        self.assertEqual(summary['volumes'], 3)
+        self.assertGreater(phase.seconds, 0)
+        self.assertEqual(len(metrics.format()), 2)
+
+    def test_phase_stops_timing_on_exit(self):
+        """Test a finished phase no longer accumulates time."""
+        with Phase('scan', progress_interval=None) as phase:
+            pass
+        elapsed = phase.seconds
+
+        self.assertEqual(phase.seconds, elapsed)
+        self.assertIsNone(phase.summary()['ratio'])
+
+    def test_progress_lines_are_periodic(self):
+        """Test a progress line is printed once the interval has passed."""
+        clock = [100.0]
+        with patch('src.metrics.time.monotonic', lambda: clock[0]), \
+                patch('sys.stdout', new_callable=StringIO) as stdout:
+            phase = Phase('archive', progress_interval=30, total_bytes=2000).start()
+            phase.advance(files=1, bytes_in=1000)
+            self.assertEqual(stdout.getvalue(), '')
+            clock[0] += 31
+            phase.advance(files=1, bytes_in=500)
+            phase.advance(files=1, bytes_in=0)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('[archive] 2 files'))
+        self.assertIn('(75%)', lines[0])
+
+    def test_report_history(self):
+        """Test reports are appended one per line and read back in order."""
+        path = Path(self.test_dir) / 'reports' / 'runs.jsonl'
+        self.assertEqual(load_reports(path), [])
+
+        for archive_id in ('run1', 'run2'):
+            metrics = RunMetrics(progress_interval=None)
+            with metrics.phase('scan') as phase:
+                phase.advance(files=5)
+            write_report(path, metrics.report(archive_id=archive_id, success=True))
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('{"torn')
+
+        reports = load_reports(path)
+
+        self.assertEqual([report['archive_id'] for report in reports], ['run1', 'run2'])
+        self.assertEqual(reports[0]['phases'][0]['files'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
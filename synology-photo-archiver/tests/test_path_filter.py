@@ -0,0 +1,139 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import change_sources, scanner
+from src.journal import ChangeJournal
+from src.path_filter import NO_FILTER, PathFilter, parse_patterns
+from src.state import StateStore
+
+
+class TestPathFilter(unittest.TestCase):
+    """Tests for compiling and applying include and exclude rules."""
+
+    def test_rules(self):
+        """Test name globs, path globs and regular expressions, for files and directories."""
+        rules = PathFilter(parse_patterns('@eaDir, #recycle\n.DS_Store, *.tmp, album/2019/*.mov, re:^raw/.*\\.cr2$'))
+        self.assertTrue(rules.skips_directory('album/@eaDir', '@eaDir'))
+        self.assertTrue(rules.skips('album/@eaDir/a.jpg/SYNOPHOTO_THUMB_M.jpg'))
+        self.assertTrue(rules.skips('#recycle', directory=True))
+        self.assertTrue(rules.skips('album/.DS_Store'))
+        self.assertTrue(rules.skips('upload.tmp'))
+        self.assertTrue(rules.skips('album/2019/clip.mov'))
+        self.assertTrue(rules.skips('raw/2020/a.cr2'))
+        self.assertFalse(rules.skips('album/2020/clip.mov'))
+        self.assertFalse(rules.skips('album/a.jpg'))
+        self.assertFalse(rules.skips('album', directory=True))
+
+    def test_include_applies_to_files_only(self):
+        """Test include rules select files without hiding the directories holding them."""
+        rules = PathFilter(['@eaDir'], ['*.jpg', '*.heic'])
+        self.assertFalse(rules.skips('album', directory=True))
+        self.assertFalse(rules.skips('album/b.heic'))
+        self.assertTrue(rules.skips('album/a.xmp'))
+        self.assertTrue(rules.skips('album/@eaDir/a.jpg'))
+
+    def test_fingerprint_and_errors(self):
+        """Test the fingerprint ignores rule order, an empty filter is falsy, and bad regexes are rejected."""
+        self.assertEqual(PathFilter(['a', 'b']).fingerprint, PathFilter(['b', 'a']).fingerprint)
+        self.assertNotEqual(PathFilter(['a']).fingerprint, PathFilter([], ['a']).fingerprint)
+        self.assertFalse(NO_FILTER)
+        self.assertTrue(PathFilter(['a']))
+        with self.assertRaises(ValueError):
+            PathFilter(['re:(unclosed'])
+
+
+class TestFilteredScan(unittest.TestCase):
+    """Tests for leaving files out while scanning."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        self.state = StateStore(os.path.join(self.test_dir, 'state.db'))
+        for relative_path in ('album/a.jpg', 'album/a.jpg.xmp', 'album/@eaDir/a.jpg/SYNOPHOTO_THUMB_M.jpg',
+                              'album/.DS_Store', '#recycle/old.jpg'):
+            path = Path(self.source_dir) / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'data')
+        self.rules = PathFilter(['@eaDir', '#recycle', '.DS_Store'])
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_excluded_entries_are_never_stated(self):
+        """Test excluded files are skipped before stat and excluded directories are not listed."""
+        listed = []
+        real_scandir = os.scandir
+
+        def scandir(path):
+            listed.append(os.path.relpath(path, self.source_dir))
+            return real_scandir(path)
+
+        with patch('src.scanner.os.scandir', side_effect=scandir):
+            found = sorted(path for path, _ in scanner.walk_tree(self.source_dir, path_filter=self.rules))
+        self.assertEqual(found, ['album/a.jpg', 'album/a.jpg.xmp'])
+        self.assertEqual(sorted(listed), ['.', 'album'])
+
+    def test_journal_new_directory_is_filtered_while_scanned(self):
+        """Test a new directory from the journal is walked with the rules, anchored at the source."""
+        rules = PathFilter(['@eaDir', 'new/skip/*'])
+        journal_path = os.path.join(self.test_dir, 'changes.db')
+        journal = ChangeJournal(journal_path)
+        self.addCleanup(journal.close)
+        session = journal.start_session(self.source_dir)
+        journal.mark_ready(session)
+        self.state.commit_files({}, meta={change_sources.PATH_FILTER_KEY: rules.fingerprint})
+        source = change_sources.open_change_source('journal', self.source_dir, self.state, journal_path,
+                                                   path_filter=rules)
+        list(source.changes({}))
+        self.state.commit_files({}, source.dir_summaries, meta=source.meta)
+        source.acknowledge()
+
+        for relative_path in ('new/b.jpg', 'new/@eaDir/b.jpg/SYNOPHOTO_THUMB_M.jpg', 'new/skip/c.jpg'):
+            path = Path(self.source_dir) / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'data')
+        journal.add_events(session, [('dir', 'new')])
+        listed = []
+        real_scandir = os.scandir
+
+        def scandir(path):
+            listed.append(os.path.relpath(path, self.source_dir))
+            return real_scandir(path)
+
+        source = change_sources.open_change_source('journal', self.source_dir, self.state, journal_path,
+                                                   path_filter=rules)
+        self.assertEqual(source.name, 'journal')
+        with patch('src.scanner.os.scandir', side_effect=scandir):
+            found = sorted(path for path, _ in source.changes({}))
+        self.assertEqual(found, ['new/b.jpg'])
+        self.assertEqual(sorted(listed), ['new', 'new/skip'])
+
+    def test_changed_rules_rescan_and_delete(self):
+        """Test new rules force a walk without pruning, and newly excluded files become deletions."""
+        processed = {}
+        source = change_sources.open_change_source('walk', self.source_dir, self.state)
+        for relative_path, record in source.changes(processed):
+            processed[relative_path] = record._replace(archive_id='run')
+        self.state.commit_files({}, source.dir_summaries,
+                                meta={change_sources.PATH_FILTER_KEY: NO_FILTER.fingerprint})
+        self.assertEqual(len(processed), 5)
+
+        previous_dirs = self.state.load_dir_summaries()
+        source = change_sources.open_change_source('walk', self.source_dir, self.state,
+                                                   previous_dirs=previous_dirs, path_filter=self.rules)
+        self.assertEqual(source.previous_dirs, {})
+        self.assertEqual(list(source.changes(processed)), [])
+        self.assertEqual(sorted(source.deletions(processed)), [
+            '#recycle/old.jpg', 'album/.DS_Store', 'album/@eaDir/a.jpg/SYNOPHOTO_THUMB_M.jpg',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src.pipeline import drain, peek, prefetch, tee_batches
+
+
+class TestPipeline(unittest.TestCase):
+    """Tests for the pipeline module."""
+
+    def test_prefetch_preserves_order(self):
+        """Test every item arrives, in order."""
+        self.assertEqual(list(prefetch(range(1000), maxsize=7)), list(range(1000)))
+
+    def test_prefetch_applies_backpressure(self):
+        """Test the producer never runs more than the queue size ahead of the consumer."""
+        produced = []
+        ahead = []
+
+        def producer():
+            for i in range(200):
+                produced.append(i)
+                yield i
+
+        for consumed, _ in enumerate(prefetch(producer(), maxsize=10), 1):
+            ahead.append(len(produced) - consumed)
+
+        # Queue plus the item being put and the one being produced
+        self.assertLessEqual(max(ahead), 12)
+
+    def test_prefetch_forwards_exceptions(self):
+        """Test errors in the producer, including SystemExit, reach the consumer."""
+        def failing(error):
+            yield 1
+            raise error
+
+        for error in (OSError('disk gone'), SystemExit(1)):
+            with self.subTest(error=error):
+                stream = prefetch(failing(error))
+                self.assertEqual(next(stream), 1)
+                with self.assertRaises(type(error)):
+                    next(stream)
+
+    def test_prefetch_stops_abandoned_producer(self):
+        """Test closing the consumer side stops and closes the producer."""
+        closed = threading.Event()
+
+        def endless():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                closed.set()
+
+        stream = prefetch(endless(), maxsize=4)
+        next(stream)
+        stream.close()
+
+        self.assertTrue(closed.wait(5))
+
+    def test_peek(self):
+        """Test peeking returns the first item without consuming it."""
+        first, items = peek(iter([1, 2, 3]))
+        self.assertEqual((first, list(items)), (1, [1, 2, 3]))
+
+        first, items = peek(iter([]))
+        self.assertEqual((first, list(items)), (None, []))
+
+    def test_tee_batches(self):
+        """Test items pass through and reach the sink in batches, the last one on exhaustion."""
+        batches = []
+        stream = tee_batches(range(7), batches.append, 3)
+
+        self.assertEqual([next(stream) for _ in range(4)], [0, 1, 2, 3])
+        self.assertEqual(batches, [[0, 1, 2]])
+        drain(stream)
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import main, plan
+from src.codec import get_codec
+from src.compressibility import CompressibilityPolicy
+from src.state import FileRecord
+
+
+class TestEstimates(unittest.TestCase):
+    """Tests for estimating output size, volumes and duration."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for i in range(30):
+            self._write(f'{i}.jpg', os.urandom(4000) + bytes(1000 * (i % 3)))
+        for i in range(3):
+            self._write(f'{i}.xmp', b'<rdf:Description exif:Rating="5"/>\n' * 300)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, name, data):
+        path = self.test_dir / name
+        path.write_bytes(data)
+        st = path.stat()
+        self.files.append((name, FileRecord(st.st_size, st.st_mtime_ns, st.st_ino, None)))
+
+    def test_types_are_sampled(self):
+        """Test stored types are not read, other types are sampled, and the estimate is repeatable."""
+        types = {estimate.extension: estimate
+                 for estimate in plan.estimate_types(self.files, self.test_dir, get_codec('gzip'),
+                                                     CompressibilityPolicy())}
+        self.assertEqual((types['.jpg'].sampled, types['.jpg'].ratio), (0, 1.0))
+        self.assertEqual(types['.xmp'].sampled, 3)
+        self.assertLess(types['.xmp'].ratio, 0.5)
+        self.assertEqual(types['.xmp'].ratio_error, 0.0)  # Every file sampled
+
+        # Without a policy JPEGs are compressed too: a sample of 20, with an error margin.
+        first = plan.estimate_types(self.files, self.test_dir, get_codec('gzip'))
+        jpg = next(estimate for estimate in first if estimate.extension == '.jpg')
+        self.assertEqual(jpg.sampled, plan.SAMPLE_FILES_PER_TYPE)
+        self.assertGreater(jpg.ratio, 0.7)
+        self.assertGreater(jpg.ratio_error, 0.0)
+        second = plan.estimate_types(self.files, self.test_dir, get_codec('gzip'))
+        self.assertEqual([e.summary() for e in first], [e.summary() for e in second])
+
+    def test_volumes(self):
+        """Test volumes are packed as the archiver packs them."""
+        self.assertEqual(plan.estimate_volumes(self.files, 0), (1, 0))
+        self.assertEqual(plan.estimate_volumes([], 0), (0, 0))
+        volumes, oversized = plan.estimate_volumes(self.files, 20000)
+        self.assertGreaterEqual(volumes, 7)
+        self.assertEqual(oversized, 0)
+        self.assertEqual(plan.estimate_volumes(self.files, 2000)[1], 33)
+
+    def test_archive_rate_from_history(self):
+        """Test the median throughput of recent large runs with the same codec is used."""
+        big = plan.MIN_HISTORY_BYTES
+
+        def run(codec, bytes_in, seconds):
+            return {'codec': codec, 'phases': [{'name': 'archive', 'bytes_in': bytes_in, 'seconds': seconds}]}
+        reports = [run('gzip', big, 1.0), run(' GZIP', big, 4.0), run('xz', big, 100.0), run('gzip', 1000, 10.0),
+                   {'jobs': [run('gzip', big, 2.0)]}]
+        self.assertEqual(plan.archive_rate(reports, 'gzip'), (big / 2.0, 3))
+        self.assertEqual(plan.archive_rate(reports, 'zstd'), (None, 0))
+
+
+class TestPlanMode(unittest.TestCase):
+    """Tests for the archiver's --plan mode."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.source_dir = self.test_dir / 'source'
+        self.dest_dir = self.test_dir / 'dest'
+        self.state_path = self.test_dir / 'state.db'
+        self.config_path = self.test_dir / 'config.ini'
+        (self.source_dir / 'album').mkdir(parents=True)
+        for i in range(5):
+            (self.source_dir / 'album' / f'{i}.jpg').write_bytes(os.urandom(3000))
+        self.config_path.write_text(
+            f'[Paths]\nsource_dir = {self.source_dir}\ndestination_dir = {self.dest_dir}\n7z_executable = 7z\n'
+            '[Archive]\npassword =\nvolume_size = 8k\n'
+            f'[State]\nfile = {self.state_path}\n', encoding='utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_plan_writes_no_archive(self):
+        """Test a plan is printed and saved, nothing is archived, and the next run still finds every file."""
+        main.main(['--config', str(self.config_path), '--plan'])
+
+        self.assertFalse(self.dest_dir.exists())
+        saved = json.loads(Path(f'{self.state_path}{main.PLAN_SUFFIX}').read_text(encoding='utf-8'))
+        self.assertEqual((saved['kind'], saved['files'], saved['volumes']), ('full', 5, 3))
+        self.assertEqual(saved['throughput_basis'], 'sample')
+        self.assertGreater(saved['seconds'], 0)
+
+        main.main(['--config', str(self.config_path)])  # Would exit if there were no changes
+        self.assertEqual(len(list(self.dest_dir.glob('*.tar.gz'))), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import tarfile
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compression
+from src.manifest import load_manifest
+from src.readahead import ReadAhead, ReadOptions, open_ahead
+
+
+class TestReadAhead(unittest.TestCase):
+    """Tests for reading source files ahead of the writer."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.contents = {f'{i}.jpg': os.urandom(1000 * (i + 1)) for i in range(6)}
+        for name, data in self.contents.items():
+            (self.test_dir / name).write_bytes(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _read(self, prefetched, chunk_size=700):
+        buffer = bytearray(chunk_size)
+        data = b''
+        with prefetched:
+            while True:
+                read = prefetched.readinto(memoryview(buffer))
+                if not read:
+                    return data
+                data += buffer[:read]
+
+    def test_files_round_trip_in_key_order(self):
+        """Test every file is yielded once, sorted within the window, with its whole content."""
+        paths = [self.test_dir / name for name in self.contents]
+        options = ReadOptions(read_ahead=2, threads=2, prefetch_bytes=1500)  # Larger files are read in part
+        reader = ReadAhead(paths, options, key=lambda path: -int(path.stem))
+        try:
+            read = [(prefetched.path.name, self._read(prefetched)) for prefetched in reader]
+        finally:
+            reader.close()
+        self.assertEqual([name for name, _ in read], [f'{i}.jpg' for i in reversed(range(6))])
+        self.assertEqual(dict(read), self.contents)
+        self.assertEqual(reader.files, 6)
+
+    def test_scan_order_and_errors(self):
+        """Test the scan order ignores the key, a missing file is skipped, and an unreadable one fails in turn."""
+        (self.test_dir / 'album').mkdir()
+        paths = [self.test_dir / '0.jpg', self.test_dir / 'missing.jpg', self.test_dir / '1.jpg',
+                 self.test_dir / 'album', self.test_dir / '2.jpg']
+        reader = ReadAhead(paths, ReadOptions(read_ahead=5, order='scan'), key=lambda path: path.name)
+        iterator = iter(reader)
+        for name in ('0.jpg', '1.jpg'):
+            prefetched = next(iterator)
+            self.assertEqual(prefetched.path.name, name)
+            prefetched.close()
+        self.assertEqual([path.name for path, _ in reader.vanished], ['missing.jpg'])
+        with self.assertRaises(OSError):
+            next(iterator)  # A directory cannot be opened as a file
+        reader.close()  # Closes 2.jpg, read ahead but never handed out
+        with self.assertRaises(ValueError):
+            ReadOptions(order='random')
+        self.assertFalse(ReadOptions(read_ahead=0))
+
+    def test_open_ahead_reads_the_start(self):
+        """Test only the first bytes are read ahead."""
+        with open_ahead(self.test_dir / '5.jpg', prefetch_bytes=100) as prefetched:
+            self.assertEqual(len(prefetched._head), 100)
+            self.assertEqual(self._read(prefetched), self.contents['5.jpg'])
+
+
+class TestArchiveReadAhead(unittest.TestCase):
+    """Tests for archives written from files read ahead."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.source_dir = self.test_dir / 'source'
+        self.dest_dir = self.test_dir / 'dest'
+        self.source_dir.mkdir()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_members_follow_inode_order(self):
+        """Test members are written in inode order and the archive holds every file unchanged."""
+        contents = {f'{name}.jpg': os.urandom(5000) for name in 'edcba'}
+        for name, data in contents.items():
+            (self.source_dir / name).write_bytes(data)
+        files = sorted(self.source_dir.iterdir())  # Name order, not creation order
+
+        self.assertTrue(compression.create_archive(files, self.source_dir, self.dest_dir, 'tar', '', '',
+                                                   read_options=ReadOptions(read_ahead=2)))
+
+        manifest = load_manifest(self.dest_dir / 'source.manifest.jsonl')
+        by_offset = sorted(manifest.files, key=lambda path: manifest.files[path]['offset'])
+        self.assertEqual(by_offset, sorted(contents, key=lambda path: (self.source_dir / path).stat().st_ino))
+        with tarfile.open(self.dest_dir / 'source.tar.gz') as tar:
+            members = {Path(m.name).name: tar.extractfile(m).read() for m in tar.getmembers()}
+        self.assertEqual(members, contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
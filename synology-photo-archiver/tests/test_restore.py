@@ -0,0 +1,130 @@
+import unittest
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compression
+from src import restore
+from src.codec import CODECS
+from src.manifest import MANIFEST_SUFFIX, load_manifest
+
+
+class TestRestore(unittest.TestCase):
+    """Tests for the restore module."""
+
+    def setUp(self):
+        """Create a source tree of a few megabytes."""
+        self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        self.dest_dir = os.path.join(self.test_dir, 'dest')
+        self.target_dir = os.path.join(self.test_dir, 'restored')
+        rng = random.Random(5)
+        self.contents = {}
+        for i in range(12):
+            relative_path = os.path.join(f'album{i % 3}', f'IMG_{i:02d}.jpg')
+            # Half random, half compressible, ~400 KB each
+            self.contents[relative_path] = rng.randbytes(200000) + bytes(200000 + i)
+        self.contents[os.path.join('album0', 'notes.txt')] = b'small file'
+        self.files = []
+        for relative_path, data in self.contents.items():
+            path = Path(self.source_dir) / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            self.files.append(path)
+        self.manifest_path = Path(self.dest_dir) / f'source{MANIFEST_SUFFIX}'
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def _archive(self, codec='gzip', volume_size='', workers=1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(compression.create_archive(self.files, self.source_dir, self.dest_dir, None, '',
+                                                       volume_size, codec=codec, workers=workers))
+
+    def _restore(self, *patterns):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return restore.restore(self.manifest_path, patterns, self.target_dir)
+
+    def _assert_restored(self, relative_paths):
+        restored = sorted(str(path.relative_to(self.target_dir))
+                          for path in Path(self.target_dir).rglob('*') if path.is_file())
+        self.assertEqual(restored, sorted(relative_paths))
+        for relative_path in relative_paths:
+            self.assertEqual((Path(self.target_dir) / relative_path).read_bytes(), self.contents[relative_path])
+
+    def test_restore_single_file_and_glob(self):
+        """Test single files and globs come back byte for byte with their mtimes."""
+        for codec, volume_size, workers in (('gzip', '', 1), ('xz', '2m', 1), ('gzip', '2m', 3), ('store', '', 1)):
+            with self.subTest(codec=codec, volume_size=volume_size, workers=workers):
+                shutil.rmtree(self.target_dir, ignore_errors=True)
+                shutil.rmtree(self.dest_dir, ignore_errors=True)
+                self._archive(codec, volume_size, workers)
+                self.assertEqual(self._restore(os.path.join('album2', 'IMG_11.jpg')), (1, 0))
+                source_mtime = (Path(self.source_dir) / 'album2' / 'IMG_11.jpg').stat().st_mtime_ns
+                self.assertEqual((Path(self.target_dir) / 'album2' / 'IMG_11.jpg').stat().st_mtime_ns,
+                                 source_mtime)
+                shutil.rmtree(self.target_dir)
+                self.assertEqual(self._restore('album0/*', 'album1'), (9, 0))
+                self._assert_restored([path for path in self.contents if not path.startswith('album2')])
+
+    def test_manifest_records_seek_points(self):
+        """Test members are indexed by offset and volumes by member boundaries."""
+        self._archive('gzip')
+        manifest = load_manifest(self.manifest_path)
+        points = manifest.volumes[0]['seek_points']
+        self.assertGreater(len(points), 3)  # ~5 MB of tar stream, a point per MB
+        self.assertEqual(points[0], [0, 0])
+        self.assertTrue(all(record['offset'] % 512 == 0 for record in manifest.files.values()))
+        self.assertNotIn('seek_points', load_manifest(self.manifest_path).volumes[0].keys() - {'seek_points'})
+
+    def test_late_file_does_not_decode_earlier_members(self):
+        """Test a late file is restored even if the start of the volume is unreadable."""
+        self._archive('gzip')
+        manifest = load_manifest(self.manifest_path)
+        late_path, late = max(manifest.files.items(), key=lambda item: item[1]['offset'])
+        volume_path = Path(self.dest_dir) / manifest.volumes[0]['name']
+        data = bytearray(volume_path.read_bytes())
+        data[20:4000] = bytes(3980)  # Corrupt the first member
+        volume_path.write_bytes(bytes(data))
+
+        self.assertEqual(self._restore(late_path), (1, 0))
+        self._assert_restored([late_path])
+        first_path = min(manifest.files, key=lambda path: manifest.files[path]['offset'])
+        self.assertEqual(self._restore(first_path), (0, 1))
+
+    def test_checksum_mismatch_is_reported(self):
+        """Test restored content is checked against the manifest's checksum."""
+        self._archive('store')
+        manifest = load_manifest(self.manifest_path)
+        record = manifest.files[os.path.join('album0', 'notes.txt')]
+        volume_path = Path(self.dest_dir) / manifest.volumes[record['volume']]['name']
+        with open(volume_path, 'r+b') as f:
+            f.seek(record['offset'] + 512 + 1)  # Header, then the data
+            f.write(b'X')
+        self.assertEqual(self._restore(os.path.join('album0', 'notes.txt')), (0, 1))
+        self.assertFalse((Path(self.target_dir) / 'album0' / 'notes.txt').exists())
+
+    def test_volume_reader_reuses_position(self):
+        """Test reading forward continues decoding instead of seeking back."""
+        self._archive('gzip')
+        manifest = load_manifest(self.manifest_path)
+        volume = manifest.volumes[0]
+        with restore.VolumeReader(Path(self.dest_dir) / volume['name'], CODECS['gzip'],
+                                  volume['seek_points']) as reader:
+            reader.seek(1024)
+            head = reader.read(100)
+            reader.seek(1124)
+            self.assertEqual(reader.position, 1124)
+            reader.seek(1024)
+            self.assertEqual(reader.read(100), head)
+
+
+if __name__ == '__main__':
+    unittest.main()
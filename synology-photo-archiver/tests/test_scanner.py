@@ -138,6 +138,96 @@ class TestScanner(unittest.TestCase):
         self.assertEqual(len(new_files), 1)
         self.assertTrue(new_files[0].is_file())
 
+    def _make_tree(self):
+        """Helper method to create a small nested tree of files."""
+        for relative_dir in ['', 'a', os.path.join('a', 'b'), os.path.join('a', 'b', 'c'), 'd']:
+            directory = os.path.join(self.source_dir, relative_dir)
+            os.makedirs(directory, exist_ok=True)
+            for i in range(3):
+                Path(os.path.join(directory, f'photo{i}.jpg')).write_bytes(b'x' * i)
+
+    def test_walk_tree_matches_rglob(self):
+        """Test the scandir walker finds exactly what Path.rglob finds."""
+        self._make_tree()
+        source_path = Path(self.source_dir)
+        expected = {
+            str(p.relative_to(source_path)): p.stat().st_size
+            for p in source_path.rglob('*') if p.is_file()
+        }
+
+        for workers in (1, 4):
+            walked = {rel: st.st_size for rel, st in scanner.walk_tree(self.source_dir, workers)}
+            self.assertEqual(walked, expected)
+
+    def test_walk_tree_yields_strings_and_stats(self):
+        """Test the walker yields relative path strings with stat results."""
+        file1 = os.path.join(self.source_dir, 'file1.jpg')
+        Path(file1).write_bytes(b'12345')
+        os.utime(file1, (1000, 1000))
+
+        (relative_path, st), = list(scanner.walk_tree(self.source_dir))
+
+        self.assertEqual(relative_path, 'file1.jpg')
+        self.assertEqual(st.st_size, 5)
+        self.assertEqual(st.st_mtime, 1000)
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'symlinks not supported')
+    def test_walk_tree_does_not_follow_directory_symlinks(self):
+        """Test symlinked directories are not descended into (same as rglob)."""
+        outside = os.path.join(self.test_dir, 'outside')
+        os.makedirs(outside)
+        Path(os.path.join(outside, 'elsewhere.jpg')).touch()
+        os.symlink(outside, os.path.join(self.source_dir, 'link'))
+        Path(os.path.join(self.source_dir, 'file1.jpg')).touch()
+
+        walked = [rel for rel, _ in scanner.walk_tree(self.source_dir)]
+
+        self.assertEqual(walked, ['file1.jpg'])
+
+    def _scan_with_pruning(self, previous_dirs, paranoid=False):
+        """Helper method returning (changed relative paths, current dir summaries)."""
+        current_dirs = {}
+        changed = scanner.find_changed_files(
+            self.source_dir, {}, previous_dirs=previous_dirs, current_dirs=current_dirs, paranoid=paranoid
+        )
+        return sorted(rel for rel, _ in changed), current_dirs
+
+    def test_unchanged_directories_are_pruned(self):
+        """Test files in directories with an unchanged listing are not re-checked."""
+        self._make_tree()
+        first, summaries = self._scan_with_pruning({})
+        self.assertEqual(len(first), 15)
+        self.assertEqual(set(summaries), {'', 'a', os.path.join('a', 'b'), os.path.join('a', 'b', 'c'), 'd'})
+
+        second, _ = self._scan_with_pruning(summaries)
+
+        self.assertEqual(second, [])
+
+    def test_changed_directory_is_rescanned(self):
+        """Test adding a file only rescans the directory that changed."""
+        self._make_tree()
+        _, summaries = self._scan_with_pruning({})
+
+        Path(os.path.join(self.source_dir, 'a', 'b', 'new.jpg')).touch()
+        changed, _ = self._scan_with_pruning(summaries)
+
+        # Empty processed_files: every file the scan looked at is reported.
+        expected = sorted(os.path.join('a', 'b', name) for name in ['new.jpg', 'photo0.jpg', 'photo1.jpg', 'photo2.jpg'])
+        self.assertEqual(changed, expected)
+
+    def test_paranoid_mode_rechecks_everything(self):
+        """Test paranoid mode ignores directory summaries."""
+        self._make_tree()
+        _, summaries = self._scan_with_pruning({})
+
+        # In-place rewrite does not change the directory listing
+        Path(os.path.join(self.source_dir, 'd', 'photo0.jpg')).write_bytes(b'edited')
+        pruned, _ = self._scan_with_pruning(summaries)
+        paranoid, _ = self._scan_with_pruning(summaries, paranoid=True)
+
+        self.assertEqual(pruned, [])
+        self.assertEqual(len(paranoid), 15)
+
 
 if __name__ == '__main__':
     unittest.main()
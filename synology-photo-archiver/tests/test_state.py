@@ -0,0 +1,168 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import state
+from src.state import DirSummary, FileRecord, StateStore
+
+
+class TestState(unittest.TestCase):
+    """Tests for the state module."""
+
+    def setUp(self):
+        """Create a temporary directory for tests."""
+        self.test_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.test_dir, 'state', 'processed_files.db')
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def test_load_empty_state(self):
+        """Test a fresh state file starts empty and is created on disk."""
+        with StateStore(self.state_path) as store:
+            self.assertEqual(store.load_files(), {})
+
+        self.assertTrue(os.path.exists(self.state_path))
+
+    def test_commit_and_reload(self):
+        """Test committed records survive reopening the state."""
+        records = {
+            'file1.jpg': FileRecord(100, 1000, 11, 'run1'),
+            os.path.join('album', 'file2.png'): FileRecord(200, 2000, 12, 'run1'),
+        }
+        with StateStore(self.state_path) as store:
+            store.commit_files(records)
+
+        with StateStore(self.state_path) as store:
+            self.assertEqual(store.load_files(), records)
+
+    def test_commit_replaces_existing_record(self):
+        """Test re-archiving a file replaces its previous record."""
+        with StateStore(self.state_path) as store:
+            store.commit_files({'file1.jpg': FileRecord(100, 1000, 11, 'run1')})
+            store.commit_files({'file1.jpg': FileRecord(150, 5000, 11, 'run2')})
+
+            self.assertEqual(store.load_files(), {'file1.jpg': FileRecord(150, 5000, 11, 'run2')})
+
+    def test_failed_commit_is_rolled_back(self):
+        """Test a commit that fails part-way leaves the state untouched."""
+        with StateStore(self.state_path) as store:
+            store.commit_files({'file1.jpg': FileRecord(100, 1000, 11, 'run1')})
+
+            bad_records = {
+                'file2.jpg': FileRecord(200, 2000, 12, 'run2'),
+                'file3.jpg': FileRecord(None, 3000, 13, 'run2'),  # violates NOT NULL
+            }
+            with self.assertRaises(Exception):
+                store.commit_files(bad_records)
+
+            self.assertEqual(list(store.load_files()), ['file1.jpg'])
+
+    def test_dir_summaries_are_replaced_on_commit(self):
+        """Test committed directory summaries replace the previous set."""
+        with StateStore(self.state_path) as store:
+            store.commit_files({}, {'': DirSummary(1, 2, b'root'), 'old': DirSummary(3, 0, b'old')})
+            store.commit_files({}, {'': DirSummary(5, 2, b'root2'), 'new': DirSummary(6, 1, b'new')})
+
+        with StateStore(self.state_path) as store:
+            self.assertEqual(store.load_dir_summaries(), {
+                '': DirSummary(5, 2, b'root2'),
+                'new': DirSummary(6, 1, b'new'),
+            })
+
+    def test_commit_without_dir_summaries_keeps_them(self):
+        """Test committing only file records leaves directory summaries alone."""
+        with StateStore(self.state_path) as store:
+            store.commit_files({}, {'': DirSummary(1, 2, b'root')})
+            store.commit_files({'file1.jpg': FileRecord(100, 1000, 11, 'run1')})
+
+            self.assertEqual(store.load_dir_summaries(), {'': DirSummary(1, 2, b'root')})
+
+    def test_compressibility_cache(self):
+        """Test probe results are committed and looked up per path."""
+        with StateStore(self.state_path) as store:
+            store.commit_files({}, compressibility={'raw/a.dng': (4096, 7, True)})
+
+            cache = store.compressibility_cache()
+            self.assertEqual(cache.get('raw/a.dng'), (4096, 7, 1))
+            self.assertIsNone(cache.get('raw/missing.dng'))
+
+    def test_lookup_by_size_and_inode(self):
+        """Test archived files can be found by size and by inode."""
+        with StateStore(self.state_path) as store:
+            store.commit_files({
+                'a.jpg': FileRecord(100, 1000, 11, 'run1'),
+                'b.jpg': FileRecord(100, 2000, 12, 'run1'),
+                'c.jpg': FileRecord(300, 3000, 11, 'run1'),
+            })
+
+            self.assertEqual(sorted(p for p, _ in store.files_with_size(100)), ['a.jpg', 'b.jpg'])
+            self.assertEqual(sorted(p for p, _ in store.files_with_inode(11)), ['a.jpg', 'c.jpg'])
+            self.assertEqual(store.files_with_size(999), [])
+
+    def test_hash_cache(self):
+        """Test content hashes are committed and looked up per path."""
+        with StateStore(self.state_path) as store:
+            store.commit_files({}, hashes={'a.jpg': (100, 1000, b'partial', None)})
+
+            self.assertEqual(store.hash_cache().get('a.jpg'), (100, 1000, b'partial', None))
+            self.assertIsNone(store.hash_cache().get('b.jpg'))
+
+    def test_staged_files_are_committed_with_archive_id(self):
+        """Test staged files and hashes are only recorded by commit_staged, then cleared."""
+        with StateStore(self.state_path) as store:
+            store.stage_files([('a.jpg', FileRecord(100, 1000, 11, None))])
+            store.stage_files([('b.jpg', FileRecord(200, 2000, 12, None))])
+            store.staged_hashes()['a.jpg'] = (100, 1000, b'partial', b'full')
+            self.assertEqual(store.load_files(), {})
+
+            store.commit_staged('run1', hashes={'a.jpg': (100, 1000, b'stale', None),
+                                                'c.jpg': (5, 6, b'c', b'c')})
+
+            self.assertEqual(store.load_files(), {
+                'a.jpg': FileRecord(100, 1000, 11, 'run1'),
+                'b.jpg': FileRecord(200, 2000, 12, 'run1'),
+            })
+            self.assertEqual(store.hash_cache().get('a.jpg'), (100, 1000, b'partial', b'full'))
+            self.assertEqual(store.hash_cache().get('c.jpg'), (5, 6, b'c', b'c'))
+
+            store.commit_staged('run2')
+            self.assertEqual(store.load_files()['a.jpg'].archive_id, 'run1')
+
+    def test_staged_files_do_not_survive_reopening(self):
+        """Test changes staged by a run that never committed are forgotten."""
+        with StateStore(self.state_path) as store:
+            store.stage_files([('a.jpg', FileRecord(100, 1000, 11, None))])
+
+        with StateStore(self.state_path) as store:
+            store.commit_staged('run2')
+            self.assertEqual(store.load_files(), {})
+
+    def test_invalid_state_file_exits(self):
+        """Test a corrupt state file exits with an error."""
+        os.makedirs(os.path.dirname(self.state_path))
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            f.write('{"this": "is not a database"}' * 100)
+
+        with self.assertRaises(SystemExit) as cm:
+            StateStore(self.state_path)
+
+        self.assertEqual(cm.exception.code, 1)
+
+    def test_newer_schema_version_exits(self):
+        """Test a state written by a newer version is refused."""
+        with StateStore(self.state_path) as store:
+            store._conn.execute(
+                "UPDATE meta SET value = ? WHERE key = 'schema_version'", (str(state.SCHEMA_VERSION + 1),)
+            )
+
+        with self.assertRaises(SystemExit):
+            StateStore(self.state_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
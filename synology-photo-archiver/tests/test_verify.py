@@ -0,0 +1,96 @@
+import unittest
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import compression
+from src import verify
+from src.manifest import MANIFEST_SUFFIX, load_manifest
+
+
+class TestVerify(unittest.TestCase):
+    """Tests for the verify module."""
+
+    def setUp(self):
+        """Archive a small library into a few volumes."""
+        self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        self.dest_dir = os.path.join(self.test_dir, 'dest')
+        rng = random.Random(3)
+        files = []
+        for i in range(30):
+            path = Path(self.source_dir) / f'album{i % 3}' / f'IMG_{i:02d}.jpg'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(rng.randbytes(20000) + bytes(30000))
+            files.append(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(compression.create_archive(files, self.source_dir, self.dest_dir, None, '', '400k'))
+        self.manifest_path = Path(self.dest_dir) / f'source{MANIFEST_SUFFIX}'
+        self.manifest = load_manifest(self.manifest_path)
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        shutil.rmtree(self.test_dir)
+
+    def _corrupt_member(self, path):
+        """Flips a byte in the middle of the volume holding a file; returns the volume index."""
+        record = self.manifest.files[path]
+        volume_path = Path(self.dest_dir) / self.manifest.volumes[record['volume']]['name']
+        data = bytearray(volume_path.read_bytes())
+        data[len(data) // 2] ^= 0xFF
+        volume_path.write_bytes(bytes(data))
+        return record['volume']
+
+    def test_intact_archive_passes_every_tier(self):
+        """Test an untouched archive verifies cleanly at every tier."""
+        self.assertGreater(len(self.manifest.volumes), 2)
+        for tier in verify.TIERS:
+            with self.subTest(tier=tier):
+                result = verify.verify_archive(self.manifest_path, tier, sample='50%', workers=2, seed=1)
+                self.assertEqual(result['problems'], [])
+                self.assertTrue(result['complete'])
+                self.assertEqual(result['volumes_checked'], len(self.manifest.volumes))
+        self.assertEqual(verify.verify_archive(self.manifest_path, 'full')['members_checked'], 30)
+        self.assertEqual(verify.verify_archive(self.manifest_path, 'sample', sample='10')['members_checked'], 10)
+
+    def test_quick_tier_detects_truncation_and_bit_flips(self):
+        """Test sizes and volume hashes catch damaged volumes without decoding."""
+        first = Path(self.dest_dir) / self.manifest.volumes[0]['name']
+        with open(first, 'r+b') as f:
+            f.truncate(first.stat().st_size - 1)
+        self._corrupt_member(next(path for path, record in self.manifest.files.items() if record['volume'] == 1))
+        result = verify.verify_archive(self.manifest_path, 'quick')
+        self.assertEqual(len(result['problems']), 2)
+        self.assertIn('bytes, the manifest says', result['problems'][0] + result['problems'][1])
+
+    def test_full_tier_names_damaged_members(self):
+        """Test the full tier reports damage in the decoded stream."""
+        volume = self._corrupt_member(next(iter(self.manifest.files)))
+        result = verify.verify_archive(self.manifest_path, 'full')
+        # Either decoding fails part-way or a checksum differs; the volume is named in both cases.
+        self.assertTrue(any(self.manifest.volumes[volume]['name'] in problem for problem in result['problems']))
+        self.assertEqual(len(result['problems']), len(set(result['problems'])))
+
+    def test_time_limit_reports_incomplete(self):
+        """Test a spent time budget stops the run without reporting problems."""
+        result = verify.verify_archive(self.manifest_path, 'full', time_limit=1e-9)
+        self.assertFalse(result['complete'])
+        self.assertEqual(result['problems'], [])
+
+    def test_parse_sample(self):
+        """Test sample sizes as counts and percentages."""
+        self.assertEqual(verify.parse_sample('10', 1000), 10)
+        self.assertEqual(verify.parse_sample('2%', 1000), 20)
+        self.assertEqual(verify.parse_sample('5000', 1000), 1000)
+        with self.assertRaises(ValueError):
+            verify.parse_sample('many', 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
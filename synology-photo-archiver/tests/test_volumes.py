@@ -0,0 +1,103 @@
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import volumes
+from src.volumes import TAR_MEMBER_OVERHEAD, iter_partitioned_volumes, iter_volumes, plan_volumes
+
+
+class TestVolumes(unittest.TestCase):
+    """Tests for the volumes module."""
+
+    def _names(self, planned):
+        return [volume.files for volume in planned]
+
+    def test_no_volume_size_gives_one_volume(self):
+        """Test a zero volume size keeps every file in one volume."""
+        planned = plan_volumes([('a', 10), ('b', 10 ** 9)], 0)
+
+        self.assertEqual(self._names(planned), [['a', 'b']])
+
+    def test_empty_input_gives_one_empty_volume(self):
+        """Test there is always at least one volume."""
+        planned = plan_volumes([], 1000)
+
+        self.assertEqual(len(planned), 1)
+        self.assertEqual(planned[0].files, [])
+
+    def test_files_are_never_split_and_volumes_stay_under_target(self):
+        """Test every volume stays within the target size."""
+        volume_bytes = 10000
+        sizes = [3000, 4000, 2500, 6000, 1000, 500, 7000, 2000]
+        planned = plan_volumes([(f'f{i}', size) for i, size in enumerate(sizes)], volume_bytes)
+
+        placed = sorted(name for volume in planned for name in volume.files)
+        self.assertEqual(placed, sorted(f'f{i}' for i in range(len(sizes))))
+        for volume in planned:
+            self.assertLessEqual(volume.bytes, volume_bytes)
+
+    def test_small_files_backfill_earlier_volumes(self):
+        """Test first-fit packs a small file into an earlier volume with room."""
+        volume_bytes = 10 * 1000 + 3 * TAR_MEMBER_OVERHEAD
+        planned = plan_volumes([('a', 6000), ('b', 6000), ('c', 3000)], volume_bytes)
+
+        self.assertEqual(self._names(planned), [['a', 'c'], ['b']])
+
+    def test_oversized_file_gets_own_volume(self):
+        """Test a file bigger than a volume is isolated and flagged."""
+        planned = plan_volumes([('a', 100), ('huge', 50000), ('b', 100)], 10000)
+
+        self.assertEqual(self._names(planned), [['a', 'b'], ['huge']])
+        self.assertEqual([volume.oversized for volume in planned], [False, True])
+
+    def test_window_limits_backfilling(self):
+        """Test only the most recent volumes are considered for back-filling."""
+        volume_bytes = 1000 + 2 * TAR_MEMBER_OVERHEAD
+        files = [(f'big{i}', 900) for i in range(4)] + [('tiny', 50)]
+
+        planned = plan_volumes(files, volume_bytes, window=2)
+
+        self.assertEqual(planned[2].files, ['big2', 'tiny'])
+        self.assertEqual(volumes.DEFAULT_PACKING_WINDOW, 8)
+
+    def test_volumes_are_yielded_before_input_ends(self):
+        """Test a volume is handed out as soon as it leaves the window."""
+        consumed = []
+
+        def files():
+            for i in range(100):
+                consumed.append(i)
+                yield f'f{i}', 900
+
+        stream = iter_volumes(files(), 1000 + TAR_MEMBER_OVERHEAD, window=2)
+        first = next(stream)
+
+        self.assertEqual(first.files, ['f0'])
+        self.assertEqual(len(consumed), 3)
+        self.assertEqual(len(list(stream)), 99)
+
+    def test_iter_volumes_empty_input_and_first_index(self):
+        """Test empty input yields nothing and numbering can start later."""
+        self.assertEqual(list(iter_volumes([], 1000)), [])
+        self.assertEqual(list(iter_volumes([], 0)), [])
+        planned = list(iter_volumes([('a', 10), ('huge', 5000)], 1000 + TAR_MEMBER_OVERHEAD, first_index=5))
+        self.assertEqual(sorted(volume.index for volume in planned), [5, 6])
+
+    def test_partitioned_volumes_never_mix_buckets(self):
+        """Test every volume holds files of one bucket, and indexes are shared across buckets."""
+        volume_bytes = 2 * (1000 + TAR_MEMBER_OVERHEAD)
+        files = [('a', 1000, '2021'), ('b', 1000, '2022'), ('c', 1000, '2021'), ('d', 1000, '2021'),
+                 ('huge', 5000, '2022')]
+        planned = sorted(iter_partitioned_volumes(files, volume_bytes), key=lambda volume: volume.index)
+
+        self.assertEqual([(volume.bucket, volume.files) for volume in planned],
+                         [('2021', ['a', 'c']), ('2022', ['b']), ('2021', ['d']), ('2022', ['huge'])])
+        self.assertTrue(planned[3].oversized)
+        unsized = list(iter_partitioned_volumes(files, 0))
+        self.assertEqual([(volume.bucket, volume.files) for volume in unsized],
+                         [('2021', ['a', 'c', 'd']), ('2022', ['b', 'huge'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import watcher
+from src.journal import ChangeJournal
+
+
+class FakeInotify:
+    """Hands out watch descriptors without touching the kernel."""
+
+    def __init__(self):
+        self.watches = {}
+
+    def add_watch(self, path, mask=watcher.WATCH_MASK):
+        return self.watches.setdefault(os.path.realpath(path), len(self.watches) + 1)
+
+    def read(self, timeout):
+        return []
+
+
+class TestWatcher(unittest.TestCase):
+    """Tests for the watcher module."""
+
+    def setUp(self):
+        """Create a source tree and a journal."""
+        self.test_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.test_dir, 'source')
+        os.makedirs(os.path.join(self.source_dir, 'a', 'b'))
+        self.journal = ChangeJournal(os.path.join(self.test_dir, 'changes.db'))
+
+    def tearDown(self):
+        """Remove the directory after the test."""
+        self.journal.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_events_are_translated_and_coalesced(self):
+        """Test inotify events become journal events, once per path."""
+        inotify = FakeInotify()
+        w = watcher.Watcher(self.source_dir, self.journal, inotify)
+        w.start()
+        self.assertEqual(len(inotify.watches), 3)
+        wd_b = inotify.watches[os.path.realpath(os.path.join(self.source_dir, 'a', 'b'))]
+
+        w.handle(wd_b, watcher.IN_MODIFY, 'x.jpg')
+        w.handle(wd_b, watcher.IN_CLOSE_WRITE, 'x.jpg')
+        w.handle(wd_b, watcher.IN_DELETE, 'y.jpg')
+        os.makedirs(os.path.join(self.source_dir, 'a', 'b', 'new', 'sub'))
+        w.handle(wd_b, watcher.IN_CREATE | watcher.IN_ISDIR, 'new')
+        w.handle(-1, watcher.IN_Q_OVERFLOW, '')
+        w.flush()
+
+        self.assertEqual(self.journal.events(0, 100), [
+            ('file', 'a/b/x.jpg'), ('delete', 'a/b/y.jpg'), ('dir', 'a/b/new'), ('overflow', ''),
+        ])
+        # The new directory and its subdirectory are watched too.
+        self.assertEqual(len(inotify.watches), 5)
+
+    def test_run_ends_session(self):
+        """Test a stopped watcher closes its session, so the journal is no longer trusted."""
+        w = watcher.Watcher(self.source_dir, self.journal, FakeInotify())
+        w.start()
+        self.assertIsNotNone(self.journal.position(self.source_dir))
+        w.run(lambda: True)
+        self.assertIsNone(self.journal.position(self.source_dir))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+    def test_real_inotify(self):
+        """Test events from the kernel reach the journal."""
+        try:
+            inotify = watcher.Inotify()
+        except OSError as e:
+            self.skipTest(f'inotify unavailable: {e}')
+        try:
+            w = watcher.Watcher(self.source_dir, self.journal, inotify)
+            w.start()
+            Path(self.source_dir, 'a', 'photo.jpg').write_bytes(b'data')
+            for _ in range(10):
+                for event in inotify.read(0.1):
+                    w.handle(*event)
+            w.flush()
+        finally:
+            inotify.close()
+        self.assertIn(('file', os.path.join('a', 'photo.jpg')), self.journal.events(0, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from src import writeout
+
+
+class FakeClock:
+    """A clock that only moves when the limiter sleeps."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Tests for pacing writes."""
+
+    def test_byte_rate(self):
+        """Test writes are paced to the byte rate once the first one has gone out."""
+        clock = FakeClock()
+        limiter = writeout.RateLimiter(bytes_per_second=1000, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            limiter.acquire(500)
+        self.assertEqual(clock.slept, [0.5, 0.5, 0.5])
+        self.assertAlmostEqual(limiter.throttled_seconds, 1.5)
+
+    def test_operation_rate_and_idle_burst(self):
+        """Test the stricter limit applies, and an idle limiter saves up only a short burst."""
+        clock = FakeClock()
+        limiter = writeout.RateLimiter(bytes_per_second=10 ** 9, ops_per_second=10, clock=clock, sleep=clock.sleep)
+        limiter.acquire(1)
+        limiter.acquire(1)
+        self.assertAlmostEqual(sum(clock.slept), 0.1)
+        clock.now += 60
+        for _ in range(8):
+            limiter.acquire(1)
+        self.assertAlmostEqual(sum(clock.slept), 0.3)  # Six writes fit in the burst; two wait
+
+    def test_unlimited(self):
+        """Test no limits never wait."""
+        limiter = writeout.RateLimiter(sleep=lambda seconds: self.fail('slept'))
+        limiter.acquire(10 ** 9)
+        self.assertFalse(limiter.enabled)
+
+
+class TestVolumeOutput(unittest.TestCase):
+    """Tests for writing volumes out."""
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.path = self.test_dir / 'photo.000.tar.gz'
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_chunks_and_rename(self):
+        """Test data goes out in whole chunks and the volume appears under its name only when complete."""
+        options = writeout.WriteOptions(chunk_size=5000, drop_cache=True)
+        self.assertEqual(options.chunk_size, 8192)
+        output = options.open(self.path)
+        data = os.urandom(20000)
+        for start in range(0, len(data), 3000):
+            output.write(data[start:start + 3000])
+        self.assertFalse(self.path.exists())
+        self.assertTrue(output.partial_path.exists())
+        output.close(fsync=True)
+
+        self.assertEqual(self.path.read_bytes(), data)
+        self.assertFalse(output.partial_path.exists())
+        self.assertEqual(output.writes, 3)  # Two full chunks and the tail
+
+    def test_discard(self):
+        """Test a discarded volume leaves nothing behind."""
+        output = writeout.WriteOptions(chunk_size=4096).open(self.path)
+        output.write(b'x' * 10000)
+        output.discard()
+        self.assertEqual(list(self.test_dir.iterdir()), [])
+
+    def test_write_error_is_raised(self):
+        """Test a failed write on the writer thread surfaces in the producer."""
+        output = writeout.WriteOptions(chunk_size=4096).open(self.path)
+        with patch.object(output, '_write_chunk', side_effect=OSError(28, 'No space left on device')):
+            with self.assertRaises(OSError):
+                for _ in range(100):
+                    output.write(b'x' * 4096)
+                output.close()
+        output.discard()
+
+    def test_any_writer_error_is_raised_without_blocking(self):
+        """Test an unexpected error on the writer thread keeps the queue draining and reaches the producer."""
+        output = writeout.WriteOptions(chunk_size=4096).open(self.path)
+        with patch.object(output, '_write_chunk', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                output._put(b'x' * 4096)
+                for _ in range(writeout.PIPELINE_DEPTH * 4):  # Full if the writer thread had died
+                    output._queue.put(b'x' * 4096, timeout=5)
+                output.close()
+        output.discard()
+
+    def test_fsync_policy(self):
+        """Test 'auto' syncs only volumes of resumable archives."""
+        self.assertTrue(writeout.WriteOptions().sync_volume(resumable=True))
+        self.assertFalse(writeout.WriteOptions().sync_volume(resumable=False))
+        self.assertTrue(writeout.WriteOptions(fsync='volume').sync_volume(resumable=False))
+        self.assertFalse(writeout.WriteOptions(fsync='never').sync_volume(resumable=True))
+        with self.assertRaises(ValueError):
+            writeout.WriteOptions(fsync='sometimes')
+
+
+if __name__ == '__main__':
+    unittest.main()